@@ -0,0 +1,4 @@
+# -*- coding: UTF-8 -*-
+"""
+Benchmarks for the ICAP worker, run against an in-process fake vCenter.
+"""
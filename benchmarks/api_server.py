@@ -0,0 +1,67 @@
+# -*- coding: UTF-8 -*-
+"""
+The API with an in-memory broker, for ``bench_serving.py`` to run in its own process.
+
+Publishing waits ``BENCH_PUBLISH_DELAY`` seconds before the task is queued, to
+stand in for a RabbitMQ that is slow to confirm it. Under uwsgi, load it with
+``--module benchmarks.api_server:application``; to serve it with gevent instead::
+
+    BENCH_SERVER=gevent python -m benchmarks.api_server 5000
+"""
+import os
+if os.environ.get('BENCH_SERVER') == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+import sys
+import time
+import atexit
+import shutil
+import tempfile
+import threading
+
+from celery import Celery
+from kombu.transport import virtual
+
+from benchmarks.bench_api import IMAGES, _drain
+from benchmarks.fake_vcenter import write_ova, verified_index
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.views import icap
+from vlab_icap_api.lib.evented import serve
+from vlab_icap_api.lib.publisher import configure
+from vlab_icap_api.lib.images import ImageCatalog, convert_name
+from vlab_icap_api.app import app
+
+
+PUBLISH_DELAY = float(os.environ.get('BENCH_PUBLISH_DELAY', 0))
+DRAIN_INTERVAL = float(os.environ.get('BENCH_DRAIN_INTERVAL', 0.1))
+
+
+def _slow_publish(basic_publish):
+    def publish(*args, **kwargs):
+        time.sleep(PUBLISH_DELAY)
+        return basic_publish(*args, **kwargs)
+    return publish
+
+
+def _setup():
+    images_dir = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, images_dir, True)
+    for image in IMAGES:
+        write_ova('{}/{}'.format(images_dir, convert_name(image)), disk_mb=0)
+    icap.IMAGES = ImageCatalog(images_dir, verified_index(images_dir))
+    virtual.Channel.basic_publish = _slow_publish(virtual.Channel.basic_publish)
+    app.celery_app = Celery('icap', backend='rpc://', broker='memory://')
+    app.celery_app.conf.broker_heartbeat = 0
+    configure(app.celery_app)
+    if DRAIN_INTERVAL:
+        threading.Thread(target=_drain, args=(app.celery_app, threading.Event(), DRAIN_INTERVAL),
+                         daemon=True).start()
+
+
+_setup()
+application = app
+
+
+if __name__ == '__main__':
+    serve(app, '127.0.0.1', int(sys.argv[1]), const.VLAB_ICAP_EVENTED_CONNECTIONS)
@@ -0,0 +1,297 @@
+# -*- coding: UTF-8 -*-
+"""
+Load tests the HTTP API: token checks, publishing tasks and building responses.
+
+Concurrent clients send a mix of ``GET``, ``POST`` and ``DELETE`` on
+``/api/2/inf/icap`` and ``GET`` on ``/api/2/inf/icap/image``, each as one of
+``--users`` users with a freshly minted test token. By default the app is served
+in-process (a threaded werkzeug server) and publishes to an in-memory broker,
+which is emptied every ``--drain-interval`` seconds to stand in for the
+workers::
+
+    python -m benchmarks.bench_api --concurrency 1 8 32 --duration 10
+
+To measure a real deployment (i.e. under uwsgi), point ``--url`` at it. Test
+tokens are only accepted while ``VLAB_VERIFY_TOKEN`` is off, and the token has to
+be minted for the IP the API sees the requests coming from (``--client-ip``).
+
+Creates are subject to admission control, so expect HTTP 429s once every user
+has ``VLAB_ICAP_USER_MAX_CREATES`` creates in flight; set it to zero to measure
+the create path without limits. The API logs every request to stderr, just
+like it does in production, so redirect stderr to keep the report readable.
+"""
+import sys
+import time
+import uuid
+import bisect
+import random
+import argparse
+import tempfile
+import threading
+import http.client
+import collections
+from contextlib import contextmanager
+from urllib.parse import urlparse
+from unittest.mock import patch
+
+import ujson
+from celery import Celery
+from werkzeug.serving import make_server, WSGIRequestHandler
+from vlab_api_common.http_auth import generate_v2_test_token
+
+from benchmarks.fake_vcenter import write_ova, verified_index
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.views import icap
+from vlab_icap_api.lib.images import ImageCatalog, convert_name
+
+
+ROUTE = '/api/2/inf/icap'
+IMAGES = ('1.0.0', '1.1.0', '2.0.0')
+# name -> (HTTP method, path, makes the request body)
+ENDPOINTS = collections.OrderedDict([
+    ('GET /icap', ('GET', ROUTE, None)),
+    ('POST /icap', ('POST', ROUTE, lambda: {'name': _machine_name(), 'image': IMAGES[0], 'network': 'frontend'})),
+    ('DELETE /icap', ('DELETE', ROUTE, lambda: {'name': _machine_name()})),
+    ('GET /image', ('GET', '{}/image'.format(ROUTE), None)),
+])
+DEFAULT_MIX = 'GET /icap=4,POST /icap=1,DELETE /icap=1,GET /image=2'
+
+
+def _machine_name():
+    return 'icap{}'.format(random.randint(0, 9999))
+
+
+def mint_tokens(users, client_ip):
+    """Make a test token for every user
+
+    :Returns: List of (username, token)
+
+    :param users: How many users to make tokens for
+    :type users: Integer
+
+    :param client_ip: The IP the API sees requests coming from
+    :type client_ip: String
+    """
+    tokens = []
+    for idx in range(users):
+        username = 'loadtest{}'.format(idx)
+        tokens.append((username, generate_v2_test_token(username=username, client_ip=client_ip).decode()))
+    return tokens
+
+
+class _QuietHandler(WSGIRequestHandler):
+    """Keeps connections open between requests, and doesn't log every one"""
+    protocol_version = 'HTTP/1.1'
+    # The headers and body are separate writes; don't let Nagle hold the body back
+    disable_nagle_algorithm = True
+
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+@contextmanager
+def stand_in(drain_interval=0.1):
+    """Serve the API in-process, publishing to an in-memory broker
+
+    :Returns: String - the base URL of the API
+
+    :param drain_interval: How often to empty the queues, like workers would;
+                           zero lets tasks pile up
+    :type drain_interval: Float
+    """
+    from vlab_icap_api.app import app
+
+    celery_app = Celery('icap', backend='rpc://', broker='memory://')
+    celery_app.conf.broker_heartbeat = 0
+    stop = threading.Event()
+    with tempfile.TemporaryDirectory() as images_dir:
+        for image in IMAGES:
+            write_ova('{}/{}'.format(images_dir, convert_name(image)), disk_mb=0)
+        with patch.object(app, 'celery_app', celery_app), \
+             patch.object(icap, 'IMAGES', ImageCatalog(images_dir, verified_index(images_dir))):
+            server = make_server('127.0.0.1', 0, app, threaded=True, request_handler=_QuietHandler)
+            threads = [threading.Thread(target=server.serve_forever, daemon=True)]
+            if drain_interval:
+                threads.append(threading.Thread(target=_drain, args=(celery_app, stop, drain_interval), daemon=True))
+            for thread in threads:
+                thread.start()
+            try:
+                yield 'http://127.0.0.1:{}'.format(server.server_port)
+            finally:
+                stop.set()
+                server.shutdown()
+                server.server_close()
+
+
+def _drain(celery_app, stop, interval):
+    """Throw away every queued task until ``stop`` is set"""
+    with celery_app.connection_for_write() as conn:
+        while not stop.wait(interval):
+            for queue in (const.VLAB_ICAP_READ_QUEUE, const.VLAB_ICAP_LIFECYCLE_QUEUE):
+                try:
+                    conn.default_channel.queue_purge(queue)
+                except Exception:
+                    # Nothing has been sent to the queue yet
+                    pass
+
+
+def parse_mix(mix):
+    """Convert "GET /icap=4,POST /icap=1" into the weight of every endpoint
+
+    :Returns: Dictionary
+
+    :Raises: ValueError for an unknown endpoint
+    """
+    weights = {}
+    for item in mix.split(','):
+        name, _, weight = item.rpartition('=')
+        name = name.strip()
+        if name not in ENDPOINTS:
+            raise ValueError('Unknown endpoint {}; choose from {}'.format(name, ', '.join(ENDPOINTS)))
+        weights[name] = int(weight)
+    return weights
+
+
+def drive(url, tokens, concurrency, duration, weights):
+    """Send requests from ``concurrency`` clients for ``duration`` seconds
+
+    :Returns: Tuple (Dictionary of endpoint -> list of (seconds, status), Float elapsed seconds)
+
+    :param url: The base URL of the API, i.e. "http://127.0.0.1:5000"
+    :type url: String
+
+    :param tokens: The (username, token) to pick from for each request
+    :type tokens: List
+
+    :param weights: How often to send each endpoint, relative to the others
+    :type weights: Dictionary
+    """
+    names = list(weights.keys())
+    cum_weights = []
+    for name in names:
+        cum_weights.append(weights[name] + (cum_weights[-1] if cum_weights else 0))
+    samples = collections.defaultdict(list)
+    lock = threading.Lock()
+    started = time.perf_counter()
+    deadline = started + duration
+
+    def client():
+        parsed = urlparse(url)
+        conn_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        conn = conn_class(parsed.netloc, timeout=30)
+        mine = []
+        while time.perf_counter() < deadline:
+            # What random.choices does, which needs Python 3.6
+            name = names[bisect.bisect(cum_weights, random.random() * cum_weights[-1], 0, len(names) - 1)]
+            method, path, make_body = ENDPOINTS[name]
+            _, token = random.choice(tokens)
+            headers = {'X-Auth': token, 'X-REQUEST-ID': uuid.uuid4().hex}
+            body = None
+            if make_body is not None:
+                body = ujson.dumps(make_body())
+                headers['Content-Type'] = 'application/json'
+            start = time.perf_counter()
+            try:
+                conn.request(method, '{}{}'.format(parsed.path.rstrip('/'), path), body=body, headers=headers)
+                resp = conn.getresponse()
+                resp.read()
+                status = resp.status
+            except (OSError, http.client.HTTPException):
+                conn.close()
+                status = 'error'
+            mine.append((name, time.perf_counter() - start, status))
+        conn.close()
+        with lock:
+            for name, seconds, status in mine:
+                samples[name].append((seconds, status))
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return dict(samples), time.perf_counter() - started
+
+
+def summarize(samples, elapsed):
+    """Compute the throughput and latency percentiles of every endpoint
+
+    :Returns: Dictionary
+    """
+    report = {}
+    everything = []
+    for name, results in sorted(samples.items()):
+        report[name] = _stats(results, elapsed)
+        everything.extend(results)
+    report['total'] = _stats(everything, elapsed)
+    return report
+
+
+def _stats(results, elapsed):
+    latencies = sorted(x[0] for x in results)
+    statuses = collections.Counter(str(x[1]) for x in results)
+
+    def percentile(pct):
+        if not latencies:
+            return 0
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * pct / 100))] * 1000, 2)
+    return {'requests': len(results),
+            'rps': round(len(results) / elapsed, 1),
+            'p50_ms': percentile(50),
+            'p90_ms': percentile(90),
+            'p99_ms': percentile(99),
+            'max_ms': percentile(100),
+            'statuses': dict(statuses)}
+
+
+def main(argv=None):
+    """Run the load test, and print the results
+
+    :Returns: Integer - the exit code
+    """
+    parser = argparse.ArgumentParser(description='Load test the ICAP API')
+    parser.add_argument('--url', help='The API to test; by default it is served in-process')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32],
+                        help='How many clients send requests at the same time')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to run each concurrency level')
+    parser.add_argument('--users', type=int, default=50, help='How many users the requests come from')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Relative weight of each endpoint')
+    parser.add_argument('--client-ip', default='127.0.0.1', help='The IP the API sees requests coming from')
+    parser.add_argument('--drain-interval', type=float, default=0.1,
+                        help='How often the in-process broker is emptied; zero lets tasks pile up')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args(argv)
+
+    weights = parse_mix(args.mix)
+    tokens = mint_tokens(args.users, args.client_ip)
+    results = []
+    with _target(args.url, args.drain_interval) as url:
+        for concurrency in args.concurrency:
+            samples, elapsed = drive(url, tokens, concurrency, args.duration, weights)
+            results.append({'concurrency': concurrency, 'endpoints': summarize(samples, elapsed)})
+    if args.json:
+        print(ujson.dumps(results, indent=2))
+        return 0
+    print('{:>5}  {:<13} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}  {}'.format(
+        'conc', 'endpoint', 'requests', 'req/s', 'p50 ms', 'p90 ms', 'p99 ms', 'max ms', 'statuses'))
+    for result in results:
+        for name, numbers in result['endpoints'].items():
+            statuses = ', '.join('{}={}'.format(x, y) for x, y in sorted(numbers['statuses'].items()))
+            print('{:>5}  {:<13} {:>8} {:>8} {:>8} {:>8} {:>8} {:>8}  {}'.format(
+                result['concurrency'], name, numbers['requests'], numbers['rps'], numbers['p50_ms'],
+                numbers['p90_ms'], numbers['p99_ms'], numbers['max_ms'], statuses))
+    return 0
+
+
+@contextmanager
+def _target(url, drain_interval):
+    """Use the supplied API, or serve one in-process"""
+    if url:
+        yield url
+    else:
+        with stand_in(drain_interval=drain_interval) as url:
+            yield url
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,198 @@
+# -*- coding: UTF-8 -*-
+"""
+Compares serving the API with uwsgi (like ``app.ini``) against serving it with gevent,
+while RabbitMQ is slow to accept tasks.
+
+Each server runs in its own process, with the API publishing to an in-memory
+broker that waits ``--publish-delay`` seconds per task (see ``api_server.py``).
+``--concurrency`` clients submit creates for ``--duration`` seconds, while a
+healthcheck is sent every half second with a 5 second timeout, like Docker
+would::
+
+    python -m benchmarks.bench_serving --servers uwsgi gevent --concurrency 100 1000 --publish-delay 0.05
+
+Admission control is turned off, so every create is published. The clients are
+greenlets in this process, so on a small machine they compete with the server
+for CPU; a few thousand threads would take more of it than the server does.
+"""
+if __name__ == '__main__':
+    from gevent import monkey
+    monkey.patch_all()
+
+import os
+import sys
+import time
+import socket
+import shutil
+import argparse
+import threading
+import subprocess
+import http.client
+from collections import OrderedDict
+
+import ujson
+
+from benchmarks.bench_api import drive, mint_tokens, parse_mix, summarize
+
+
+HEALTHCHECK = '/api/1/inf/icap/healthcheck'
+HEALTHCHECK_TIMEOUT = 5
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVERS = ('uwsgi', 'gevent')
+
+
+def _free_port():
+    with socket.socket() as the_socket:
+        the_socket.bind(('127.0.0.1', 0))
+        return the_socket.getsockname()[1]
+
+
+def command(server, port, processes=1):
+    """Build the command that serves the API
+
+    :Returns: List
+
+    :param server: Either "uwsgi" or "gevent"
+    :type server: String
+
+    :param processes: How many uwsgi workers to run; ``app.ini`` runs one
+    :type processes: Integer
+    """
+    if server == 'uwsgi':
+        uwsgi = shutil.which('uwsgi') or os.path.join(os.path.dirname(sys.executable), 'uwsgi')
+        # The same settings as app.ini, except for the app and the socket
+        return [uwsgi, '--http-socket', '127.0.0.1:{}'.format(port), '--module', 'benchmarks.api_server:application',
+                '--master', '--processes', str(processes), '--threads', '1', '--enable-threads', '--lazy-apps',
+                '--need-app', '--die-on-term', '--disable-logging', '--buffer-size', '32768',
+                # uwsgi closes the connection after every response; say so, or the clients count an error
+                '--add-header', 'Connection: close']
+    elif server == 'gevent':
+        return [sys.executable, '-m', 'benchmarks.api_server', str(port)]
+    raise ValueError('Unknown server {}; choose from {}'.format(server, ', '.join(SERVERS)))
+
+
+def start(server, publish_delay, processes=1):
+    """Run the API in a new process, and wait until it answers
+
+    :Returns: Tuple (subprocess.Popen, String base URL)
+    """
+    port = _free_port()
+    env = dict(os.environ, BENCH_SERVER=server, BENCH_PUBLISH_DELAY=str(publish_delay),
+               VLAB_ICAP_USER_MAX_CREATES='0', VLAB_ICAP_MAX_QUEUED_CREATES='0',
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get('PYTHONPATH')])))
+    proc = subprocess.Popen(command(server, port, processes), cwd=ROOT, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('{} exited with {}'.format(server, proc.returncode))
+        if probe('127.0.0.1', port, timeout=1) is not None:
+            return proc, 'http://127.0.0.1:{}'.format(port)
+        time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError('{} never answered'.format(server))
+
+
+def stop(proc):
+    """Stop the API"""
+    proc.terminate()
+    try:
+        proc.wait(timeout=10)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        proc.wait()
+
+
+def probe(host, port, timeout=HEALTHCHECK_TIMEOUT):
+    """Send one healthcheck
+
+    :Returns: Float seconds it took, or None if it failed or took too long
+    """
+    conn = http.client.HTTPConnection(host, port, timeout=timeout)
+    start = time.perf_counter()
+    try:
+        conn.request('GET', HEALTHCHECK)
+        resp = conn.getresponse()
+        resp.read()
+        if resp.status != 200:
+            return None
+    except (OSError, http.client.HTTPException):
+        return None
+    finally:
+        conn.close()
+    return time.perf_counter() - start
+
+
+def _watch_health(port, stop_event, results, interval=0.5):
+    while not stop_event.wait(interval):
+        results.append(probe('127.0.0.1', port))
+
+
+def run(server, concurrencies, duration, publish_delay, weights, tokens, processes=1):
+    """Load test one server at every concurrency level
+
+    :Returns: List of dictionaries
+    """
+    proc, url = start(server, publish_delay, processes)
+    port = int(url.rsplit(':', 1)[1])
+    results = []
+    try:
+        for concurrency in concurrencies:
+            health = []
+            stop_event = threading.Event()
+            watcher = threading.Thread(target=_watch_health, args=(port, stop_event, health))
+            watcher.start()
+            samples, elapsed = drive(url, tokens, concurrency, duration, weights)
+            stop_event.set()
+            watcher.join()
+            passed = sorted(x for x in health if x is not None)
+            results.append({'server': server, 'concurrency': concurrency,
+                            'total': summarize(samples, elapsed)['total'],
+                            'health': {'sent': len(health), 'failed': len(health) - len(passed),
+                                       'max_ms': round(passed[-1] * 1000, 1) if passed else None}})
+    finally:
+        stop(proc)
+    return results
+
+
+def main(argv=None):
+    """Run the benchmark, and print the results
+
+    :Returns: Integer - the exit code
+    """
+    parser = argparse.ArgumentParser(description='Compare serving the ICAP API with uwsgi and gevent')
+    parser.add_argument('--servers', nargs='+', default=list(SERVERS), choices=SERVERS, help='What to serve with')
+    parser.add_argument('--processes', type=int, default=1, help='How many uwsgi workers to run')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[10, 100, 1000],
+                        help='How many clients send requests at the same time')
+    parser.add_argument('--duration', type=float, default=10, help='Seconds to run each concurrency level')
+    parser.add_argument('--publish-delay', type=float, default=0.05,
+                        help='Seconds the broker takes to accept each task')
+    parser.add_argument('--users', type=int, default=50, help='How many users the requests come from')
+    parser.add_argument('--mix', default='POST /icap=1', help='Relative weight of each endpoint')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args(argv)
+
+    weights = parse_mix(args.mix)
+    tokens = mint_tokens(args.users, '127.0.0.1')
+    results = []
+    for server in args.servers:
+        results.extend(run(server, args.concurrency, args.duration, args.publish_delay, weights, tokens,
+                           args.processes))
+    if args.json:
+        print(ujson.dumps(results, indent=2))
+        return 0
+    print('{:<7} {:>5} {:>8} {:>8} {:>8} {:>8} {:>9}  {:<24} {}'.format(
+        'server', 'conc', 'requests', 'req/s', 'p50 ms', 'p99 ms', 'max ms', 'statuses', 'healthchecks'))
+    for result in results:
+        numbers = result['total']
+        statuses = ', '.join('{}={}'.format(x, y) for x, y in sorted(numbers['statuses'].items()))
+        health = '{failed}/{sent} failed, slowest {max_ms} ms'.format(**result['health'])
+        print('{:<7} {:>5} {:>8} {:>8} {:>8} {:>8} {:>9}  {:<24} {}'.format(
+            result['server'], result['concurrency'], numbers['requests'], numbers['rps'], numbers['p50_ms'],
+            numbers['p99_ms'], numbers['max_ms'], statuses, health))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,110 @@
+# -*- coding: UTF-8 -*-
+"""
+Measures how long it takes to import the entry points of the API and the
+worker, and how much memory that uses.
+
+Every uwsgi worker and every autoscaled container pays this before it can serve
+anything, so this benchmark runs each entry point in a fresh interpreter and
+reports the median import time, the peak resident memory, and if pyVmomi got
+loaded (the API should never load it; the worker only for its first task)::
+
+    python -m benchmarks.bench_startup --iterations 5
+
+Resident memory comes from ``getrusage``, so it includes the interpreter itself;
+the ``python`` row is the baseline to subtract.
+"""
+import sys
+import argparse
+import statistics
+import subprocess
+from collections import OrderedDict
+
+import ujson
+
+
+ENTRY_POINTS = OrderedDict([
+    ('python', ('', '')),
+    ('api', ('import vlab_icap_api.app', '')),
+    ('worker', ('import vlab_icap_api.lib.worker.tasks as tasks', '')),
+    # What a worker process pays once it runs the first task
+    ('worker+task', ('import vlab_icap_api.lib.worker.tasks as tasks', 'tasks.vmware.show_icap')),
+])
+
+PROBE = """
+import sys, time, resource
+started = time.perf_counter()
+{}
+imported = time.perf_counter() - started
+{}
+seconds = time.perf_counter() - started
+import json
+print(json.dumps({{'seconds': seconds, 'import_seconds': imported,
+                  'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  'pyvmomi': 'pyVmomi' in sys.modules, 'modules': len(sys.modules)}}))
+"""
+
+
+def measure(entry_point):
+    """Run an entry point in a new interpreter
+
+    :Returns: Dictionary
+
+    :param entry_point: The name of a key in ``ENTRY_POINTS``
+    :type entry_point: String
+    """
+    code = PROBE.format(*ENTRY_POINTS[entry_point])
+    output = subprocess.check_output([sys.executable, '-c', code], stderr=subprocess.DEVNULL)
+    return ujson.loads(output.decode().strip().splitlines()[-1])
+
+
+def run(entry_points, iterations):
+    """Measure every entry point
+
+    :Returns: Dictionary
+
+    :param entry_points: The names of the entry points to measure
+    :type entry_points: List
+
+    :param iterations: How many fresh interpreters to measure each entry point with
+    :type iterations: Integer
+    """
+    results = OrderedDict()
+    for entry_point in entry_points:
+        # Once, so the bytecode is compiled before anything is timed
+        measure(entry_point)
+        samples = [measure(entry_point) for _ in range(iterations)]
+        results[entry_point] = {'ms': round(statistics.median(x['seconds'] for x in samples) * 1000, 1),
+                                'import_ms': round(statistics.median(x['import_seconds'] for x in samples) * 1000, 1),
+                                'rss_mb': round(statistics.median(x['rss_mb'] for x in samples), 1),
+                                'modules': samples[-1]['modules'],
+                                'pyvmomi': samples[-1]['pyvmomi']}
+    return results
+
+
+def main(argv=None):
+    """Run the benchmark, and print the results
+
+    :Returns: Integer - the exit code
+    """
+    parser = argparse.ArgumentParser(description='Benchmark how fast the API and worker start')
+    parser.add_argument('--entry-points', nargs='+', default=list(ENTRY_POINTS.keys()),
+                        choices=list(ENTRY_POINTS.keys()), help='What to measure')
+    parser.add_argument('--iterations', type=int, default=5, help='How many times to start each entry point')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = run(args.entry_points, args.iterations)
+    if args.json:
+        print(ujson.dumps(results, indent=2))
+        return 0
+    print('{:<12} {:>9} {:>9} {:>8} {:>8}  {}'.format('entry point', 'total ms', 'import ms', 'rss MB',
+                                                     'modules', 'pyVmomi'))
+    for entry_point, numbers in results.items():
+        print('{:<12} {:>9} {:>9} {:>8} {:>8}  {}'.format(entry_point, numbers['ms'], numbers['import_ms'],
+                                                         numbers['rss_mb'], numbers['modules'],
+                                                         'loaded' if numbers['pyvmomi'] else '-'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+# -*- coding: UTF-8 -*-
+"""
+Times the worker's vCenter operations against ``FakeVCenter``.
+
+For every combination of folder count (how many users vCenter has) and VM
+count (how many ICAP instances the benchmarked user has), this runs
+``show_icap``, ``create_icap``, ``update_network`` and ``delete_icap`` and
+reports the median wall time and how many SOAP calls each one made::
+
+    python -m benchmarks.bench_vmware --folders 10 500 --vms 1 50 --latency-ms 2
+
+The SOAP call counts don't depend on the latency, so a regression in how many
+round-trips an operation makes shows up even with ``--latency-ms 0``.
+"""
+import sys
+import time
+import logging
+import argparse
+import statistics
+
+import ujson
+
+from benchmarks.fake_vcenter import FakeVCenter, ICAP_NETWORK
+from vlab_icap_api.lib.worker import vmware
+
+
+USERNAME = 'bench'
+IMAGE = '1.0.0'
+NETWORK = '{}_{}'.format(USERNAME, ICAP_NETWORK)
+OPERATIONS = ('show_icap', 'create_icap', 'update_network', 'delete_icap')
+
+
+def run(folders, vms, ova_mb, latency, task_delay, ip_delay, iterations):
+    """Benchmark every operation for one size of inventory
+
+    :Returns: Dictionary, of operation -> {'wall_ms', 'calls', 'top_calls'}
+
+    :param folders: How many other users have a folder in vCenter
+    :type folders: Integer
+
+    :param vms: How many ICAP instances the benchmarked user has
+    :type vms: Integer
+
+    :param iterations: How many times to run each operation
+    :type iterations: Integer
+    """
+    logger = logging.getLogger(__name__)
+    fake = FakeVCenter(latency=latency, task_delay=task_delay, ip_delay=ip_delay)
+    for idx in range(folders):
+        fake.add_user('user{}'.format(idx))
+    fake.add_user(USERNAME, vms=vms)
+    timings = {x: [] for x in OPERATIONS}
+    calls = {}
+    with fake.patch(images=[IMAGE], ova_mb=ova_mb):
+        # Warm up; the first call logs in, and fills the OVA cache
+        vmware.show_icap(USERNAME)
+        for iteration in range(iterations):
+            machine_name = 'benchmark{}'.format(iteration)
+            steps = (('show_icap', lambda: vmware.show_icap(USERNAME)),
+                     ('create_icap', lambda: vmware.create_icap(USERNAME, machine_name, IMAGE, NETWORK, logger)),
+                     ('update_network', lambda: vmware.update_network(USERNAME, machine_name, NETWORK)),
+                     ('delete_icap', lambda: vmware.delete_icap(USERNAME, machine_name, logger)))
+            for operation, step in steps:
+                fake.reset_calls()
+                start = time.perf_counter()
+                step()
+                timings[operation].append(time.perf_counter() - start)
+                # Same work every iteration, so any iteration's calls will do
+                calls[operation] = dict(fake.calls)
+    report = {}
+    for operation in OPERATIONS:
+        report[operation] = {'wall_ms': round(statistics.median(timings[operation]) * 1000, 1),
+                             'calls': sum(calls[operation].values()),
+                             'top_calls': sorted(calls[operation].items(), key=lambda x: -x[1])[:5]}
+    return report
+
+
+def main(argv=None):
+    """Run the benchmark, and print the results
+
+    :Returns: Integer - the exit code
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the ICAP worker against a fake vCenter')
+    parser.add_argument('--folders', type=int, nargs='+', default=[10, 200],
+                        help='How many other user folders are in vCenter')
+    parser.add_argument('--vms', type=int, nargs='+', default=[1, 25],
+                        help='How many ICAP instances the benchmarked user has')
+    parser.add_argument('--ova-mb', type=int, default=16, help='The size of the OVA disk to upload')
+    parser.add_argument('--latency-ms', type=float, default=1.0, help='How long every SOAP call takes')
+    parser.add_argument('--task-delay', type=float, default=0.1, help='Seconds for a vCenter task to finish')
+    parser.add_argument('--ip-delay', type=float, default=0.5, help='Seconds for a new VM to report an IP')
+    parser.add_argument('--iterations', type=int, default=3, help='How many times to run each operation')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args(argv)
+
+    results = []
+    for folders in args.folders:
+        for vms in args.vms:
+            report = run(folders, vms, args.ova_mb, args.latency_ms / 1000, args.task_delay,
+                         args.ip_delay, args.iterations)
+            results.append({'folders': folders, 'vms': vms, 'operations': report})
+    if args.json:
+        print(ujson.dumps(results, indent=2))
+        return 0
+    print('{:>8} {:>5}  {:<15} {:>10} {:>6}  {}'.format('folders', 'vms', 'operation', 'wall ms', 'calls', 'most made'))
+    for result in results:
+        for operation, numbers in result['operations'].items():
+            top = ', '.join('{}={}'.format(x, y) for x, y in numbers['top_calls'][:3])
+            print('{:>8} {:>5}  {:<15} {:>10} {:>6}  {}'.format(result['folders'], result['vms'], operation,
+                                                                numbers['wall_ms'], numbers['calls'], top))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
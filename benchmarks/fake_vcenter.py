@@ -0,0 +1,735 @@
+# -*- coding: UTF-8 -*-
+"""
+An in-process stand-in for vCenter, for benchmarking the worker.
+
+Every pyVmomi managed object forwards method calls and property reads to its
+"stub", which normally turns them into SOAP requests. ``FakeVCenter`` is that
+stub: it answers from an in-memory inventory, sleeps ``latency`` seconds per
+call like a network round-trip would, and counts every call by name. The real
+``vmware.py`` and ``vlab_inf_common`` code runs unchanged on top of it, so the
+call counts are the same SOAP requests a real vCenter would see.
+
+Only the parts of the vSphere API this service uses are modeled; anything else
+raises NotImplementedError.
+"""
+import io
+import os
+import re
+import time
+import types
+import tarfile
+import tempfile
+import datetime
+import itertools
+import threading
+import collections
+from contextlib import contextmanager
+from unittest.mock import patch
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+
+import ujson
+import OpenSSL
+from pyVmomi import vim, vmodl
+from vlab_inf_common.vmware import vcenter as inf_vcenter, virtual_machine, ova as inf_ova
+
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.images import ImageIndex, convert_name
+from vlab_icap_api.lib.worker import sessions, waiter, vmware
+from vlab_icap_api.lib.worker.ovas import OvaCache
+
+
+PAGE_SIZE = 100
+WAIT_TICK = 0.005
+ICAP_NETWORK = 'frontend'
+
+
+def icap_meta(version='1.0.0'):
+    """The notes of an ICAP instance created by this service
+
+    :Returns: String
+    """
+    return ujson.dumps({'component': 'ICAP',
+                        'created': 1234.5,
+                        'version': version,
+                        'configured': False,
+                        'generation': 1})
+
+
+class FakeVCenter(object):
+    """Answers pyVmomi calls from an in-memory inventory.
+
+    :param latency: Seconds every call takes, on top of the work it does
+    :type latency: Float
+
+    :param task_delay: Seconds between a task starting and vCenter reporting it done
+    :type task_delay: Float
+
+    :param ip_delay: Seconds between powering on a VM and it reporting an IP
+    :type ip_delay: Float
+    """
+    def __init__(self, latency=0.0, task_delay=0.0, ip_delay=0.0):
+        # The API version a real SoapStubAdapter would have negotiated
+        self.version = 'vim.version.version9'
+        self.latency = latency
+        self.task_delay = task_delay
+        self.ip_delay = ip_delay
+        self.calls = collections.Counter()
+        self.uploaded = 0
+        self._lock = threading.RLock()
+        self._ids = itertools.count(1)
+        self._props = {}
+        self._objects = {}
+        self._collectors = {}
+        self._filters = {}
+        self._tokens = {}
+        self._import_specs = {}
+        self._leases = {}
+        self._upload_server = None
+        self._build()
+
+    # -- Building the inventory ------------------------------------------------
+
+    def _new(self, vimtype, prefix, **props):
+        """Register a managed object, and its properties"""
+        with self._lock:
+            the_mo = vimtype('{}-{}'.format(prefix, next(self._ids)), self)
+            props.setdefault('parent', None)
+            self._props[the_mo._moId] = props
+            self._objects[the_mo._moId] = the_mo
+        return the_mo
+
+    def _build(self):
+        """Make the objects every vCenter has: one datacenter, host, datastore cluster and switch"""
+        self.root_folder = self._new(vim.Folder, 'group-d', name='Datacenters', childEntity=[])
+        self.vm_folder = self._new(vim.Folder, 'group-v', name='vm', childEntity=[])
+        self.host_folder = self._new(vim.Folder, 'group-h', name='host', childEntity=[])
+        self.datastore_folder = self._new(vim.Folder, 'group-s', name='datastore', childEntity=[])
+        self.network_folder = self._new(vim.Folder, 'group-n', name='network', childEntity=[])
+        self.datacenter = self._new(vim.Datacenter, 'datacenter', name='Datacenter',
+                                    vmFolder=self.vm_folder, hostFolder=self.host_folder,
+                                    datastoreFolder=self.datastore_folder, networkFolder=self.network_folder)
+        self._adopt(self.root_folder, self.datacenter)
+
+        self.host = self._new(vim.HostSystem, 'host', name='esxi-1.test',
+                              runtime=vim.host.RuntimeInfo(inMaintenanceMode=False))
+        self.resource_pool = self._new(vim.ResourcePool, 'resgroup', name=const.INF_VCENTER_RESORUCE_POOL)
+        cluster = self._new(vim.ClusterComputeResource, 'domain-c', name='Cluster',
+                            resourcePool=self.resource_pool, host=[self.host])
+        self._adopt(self.host_folder, cluster)
+
+        datastore = self._new(vim.Datastore, 'datastore', name='{}-1'.format(const.INF_VCENTER_DATASTORE))
+        pod = self._new(vim.StoragePod, 'group-p', name=const.INF_VCENTER_DATASTORE, childEntity=[])
+        self._adopt(pod, datastore)
+        self._adopt(self.datastore_folder, pod)
+
+        self.dv_switch = self._new(vim.dvs.VmwareDistributedVirtualSwitch, 'dvs', name='dvSwitch',
+                                   uuid='50 1a 2b 3c 4d 5e 6f 70-81 92 a3 b4 c5 d6 e7 f8')
+        self._adopt(self.network_folder, self.dv_switch)
+
+        self.top_folder = self.add_folder(const.INF_VCENTER_TOP_LVL_DIR.strip('/'), parent=self.vm_folder)
+
+        self.service_instance = self._new(vim.ServiceInstance, 'ServiceInstance')
+        self.property_collector = self._new(vmodl.query.PropertyCollector, 'propertyCollector')
+        self._collectors[self.property_collector._moId] = {'filters': {}, 'reported': {}, 'version': 0}
+        content = vim.ServiceInstanceContent(
+            rootFolder=self.root_folder,
+            propertyCollector=self.property_collector,
+            viewManager=self._new(vim.view.ViewManager, 'ViewManager'),
+            searchIndex=self._new(vim.SearchIndex, 'SearchIndex'),
+            sessionManager=self._new(vim.SessionManager, 'SessionManager',
+                                     currentSession=vim.UserSession(key='52a1', userName=const.INF_VCENTER_USER)),
+            setting=self._new(vim.option.OptionManager, 'VpxSettings',
+                              setting=[vim.option.OptionValue(key='VirtualCenter.FQDN', value='vcenter.test')]),
+            ovfManager=self._new(vim.OvfManager, 'OvfManager'),
+            about=vim.AboutInfo(name='VMware vCenter Server', instanceUuid='9d3c2e54-0000-4000-8000-000000000001'),
+        )
+        self._props[self.service_instance._moId]['content'] = content
+        self.content = content
+
+    def _adopt(self, parent, child):
+        """Put an object into a folder (or any other container with ``childEntity``)"""
+        with self._lock:
+            self._props[parent._moId]['childEntity'].append(child)
+            self._props[child._moId]['parent'] = parent
+
+    def add_folder(self, name, parent=None):
+        """Make a VM folder, under the top level directory by default
+
+        :Returns: vim.Folder
+        """
+        folder = self._new(vim.Folder, 'group-v', name=name, childEntity=[])
+        self._adopt(parent or self.top_folder, folder)
+        return folder
+
+    def add_network(self, name):
+        """Make a distributed port group
+
+        :Returns: vim.dvs.DistributedVirtualPortgroup
+        """
+        config = vim.dvs.DistributedVirtualPortgroup.ConfigInfo(name=name, distributedVirtualSwitch=self.dv_switch)
+        network = self._new(vim.dvs.DistributedVirtualPortgroup, 'dvportgroup', name=name, config=config)
+        with self._lock:
+            self._props[network._moId]['key'] = network._moId
+            self._props[network._moId]['vm'] = lambda: self._vms_on(network)
+        self._adopt(self.network_folder, network)
+        return network
+
+    def add_vm(self, folder, name, annotation=None, powered_on=True, networks=()):
+        """Make a virtual machine
+
+        :Returns: vim.VirtualMachine
+        """
+        the_vm = self._new(vim.VirtualMachine, 'vm', name=name, annotation=annotation,
+                           power_state='poweredOff', powered_on_at=None, network=list(networks),
+                           ip='10.{}.{}.{}'.format(*self._ip_octets()))
+        props = self._props[the_vm._moId]
+        props['runtime'] = lambda: vim.vm.RuntimeInfo(powerState=props['power_state'])
+        props['config'] = lambda: self._vm_config(props)
+        props['guest'] = lambda: self._vm_guest(props)
+        self._adopt(folder, the_vm)
+        if powered_on:
+            props['power_state'] = 'poweredOn'
+            props['powered_on_at'] = 0
+        return the_vm
+
+    def add_user(self, username, vms=0, version='1.0.0'):
+        """Make a user's folder, with a network and ``vms`` ICAP instances on it
+
+        :Returns: vim.Folder
+        """
+        folder = self.add_folder(username)
+        network = self.add_network('{}_{}'.format(username, ICAP_NETWORK))
+        for idx in range(vms):
+            self.add_vm(folder, 'icap{}'.format(idx), annotation=icap_meta(version), networks=[network])
+        return folder
+
+    def _ip_octets(self):
+        number = next(self._ids)
+        return (number >> 16) & 255, (number >> 8) & 255, number & 255
+
+    def _vms_on(self, network):
+        """The VMs connected to a network"""
+        with self._lock:
+            return [self._objects[x] for x, y in self._props.items()
+                    if x.startswith('vm-') and network in y.get('network', [])]
+
+    def _vm_config(self, props):
+        """The ``config`` property of a VM"""
+        nic = vim.vm.device.VirtualVmxnet3(key=4000,
+                                           deviceInfo=vim.Description(label='Network adapter 1', summary=''))
+        return vim.vm.ConfigInfo(name=props['name'], annotation=props['annotation'],
+                                 template=False, hardware=vim.vm.VirtualHardware(device=[nic]))
+
+    def _vm_guest(self, props):
+        """The ``guest`` property of a VM; it has an IP ``ip_delay`` seconds after power on"""
+        ip = None
+        if props['power_state'] == 'poweredOn' and time.time() - props['powered_on_at'] >= self.ip_delay:
+            ip = props['ip']
+        nics = [vim.vm.GuestInfo.NicInfo(ipAddress=[ip] if ip else [], network=self._props[x._moId]['name'])
+                for x in props['network']]
+        return vim.vm.GuestInfo(ipAddress=ip, net=nics)
+
+    # -- The pyVmomi stub interface --------------------------------------------
+
+    def InvokeAccessor(self, the_mo, info):
+        """Read a property of a managed object"""
+        self._count('{}.{}'.format(the_mo._wsdlName, info.name))
+        return self._get(the_mo, info.name)
+
+    def InvokeMethod(self, the_mo, info, args, outerStub=None):
+        """Call a method of a managed object
+
+        Like ``SoapStubAdapter``, a call made for another stub (i.e. the worker's
+        ``_ReloginStub``) returns the HTTP status and the result, instead of
+        raising the fault.
+        """
+        self._count('{}.{}'.format(the_mo._wsdlName, info.wsdlName))
+        handler = getattr(self, '_{}'.format(info.wsdlName), None)
+        if handler is None:
+            raise NotImplementedError('{}.{}'.format(the_mo._wsdlName, info.wsdlName))
+        if outerStub is None:
+            return handler(the_mo, *args)
+        try:
+            return 200, handler(the_mo, *args)
+        except vmodl.MethodFault as fault:
+            return 500, fault
+
+    def _count(self, name):
+        """Record a call, and take as long as a round-trip to vCenter"""
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def login(self, **kwargs):
+        """Stands in for ``pyVim.connect.SmartConnect``
+
+        :Returns: vim.ServiceInstance
+        """
+        self._count('SessionManager.Login')
+        return self.service_instance
+
+    def logout(self, service_instance):
+        """Stands in for ``pyVim.connect.Disconnect``"""
+        self._count('SessionManager.Logout')
+
+    def reset_calls(self):
+        """Forget every call counted so far"""
+        with self._lock:
+            self.calls.clear()
+
+    def _get(self, the_mo, name):
+        """The current value of a property"""
+        with self._lock:
+            try:
+                props = self._props[the_mo._moId]
+            except KeyError:
+                raise vmodl.fault.ManagedObjectNotFound(obj=the_mo)
+            value = props.get(name)
+        if callable(value):
+            value = value()
+        if isinstance(value, list):
+            value = list(value)
+        return value
+
+    def _resolve(self, the_mo, path):
+        """The current value of a property path, like "runtime.powerState" """
+        first, _, rest = path.partition('.')
+        value = self._get(the_mo, first)
+        for attr in [x for x in rest.split('.') if x]:
+            if value is None:
+                break
+            value = getattr(value, attr)
+        return value
+
+    def _children(self, the_mo):
+        """What a container view or traversal finds directly within an object"""
+        props = self._props.get(the_mo._moId, {})
+        if isinstance(the_mo, vim.Datacenter):
+            return [props['vmFolder'], props['hostFolder'], props['datastoreFolder'], props['networkFolder']]
+        if isinstance(the_mo, vim.ComputeResource):
+            return [props['resourcePool']] + props['host']
+        return list(props.get('childEntity', []))
+
+    # -- Tasks -----------------------------------------------------------------
+
+    def _task(self, result=None, error=None):
+        """Make a task that completes ``task_delay`` seconds from now
+
+        :Returns: vim.Task
+        """
+        done_at = time.time() + self.task_delay
+        the_task = self._new(vim.Task, 'task')
+
+        def info():
+            done = time.time() >= done_at
+            state = 'running'
+            if done:
+                state = 'error' if error else 'success'
+            return vim.TaskInfo(key=the_task._moId, task=the_task, state=state, cancelled=False,
+                                cancelable=False, descriptionId='fake',
+                                result=result if done else None,
+                                error=error if done else None,
+                                completeTime=datetime.datetime.now() if done else None)
+        self._props[the_task._moId]['info'] = info
+        return the_task
+
+    # -- Methods, named by their SOAP (wsdl) name --------------------------------
+
+    def _RetrieveServiceContent(self, the_mo):
+        return self.content
+
+    def _AcquireCloneTicket(self, the_mo):
+        return 'cst-VCT-{}'.format(next(self._ids))
+
+    def _CreateContainerView(self, the_mo, container, type, recursive):
+        found = []
+        pending = self._children(container)
+        while pending:
+            current = pending.pop(0)
+            if not type or isinstance(current, tuple(type)):
+                found.append(current)
+            if recursive:
+                pending.extend(self._children(current))
+        return self._new(vim.view.ContainerView, 'session[fake]view', view=found)
+
+    def _DestroyView(self, the_mo):
+        with self._lock:
+            self._props.pop(the_mo._moId, None)
+            self._objects.pop(the_mo._moId, None)
+
+    def _FindChild(self, the_mo, entity, name):
+        for child in self._children(entity):
+            if self._get(child, 'name') == name:
+                return child
+        return None
+
+    def _CreateFolder(self, the_mo, name):
+        return self.add_folder(name, parent=the_mo)
+
+    def _MoveIntoFolder_Task(self, the_mo, objects):
+        for obj in objects:
+            with self._lock:
+                old_parent = self._props[obj._moId]['parent']
+                self._props[old_parent._moId]['childEntity'].remove(obj)
+            self._adopt(the_mo, obj)
+        return self._task()
+
+    def _PowerOnVM_Task(self, the_mo, host=None):
+        with self._lock:
+            props = self._props[the_mo._moId]
+            props['power_state'] = 'poweredOn'
+            props['powered_on_at'] = time.time()
+        return self._task()
+
+    def _PowerOffVM_Task(self, the_mo):
+        with self._lock:
+            self._props[the_mo._moId]['power_state'] = 'poweredOff'
+        return self._task()
+
+    def _Destroy_Task(self, the_mo):
+        with self._lock:
+            props = self._props.pop(the_mo._moId)
+            self._objects.pop(the_mo._moId)
+            self._props[props['parent']._moId]['childEntity'].remove(the_mo)
+        return self._task()
+
+    def _Rename_Task(self, the_mo, newName):
+        with self._lock:
+            self._props[the_mo._moId]['name'] = newName
+        return self._task()
+
+    def _ReconfigVM_Task(self, the_mo, spec):
+        with self._lock:
+            props = self._props[the_mo._moId]
+            if spec.annotation is not None:
+                props['annotation'] = spec.annotation
+            for change in spec.deviceChange or []:
+                port = getattr(change.device.backing, 'port', None)
+                if port is not None:
+                    props['network'] = [self._objects[port.portgroupKey]]
+        return self._task()
+
+    def _CreateImportSpec(self, the_mo, ovfDescriptor, resourcePool, datastore, cisp):
+        disks = re.findall(r'ovf:href="([^"]+\.vmdk)"', ovfDescriptor)
+        file_items = [vim.OvfManager.FileItem(deviceId='/{}/disk-{}'.format(cisp.entityName, idx),
+                                              path=disk, create=True)
+                      for idx, disk in enumerate(disks)]
+        networks = [x.network for x in cisp.networkMapping or []]
+        with self._lock:
+            self._import_specs[cisp.entityName] = (file_items, networks)
+        import_spec = vim.VirtualMachineImportSpec(configSpec=vim.vm.ConfigSpec(name=cisp.entityName))
+        return vim.OvfManager.CreateImportSpecResult(importSpec=import_spec, fileItem=file_items)
+
+    def _ImportVApp(self, the_mo, spec, folder=None, host=None):
+        name = spec.configSpec.name
+        with self._lock:
+            file_items, networks = self._import_specs.pop(name)
+        lease = self._new(vim.HttpNfcLease, 'session[fake]lease', state='ready', error=None)
+        urls = [vim.HttpNfcLease.DeviceUrl(key=x.deviceId, importKey=x.deviceId,
+                                           url='http://127.0.0.1:{}/nfc/{}/{}'.format(self._upload_port(), lease._moId, idx))
+                for idx, x in enumerate(file_items)]
+        self._props[lease._moId]['info'] = vim.HttpNfcLease.Info(lease=lease, deviceUrl=urls)
+        self._leases[lease._moId] = (name, folder, networks)
+        return lease
+
+    def _HttpNfcLeaseProgress(self, the_mo, percent):
+        return None
+
+    def _HttpNfcLeaseComplete(self, the_mo):
+        name, folder, networks = self._leases.pop(the_mo._moId)
+        self.add_vm(folder, name, powered_on=False, networks=networks)
+        self._props[the_mo._moId]['state'] = 'done'
+
+    def _HttpNfcLeaseAbort(self, the_mo, fault=None):
+        self._leases.pop(the_mo._moId, None)
+        self._props[the_mo._moId]['state'] = 'error'
+
+    # -- The PropertyCollector -------------------------------------------------
+
+    def _RetrievePropertiesEx(self, the_mo, specSet, options):
+        found = []
+        for spec in specSet:
+            for obj_spec in spec.objectSet:
+                candidates = [] if obj_spec.skip else [obj_spec.obj]
+                for traversal in obj_spec.selectSet or []:
+                    candidates.extend(self._children(obj_spec.obj) if traversal.path == 'childEntity' else [])
+                for obj in candidates:
+                    for prop_spec in spec.propSet:
+                        if isinstance(obj, prop_spec.type):
+                            found.append(self._object_content(obj, prop_spec.pathSet))
+        return self._page(found, options.maxObjects or PAGE_SIZE)
+
+    def _ContinueRetrievePropertiesEx(self, the_mo, token):
+        with self._lock:
+            found, page_size = self._tokens.pop(token)
+        return self._page(found, page_size)
+
+    def _page(self, found, page_size):
+        """Return up to ``page_size`` objects, and a token for the rest"""
+        if not found:
+            return None
+        token = None
+        if len(found) > page_size:
+            token = 'token-{}'.format(next(self._ids))
+            with self._lock:
+                self._tokens[token] = (found[page_size:], page_size)
+        return vmodl.query.PropertyCollector.RetrieveResult(token=token, objects=found[:page_size])
+
+    def _object_content(self, obj, paths):
+        """The requested properties of one object, like a RetrieveResult has them"""
+        prop_set = []
+        for path in paths:
+            value = self._resolve(obj, path)
+            if isinstance(value, list):
+                if not value:
+                    continue
+                value = type(value[0]).Array(value)
+            if value is not None:
+                prop_set.append(vmodl.DynamicProperty(name=path, val=value))
+        return vmodl.query.PropertyCollector.ObjectContent(obj=obj, propSet=prop_set)
+
+    def _CreatePropertyCollector(self, the_mo):
+        collector = self._new(vmodl.query.PropertyCollector, 'session[fake]collector')
+        with self._lock:
+            self._collectors[collector._moId] = {'filters': {}, 'reported': {}, 'version': 0}
+        return collector
+
+    def _DestroyPropertyCollector(self, the_mo):
+        with self._lock:
+            collector = self._collectors.pop(the_mo._moId, {'filters': {}})
+            for filter_id in collector['filters']:
+                self._filters.pop(filter_id, None)
+
+    def _CreateFilter(self, the_mo, spec, partialUpdates):
+        the_filter = self._new(vmodl.query.PropertyCollector.Filter, 'session[fake]filter')
+        watched = []
+        for obj_spec in spec.objectSet:
+            for prop_spec in spec.propSet:
+                watched.append((obj_spec.obj, list(prop_spec.pathSet)))
+        with self._lock:
+            self._collectors[the_mo._moId]['filters'][the_filter._moId] = (the_filter, watched)
+            self._filters[the_filter._moId] = the_mo._moId
+        return the_filter
+
+    def _DestroyPropertyFilter(self, the_mo):
+        with self._lock:
+            collector_id = self._filters.pop(the_mo._moId, None)
+            if collector_id in self._collectors:
+                self._collectors[collector_id]['filters'].pop(the_mo._moId, None)
+
+    def _WaitForUpdatesEx(self, the_mo, version, options):
+        max_wait = options.maxWaitSeconds if options and options.maxWaitSeconds is not None else 60
+        deadline = time.time() + max_wait
+        while True:
+            update = self._updates(the_mo._moId)
+            if update is not None:
+                return update
+            if time.time() >= deadline:
+                return None
+            time.sleep(WAIT_TICK)
+
+    def _updates(self, collector_id):
+        """Everything a collector's filters watch that changed since it last reported
+
+        :Returns: vmodl.query.PropertyCollector.UpdateSet, or None if nothing changed
+        """
+        with self._lock:
+            collector = self._collectors[collector_id]
+            filters = list(collector['filters'].items())
+        filter_updates = []
+        for filter_id, (the_filter, watched) in filters:
+            object_updates = []
+            for obj, paths in watched:
+                changes = []
+                for path in paths:
+                    try:
+                        value = self._resolve(obj, path)
+                    except vmodl.fault.ManagedObjectNotFound:
+                        continue
+                    key = (filter_id, obj._moId, path)
+                    if key in collector['reported'] and collector['reported'][key] == value:
+                        continue
+                    collector['reported'][key] = value
+                    change = vmodl.query.PropertyCollector.Change(name=path, op='assign')
+                    if value is not None:
+                        change.val = value
+                    changes.append(change)
+                if changes:
+                    object_updates.append(vmodl.query.PropertyCollector.ObjectUpdate(kind='modify', obj=obj,
+                                                                                     changeSet=changes))
+            if object_updates:
+                filter_updates.append(vmodl.query.PropertyCollector.FilterUpdate(filter=the_filter,
+                                                                                 objectSet=object_updates))
+        if not filter_updates:
+            return None
+        with self._lock:
+            collector['version'] += 1
+            version = collector['version']
+        return vmodl.query.PropertyCollector.UpdateSet(version=str(version), filterSet=filter_updates)
+
+    # -- Uploads -----------------------------------------------------------------
+
+    def _upload_port(self):
+        """Start the HTTP server that receives OVA disk uploads, if it isn't running"""
+        with self._lock:
+            if self._upload_server is None:
+                fake = self
+
+                class Handler(BaseHTTPRequestHandler):
+                    def do_POST(self):
+                        remaining = int(self.headers['Content-Length'])
+                        while remaining:
+                            chunk = self.rfile.read(min(remaining, 1024 * 1024))
+                            if not chunk:
+                                break
+                            remaining -= len(chunk)
+                            with fake._lock:
+                                fake.uploaded += len(chunk)
+                        self.send_response(200)
+                        self.end_headers()
+
+                    def log_message(self, *args):
+                        pass
+
+                class Server(ThreadingMixIn, HTTPServer):
+                    daemon_threads = True
+
+                self._upload_server = Server(('127.0.0.1', 0), Handler)
+                thread = threading.Thread(target=self._upload_server.serve_forever, daemon=True)
+                thread.start()
+            return self._upload_server.server_address[1]
+
+    def close(self):
+        """Stop the upload server"""
+        with self._lock:
+            server, self._upload_server = self._upload_server, None
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+
+    @contextmanager
+    def patch(self, images=('1.0.0',), ova_mb=1):
+        """Make the worker talk to this fake instead of a real vCenter
+
+        Pooled sessions and the task waiter are reset on the way in and out, so
+        nothing holds on to objects from another vCenter. The OVAs the worker
+        deploys are generated in a temporary directory.
+
+        :param images: The versions of ICAP to make an OVA for
+        :type images: List
+
+        :param ova_mb: The size of the disk in each OVA, in megabytes
+        :type ova_mb: Integer
+        """
+        pem = _self_signed_cert()
+        fake_ssl = types.SimpleNamespace(get_server_certificate=lambda *args, **kwargs: pem)
+        sessions.POOL.close()
+        waiter.WAITER.close()
+        with tempfile.TemporaryDirectory() as images_dir:
+            for image in images:
+                write_ova(os.path.join(images_dir, convert_name(image)), ova_mb)
+            with patch.object(inf_vcenter.connect, 'SmartConnect', self.login), \
+                 patch.object(inf_vcenter.connect, 'Disconnect', self.logout), \
+                 patch.object(virtual_machine, 'ssl', fake_ssl), \
+                 patch.object(inf_ova, 'Timer', _daemon_timer), \
+                 patch.object(vmware, 'OVAS', OvaCache(images_dir)), \
+                 patch.object(vmware, 'INDEX', verified_index(images_dir)):
+                try:
+                    yield self
+                finally:
+                    waiter.WAITER.close()
+                    sessions.POOL.close()
+                    self.close()
+
+
+OVF = """<?xml version="1.0" encoding="UTF-8"?>
+<Envelope xmlns="http://schemas.dmtf.org/ovf/envelope/1" xmlns:ovf="http://schemas.dmtf.org/ovf/envelope/1">
+  <References>
+    <File ovf:href="icap-disk1.vmdk" ovf:id="file1" ovf:size="{size}"/>
+  </References>
+  <NetworkSection>
+    <Network ovf:name="VM Network"/>
+  </NetworkSection>
+</Envelope>
+"""
+
+
+class _UpFrontIndex(ImageIndex):
+    """An ``ImageIndex`` that's only scanned when asked, instead of by a thread
+    that'd outlive the temporary images directory"""
+    def start(self):
+        pass
+
+
+def verified_index(images_dir):
+    """Verify the OVAs in a directory, like the background indexer would have
+
+    :Returns: ImageIndex
+
+    :param images_dir: The directory of OVAs made by ``write_ova``
+    :type images_dir: String
+    """
+    index = _UpFrontIndex(images_dir, os.path.join(images_dir, '.index'), interval=3600)
+    index.scan()
+    return index
+
+
+def write_ova(path, disk_mb):
+    """Make an OVA with one (zero filled) disk, like the ones in the images directory
+
+    :Returns: None
+
+    :param path: Where to write the OVA
+    :type path: String
+
+    :param disk_mb: The size of the disk, in megabytes
+    :type disk_mb: Integer
+    """
+    size = disk_mb * 1024 * 1024
+    ovf = OVF.format(size=size).encode()
+    with tarfile.open(path, 'w') as the_tar:
+        info = tarfile.TarInfo('icap.ovf')
+        info.size = len(ovf)
+        the_tar.addfile(info, io.BytesIO(ovf))
+        info = tarfile.TarInfo('icap-disk1.vmdk')
+        info.size = size
+        the_tar.addfile(info, _Zeros(size))
+
+
+class _Zeros(object):
+    """A file-like object of ``size`` zero bytes, so big disks don't sit in memory"""
+    def __init__(self, size):
+        self._remaining = size
+
+    def read(self, size=-1):
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        self._remaining -= size
+        return bytes(size)
+
+
+def _daemon_timer(*args, **kwargs):
+    """A ``threading.Timer`` that doesn't keep the process alive, for the OVA lease chimer"""
+    timer = threading.Timer(*args, **kwargs)
+    timer.daemon = True
+    return timer
+
+
+def _self_signed_cert():
+    """A PEM certificate, for the console URL thumbprint
+
+    :Returns: String
+    """
+    key = OpenSSL.crypto.PKey()
+    key.generate_key(OpenSSL.crypto.TYPE_RSA, 2048)
+    cert = OpenSSL.crypto.X509()
+    cert.get_subject().CN = 'vcenter.test'
+    cert.set_serial_number(1)
+    cert.gmtime_adj_notBefore(0)
+    cert.gmtime_adj_notAfter(3600)
+    cert.set_issuer(cert.get_subject())
+    cert.set_pubkey(key)
+    cert.sign(key, 'sha256')
+    return OpenSSL.crypto.dump_certificate(OpenSSL.crypto.FILETYPE_PEM, cert).decode()
@@ -10,10 +10,12 @@ setup(name="vlab-icap-api",
       author="Nicholas Willhite,",
       author_email='willnx84@gmail.com',
       version='2019.06.25',
-      packages=find_packages(),
+      packages=find_packages(exclude=['benchmarks', 'benchmarks.*']),
       include_package_data=True,
       package_files={'vlab_icap_api' : ['app.ini']},
       description="icap",
       install_requires=['flask', 'ldap3', 'pyjwt', 'uwsgi', 'vlab-api-common',
-                        'ujson', 'cryptography', 'vlab-inf-common', 'celery']
+                        'ujson', 'cryptography', 'vlab-inf-common', 'celery',
+                        'prometheus_client'],
+      extras_require={'evented': ['gevent']}
       )
@@ -0,0 +1,202 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions and objects in admission.py
+"""
+import threading
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_icap_api.lib import admission
+
+
+class TestQueueDepth(unittest.TestCase):
+    """A set of test cases for the ``queue_depth`` function"""
+
+    def test_queue_depth(self):
+        """``queue_depth`` returns the number of messages in the queue"""
+        fake_celery_app = MagicMock()
+        conn = fake_celery_app.connection_for_read.return_value.__enter__.return_value
+        conn.default_channel.queue_declare.return_value.message_count = 7
+
+        output = admission.queue_depth(fake_celery_app, 'icap-lifecycle')
+
+        self.assertEqual(output, 7)
+
+    def test_queue_depth_error(self):
+        """``queue_depth`` returns None when the broker cannot be queried"""
+        fake_celery_app = MagicMock()
+        fake_celery_app.connection_for_read.side_effect = OSError('doh')
+
+        output = admission.queue_depth(fake_celery_app, 'icap-lifecycle')
+
+        self.assertTrue(output is None)
+
+
+class TestAdmissionControl(unittest.TestCase):
+    """A set of test cases for the AdmissionControl object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.control = admission.AdmissionControl(user_limit=2, queue_limit=10, estimate=600)
+        self.fake_celery_app = MagicMock()
+        self.fake_celery_app.AsyncResult.return_value.ready.return_value = False
+        patcher = patch.object(admission, 'queue_depth')
+        self.fake_queue_depth = patcher.start()
+        self.fake_queue_depth.return_value = 0
+        self.addCleanup(patcher.stop)
+
+    def test_admit(self):
+        """``admit`` sends the task, and tracks it as in flight"""
+        output = self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-1')
+
+        self.assertEqual(output, 'task-1')
+        self.assertEqual(self.control.inflight('bob'), 1)
+
+    @patch.object(admission.time, 'time')
+    def test_user_limit(self, fake_time):
+        """``admit`` raises Throttled, with a Retry-After estimate, at the per-user limit"""
+        fake_time.return_value = 100
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-1')
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-2')
+        fake_time.return_value = 200
+        send = MagicMock()
+
+        with self.assertRaises(admission.Throttled) as the_error:
+            self.control.admit(self.fake_celery_app, 'bob', send)
+
+        self.assertEqual(the_error.exception.retry_after, 500)
+        self.assertFalse(send.called)
+
+    def test_weight(self):
+        """``admit`` counts a bulk create once for every instance it makes"""
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-1', weight=2)
+
+        self.assertEqual(self.control.inflight('bob'), 2)
+
+    def test_weight_limit(self):
+        """``admit`` raises Throttled when a bulk create would go over the per-user limit"""
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-1')
+        send = MagicMock()
+
+        with self.assertRaises(admission.Throttled):
+            self.control.admit(self.fake_celery_app, 'bob', send, weight=2)
+
+        self.assertFalse(send.called)
+
+    def test_weight_over_limit(self):
+        """A bulk create bigger than the per-user limit runs alone, instead of never being admitted"""
+        output = self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-1', weight=20)
+
+        self.assertEqual(output, 'task-1')
+        with self.assertRaises(admission.Throttled):
+            self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-2')
+
+    def test_weight_finished(self):
+        """``admit`` frees all the weight of a bulk create once it finishes"""
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-1', weight=2)
+        self.fake_celery_app.AsyncResult.return_value.ready.return_value = True
+
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-2', weight=2)
+
+        self.assertEqual(self.control.inflight('bob'), 2)
+
+    def test_user_limit_per_user(self):
+        """``admit`` only counts the creates of the same user"""
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-1')
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-2')
+
+        output = self.control.admit(self.fake_celery_app, 'alice', lambda: 'task-3')
+
+        self.assertEqual(output, 'task-3')
+
+    def test_finished(self):
+        """``admit`` forgets creates that finished"""
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-1')
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-2')
+        self.fake_celery_app.AsyncResult.return_value.ready.return_value = True
+
+        output = self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-3')
+
+        self.assertEqual(output, 'task-3')
+        self.assertEqual(self.control.inflight('bob'), 1)
+
+    @patch.object(admission.time, 'time')
+    def test_expired(self, fake_time):
+        """``admit`` stops counting creates that should have timed out long ago"""
+        fake_time.return_value = 100
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-1')
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-2')
+        fake_time.return_value = 100 + (2 * admission.const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT) + 1
+
+        output = self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-3')
+
+        self.assertEqual(output, 'task-3')
+
+    def test_queue_limit(self):
+        """``admit`` raises Throttled when the lifecycle queue is too deep"""
+        self.fake_queue_depth.return_value = 10
+
+        with self.assertRaises(admission.Throttled) as the_error:
+            self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-1')
+
+        self.assertTrue(the_error.exception.retry_after >= 600)
+
+    def test_queue_unknown(self):
+        """``admit`` lets creates through when the queue depth is unknown"""
+        self.fake_queue_depth.return_value = None
+
+        output = self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-1')
+
+        self.assertEqual(output, 'task-1')
+
+    def test_no_limits(self):
+        """A limit of zero turns it off, and creates aren't tracked or checked on"""
+        control = admission.AdmissionControl(user_limit=0, queue_limit=0, estimate=600)
+        for idx in range(5):
+            control.admit(self.fake_celery_app, 'bob', lambda: 'task-{}'.format(idx))
+
+        self.assertEqual(control.inflight('bob'), 0)
+        self.assertFalse(self.fake_queue_depth.called)
+        self.assertFalse(self.fake_celery_app.AsyncResult.called)
+
+    def test_queue_depth_cached(self):
+        """``admit`` only asks the broker for the queue depth once per ``QUEUE_DEPTH_TTL``"""
+        self.control.admit(self.fake_celery_app, 'bob', lambda: 'task-1')
+        self.control.admit(self.fake_celery_app, 'alice', lambda: 'task-2')
+
+        self.assertEqual(self.fake_queue_depth.call_count, 1)
+
+    def test_other_users(self):
+        """``admit`` doesn't hold up other users while a create is being sent"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_send():
+            started.set()
+            release.wait(5)
+            return 'task-1'
+
+        first = threading.Thread(target=self.control.admit, args=(self.fake_celery_app, 'bob', slow_send))
+        first.start()
+        started.wait(5)
+        other = []
+        second = threading.Thread(target=lambda: other.append(self.control.admit(self.fake_celery_app, 'alice', lambda: 'task-2')))
+        second.start()
+        second.join(1)
+        before_release = list(other)
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(before_release, ['task-2'])
+
+    def test_send_fails(self):
+        """``admit`` doesn't track a create that failed to send"""
+        with self.assertRaises(RuntimeError):
+            self.control.admit(self.fake_celery_app, 'bob', MagicMock(side_effect=RuntimeError('doh')))
+
+        self.assertEqual(self.control.inflight('bob'), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -53,5 +53,27 @@ class TestIcapViewSchema(unittest.TestCase):
         self.assertTrue(schema_valid)
 
 
+    def test_bulk_post_schema(self):
+        """The schema defined for POST on /bulk is valid"""
+        try:
+            Draft4Validator.check_schema(icap.IcapView.BULK_POST_SCHEMA)
+            schema_valid = True
+        except RuntimeError:
+            schema_valid = False
+
+        self.assertTrue(schema_valid)
+
+
+    def test_bulk_delete_schema(self):
+        """The schema defined for DELETE on /bulk is valid"""
+        try:
+            Draft4Validator.check_schema(icap.IcapView.BULK_DELETE_SCHEMA)
+            schema_valid = True
+        except RuntimeError:
+            schema_valid = False
+
+        self.assertTrue(schema_valid)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,51 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the API load generator in benchmarks/bench_api.py
+"""
+import unittest
+
+from benchmarks import bench_api
+
+
+class TestBenchApi(unittest.TestCase):
+    """A set of test cases for bench_api.py"""
+
+    def test_parse_mix(self):
+        """``parse_mix`` returns the weight of every endpoint"""
+        output = bench_api.parse_mix('GET /icap=4,POST /icap=1')
+        expected = {'GET /icap': 4, 'POST /icap': 1}
+
+        self.assertEqual(output, expected)
+
+    def test_parse_mix_unknown(self):
+        """``parse_mix`` raises ValueError for an endpoint it cannot send"""
+        with self.assertRaises(ValueError):
+            bench_api.parse_mix('PUT /icap=1')
+
+    def test_summarize(self):
+        """``summarize`` reports the throughput, percentiles and statuses of every endpoint"""
+        samples = {'GET /icap': [(0.001 * x, 202) for x in range(1, 101)],
+                   'GET /image': [(0.5, 200), (0.5, 'error')]}
+
+        output = bench_api.summarize(samples, elapsed=2)
+
+        self.assertEqual(output['GET /icap']['rps'], 50)
+        self.assertEqual(output['GET /icap']['p50_ms'], 51)
+        self.assertEqual(output['GET /icap']['p99_ms'], 100)
+        self.assertEqual(output['GET /image']['statuses'], {'200': 1, 'error': 1})
+        self.assertEqual(output['total']['requests'], 102)
+
+    def test_drive(self):
+        """``drive`` sends every endpoint to the in-process API, and they all succeed"""
+        tokens = bench_api.mint_tokens(users=20, client_ip='127.0.0.1')
+        weights = bench_api.parse_mix(bench_api.DEFAULT_MIX)
+        with bench_api.stand_in() as url:
+            samples, _ = bench_api.drive(url, tokens, concurrency=2, duration=0.5, weights=weights)
+
+        statuses = {x[1] for results in samples.values() for x in results}
+        self.assertTrue(statuses)
+        self.assertTrue(statuses.issubset({200, 202, 429}))
+
+
+if __name__ == '__main__':
+    unittest.main()
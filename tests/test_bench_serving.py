@@ -0,0 +1,40 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the serving benchmark in benchmarks/bench_serving.py
+"""
+import unittest
+
+from benchmarks import bench_serving
+
+
+class TestBenchServing(unittest.TestCase):
+    """A set of test cases for bench_serving.py"""
+
+    def test_command_uwsgi(self):
+        """``command`` serves the API like app.ini, with the requested number of workers"""
+        output = bench_serving.command('uwsgi', 5000, processes=4)
+
+        self.assertIn('127.0.0.1:5000', output)
+        self.assertEqual(output[output.index('--processes') + 1], '4')
+        self.assertEqual(output[output.index('--threads') + 1], '1')
+
+    def test_command_gevent(self):
+        """``command`` serves the API with gevent in a new interpreter"""
+        output = bench_serving.command('gevent', 5000)
+
+        self.assertEqual(output[-3:], ['-m', 'benchmarks.api_server', '5000'])
+
+    def test_command_unknown(self):
+        """``command`` raises ValueError for a server it doesn't know"""
+        with self.assertRaises(ValueError):
+            bench_serving.command('gunicorn', 5000)
+
+    def test_probe_down(self):
+        """``probe`` returns None when nothing answers the healthcheck"""
+        output = bench_serving.probe('127.0.0.1', bench_serving._free_port(), timeout=1)
+
+        self.assertEqual(output, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,29 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the startup benchmark in benchmarks/bench_startup.py
+"""
+import unittest
+
+from benchmarks import bench_startup
+
+
+class TestBenchStartup(unittest.TestCase):
+    """A set of test cases for bench_startup.py"""
+
+    def test_api_no_pyvmomi(self):
+        """Starting the API never imports pyVmomi"""
+        output = bench_startup.measure('api')
+
+        self.assertFalse(output['pyvmomi'])
+
+    def test_worker_no_pyvmomi(self):
+        """Starting the worker doesn't import pyVmomi until a task needs it"""
+        output = bench_startup.run(['worker', 'worker+task'], iterations=1)
+
+        self.assertFalse(output['worker']['pyvmomi'])
+        self.assertTrue(output['worker+task']['pyvmomi'])
+        self.assertTrue(output['worker']['rss_mb'] > 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,61 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests that run vmware.py against the fake vCenter of the benchmarks
+"""
+import unittest
+from unittest.mock import MagicMock
+
+from benchmarks import bench_vmware
+from benchmarks.fake_vcenter import FakeVCenter
+from vlab_icap_api.lib.worker import vmware
+
+
+class TestFakeVCenter(unittest.TestCase):
+    """A set of test cases for running vmware.py against FakeVCenter"""
+
+    def test_show_icap(self):
+        """``show_icap`` returns every ICAP instance of the user"""
+        fake = FakeVCenter()
+        fake.add_user('alice', vms=2)
+        fake.add_user('bob', vms=1)
+        with fake.patch():
+            output = vmware.show_icap('alice')
+
+        self.assertEqual(sorted(output.keys()), ['icap0', 'icap1'])
+        self.assertEqual(output['icap0']['networks'], ['frontend'])
+
+    def test_show_icap_one_retrieve(self):
+        """``show_icap`` reads the properties of every VM with a single RetrievePropertiesEx"""
+        fake = FakeVCenter()
+        fake.add_user('alice', vms=30)
+        with fake.patch():
+            vmware.show_icap('alice')
+
+        self.assertEqual(fake.calls['PropertyCollector.RetrievePropertiesEx'], 1)
+        self.assertEqual(fake.calls['VirtualMachine.config'], 0)
+
+    def test_create_delete(self):
+        """An ICAP instance can be created, moved to another network, and deleted"""
+        fake = FakeVCenter()
+        fake.add_user('alice')
+        with fake.patch():
+            vmware.create_icap('alice', 'myICAP', '1.0.0', 'alice_frontend', MagicMock())
+            vmware.update_network('alice', 'myICAP', 'alice_frontend')
+            created = vmware.show_icap('alice')
+            vmware.delete_icap('alice', 'myICAP', MagicMock())
+            deleted = vmware.show_icap('alice')
+
+        self.assertEqual(list(created.keys()), ['myICAP'])
+        self.assertEqual(deleted, {})
+        self.assertEqual(fake.uploaded, 1024 * 1024)
+
+    def test_run(self):
+        """``bench_vmware.run`` reports the wall time and SOAP calls of every operation"""
+        report = bench_vmware.run(folders=2, vms=1, ova_mb=1, latency=0, task_delay=0, ip_delay=0, iterations=1)
+
+        self.assertEqual(set(report.keys()), set(bench_vmware.OPERATIONS))
+        self.assertTrue(all(x['calls'] > 0 for x in report.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in cache.py
+"""
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from vlab_icap_api.lib.worker import cache
+
+
+class TestInventoryCache(unittest.TestCase):
+    """A set of test cases for the InventoryCache object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.cache_dir = tempfile.mkdtemp()
+        self.inventory = cache.InventoryCache(self.cache_dir, ttl=300)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.cache_dir)
+
+    def test_miss(self):
+        """``InventoryCache`` - ``get`` returns None when nothing is cached"""
+        self.assertTrue(self.inventory.get('bob') is None)
+
+    def test_set(self):
+        """``InventoryCache`` - ``get`` returns what was stored via ``set``"""
+        self.inventory.set('bob', {'myICAP': {'state': 'poweredOn'}})
+
+        output = self.inventory.get('bob')
+        expected = {'myICAP': {'state': 'poweredOn'}}
+
+        self.assertEqual(output, expected)
+
+    def test_set_no_console(self):
+        """``InventoryCache`` - ``set`` doesn't store the single-use console URLs"""
+        vms = {'myICAP': {'state': 'poweredOn', 'console': 'https://vcenter/console?sessionTicket=asdf'}}
+        self.inventory.set('bob', vms)
+
+        output = self.inventory.get('bob')
+        expected = {'myICAP': {'state': 'poweredOn'}}
+
+        self.assertEqual(output, expected)
+        # The caller still returns its console URLs to the client
+        self.assertIn('console', vms['myICAP'])
+
+    def test_update_no_console(self):
+        """``InventoryCache`` - ``update`` doesn't store the console URL of a new instance"""
+        self.inventory.set('bob', {'myICAP': {}})
+        self.inventory.update('bob', {'otherICAP': {'console': 'https://vcenter/console?sessionTicket=asdf'}})
+
+        output = self.inventory.get('bob')
+        expected = {'myICAP': {}, 'otherICAP': {}}
+
+        self.assertEqual(output, expected)
+
+    def test_per_user(self):
+        """``InventoryCache`` keeps each user's inventory separate"""
+        self.inventory.set('bob', {'myICAP': {}})
+
+        self.assertTrue(self.inventory.get('alice') is None)
+
+    def test_ttl(self):
+        """``InventoryCache`` - ``get`` ignores expired inventories"""
+        self.inventory.set('bob', {'myICAP': {}})
+        with patch.object(cache.time, 'time', return_value=cache.time.time() + 301):
+            output = self.inventory.get('bob')
+
+        self.assertTrue(output is None)
+
+    def test_update(self):
+        """``InventoryCache`` - ``update`` adds instances to a cached inventory"""
+        self.inventory.set('bob', {'myICAP': {}})
+        self.inventory.update('bob', {'otherICAP': {}})
+
+        output = self.inventory.get('bob')
+        expected = {'myICAP': {}, 'otherICAP': {}}
+
+        self.assertEqual(output, expected)
+
+    def test_update_miss(self):
+        """``InventoryCache`` - ``update`` does not create a partial inventory"""
+        self.inventory.update('bob', {'otherICAP': {}})
+
+        self.assertTrue(self.inventory.get('bob') is None)
+
+    def test_remove(self):
+        """``InventoryCache`` - ``remove`` deletes an instance from a cached inventory"""
+        self.inventory.set('bob', {'myICAP': {}, 'otherICAP': {}})
+        self.inventory.remove('bob', 'otherICAP')
+
+        output = self.inventory.get('bob')
+        expected = {'myICAP': {}}
+
+        self.assertEqual(output, expected)
+
+    def test_invalidate(self):
+        """``InventoryCache`` - ``invalidate`` forgets a user's inventory"""
+        self.inventory.set('bob', {'myICAP': {}})
+        self.inventory.invalidate('bob')
+
+        self.assertTrue(self.inventory.get('bob') is None)
+
+    def test_invalidate_miss(self):
+        """``InventoryCache`` - ``invalidate`` is a no-op when nothing is cached"""
+        self.inventory.invalidate('bob')
+
+    def test_set_generation(self):
+        """``InventoryCache`` - ``set`` stores the inventory when nothing changed since ``generation``"""
+        generation = self.inventory.generation('bob')
+        self.inventory.set('bob', {'myICAP': {}}, generation=generation)
+
+        self.assertEqual(self.inventory.get('bob'), {'myICAP': {}})
+
+    def test_set_stale_update(self):
+        """``InventoryCache`` - ``set`` doesn't overwrite an ``update`` made after ``generation``"""
+        self.inventory.set('bob', {'myICAP': {}})
+        generation = self.inventory.generation('bob')
+        self.inventory.update('bob', {'newICAP': {}})
+        self.inventory.set('bob', {'myICAP': {}}, generation=generation)
+
+        self.assertEqual(self.inventory.get('bob'), {'myICAP': {}, 'newICAP': {}})
+
+    def test_set_stale_update_miss(self):
+        """``InventoryCache`` - ``set`` doesn't store a query that an ``update`` of an uncached inventory made stale"""
+        generation = self.inventory.generation('bob')
+        self.inventory.update('bob', {'newICAP': {}})
+        self.inventory.set('bob', {'myICAP': {}}, generation=generation)
+
+        self.assertTrue(self.inventory.get('bob') is None)
+
+    def test_set_stale_remove(self):
+        """``InventoryCache`` - ``set`` doesn't bring back an instance removed after ``generation``"""
+        self.inventory.set('bob', {'myICAP': {}, 'oldICAP': {}})
+        generation = self.inventory.generation('bob')
+        self.inventory.remove('bob', 'oldICAP')
+        self.inventory.set('bob', {'myICAP': {}, 'oldICAP': {}}, generation=generation)
+
+        self.assertEqual(self.inventory.get('bob'), {'myICAP': {}})
+
+    def test_set_stale_invalidate(self):
+        """``InventoryCache`` - ``set`` doesn't store a query that ``invalidate`` made stale"""
+        generation = self.inventory.generation('bob')
+        self.inventory.invalidate('bob')
+        self.inventory.set('bob', {'myICAP': {}}, generation=generation)
+
+        self.assertTrue(self.inventory.get('bob') is None)
+
+    def test_generation_per_user(self):
+        """``InventoryCache`` - changing one user's inventory doesn't change the generation of another"""
+        generation = self.inventory.generation('alice')
+        self.inventory.invalidate('bob')
+
+        self.assertEqual(self.inventory.generation('alice'), generation)
+
+    def test_unsafe_username(self):
+        """``InventoryCache`` keeps usernames from escaping the cache directory"""
+        self.inventory.set('../bob', {'myICAP': {}})
+
+        self.assertEqual(self.inventory.get('../bob'), {'myICAP': {}})
+        self.assertTrue(self.inventory.get('bob') is None)
+
+
+
+class TestHostLock(unittest.TestCase):
+    """A set of test cases for the ``host_lock`` function"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        patcher = patch.object(cache, 'const', cache.const._replace(VLAB_ICAP_CACHE_DIR=self.cache_dir))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_host_lock(self):
+        """``host_lock`` yields True when the lock is acquired"""
+        with cache.host_lock('testing') as acquired:
+            self.assertTrue(acquired)
+
+    def test_host_lock_held(self):
+        """``host_lock`` yields False when not blocking, and the lock is already held"""
+        with cache.host_lock('testing'):
+            with cache.host_lock('testing', blocking=False) as acquired:
+                self.assertFalse(acquired)
+
+
+if __name__ == '__main__':
+    unittest.main()
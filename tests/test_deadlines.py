@@ -0,0 +1,119 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in deadlines.py
+"""
+import time
+import unittest
+import threading
+
+from vlab_icap_api.lib.worker import deadlines
+
+
+class TestDeadlines(unittest.TestCase):
+    """A set of test cases for the deadlines.py module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.addCleanup(deadlines.clear)
+
+    def test_no_deadline(self):
+        """``remaining`` leaves the timeout alone when no task deadline is set"""
+        output = deadlines.remaining(600)
+
+        self.assertEqual(output, 600)
+
+    def test_no_deadline_forever(self):
+        """``remaining`` returns None when there's no timeout, and no deadline"""
+        output = deadlines.remaining()
+
+        self.assertTrue(output is None)
+
+    def test_remaining(self):
+        """``remaining`` caps a timeout at the time left before the deadline"""
+        deadlines.start(10)
+
+        output = deadlines.remaining(600)
+
+        self.assertTrue(0 < output <= 10)
+
+    def test_remaining_shorter(self):
+        """``remaining`` keeps a timeout that ends before the deadline"""
+        deadlines.start(600)
+
+        output = deadlines.remaining(5)
+
+        self.assertEqual(output, 5)
+
+    def test_remaining_forever(self):
+        """``remaining`` turns waiting forever into waiting until the deadline"""
+        deadlines.start(10)
+
+        output = deadlines.remaining()
+
+        self.assertTrue(0 < output <= 10)
+
+    def test_expired(self):
+        """``remaining`` raises DeadlineExceeded once the deadline passes"""
+        deadlines.start(0.01)
+        time.sleep(0.02)
+
+        with self.assertRaises(deadlines.DeadlineExceeded):
+            deadlines.remaining(600)
+
+    def test_no_time_limit(self):
+        """A task without a time limit gets no deadline"""
+        deadlines.start(None)
+
+        self.assertTrue(deadlines.current() is None)
+
+    def test_clear(self):
+        """``clear`` removes the deadline once the task is done"""
+        deadlines.start(10)
+        deadlines.clear()
+
+        self.assertTrue(deadlines.current() is None)
+
+    def test_per_thread(self):
+        """Every thread has its own deadline"""
+        deadlines.start(10)
+        seen = []
+        thread = threading.Thread(target=lambda: seen.append(deadlines.current()))
+        thread.start()
+        thread.join()
+
+        self.assertEqual(seen, [None])
+
+    def test_adopt(self):
+        """``adopt`` gives a helper thread the deadline of the task's thread"""
+        deadlines.start(10)
+        deadline = deadlines.current()
+        seen = []
+
+        def helper():
+            deadlines.adopt(deadline)
+            seen.append(deadlines.current())
+            deadlines.clear()
+
+        thread = threading.Thread(target=helper)
+        thread.start()
+        thread.join()
+
+        self.assertEqual(seen, [deadline])
+
+    def test_check(self):
+        """``check`` raises DeadlineExceeded for a deadline in the past"""
+        with self.assertRaises(deadlines.DeadlineExceeded):
+            deadlines.check(time.time() - 1)
+
+    def test_check_ok(self):
+        """``check`` is fine with a future deadline, or no deadline"""
+        deadlines.check(time.time() + 10)
+        deadlines.check(None)
+
+    def test_is_runtime_error(self):
+        """Code that handles a vCenter timeout also handles running out of time"""
+        self.assertTrue(issubclass(deadlines.DeadlineExceeded, RuntimeError))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in evented.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_icap_api.lib import evented
+
+
+class TestEvented(unittest.TestCase):
+    """A set of test cases for evented.py"""
+
+    def test_is_evented(self):
+        """``is_evented`` returns False when gevent hasn't monkey patched the process"""
+        self.assertFalse(evented.is_evented())
+
+    def test_is_evented_patched(self):
+        """``is_evented`` returns True once threading is monkey patched"""
+        fake_monkey = MagicMock()
+        fake_monkey.is_module_patched.return_value = True
+        with patch.dict(evented.sys.modules, {'gevent.monkey': fake_monkey}):
+            output = evented.is_evented()
+
+        self.assertTrue(output)
+        fake_monkey.is_module_patched.assert_called_with('threading')
+
+    def test_offload(self):
+        """``offload`` just calls the function without gevent"""
+        fake_func = MagicMock(return_value='woot')
+
+        output = evented.offload(fake_func, 'some/path')
+
+        self.assertEqual(output, 'woot')
+        fake_func.assert_called_with('some/path')
+
+    @patch.object(evented, 'is_evented', return_value=True)
+    def test_offload_threadpool(self, fake_is_evented):
+        """``offload`` runs the function in the threadpool of gevent, once monkey patched"""
+        fake_gevent = MagicMock()
+        fake_func = MagicMock()
+        with patch.dict(evented.sys.modules, {'gevent': fake_gevent}):
+            output = evented.offload(fake_func, 'some/path')
+
+        fake_gevent.get_hub.return_value.threadpool.apply.assert_called_with(fake_func, ('some/path',))
+        self.assertFalse(fake_func.called)
+        self.assertTrue(output is fake_gevent.get_hub.return_value.threadpool.apply.return_value)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,6 +3,7 @@
 A suite of tests for the healthcheck API end point
 """
 import unittest
+from unittest.mock import patch
 
 from flask import Flask
 
@@ -28,6 +29,23 @@ class TestHealthView(unittest.TestCase):
 
         self.assertEqual(expected, resp.status_code)
 
+    @patch.object(healthcheck, 'PROBER')
+    def test_ready(self, fake_PROBER):
+        """GET on /api/1/inf/icap/healthcheck/ready returns 200 when the dependencies are usable"""
+        fake_PROBER.status.return_value = (True, {'broker': {'ok': True}})
+        resp = self.app.get('/api/1/inf/icap/healthcheck/ready')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['checks'], {'broker': {'ok': True}})
+
+    @patch.object(healthcheck, 'PROBER')
+    def test_not_ready(self, fake_PROBER):
+        """GET on /api/1/inf/icap/healthcheck/ready returns 503 when a dependency isn't usable"""
+        fake_PROBER.status.return_value = (False, {'broker': {'ok': False}})
+        resp = self.app.get('/api/1/inf/icap/healthcheck/ready')
+
+        self.assertEqual(resp.status_code, 503)
+
 
 if __name__ == '__main__':
     unittest.main()
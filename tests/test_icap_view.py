@@ -11,6 +11,7 @@ from vlab_api_common import flask_common
 from vlab_api_common.http_auth import generate_v2_test_token
 
 
+from vlab_icap_api.lib import admission, publisher
 from vlab_icap_api.lib.views import icap
 
 
@@ -33,6 +34,26 @@ class TestIcapView(unittest.TestCase):
         cls.fake_task = MagicMock()
         cls.fake_task.id = 'asdf-asdf-asdf'
         app.celery_app.send_task.return_value = cls.fake_task
+        # A fresh log, so submissions from other tests aren't deduplicated
+        cls.submissions_patcher = patch.object(icap, 'SUBMISSIONS', icap.SubmissionLog(window=60))
+        cls.submissions_patcher.start()
+        cls.admission_patcher = patch.object(icap, 'ADMISSION', icap.AdmissionControl(user_limit=2, queue_limit=10, estimate=600))
+        cls.admission_patcher.start()
+        cls.queue_depth_patcher = patch.object(admission, 'queue_depth')
+        cls.fake_queue_depth = cls.queue_depth_patcher.start()
+        cls.fake_queue_depth.return_value = 0
+        # Every image is verified, unless a test says otherwise
+        cls.images_patcher = patch.object(icap, 'IMAGES')
+        cls.fake_IMAGES = cls.images_patcher.start()
+        # Tasks stay in flight, unless a test says otherwise
+        app.celery_app.AsyncResult.return_value.ready.return_value = False
+
+    def tearDown(self):
+        """Runs after every test case"""
+        self.submissions_patcher.stop()
+        self.admission_patcher.stop()
+        self.queue_depth_patcher.stop()
+        self.images_patcher.stop()
 
     def test_v1_deprecated(self):
         """IcapView - GET on /api/1/inf/icap returns an HTTP 404"""
@@ -64,6 +85,35 @@ class TestIcapView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_get_refresh(self):
+        """IcapView - GET on /api/2/inf/icap supports bypassing the cached inventory"""
+        self.app.get('/api/2/inf/icap?refresh=true',
+                     headers={'X-Auth': self.token})
+
+        the_kwargs = self.app.application.celery_app.send_task.call_args[1]['kwargs']
+        expected = {'refresh': True}
+
+        self.assertEqual(the_kwargs, expected)
+
+    def test_get_read_queue(self):
+        """IcapView - GET on /api/2/inf/icap sends the task to the read queue"""
+        self.app.get('/api/2/inf/icap',
+                     headers={'X-Auth': self.token})
+
+        queue = self.app.application.celery_app.send_task.call_args[1]['queue']
+        expected = icap.const.VLAB_ICAP_READ_QUEUE
+
+        self.assertEqual(queue, expected)
+
+    def test_get_published_at(self):
+        """IcapView - tasks are sent with the time they were published, to measure the queue wait"""
+        self.app.get('/api/2/inf/icap',
+                     headers={'X-Auth': self.token})
+
+        headers = self.app.application.celery_app.send_task.call_args[1]['headers']
+
+        self.assertTrue(isinstance(headers['published_at'], float))
+
     def test_post_task(self):
         """IcapView - POST on /api/2/inf/icap returns a task-id"""
         resp = self.app.post('/api/2/inf/icap',
@@ -77,6 +127,190 @@ class TestIcapView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
+    def test_post_unverified_image(self):
+        """IcapView - POST on /api/2/inf/icap returns HTTP 400 for an image that hasn't passed verification"""
+        self.fake_IMAGES.check.side_effect = ValueError('ICAP someVersion is still being verified')
+        resp = self.app.post('/api/2/inf/icap',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN",
+                                   'name': "myIcapBox",
+                                   'image': "someVersion"})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json['error'], 'ICAP someVersion is still being verified')
+        self.assertFalse(self.app.application.celery_app.send_task.called)
+
+    def test_post_images_not_mounted(self):
+        """IcapView - POST on /api/2/inf/icap leaves checking the image to the worker if the API cannot read the images"""
+        self.fake_IMAGES.check.side_effect = OSError('testing')
+        resp = self.app.post('/api/2/inf/icap',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN",
+                                   'name': "myIcapBox",
+                                   'image': "someVersion"})
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_post_lifecycle_queue(self):
+        """IcapView - POST on /api/2/inf/icap sends the task to the lifecycle queue"""
+        self.app.post('/api/2/inf/icap',
+                      headers={'X-Auth': self.token},
+                      json={'network': "someLAN",
+                            'name': "myIcapBox",
+                            'image': "someVersion"})
+
+        queue = self.app.application.celery_app.send_task.call_args[1]['queue']
+        expected = icap.const.VLAB_ICAP_LIFECYCLE_QUEUE
+
+        self.assertEqual(queue, expected)
+
+    def test_post_retry(self):
+        """IcapView - POST on /api/2/inf/icap with a repeated X-REQUEST-ID returns the original task"""
+        body = {'network': "someLAN", 'name': "myIcapBox", 'image': "someVersion"}
+        headers = {'X-Auth': self.token, 'X-REQUEST-ID': 'myRequest'}
+        self.app.post('/api/2/inf/icap', headers=headers, json=body)
+        self.fake_task.id = 'some-other-task'
+        resp = self.app.post('/api/2/inf/icap', headers=headers, json=body)
+
+        task_id = resp.json['content']['task-id']
+        link = resp.headers['Link']
+
+        self.assertEqual(task_id, 'asdf-asdf-asdf')
+        self.assertTrue('asdf-asdf-asdf' in link)
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 1)
+
+    def test_post_new_request(self):
+        """IcapView - POST on /api/2/inf/icap with a different X-REQUEST-ID creates a new task"""
+        body = {'network': "someLAN", 'name': "myIcapBox", 'image': "someVersion"}
+        self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token, 'X-REQUEST-ID': 'req1'}, json=body)
+        self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token, 'X-REQUEST-ID': 'req2'}, json=body)
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 2)
+
+    def test_post_no_request_id(self):
+        """IcapView - POST on /api/2/inf/icap without an X-REQUEST-ID is never deduplicated"""
+        body = {'network': "someLAN", 'name': "myIcapBox", 'image': "someVersion"}
+        self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token}, json=body)
+        self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token}, json=body)
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 2)
+
+    def test_delete_retry_not_create(self):
+        """IcapView - Reusing an X-REQUEST-ID for a different verb creates a new task"""
+        headers = {'X-Auth': self.token, 'X-REQUEST-ID': 'myRequest'}
+        self.app.post('/api/2/inf/icap', headers=headers,
+                      json={'network': "someLAN", 'name': "myIcapBox", 'image': "someVersion"})
+        self.app.delete('/api/2/inf/icap', headers=headers, json={'name': "myIcapBox"})
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 2)
+
+    def test_get_coalesced(self):
+        """IcapView - GET on /api/2/inf/icap shares a task with an identical request sent just before"""
+        self.app.get('/api/2/inf/icap', headers={'X-Auth': self.token})
+        self.app.get('/api/2/inf/icap', headers={'X-Auth': self.token})
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 1)
+
+    def test_get_refresh_not_coalesced(self):
+        """IcapView - GET on /api/2/inf/icap doesn't share a task between refresh and cached requests"""
+        self.app.get('/api/2/inf/icap', headers={'X-Auth': self.token})
+        self.app.get('/api/2/inf/icap?refresh=true', headers={'X-Auth': self.token})
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 2)
+
+    def test_post_user_limit(self):
+        """IcapView - POST on /api/2/inf/icap returns 429 when the user has too many creates in flight"""
+        body = {'network': "someLAN", 'name': "myIcapBox", 'image': "someVersion"}
+        self.app.application.celery_app.send_task.side_effect = [MagicMock(id='task-1'), MagicMock(id='task-2')]
+        self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token}, json=body)
+        self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token}, json=body)
+        resp = self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token}, json=body)
+
+        self.assertEqual(resp.status_code, 429)
+        self.assertTrue(int(resp.headers['Retry-After']) > 0)
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 2)
+
+    def test_post_user_limit_finished(self):
+        """IcapView - POST on /api/2/inf/icap doesn't count creates that finished against the limit"""
+        body = {'network': "someLAN", 'name': "myIcapBox", 'image': "someVersion"}
+        self.app.application.celery_app.AsyncResult.return_value.ready.return_value = True
+        for _ in range(3):
+            resp = self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token}, json=body)
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_post_retry_throttled(self):
+        """IcapView - POST on /api/2/inf/icap still returns the original task on retry, at the user limit"""
+        body = {'network': "someLAN", 'name': "myIcapBox", 'image': "someVersion"}
+        self.app.application.celery_app.send_task.side_effect = [MagicMock(id='task-1'), MagicMock(id='task-2')]
+        self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token, 'X-REQUEST-ID': 'req1'}, json=body)
+        self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token, 'X-REQUEST-ID': 'req2'}, json=body)
+        resp = self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token, 'X-REQUEST-ID': 'req1'}, json=body)
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_broker_busy(self):
+        """IcapView - returns 503 with a Retry-After when the task cannot be published in time"""
+        icap.report_broker_busy(self.app.application)
+        self.app.application.celery_app.send_task.side_effect = publisher.BrokerBusy('doh', 5)
+        resp = self.app.post('/api/2/inf/icap',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN", 'name': "myIcapBox", 'image': "someVersion"})
+
+        self.assertEqual(resp.status_code, 503)
+        self.assertEqual(resp.headers['Retry-After'], '5')
+
+    def test_broker_busy_not_counted(self):
+        """IcapView - a create that could not be published doesn't count against the user limit"""
+        icap.report_broker_busy(self.app.application)
+        body = {'network': "someLAN", 'name': "myIcapBox", 'image': "someVersion"}
+        self.app.application.celery_app.send_task.side_effect = publisher.BrokerBusy('doh', 5)
+        for _ in range(2):
+            self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token}, json=body)
+        self.app.application.celery_app.send_task.side_effect = None
+        resp = self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token}, json=body)
+
+        self.assertEqual(resp.status_code, 202)
+
+    def test_modify_network(self):
+        """IcapView - PUT on /api/2/inf/icap/network sends the task to the lifecycle queue"""
+        resp = self.app.put('/api/2/inf/icap/network',
+                            headers={'X-Auth': self.token},
+                            json={'name': "myIcapBox", 'new_network': "otherLAN"})
+
+        call = self.app.application.celery_app.send_task.call_args
+        expected = ('icap.modify_network', ['bob', 'myIcapBox', 'bob_otherLAN', 'noId'])
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(call[0], expected)
+        self.assertEqual(call[1]['queue'], icap.const.VLAB_ICAP_LIFECYCLE_QUEUE)
+
+    def test_modify_network_retry(self):
+        """IcapView - PUT on /api/2/inf/icap/network only sends one task for a retried request"""
+        body = {'name': "myIcapBox", 'new_network': "otherLAN"}
+        for _ in range(2):
+            self.app.put('/api/2/inf/icap/network', headers={'X-Auth': self.token, 'X-REQUEST-ID': 'req1'}, json=body)
+
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 1)
+
+    def test_post_queue_limit(self):
+        """IcapView - POST on /api/2/inf/icap returns 429 when the lifecycle queue is too deep"""
+        self.fake_queue_depth.return_value = 10
+        resp = self.app.post('/api/2/inf/icap',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN", 'name': "myIcapBox", 'image': "someVersion"})
+
+        self.assertEqual(resp.status_code, 429)
+        self.assertTrue('Retry-After' in resp.headers)
+        self.assertFalse(self.app.application.celery_app.send_task.called)
+
+    def test_delete_not_throttled(self):
+        """IcapView - DELETE on /api/2/inf/icap isn't subject to the create limits"""
+        self.fake_queue_depth.return_value = 10
+        resp = self.app.delete('/api/2/inf/icap', headers={'X-Auth': self.token}, json={'name': "myIcapBox"})
+
+        self.assertEqual(resp.status_code, 202)
+
     def test_post_task_link(self):
         """IcapView - POST on /api/2/inf/icap sets the Link header"""
         resp = self.app.post('/api/2/inf/icap',
@@ -112,8 +346,66 @@ class TestIcapView(unittest.TestCase):
 
         self.assertEqual(task_id, expected)
 
-    def test_image(self):
-        """IcapView - GET on the ./image end point returns the a task-id"""
+    def test_task_progress(self):
+        """IcapView - GET on the ./task end point returns the progress of a running task"""
+        fake_result = self.app.application.celery_app.AsyncResult.return_value
+        fake_result.status = 'PROGRESS'
+        fake_result.info = {'phase': 'uploading', 'uploaded': 10, 'total': 100}
+        resp = self.app.get('/api/2/inf/icap/task/asdf-asdf-asdf',
+                            headers={'X-Auth': self.token})
+
+        expected = {'phase': 'uploading', 'uploaded': 10, 'total': 100}
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.json['content']['progress'], expected)
+        self.assertEqual(resp.headers['Retry-After'], '15')
+
+    def test_task_pending(self):
+        """IcapView - GET on the ./task end point sets Retry-After for a pending task"""
+        fake_result = self.app.application.celery_app.AsyncResult.return_value
+        fake_result.status = 'PENDING'
+        resp = self.app.get('/api/2/inf/icap/task/asdf-asdf-asdf',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 202)
+        self.assertEqual(resp.headers['Retry-After'], '2')
+        self.assertTrue('progress' not in resp.json['content'])
+
+    def test_task_success(self):
+        """IcapView - GET on the ./task end point returns the result of a finished task"""
+        fake_result = self.app.application.celery_app.AsyncResult.return_value
+        fake_result.status = 'SUCCESS'
+        fake_result.result = {'content': {'worked': True}, 'error': None, 'params': {}}
+        resp = self.app.get('/api/2/inf/icap/task/asdf-asdf-asdf',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['content'], {'worked': True})
+
+    def test_task_error(self):
+        """IcapView - GET on the ./task end point returns an HTTP 400 when the task had bad input"""
+        fake_result = self.app.application.celery_app.AsyncResult.return_value
+        fake_result.status = 'SUCCESS'
+        fake_result.result = {'content': {}, 'error': 'testing', 'params': {}}
+        resp = self.app.get('/api/2/inf/icap/task/asdf-asdf-asdf',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual(resp.json['error'], 'testing')
+
+    def test_task_failure(self):
+        """IcapView - GET on the ./task end point returns an HTTP 500 when the task blew up"""
+        fake_result = self.app.application.celery_app.AsyncResult.return_value
+        fake_result.status = 'FAILURE'
+        resp = self.app.get('/api/2/inf/icap/task/asdf-asdf-asdf',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 500)
+
+    @patch.object(icap, 'IMAGES')
+    def test_image(self, fake_IMAGES):
+        """IcapView - GET on the ./image end point returns the a task-id when the images dir is not available"""
+        fake_IMAGES.images.side_effect = OSError('testing')
         resp = self.app.get('/api/2/inf/icap/image',
                             headers={'X-Auth': self.token})
 
@@ -124,9 +416,183 @@ class TestIcapView(unittest.TestCase):
 
     def test_image_link(self):
         """IcapView - GET on the ./image end point sets the Link header"""
+        self.fake_IMAGES.images.side_effect = OSError('testing')
+        resp = self.app.get('/api/2/inf/icap/image',
+                            headers={'X-Auth': self.token})
+
+
+    @patch.object(icap, 'IMAGES')
+    def test_image_inline(self, fake_IMAGES):
+        """IcapView - GET on the ./image end point returns the versions without a task"""
+        fake_IMAGES.images.return_value = (['1.0.0'], 'someEtag')
+        resp = self.app.get('/api/2/inf/icap/image',
+                            headers={'X-Auth': self.token})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['content'], {'image': ['1.0.0']})
+        self.assertFalse(self.app.application.celery_app.send_task.called)
+
+    @patch.object(icap, 'IMAGES')
+    def test_image_etag(self, fake_IMAGES):
+        """IcapView - GET on the ./image end point sets the ETag header"""
+        fake_IMAGES.images.return_value = (['1.0.0'], 'someEtag')
         resp = self.app.get('/api/2/inf/icap/image',
                             headers={'X-Auth': self.token})
 
+        self.assertEqual(resp.headers['ETag'], '"someEtag"')
+
+    @patch.object(icap, 'IMAGES')
+    def test_image_not_modified(self, fake_IMAGES):
+        """IcapView - GET on the ./image end point returns HTTP 304 when the client has the current list"""
+        fake_IMAGES.images.return_value = (['1.0.0'], 'someEtag')
+        resp = self.app.get('/api/2/inf/icap/image',
+                            headers={'X-Auth': self.token, 'If-None-Match': '"someEtag"'})
+
+        self.assertEqual(resp.status_code, 304)
+
+
+    def test_bulk_create_task(self):
+        """IcapView - POST on /api/2/inf/icap/bulk returns a task-id"""
+        resp = self.app.post('/api/2/inf/icap/bulk',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN",
+                                   'names': ["icap1", "icap2"],
+                                   'image': "someVersion"})
+
+        task_id = resp.json['content']['task-id']
+        expected = 'asdf-asdf-asdf'
+
+        self.assertEqual(task_id, expected)
+
+    def test_bulk_create_unverified_image(self):
+        """IcapView - POST on /api/2/inf/icap/bulk returns HTTP 400 for an image that failed verification"""
+        self.fake_IMAGES.check.side_effect = ValueError('ICAP someVersion failed verification: testing')
+        resp = self.app.post('/api/2/inf/icap/bulk',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN",
+                                   'names': ["icap1", "icap2"],
+                                   'image': "someVersion"})
+
+        self.assertEqual(resp.status_code, 400)
+        self.assertFalse(self.app.application.celery_app.send_task.called)
+
+    def test_bulk_create_task_link(self):
+        """IcapView - POST on /api/2/inf/icap/bulk sets the Link header"""
+        resp = self.app.post('/api/2/inf/icap/bulk',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN",
+                                   'names': ["icap1", "icap2"],
+                                   'image': "someVersion"})
+
+        task_id = resp.headers['Link']
+        expected = '<https://localhost/api/2/inf/icap/task/asdf-asdf-asdf>; rel=status'
+
+        self.assertEqual(task_id, expected)
+
+    def test_bulk_create_prefix(self):
+        """IcapView - POST on /api/2/inf/icap/bulk supports a count and name prefix"""
+        self.app.post('/api/2/inf/icap/bulk',
+                      headers={'X-Auth': self.token},
+                      json={'network': "someLAN",
+                            'count': 3,
+                            'prefix': "icap",
+                            'image': "someVersion"})
+
+        the_args = self.app.application.celery_app.send_task.call_args[0][1]
+        expected = ['bob', ['icap1', 'icap2', 'icap3'], 'someVersion', 'bob_someLAN', 'noId']
+
+        self.assertEqual(the_args, expected)
+
+    def test_bulk_create_names_and_count(self):
+        """IcapView - POST on /api/2/inf/icap/bulk rejects a list of names and a count together"""
+        resp = self.app.post('/api/2/inf/icap/bulk',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN",
+                                   'names': ["icap1"],
+                                   'count': 3,
+                                   'prefix': "icap",
+                                   'image': "someVersion"})
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_bulk_create_too_many(self):
+        """IcapView - POST on /api/2/inf/icap/bulk limits how many instances can be created at once"""
+        resp = self.app.post('/api/2/inf/icap/bulk',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN",
+                                   'count': 9000,
+                                   'prefix': "icap",
+                                   'image': "someVersion"})
+
+        self.assertEqual(resp.status_code, 400)
+
+    def test_bulk_create_user_limit(self):
+        """IcapView - POST on /api/2/inf/icap/bulk counts every instance against the per-user limit"""
+        body = {'network': "someLAN", 'name': "myIcapBox", 'image': "someVersion"}
+        self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token}, json=body)
+        resp = self.app.post('/api/2/inf/icap/bulk',
+                             headers={'X-Auth': self.token},
+                             json={'network': "someLAN",
+                                   'names': ["icap1", "icap2"],
+                                   'image': "someVersion"})
+
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(self.app.application.celery_app.send_task.call_count, 1)
+
+    def test_bulk_create_blocks_creates(self):
+        """IcapView - POST on /api/2/inf/icap returns 429 while a bulk create uses up the per-user limit"""
+        self.app.post('/api/2/inf/icap/bulk',
+                      headers={'X-Auth': self.token},
+                      json={'network': "someLAN",
+                            'names': ["icap1", "icap2"],
+                            'image': "someVersion"})
+        body = {'network': "someLAN", 'name': "myIcapBox", 'image': "someVersion"}
+        resp = self.app.post('/api/2/inf/icap', headers={'X-Auth': self.token}, json=body)
+
+        self.assertEqual(resp.status_code, 429)
+
+
+    def test_bulk_delete_task(self):
+        """IcapView - DELETE on /api/2/inf/icap/bulk returns a task-id"""
+        resp = self.app.delete('/api/2/inf/icap/bulk',
+                               headers={'X-Auth': self.token},
+                               json={'names': ['icap1', 'icap2']})
+
+        task_id = resp.json['content']['task-id']
+        expected = 'asdf-asdf-asdf'
+
+        self.assertEqual(task_id, expected)
+
+    def test_bulk_delete_task_link(self):
+        """IcapView - DELETE on /api/2/inf/icap/bulk sets the Link header"""
+        resp = self.app.delete('/api/2/inf/icap/bulk',
+                               headers={'X-Auth': self.token},
+                               json={'names': ['icap1', 'icap2']})
+
+        task_id = resp.headers['Link']
+        expected = '<https://localhost/api/2/inf/icap/task/asdf-asdf-asdf>; rel=status'
+
+        self.assertEqual(task_id, expected)
+
+    def test_bulk_delete_all(self):
+        """IcapView - DELETE on /api/2/inf/icap/bulk supports deleting every ICAP instance"""
+        self.app.delete('/api/2/inf/icap/bulk',
+                        headers={'X-Auth': self.token},
+                        json={'all': True})
+
+        the_args = self.app.application.celery_app.send_task.call_args[0][1]
+        expected = ['bob', None, 'noId']
+
+        self.assertEqual(the_args, expected)
+
+    def test_bulk_delete_bad_body(self):
+        """IcapView - DELETE on /api/2/inf/icap/bulk requires a list of names or all=true"""
+        resp = self.app.delete('/api/2/inf/icap/bulk',
+                               headers={'X-Auth': self.token},
+                               json={'all': False})
+
+        self.assertEqual(resp.status_code, 400)
+
 
 if __name__ == '__main__':
     unittest.main()
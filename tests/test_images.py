@@ -0,0 +1,383 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in images.py
+"""
+import io
+import os
+import fcntl
+import shutil
+import hashlib
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_icap_api.lib import images
+
+
+OVF = '<Envelope><References><File ovf:href="icap-disk1.vmdk" ovf:id="file1"/></References></Envelope>'
+
+
+def make_ova(path, disk=b'some disk', manifest=True, checksum=None, extra=()):
+    """Write a small OVA, optionally with a manifest of the SHA256 of every file
+
+    :param checksum: Put this in the manifest for the disk, instead of its real checksum
+    :param extra: (name, data) of other files to add to the OVA
+    """
+    files = [('icap.ovf', OVF.encode()), ('icap-disk1.vmdk', disk)] + list(extra)
+    if manifest:
+        lines = []
+        for name, data in files[:2]:
+            digest = hashlib.sha256(data).hexdigest()
+            if name.endswith('.vmdk') and checksum:
+                digest = checksum
+            lines.append('SHA256({})= {}'.format(name, digest))
+        files.insert(1, ('icap.mf', '\n'.join(lines).encode()))
+    with tarfile.open(path, 'w') as the_tar:
+        for name, data in files:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            the_tar.addfile(info, io.BytesIO(data))
+
+
+class TestVerifyOva(unittest.TestCase):
+    """A set of test cases for the ``verify_ova`` function"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.images_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.images_dir)
+        self.path = os.path.join(self.images_dir, 'ICAP-1.0.0.ova')
+
+    def test_verified(self):
+        """``verify_ova`` - returns a dictionary when the contents match the manifest"""
+        make_ova(self.path)
+
+        output = images.verify_ova(self.path)
+        expected = {'manifest': True}
+
+        self.assertEqual(output, expected)
+
+    def test_no_manifest(self):
+        """``verify_ova`` - an OVA without a manifest only has its structure checked"""
+        make_ova(self.path, manifest=False)
+
+        output = images.verify_ova(self.path)
+        expected = {'manifest': False}
+
+        self.assertEqual(output, expected)
+
+    def test_checksum_mismatch(self):
+        """``verify_ova`` - raises ValueError if a file doesn't match the manifest"""
+        make_ova(self.path, checksum='ab' * 32)
+
+        with self.assertRaisesRegex(ValueError, 'Checksum mismatch for icap-disk1.vmdk'):
+            images.verify_ova(self.path)
+
+    def test_truncated(self):
+        """``verify_ova`` - raises ValueError if the OVA was only partially copied"""
+        make_ova(self.path, disk=os.urandom(20000), manifest=False)
+        with open(self.path, 'r+b') as the_file:
+            the_file.truncate(10000)
+
+        with self.assertRaisesRegex(ValueError, 'Unreadable OVA'):
+            images.verify_ova(self.path)
+
+    def test_not_a_tar(self):
+        """``verify_ova`` - raises ValueError if the file isn't an OVA at all"""
+        with open(self.path, 'wb') as the_file:
+            the_file.write(b'not a tarball')
+
+        with self.assertRaisesRegex(ValueError, 'Unreadable OVA'):
+            images.verify_ova(self.path)
+
+    def test_missing_reference(self):
+        """``verify_ova`` - raises ValueError if a file the OVF needs isn't in the OVA"""
+        with tarfile.open(self.path, 'w') as the_tar:
+            info = tarfile.TarInfo('icap.ovf')
+            info.size = len(OVF)
+            the_tar.addfile(info, io.BytesIO(OVF.encode()))
+
+        with self.assertRaisesRegex(ValueError, 'missing: icap-disk1.vmdk'):
+            images.verify_ova(self.path)
+
+    def test_not_in_manifest(self):
+        """``verify_ova`` - raises ValueError if a file isn't listed in the manifest"""
+        make_ova(self.path, extra=[('sneaky.vmdk', b'data')])
+
+        with self.assertRaisesRegex(ValueError, 'Manifest does not match'):
+            images.verify_ova(self.path)
+
+    def test_malformed_manifest(self):
+        """``verify_ova`` - raises ValueError if the manifest cannot be parsed"""
+        with tarfile.open(self.path, 'w') as the_tar:
+            for name, data in (('icap.ovf', OVF.encode()), ('icap.mf', b'junk'), ('icap-disk1.vmdk', b'a')):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                the_tar.addfile(info, io.BytesIO(data))
+
+        with self.assertRaisesRegex(ValueError, 'Malformed manifest line'):
+            images.verify_ova(self.path)
+
+
+class TestImageIndex(unittest.TestCase):
+    """A set of test cases for the ImageIndex object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.images_dir = tempfile.mkdtemp()
+        self.index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.images_dir)
+        self.addCleanup(shutil.rmtree, self.index_dir)
+        patcher = patch.object(images.ImageIndex, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        make_ova(os.path.join(self.images_dir, 'ICAP-1.0.0.ova'))
+        make_ova(os.path.join(self.images_dir, 'ICAP-2.0.0.ova'), checksum='ab' * 32)
+        self.index = images.ImageIndex(self.images_dir, self.index_dir, interval=60)
+
+    def test_unverified(self):
+        """``ImageIndex`` - ``result`` returns None before an OVA is verified"""
+        self.assertEqual(self.index.result('ICAP-1.0.0.ova'), None)
+
+    def test_scan(self):
+        """``ImageIndex`` - ``scan`` records if every OVA passed verification"""
+        self.index.scan()
+
+        good = self.index.result('ICAP-1.0.0.ova')
+        bad = self.index.result('ICAP-2.0.0.ova')
+
+        self.assertTrue(good['ok'])
+        self.assertFalse(bad['ok'])
+        self.assertIn('Checksum mismatch', bad['error'])
+
+    def test_scan_once(self):
+        """``ImageIndex`` - ``scan`` only reads an OVA once"""
+        self.index.scan()
+        with patch.object(images, 'verify_ova') as fake_verify_ova:
+            self.index.scan()
+
+        self.assertFalse(fake_verify_ova.called)
+
+    def test_shared(self):
+        """``ImageIndex`` - the results of one process are used by the others"""
+        self.index.scan()
+        other = images.ImageIndex(self.images_dir, self.index_dir, interval=60)
+
+        output = other.result('ICAP-1.0.0.ova')
+
+        self.assertTrue(output['ok'])
+
+    def test_scan_offloaded(self):
+        """``ImageIndex`` - ``scan`` hashes the OVAs with ``offload``, so gevent doesn't stall"""
+        with patch.object(images, 'offload', return_value={'manifest': True}) as fake_offload:
+            self.index.scan()
+
+        self.assertEqual(fake_offload.call_count, 2)
+        self.assertTrue(self.index.result('ICAP-2.0.0.ova')['ok'])
+
+    def test_subscribe(self):
+        """``ImageIndex`` - subscribers are told which OVAs passed verification"""
+        fake_callback = MagicMock()
+        self.index.subscribe(fake_callback)
+
+        self.index.scan()
+        self.index.scan()
+
+        fake_callback.assert_called_once_with(['ICAP-1.0.0.ova'])
+
+    def test_subscribe_warm(self):
+        """``ImageIndex`` - subscribers aren't told about OVAs that were already verified"""
+        self.index.scan()
+        other = images.ImageIndex(self.images_dir, self.index_dir, interval=60)
+        fake_callback = MagicMock()
+        other.subscribe(fake_callback)
+
+        other.scan()
+
+        self.assertFalse(fake_callback.called)
+
+    def test_subscribe_other_process(self):
+        """``ImageIndex`` - subscribers are told once another process verifies an OVA this one was waiting on"""
+        fake_callback = MagicMock()
+        self.index.subscribe(fake_callback)
+        with open(os.path.join(self.index_dir, 'ICAP-1.0.0.ova.lock'), 'w') as the_lock:
+            fcntl.flock(the_lock, fcntl.LOCK_EX)
+            self.index.scan()
+        images.ImageIndex(self.images_dir, self.index_dir, interval=60).scan()
+
+        self.index.scan()
+
+        fake_callback.assert_called_once_with(['ICAP-1.0.0.ova'])
+
+    def test_subscriber_fails(self):
+        """``ImageIndex`` - a subscriber that raises doesn't stop the scan"""
+        self.index.subscribe(MagicMock(side_effect=RuntimeError('doh')))
+
+        self.index.scan()
+
+        self.assertTrue(self.index.result('ICAP-1.0.0.ova')['ok'])
+
+    def test_key(self):
+        """``ImageIndex`` - ``key`` returns None for an OVA that doesn't exist"""
+        self.assertTrue(self.index.key('ICAP-1.0.0.ova'))
+        self.assertEqual(self.index.key('ICAP-9.9.9.ova'), None)
+
+    def test_replaced(self):
+        """``ImageIndex`` - replacing an OVA gets it verified again"""
+        self.index.scan()
+        path = os.path.join(self.images_dir, 'ICAP-1.0.0.ova')
+        make_ova(path + '.new', disk=b'a new disk')
+        os.replace(path + '.new', path)
+
+        output = self.index.result('ICAP-1.0.0.ova')
+
+        self.assertEqual(output, None)
+
+    def test_locked(self):
+        """``ImageIndex`` - ``scan`` skips an OVA another process is verifying"""
+        with open(os.path.join(self.index_dir, 'ICAP-1.0.0.ova.lock'), 'w') as the_lock:
+            fcntl.flock(the_lock, fcntl.LOCK_EX)
+            # flock is per open file, so a second open in this process is like another process
+            self.index.scan()
+
+        self.assertEqual(self.index.result('ICAP-1.0.0.ova'), None)
+        self.assertFalse(self.index.result('ICAP-2.0.0.ova')['ok'])
+
+    def test_check(self):
+        """``ImageIndex`` - ``check`` accepts a verified image"""
+        self.index.scan()
+
+        self.index.check('1.0.0')
+
+    def test_check_failed(self):
+        """``ImageIndex`` - ``check`` rejects an image that failed verification"""
+        self.index.scan()
+
+        with self.assertRaisesRegex(ValueError, 'ICAP 2.0.0 failed verification'):
+            self.index.check('2.0.0')
+
+    @patch.object(images.ImageIndex, 'wake')
+    def test_check_pending(self, fake_wake):
+        """``ImageIndex`` - ``check`` rejects an image that isn't verified yet"""
+        with self.assertRaisesRegex(ValueError, 'still being verified'):
+            self.index.check('1.0.0')
+
+        self.assertTrue(fake_wake.called)
+
+    def test_check_missing(self):
+        """``ImageIndex`` - ``check`` rejects a version that doesn't exist"""
+        with self.assertRaisesRegex(ValueError, 'Invalid version'):
+            self.index.check('9.9.9')
+
+    def test_check_no_dir(self):
+        """``ImageIndex`` - ``check`` raises OSError if the images directory cannot be read"""
+        index = images.ImageIndex('/no/such/dir', self.index_dir, interval=60)
+
+        with self.assertRaises(OSError):
+            index.check('1.0.0')
+
+    def test_verified(self):
+        """``ImageIndex`` - ``verified`` only returns versions that passed verification"""
+        self.index.scan()
+
+        output = self.index.verified(['ICAP-1.0.0.ova', 'ICAP-2.0.0.ova', 'README'])
+        expected = (['1.0.0'], False)
+
+        self.assertEqual(output, expected)
+
+
+class TestImageCatalog(unittest.TestCase):
+    """A set of test cases for the ImageCatalog object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.images_dir = tempfile.mkdtemp()
+        self.index_dir = tempfile.mkdtemp()
+        patcher = patch.object(images.ImageIndex, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        make_ova(os.path.join(self.images_dir, 'ICAP-1.0.0.ova'))
+        self.index = images.ImageIndex(self.images_dir, self.index_dir, interval=60)
+        self.index.scan()
+        self.catalog = images.ImageCatalog(self.images_dir, self.index)
+
+    def tearDown(self):
+        """Runs after every test case"""
+        shutil.rmtree(self.images_dir)
+        shutil.rmtree(self.index_dir)
+
+    def _touch_dir(self):
+        """Not every filesystem has a fine grained mtime"""
+        stat = os.stat(self.images_dir)
+        os.utime(self.images_dir, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+
+    def test_images(self):
+        """``ImageCatalog`` - ``images`` returns the available versions"""
+        output, _ = self.catalog.images()
+        expected = ['1.0.0']
+
+        self.assertEqual(output, expected)
+
+    def test_cached(self):
+        """``ImageCatalog`` - ``images`` only lists the directory when it changes"""
+        self.catalog.images()
+        with patch.object(images.os, 'listdir') as fake_listdir:
+            self.catalog.images()
+
+        self.assertFalse(fake_listdir.called)
+
+    def test_refresh(self):
+        """``ImageCatalog`` - ``images`` picks up new OVAs, once they're verified"""
+        _, etag = self.catalog.images()
+        make_ova(os.path.join(self.images_dir, 'ICAP-2.0.0.ova'))
+        self._touch_dir()
+
+        with patch.object(images.ImageIndex, 'wake'):
+            pending, pending_etag = self.catalog.images()
+        self.index.scan()
+        output, new_etag = self.catalog.images()
+
+        self.assertEqual(pending, ['1.0.0'])
+        self.assertEqual(pending_etag, etag)
+        self.assertEqual(output, ['1.0.0', '2.0.0'])
+        self.assertNotEqual(etag, new_etag)
+
+    def test_failed_hidden(self):
+        """``ImageCatalog`` - ``images`` doesn't return versions that failed verification"""
+        make_ova(os.path.join(self.images_dir, 'ICAP-2.0.0.ova'), checksum='ab' * 32)
+        self._touch_dir()
+        self.index.scan()
+
+        output, _ = self.catalog.images()
+
+        self.assertEqual(output, ['1.0.0'])
+
+    def test_missing_dir(self):
+        """``ImageCatalog`` - ``images`` raises OSError if the directory doesn't exist"""
+        catalog = images.ImageCatalog('/no/such/dir', self.index)
+
+        with self.assertRaises(OSError):
+            catalog.images()
+
+
+class TestConvertName(unittest.TestCase):
+    """A set of test cases for the ``convert_name`` function"""
+
+    def test_convert_name(self):
+        """``convert_name`` - defaults to converting to the OVA file name"""
+        output = images.convert_name(name='1.0.0')
+        expected = 'ICAP-1.0.0.ova'
+
+        self.assertEqual(output, expected)
+
+    def test_convert_name_to_version(self):
+        """``convert_name`` - can take a OVA file name, and extract the version from it"""
+        output = images.convert_name('ICAP-1.0.0.ova', to_version=True)
+        expected = '1.0.0'
+
+        self.assertEqual(output, expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
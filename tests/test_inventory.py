@@ -0,0 +1,195 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in inventory.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_icap_api.lib.worker import inventory
+
+
+class TestInventory(unittest.TestCase):
+    """A set of test cases for the inventory.py module"""
+
+    def _make_result(self, vm, props, token=None):
+        """Build a fake RetrieveResult object"""
+        result = MagicMock()
+        obj = MagicMock()
+        obj.obj = vm
+        obj.propSet = []
+        for name, value in props.items():
+            prop = MagicMock()
+            prop.name = name
+            prop.val = value
+            obj.propSet.append(prop)
+        result.objects = [obj]
+        result.token = token
+        return result
+
+    def test_retrieve_vms(self):
+        """``retrieve_vms`` returns a mapping of VM to the requested properties"""
+        fake_vcenter = MagicMock()
+        fake_vm = MagicMock()
+        collector = fake_vcenter.content.propertyCollector
+        collector.RetrievePropertiesEx.return_value = self._make_result(fake_vm, {'name': 'myICAP'})
+
+        output = inventory.retrieve_vms(fake_vcenter, inventory.vim.Folder('group-1'), ['name'])
+        expected = {fake_vm: {'name': 'myICAP'}}
+
+        self.assertEqual(output, expected)
+
+    def test_retrieve_vms_one_call(self):
+        """``retrieve_vms`` makes a single call to vCenter when the results fit in one page"""
+        fake_vcenter = MagicMock()
+        collector = fake_vcenter.content.propertyCollector
+        collector.RetrievePropertiesEx.return_value = self._make_result(MagicMock(), {'name': 'myICAP'})
+
+        inventory.retrieve_vms(fake_vcenter, inventory.vim.Folder('group-1'), ['name'])
+
+        self.assertEqual(collector.RetrievePropertiesEx.call_count, 1)
+        self.assertFalse(collector.ContinueRetrievePropertiesEx.called)
+
+    def test_retrieve_vms_paginated(self):
+        """``retrieve_vms`` follows the continuation token for large folders"""
+        fake_vcenter = MagicMock()
+        vm1, vm2 = MagicMock(), MagicMock()
+        collector = fake_vcenter.content.propertyCollector
+        collector.RetrievePropertiesEx.return_value = self._make_result(vm1, {'name': 'one'}, token='more')
+        collector.ContinueRetrievePropertiesEx.return_value = self._make_result(vm2, {'name': 'two'})
+
+        output = inventory.retrieve_vms(fake_vcenter, inventory.vim.Folder('group-1'), ['name'])
+        expected = {vm1: {'name': 'one'}, vm2: {'name': 'two'}}
+
+        self.assertEqual(output, expected)
+
+    def test_retrieve_vms_empty(self):
+        """``retrieve_vms`` returns an empty dictionary for an empty folder"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.propertyCollector.RetrievePropertiesEx.return_value = None
+
+        output = inventory.retrieve_vms(fake_vcenter, inventory.vim.Folder('group-1'), ['name'])
+
+        self.assertEqual(output, {})
+
+    def test_parse_meta(self):
+        """``parse_meta`` converts the VM notes into a dictionary"""
+        output = inventory.parse_meta('{"component": "ICAP"}')
+        expected = {'component': 'ICAP'}
+
+        self.assertEqual(output, expected)
+
+    def test_parse_meta_no_config(self):
+        """``parse_meta`` returns the 'Unknown' meta data when a VM has no notes"""
+        output = inventory.parse_meta(None)
+
+        self.assertEqual(output['component'], 'Unknown')
+
+    def test_parse_meta_bad_notes(self):
+        """``parse_meta`` returns the 'Unknown' meta data when the notes are not JSON"""
+        output = inventory.parse_meta('some notes')
+
+        self.assertEqual(output['component'], 'Unknown')
+
+    def test_get_ips(self):
+        """``get_ips`` ignores IPv6 link local addresses"""
+        nic = MagicMock()
+        nic.ipAddress = ['10.1.1.2', 'fe80::1']
+
+        output = inventory.get_ips([nic])
+        expected = ['10.1.1.2']
+
+        self.assertEqual(output, expected)
+
+    def test_get_networks(self):
+        """``get_networks`` only returns the user's networks, without the username prefix"""
+        fake_vcenter = MagicMock()
+        net1, net2, net3 = MagicMock(), MagicMock(), MagicMock()
+        net1._moId, net2._moId, net3._moId = 'net-1', 'net-2', 'net-3'
+        fake_vcenter.networks = {'bob_frontend': net1, 'bob_backend': net2, 'alice_frontend': net3}
+
+        output = inventory.get_networks(fake_vcenter, 'bob', [net1, net3])
+        expected = ['frontend']
+
+        self.assertEqual(output, expected)
+
+    def test_get_folder(self):
+        """``get_folder`` returns the folder when it exists"""
+        fake_vcenter = MagicMock()
+
+        output = inventory.get_folder(fake_vcenter, 'someFolder')
+
+        self.assertTrue(output is fake_vcenter.get_by_name.return_value)
+        self.assertFalse(fake_vcenter.create_vm_folder.called)
+
+    def test_get_folder_create(self):
+        """``get_folder`` makes the folder under the top level directory when told to"""
+        fake_vcenter = MagicMock()
+        the_folder = MagicMock()
+        fake_vcenter.get_by_name.side_effect = [ValueError('testing'), the_folder]
+
+        output = inventory.get_folder(fake_vcenter, 'someFolder', create=True)
+
+        self.assertTrue(output is the_folder)
+        fake_vcenter.create_vm_folder.assert_called_with('vlab/someFolder')
+
+    @patch.object(inventory, 'read_meta')
+    def test_find_icap(self, fake_read_meta):
+        """``find_icap`` returns the VM when it's an ICAP instance"""
+        fake_vcenter = MagicMock()
+        the_vm = inventory.vim.VirtualMachine('vm-1')
+        fake_vcenter.content.searchIndex.FindChild.return_value = the_vm
+        fake_read_meta.return_value = {'component': 'ICAP'}
+
+        output = inventory.find_icap(fake_vcenter, inventory.vim.Folder('group-1'), 'myICAP')
+
+        self.assertTrue(output is the_vm)
+
+    @patch.object(inventory, 'read_meta')
+    def test_find_icap_missing(self, fake_read_meta):
+        """``find_icap`` returns None when there's no VM with that name"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.searchIndex.FindChild.return_value = None
+
+        output = inventory.find_icap(fake_vcenter, inventory.vim.Folder('group-1'), 'myICAP')
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_read_meta.called)
+
+    @patch.object(inventory, 'read_meta')
+    def test_find_icap_not_icap(self, fake_read_meta):
+        """``find_icap`` returns None when the VM is not an ICAP instance"""
+        fake_vcenter = MagicMock()
+        fake_vcenter.content.searchIndex.FindChild.return_value = inventory.vim.VirtualMachine('vm-1')
+        fake_read_meta.return_value = {'component': 'Windows'}
+
+        output = inventory.find_icap(fake_vcenter, inventory.vim.Folder('group-1'), 'myICAP')
+
+        self.assertTrue(output is None)
+
+    def test_read_meta(self):
+        """``read_meta`` only retrieves the annotation of the VM"""
+        fake_vcenter = MagicMock()
+        collector = fake_vcenter.content.propertyCollector
+        collector.RetrievePropertiesEx.return_value = self._make_result(MagicMock(), {'config.annotation': '{"component": "ICAP"}'})
+
+        output = inventory.read_meta(fake_vcenter, inventory.vim.VirtualMachine('vm-1'))
+        path_set = collector.RetrievePropertiesEx.call_args[1]['specSet'][0].propSet[0].pathSet
+
+        self.assertEqual(output, {'component': 'ICAP'})
+        self.assertEqual(path_set, ['config.annotation'])
+
+    def test_read_props(self):
+        """``read_props`` returns only the requested properties of the VM"""
+        fake_vcenter = MagicMock()
+        collector = fake_vcenter.content.propertyCollector
+        collector.RetrievePropertiesEx.return_value = self._make_result(MagicMock(), {'config.template': True})
+
+        output = inventory.read_props(fake_vcenter, inventory.vim.VirtualMachine('vm-1'), ['config.template'])
+        path_set = collector.RetrievePropertiesEx.call_args[1]['specSet'][0].propSet[0].pathSet
+
+        self.assertEqual(output, {'config.template': True})
+        self.assertEqual(path_set, ['config.template'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,55 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the lazy.py module
+"""
+import sys
+import unittest
+from unittest.mock import patch
+
+from vlab_icap_api.lib import lazy
+
+
+class TestLazyModule(unittest.TestCase):
+    """A set of test cases for the LazyModule object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        # A module no other test imports
+        self.name = 'xml.dom.pulldom'
+        sys.modules.pop(self.name, None)
+        self.addCleanup(sys.modules.pop, self.name, None)
+
+    def test_not_imported(self):
+        """``LazyModule`` doesn't import the module when created"""
+        module = lazy.LazyModule(self.name)
+
+        self.assertFalse(lazy.is_loaded(module))
+
+    def test_imported_on_use(self):
+        """``LazyModule`` imports the module the first time an attribute is used"""
+        module = lazy.LazyModule(self.name)
+
+        output = module.START_ELEMENT
+
+        self.assertEqual(output, 'START_ELEMENT')
+        self.assertTrue(lazy.is_loaded(module))
+
+    def test_imported_once(self):
+        """``LazyModule`` only looks up the module the first time"""
+        module = lazy.LazyModule(self.name)
+        with patch.object(lazy.importlib, 'import_module', wraps=lazy.importlib.import_module) as fake_import:
+            module.START_ELEMENT
+            module.END_ELEMENT
+
+        self.assertEqual(fake_import.call_count, 1)
+
+    def test_missing_attribute(self):
+        """``LazyModule`` raises AttributeError for something the module doesn't have"""
+        module = lazy.LazyModule(self.name)
+
+        with self.assertRaises(AttributeError):
+            module.not_a_thing
+
+
+if __name__ == '__main__':
+    unittest.main()
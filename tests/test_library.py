@@ -0,0 +1,308 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in library.py
+"""
+import io
+import unittest
+import urllib.error
+from unittest.mock import patch, MagicMock
+
+import ujson
+
+from vlab_icap_api.lib.worker import library
+
+
+def _response(value):
+    """Make a fake response of the vCenter REST API"""
+    fake_resp = MagicMock()
+    fake_resp.__enter__.return_value.read.return_value = ujson.dumps({'value': value}).encode()
+    return fake_resp
+
+
+def _http_error(code, messages=()):
+    """Make a fake HTTP error of the vCenter REST API"""
+    body = ujson.dumps({'type': 'com.vmware.vapi.std.errors.not_found',
+                        'value': {'messages': [{'default_message': x} for x in messages]}}).encode()
+    return urllib.error.HTTPError('https://vcenter/rest', code, 'some reason', {}, io.BytesIO(body))
+
+
+class TestLibrary(unittest.TestCase):
+    """A set of test cases for the module functions of library.py"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_client = MagicMock()
+        self.fake_client.library_id = 'lib-1'
+        self.fake_logger = MagicMock()
+        patcher = patch.object(library, 'INDEX')
+        self.fake_INDEX = patcher.start()
+        self.fake_INDEX.result.return_value = {'ok': True, 'key': [1, 2, 3]}
+        self.fake_INDEX.key.return_value = [1, 2, 3]
+        self.addCleanup(patcher.stop)
+
+    def _set_mode(self, mode):
+        """Patch the deploy mode for a single test"""
+        patcher = patch.object(library, 'const', library.const._replace(VLAB_ICAP_DEPLOY_MODE=mode))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_enabled(self):
+        """``enabled`` is True for the library deploy mode"""
+        self._set_mode('library')
+
+        self.assertTrue(library.enabled())
+
+    def test_disabled(self):
+        """``enabled`` is False for the other deploy modes"""
+        for mode in ('ova', 'template', 'linked'):
+            self._set_mode(mode)
+            self.assertFalse(library.enabled())
+
+    def test_item_name(self):
+        """``item_name`` includes the version"""
+        self.assertEqual(library.item_name('1.0.0'), 'icap-1.0.0')
+
+    def test_list_items(self):
+        """``list_items`` returns the ICAP items in the library, by version"""
+        items = {'item-1': {'description': '{"component": "ICAP", "version": "1.0.0", "key": [1, 2, 3]}'},
+                 'item-2': {'description': 'Not made by this service'}}
+        def fake_call(method, path, params=None):
+            if params:
+                return sorted(items.keys())
+            return items[path.split('id:')[1]]
+        self.fake_client.call.side_effect = fake_call
+
+        output = library.list_items(self.fake_client)
+        expected = {'1.0.0': ('item-1', {'component': 'ICAP', 'version': '1.0.0', 'key': [1, 2, 3]})}
+
+        self.assertEqual(output, expected)
+
+    def test_list_items_no_library(self):
+        """``list_items`` returns an empty dictionary if the library doesn't exist yet"""
+        self.fake_client.library_id = None
+
+        output = library.list_items(self.fake_client)
+
+        self.assertEqual(output, {})
+
+    def test_is_stale(self):
+        """``is_stale`` is False while the OVA is the one the item was made from"""
+        self.assertFalse(library.is_stale('1.0.0', {'key': [1, 2, 3]}))
+
+    def test_is_stale_replaced(self):
+        """``is_stale`` is True once the OVA is replaced"""
+        self.assertTrue(library.is_stale('1.0.0', {'key': [4, 5, 6]}))
+
+    def test_is_stale_deleted(self):
+        """``is_stale`` is True once the OVA is deleted"""
+        self.fake_INDEX.key.return_value = None
+
+        self.assertTrue(library.is_stale('1.0.0', {'key': [1, 2, 3]}))
+
+    def test_is_stale_failed(self):
+        """``is_stale`` is True if the OVA failed verification"""
+        self.fake_INDEX.result.return_value = {'ok': False, 'key': [1, 2, 3]}
+
+        self.assertTrue(library.is_stale('1.0.0', {'key': [1, 2, 3]}))
+
+    def test_is_stale_pending(self):
+        """``is_stale`` is False while the OVA the item was made from waits to be verified again"""
+        self.fake_INDEX.result.return_value = None
+
+        self.assertFalse(library.is_stale('1.0.0', {'key': [1, 2, 3]}))
+
+    def test_find_item(self):
+        """``find_item`` returns the ID of the version's item"""
+        self.fake_client.call.side_effect = [['item-1'], {'description': '{"key": [1, 2, 3]}'}]
+
+        output = library.find_item(self.fake_client, '1.0.0')
+
+        self.assertEqual(output, 'item-1')
+
+    def test_find_item_missing(self):
+        """``find_item`` returns None if the version isn't in the library"""
+        self.fake_client.call.return_value = []
+
+        output = library.find_item(self.fake_client, '1.0.0')
+
+        self.assertEqual(output, None)
+
+    def test_find_item_stale(self):
+        """``find_item`` returns None if the item was made from an older OVA"""
+        self.fake_client.call.side_effect = [['item-1'], {'description': '{"key": [4, 5, 6]}'}]
+
+        output = library.find_item(self.fake_client, '1.0.0')
+
+        self.assertEqual(output, None)
+
+    @patch.object(library.time, 'sleep')
+    @patch.object(library.urllib.request, 'urlopen')
+    @patch.object(library, 'DiskUploader')
+    def test_publish(self, fake_DiskUploader, fake_urlopen, fake_sleep):
+        """``publish`` uploads the OVF and every disk into a new item, then waits for vCenter to import them"""
+        disk = MagicMock()
+        disk.name = 'icap-disk1.vmdk'
+        disk.size = 100
+        info = MagicMock()
+        info.ovf = '<Envelope/>'
+        info.members = [disk]
+        upload = {'upload_endpoint': {'uri': 'https://vcenter/cls/data/1'}}
+        self.fake_client.call.side_effect = ['item-1', 'session-1', upload, upload, None,
+                                             {'state': 'ACTIVE'}, {'state': 'DONE'}]
+
+        output = library.publish(self.fake_client, info, '1.0.0', self.fake_logger)
+        create_spec = self.fake_client.call.call_args_list[0][1]['body']['create_spec']
+
+        self.assertEqual(output, 'item-1')
+        self.assertEqual(create_spec['name'], 'icap-1.0.0')
+        self.assertEqual(ujson.loads(create_spec['description'])['key'], [1, 2, 3])
+        fake_DiskUploader.return_value.upload.assert_called_with([(disk, 'https://vcenter/cls/data/1')])
+        self.assertEqual(fake_urlopen.call_args[0][0].get_method(), 'PUT')
+
+    @patch.object(library.urllib.request, 'urlopen')
+    @patch.object(library, 'DiskUploader')
+    def test_publish_error(self, fake_DiskUploader, fake_urlopen):
+        """``publish`` removes the item if the upload fails"""
+        info = MagicMock()
+        info.ovf = '<Envelope/>'
+        info.members = []
+        upload = {'upload_endpoint': {'uri': 'https://vcenter/cls/data/1'}}
+        self.fake_client.call.side_effect = ['item-1', 'session-1', upload, None, {'state': 'ERROR'}, None]
+
+        with self.assertRaises(RuntimeError):
+            library.publish(self.fake_client, info, '1.0.0', self.fake_logger)
+
+        self.fake_client.call.assert_called_with('DELETE', '/rest/com/vmware/content/library/item/id:item-1')
+
+    def test_deploy(self):
+        """``deploy`` returns the ID of the new VM"""
+        self.fake_client.call.return_value = {'succeeded': True,
+                                              'resource_id': {'type': 'VirtualMachine', 'id': 'vm-1'}}
+
+        output = library.deploy(self.fake_client, 'item-1', 'myIcap', 'frontend', 'network-1',
+                                'group-v1', 'resgroup-1', 'datastore-1')
+        body = self.fake_client.call.call_args[1]['body']
+
+        self.assertEqual(output, 'vm-1')
+        self.assertEqual(body['deployment_spec']['network_mappings'], [{'key': 'frontend', 'value': 'network-1'}])
+        self.assertEqual(body['target'], {'resource_pool_id': 'resgroup-1', 'folder_id': 'group-v1'})
+
+    def test_deploy_error(self):
+        """``deploy`` raises RuntimeError if vCenter couldn't make the VM"""
+        self.fake_client.call.return_value = {'succeeded': False,
+                                              'error': {'errors': [{'error': {'default_message': 'testing'}}]}}
+
+        with self.assertRaisesRegex(RuntimeError, 'testing'):
+            library.deploy(self.fake_client, 'item-1', 'myIcap', 'frontend', 'network-1',
+                           'group-v1', 'resgroup-1', 'datastore-1')
+
+    @patch.object(library, 'current_app')
+    def test_request_sync(self, fake_current_app):
+        """``request_sync`` only queues one sync per scan interval"""
+        patcher = patch.object(library, '_last_sync_request', 0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        first = library.request_sync()
+        second = library.request_sync()
+
+        self.assertTrue(first)
+        self.assertFalse(second)
+        self.assertEqual(fake_current_app.send_task.call_count, 1)
+
+
+class TestLibraryClient(unittest.TestCase):
+    """A set of test cases for the LibraryClient object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.client = library.LibraryClient('vcenter', 443, 'alice', 'iLoveCats')
+
+    @patch.object(library.urllib.request, 'urlopen')
+    def test_call(self, fake_urlopen):
+        """``LibraryClient`` - ``call`` logs in once, and returns the value of the response"""
+        fake_urlopen.side_effect = [_response('session-1'), _response(['lib-1']), _response(['lib-2'])]
+
+        first = self.client.call('GET', '/rest/com/vmware/content/library')
+        second = self.client.call('GET', '/rest/com/vmware/content/library')
+        sent = fake_urlopen.call_args[0][0]
+
+        self.assertEqual(first, ['lib-1'])
+        self.assertEqual(second, ['lib-2'])
+        self.assertEqual(fake_urlopen.call_count, 3)
+        self.assertEqual(sent.get_header('Vmware-api-session-id'), 'session-1')
+
+    @patch.object(library.urllib.request, 'urlopen')
+    def test_call_params(self, fake_urlopen):
+        """``LibraryClient`` - ``call`` sends the query parameters"""
+        fake_urlopen.side_effect = [_response('session-1'), _response([])]
+
+        self.client.call('GET', '/rest/com/vmware/content/library/item', params={'library_id': 'lib-1'})
+        sent = fake_urlopen.call_args[0][0]
+
+        self.assertEqual(sent.full_url, 'https://vcenter:443/rest/com/vmware/content/library/item?library_id=lib-1')
+
+    @patch.object(library.urllib.request, 'urlopen')
+    def test_call_expired(self, fake_urlopen):
+        """``LibraryClient`` - ``call`` logs in again if the session expired"""
+        fake_urlopen.side_effect = [_response('session-1'), _http_error(401),
+                                    _response('session-2'), _response(['lib-1'])]
+
+        output = self.client.call('GET', '/rest/com/vmware/content/library')
+        sent = fake_urlopen.call_args[0][0]
+
+        self.assertEqual(output, ['lib-1'])
+        self.assertEqual(sent.get_header('Vmware-api-session-id'), 'session-2')
+
+    @patch.object(library.urllib.request, 'urlopen')
+    def test_call_error(self, fake_urlopen):
+        """``LibraryClient`` - ``call`` raises RuntimeError with the message from vCenter"""
+        fake_urlopen.side_effect = [_response('session-1'), _http_error(404, ['Library not found'])]
+
+        with self.assertRaisesRegex(RuntimeError, 'HTTP 404 Library not found'):
+            self.client.call('GET', '/rest/com/vmware/content/library/id:lib-1')
+
+    @patch.object(library.urllib.request, 'urlopen')
+    def test_call_no_content(self, fake_urlopen):
+        """``LibraryClient`` - ``call`` returns None when vCenter doesn't send a body"""
+        fake_empty = MagicMock()
+        fake_empty.__enter__.return_value.read.return_value = b''
+        fake_urlopen.side_effect = [_response('session-1'), fake_empty]
+
+        output = self.client.call('DELETE', '/rest/com/vmware/content/library/item/id:item-1')
+
+        self.assertEqual(output, None)
+
+    def test_library_id(self):
+        """``LibraryClient`` - ``library_id`` is looked up once"""
+        with patch.object(self.client, 'call') as fake_call:
+            fake_call.return_value = ['lib-1']
+            self.client.library_id
+            output = self.client.library_id
+
+        self.assertEqual(output, 'lib-1')
+        self.assertEqual(fake_call.call_count, 1)
+
+    def test_create_library(self):
+        """``LibraryClient`` - ``create_library`` keeps the library on the datastore"""
+        with patch.object(self.client, 'call') as fake_call:
+            fake_call.side_effect = [[], 'lib-1']
+            output = self.client.create_library('datastore-1')
+
+        spec = fake_call.call_args[1]['body']['create_spec']
+
+        self.assertEqual(output, 'lib-1')
+        self.assertEqual(spec['storage_backings'], [{'type': 'DATASTORE', 'datastore_id': 'datastore-1'}])
+
+    def test_create_library_exists(self):
+        """``LibraryClient`` - ``create_library`` doesn't make a second library"""
+        with patch.object(self.client, 'call') as fake_call:
+            fake_call.return_value = ['lib-1']
+            output = self.client.create_library('datastore-1')
+
+        self.assertEqual(output, 'lib-1')
+        self.assertEqual(fake_call.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the metrics.py module
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from prometheus_client.parser import text_string_to_metric_families
+
+from vlab_icap_api.lib import metrics
+
+
+def _sample(name, **labels):
+    """The value of one sample in the output of ``render``, or zero if it's not there"""
+    for family in text_string_to_metric_families(metrics.render().decode()):
+        for sample in family.samples:
+            if sample.name == name and sample.labels == labels:
+                return sample.value
+    return 0
+
+
+class TestMetrics(unittest.TestCase):
+    """A set of test cases for the metrics.py module"""
+
+    def test_multiproc_dir(self):
+        """Every process records into the same directory, so the scrape can add them up"""
+        self.assertEqual(os.environ['PROMETHEUS_MULTIPROC_DIR'], metrics.MULTIPROC_DIR)
+        self.assertTrue(os.path.isdir(metrics.MULTIPROC_DIR))
+
+    def test_multiproc_dir_default(self):
+        """The metrics go in the cache directory, unless ``PROMETHEUS_MULTIPROC_DIR`` says otherwise"""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        with patch.dict(metrics.os.environ, clear=False):
+            metrics.os.environ.pop('PROMETHEUS_MULTIPROC_DIR')
+            with patch.object(metrics, 'const', metrics.const._replace(VLAB_ICAP_CACHE_DIR=cache_dir)):
+                output = metrics._multiproc_dir()
+
+        self.assertEqual(output, os.path.join(cache_dir, 'metrics'))
+        self.assertTrue(os.path.isdir(output))
+
+    @patch.object(metrics.os, 'makedirs', side_effect=PermissionError('testing'))
+    def test_multiproc_dir_error(self, fake_makedirs):
+        """Each process only reports its own metrics when the directory cannot be made"""
+        with patch.dict(metrics.os.environ, clear=False):
+            output = metrics._multiproc_dir()
+            exported = 'PROMETHEUS_MULTIPROC_DIR' in metrics.os.environ
+
+        self.assertTrue(output is None)
+        self.assertFalse(exported)
+
+    def test_render(self):
+        """``render`` adds up the metrics recorded by every process"""
+        before = _sample('icap_api_tasks_published_total', task='icap.test_render')
+        metrics.TASKS_PUBLISHED.labels(task='icap.test_render').inc()
+
+        after = _sample('icap_api_tasks_published_total', task='icap.test_render')
+
+        self.assertEqual(after - before, 1)
+
+    @patch.object(metrics, 'generate_latest')
+    def test_render_single_process(self, fake_generate_latest):
+        """``render`` reports the metrics of only this process when there's no shared directory"""
+        with patch.object(metrics, 'MULTIPROC_DIR', None):
+            metrics.render()
+
+        fake_generate_latest.assert_called_with(metrics.REGISTRY)
+
+    @patch.object(metrics.multiprocess, 'mark_process_dead')
+    def test_retire_process(self, fake_mark_process_dead):
+        """``retire_process`` tells prometheus_client the process is gone"""
+        metrics.retire_process()
+
+        fake_mark_process_dead.assert_called_with(os.getpid(), metrics.MULTIPROC_DIR)
+
+    @patch.object(metrics.multiprocess, 'mark_process_dead')
+    def test_retire_process_single(self, fake_mark_process_dead):
+        """``retire_process`` does nothing when there's no shared directory"""
+        with patch.object(metrics, 'MULTIPROC_DIR', None):
+            metrics.retire_process()
+
+        self.assertFalse(fake_mark_process_dead.called)
+
+    def test_timed(self):
+        """``timed`` sets the outcome to "ok" if the block works"""
+        fake_histogram = MagicMock()
+
+        with metrics.timed(fake_histogram, op='login'):
+            pass
+
+        fake_histogram.labels.assert_called_with(op='login', outcome='ok')
+        self.assertTrue(fake_histogram.labels.return_value.observe.called)
+
+    def test_timed_error(self):
+        """``timed`` sets the outcome to "error" if the block raises"""
+        fake_histogram = MagicMock()
+
+        with self.assertRaises(RuntimeError):
+            with metrics.timed(fake_histogram, op='login'):
+                raise RuntimeError('testing')
+
+        fake_histogram.labels.assert_called_with(op='login', outcome='error')
+
+    def test_timed_vcenter(self):
+        """``timed`` records into the vCenter histogram"""
+        before = _sample('icap_vcenter_operation_duration_seconds_count', op='test_timed', outcome='ok')
+        with metrics.timed(metrics.VCENTER_SECONDS, op='test_timed'):
+            pass
+
+        after = _sample('icap_vcenter_operation_duration_seconds_count', op='test_timed', outcome='ok')
+
+        self.assertEqual(after - before, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
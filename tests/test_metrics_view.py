@@ -0,0 +1,55 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the metrics API end point
+"""
+import unittest
+
+from flask import Flask
+from prometheus_client.parser import text_string_to_metric_families
+
+from vlab_icap_api.lib.views import healthcheck
+from vlab_icap_api.lib.views import metrics as metrics_view
+
+
+class TestMetricsView(unittest.TestCase):
+    """A set of test cases for the MetricsView object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        app = Flask(__name__)
+        healthcheck.HealthView.register(app)
+        metrics_view.MetricsView.register(app)
+        metrics_view.record_requests(app)
+        app.config['TESTING'] = True
+        self.app = app.test_client()
+
+    def _count(self, endpoint):
+        """How many requests to an end point the metrics report"""
+        resp = self.app.get('/api/1/inf/icap/metrics')
+        for family in text_string_to_metric_families(resp.data.decode()):
+            for sample in family.samples:
+                if sample.name == 'icap_api_request_duration_seconds_count' and \
+                   sample.labels == {'method': 'GET', 'endpoint': endpoint, 'status': '200'}:
+                    return sample.value
+        return 0
+
+    def test_metrics(self):
+        """GET on /api/1/inf/icap/metrics returns the Prometheus text format"""
+        self.app.get('/api/1/inf/icap/healthcheck')
+        resp = self.app.get('/api/1/inf/icap/metrics')
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.headers['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('# TYPE icap_api_request_duration_seconds histogram', resp.data.decode())
+
+    def test_records_requests(self):
+        """Every request is timed, by method, route and status"""
+        before = self._count('/api/1/inf/icap/healthcheck')
+        self.app.get('/api/1/inf/icap/healthcheck')
+
+        after = self._count('/api/1/inf/icap/healthcheck')
+
+        self.assertEqual(after - before, 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,155 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in ovas.py
+"""
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_icap_api.lib.worker import ovas
+
+
+OVF = '<Envelope><NetworkSection><Network ovf:name="VM Network"></Network></NetworkSection></Envelope>'
+
+
+class TestOvaCache(unittest.TestCase):
+    """A set of test cases for the OvaCache object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.images_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.images_dir)
+        self.ova_cache = ovas.OvaCache(self.images_dir)
+        self._make_ova('1.0.0', disk=b'some disk')
+
+    def _make_ova(self, version, disk):
+        """Write a small OVA to the images directory"""
+        path = os.path.join(self.images_dir, 'ICAP-{}.ova'.format(version))
+        with tarfile.open(path, 'w') as the_tar:
+            for name, data in (('icap.ovf', OVF.encode()), ('icap-disk1.vmdk', disk)):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                the_tar.addfile(info, io.BytesIO(data))
+        return path
+
+    def test_get(self):
+        """``OvaCache`` - ``get`` returns the networks and disks within the OVA"""
+        info = self.ova_cache.get('1.0.0')
+
+        self.assertEqual(info.networks, ['VM Network'])
+        self.assertEqual(info.disks, {'icap-disk1.vmdk': 9})
+
+    def test_get_cached(self):
+        """``OvaCache`` - ``get`` only parses an OVA once"""
+        with patch.object(ovas.OvaCache, '_parse', wraps=ovas.OvaCache._parse) as fake_parse:
+            self.ova_cache.get('1.0.0')
+            self.ova_cache.get('1.0.0')
+
+        self.assertEqual(fake_parse.call_count, 1)
+
+    def test_get_changed(self):
+        """``OvaCache`` - ``get`` parses the OVA again after it's replaced"""
+        self.ova_cache.get('1.0.0')
+        path = self._make_ova('1.0.0', disk=b'a bigger disk')
+        os.utime(path, ns=(1, 1))
+
+        info = self.ova_cache.get('1.0.0')
+
+        self.assertEqual(info.disks, {'icap-disk1.vmdk': 13})
+
+    def test_get_missing(self):
+        """``OvaCache`` - ``get`` raises ValueError for an unknown version"""
+        with self.assertRaises(ValueError):
+            self.ova_cache.get('9.9.9')
+
+    def test_open(self):
+        """``OvaCache`` - ``open`` returns an Ova that can read the disks"""
+        the_ova = self.ova_cache.open('1.0.0')
+        try:
+            disk = the_ova._disks['icap-disk1.vmdk'].read()
+            networks = the_ova.networks
+        finally:
+            the_ova.close()
+
+        self.assertEqual(disk, b'some disk')
+        self.assertEqual(networks, ['VM Network'])
+
+    @patch.object(ovas, 'DiskUploader')
+    @patch.object(ovas.time, 'time', side_effect=[100.0, 102.0])
+    @patch.object(ovas, 'OVA_UPLOAD_RATE')
+    @patch.object(ovas, 'OVA_UPLOAD_SECONDS')
+    @patch.object(ovas, 'OVA_UPLOAD_BYTES')
+    def test_deploy_metrics(self, fake_upload_bytes, fake_upload_seconds, fake_upload_rate, fake_time,
+                            fake_DiskUploader):
+        """``CachedOva`` - ``deploy`` records the bytes uploaded and the throughput"""
+        fake_DiskUploader.return_value.upload.return_value = 9
+        the_ova = self.ova_cache.open('1.0.0')
+        try:
+            the_ova.deploy(self._make_spec(), self._make_lease(), 'somehost')
+        finally:
+            the_ova.close()
+
+        fake_upload_bytes.inc.assert_called_with(9)
+        fake_upload_seconds.inc.assert_called_with(2.0)
+        fake_upload_rate.observe.assert_called_with(4.5)
+
+    @patch.object(ovas, 'DiskUploader')
+    def test_deploy(self, fake_DiskUploader):
+        """``CachedOva`` - ``deploy`` uploads every disk to its device URL, then completes the lease"""
+        fake_DiskUploader.return_value.upload.return_value = 9
+        fake_lease = self._make_lease()
+        the_ova = self.ova_cache.open('1.0.0')
+        try:
+            the_ova.deploy(self._make_spec(), fake_lease, 'somehost')
+        finally:
+            the_ova.close()
+
+        disks = fake_DiskUploader.return_value.upload.call_args[0][0]
+        member, url = disks[0]
+
+        self.assertEqual(member.name, 'icap-disk1.vmdk')
+        self.assertEqual(url, 'https://esxi/nfc/disk-0')
+        self.assertTrue(fake_lease.Complete.called)
+
+    @patch.object(ovas, 'DiskUploader')
+    def test_deploy_error(self, fake_DiskUploader):
+        """``CachedOva`` - ``deploy`` aborts the lease if an upload fails"""
+        fake_DiskUploader.return_value.upload.side_effect = RuntimeError('testing')
+        fake_lease = self._make_lease()
+        the_ova = self.ova_cache.open('1.0.0')
+        try:
+            with self.assertRaises(RuntimeError):
+                the_ova.deploy(self._make_spec(), fake_lease, 'somehost')
+        finally:
+            the_ova.close()
+
+        self.assertTrue(fake_lease.Abort.called)
+        self.assertFalse(fake_lease.Complete.called)
+
+    @staticmethod
+    def _make_spec():
+        """A deploy spec with one disk"""
+        fake_spec = MagicMock()
+        fake_item = MagicMock()
+        fake_item.path = 'icap-disk1.vmdk'
+        fake_item.deviceId = 'disk-0'
+        fake_spec.fileItem = [fake_item]
+        return fake_spec
+
+    @staticmethod
+    def _make_lease():
+        """A lease with a device URL for the disk of ``_make_spec``"""
+        fake_lease = MagicMock()
+        fake_url = MagicMock()
+        fake_url.importKey = 'disk-0'
+        fake_url.url = 'https://esxi/nfc/disk-0'
+        fake_lease.info.deviceUrl = [fake_url]
+        return fake_lease
+
+
+if __name__ == '__main__':
+    unittest.main()
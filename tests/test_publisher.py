@@ -0,0 +1,101 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in publisher.py
+"""
+import socket
+import unittest
+from unittest.mock import patch, MagicMock
+
+from amqp.exceptions import MessageNacked
+from kombu.exceptions import LimitExceeded, OperationalError
+
+from vlab_icap_api.lib import publisher
+
+
+class TestConfigure(unittest.TestCase):
+    """A set of test cases for the ``configure`` function"""
+
+    def test_configure(self):
+        """``configure`` sizes the connection pool, and turns on publisher confirms"""
+        fake_celery_app = MagicMock()
+        with patch.object(publisher, 'const', publisher.const._replace(VLAB_ICAP_BROKER_POOL_LIMIT=42,
+                                                                        VLAB_ICAP_PUBLISH_CONFIRMS=1)):
+            publisher.configure(fake_celery_app)
+
+        self.assertEqual(fake_celery_app.conf.broker_pool_limit, 42)
+        self.assertEqual(fake_celery_app.conf.broker_transport_options, {'max_retries': 1, 'confirm_publish': True})
+
+    def test_configure_no_confirms(self):
+        """``configure`` only bounds the connection retries when confirms are off"""
+        fake_celery_app = MagicMock()
+        with patch.object(publisher, 'const', publisher.const._replace(VLAB_ICAP_PUBLISH_CONFIRMS=0)):
+            publisher.configure(fake_celery_app)
+
+        self.assertEqual(fake_celery_app.conf.broker_transport_options, {'max_retries': 1})
+
+
+class TestSendTask(unittest.TestCase):
+    """A set of test cases for the ``send_task`` function"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_celery_app = MagicMock()
+        self.fake_producer = self.fake_celery_app.producer_pool.acquire.return_value.__enter__.return_value
+
+    def test_send_task(self):
+        """``send_task`` publishes with a producer from the pool, bounding every wait"""
+        publisher.send_task(self.fake_celery_app, 'icap.show', ['bob'], queue='icap-read')
+
+        self.fake_celery_app.producer_pool.acquire.assert_called_with(block=True,
+                                                                       timeout=publisher.const.VLAB_ICAP_PUBLISH_TIMEOUT)
+        self.fake_celery_app.send_task.assert_called_with('icap.show', ['bob'], producer=self.fake_producer,
+                                                          timeout=publisher.const.VLAB_ICAP_PUBLISH_TIMEOUT,
+                                                          queue='icap-read')
+
+    def test_send_task_returns(self):
+        """``send_task`` returns the result of the task"""
+        output = publisher.send_task(self.fake_celery_app, 'icap.show', ['bob'])
+        expected = self.fake_celery_app.send_task.return_value
+
+        self.assertTrue(output is expected)
+
+    def test_pool_exhausted(self):
+        """``send_task`` raises BrokerBusy when no producer frees up in time"""
+        self.fake_celery_app.producer_pool.acquire.side_effect = LimitExceeded()
+
+        with self.assertRaises(publisher.BrokerBusy) as the_error:
+            publisher.send_task(self.fake_celery_app, 'icap.show', ['bob'])
+
+        self.assertEqual(the_error.exception.retry_after, publisher.const.VLAB_ICAP_PUBLISH_TIMEOUT)
+
+    def test_broker_down(self):
+        """``send_task`` raises BrokerBusy when the broker cannot be reached"""
+        self.fake_celery_app.send_task.side_effect = OperationalError('doh')
+
+        with self.assertRaisesRegex(publisher.BrokerBusy, 'Unable to queue icap.show'):
+            publisher.send_task(self.fake_celery_app, 'icap.show', ['bob'])
+
+    def test_nacked(self):
+        """``send_task`` raises BrokerBusy when the broker refuses the task"""
+        self.fake_celery_app.send_task.side_effect = MessageNacked()
+
+        with self.assertRaises(publisher.BrokerBusy):
+            publisher.send_task(self.fake_celery_app, 'icap.show', ['bob'])
+
+    def test_confirm_timeout(self):
+        """``send_task`` raises BrokerBusy when the broker doesn't confirm the task in time"""
+        self.fake_celery_app.send_task.side_effect = socket.timeout()
+
+        with self.assertRaises(publisher.BrokerBusy):
+            publisher.send_task(self.fake_celery_app, 'icap.show', ['bob'])
+
+    def test_other_errors(self):
+        """``send_task`` doesn't hide errors that aren't about the broker"""
+        self.fake_celery_app.send_task.side_effect = TypeError('doh')
+
+        with self.assertRaises(TypeError):
+            publisher.send_task(self.fake_celery_app, 'icap.show', ['bob'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the readiness.py module
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_icap_api.lib import readiness
+
+
+class TestProber(unittest.TestCase):
+    """A set of test cases for the Prober object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_check = MagicMock()
+        self.prober = readiness.Prober(checks={'thing': self.fake_check}, interval=10)
+        patcher = patch.object(readiness.Prober, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ready(self):
+        """``Prober`` - ``status`` is ready when every check passes"""
+        self.prober.probe()
+
+        ready, results = self.prober.status()
+
+        self.assertTrue(ready)
+        self.assertTrue(results['thing']['ok'])
+        self.assertEqual(results['thing']['error'], None)
+
+    def test_not_ready(self):
+        """``Prober`` - ``status`` reports the error of a failed check"""
+        self.fake_check.side_effect = RuntimeError('testing')
+        self.prober.probe()
+
+        ready, results = self.prober.status()
+
+        self.assertFalse(ready)
+        self.assertEqual(results['thing']['error'], 'RuntimeError: testing')
+
+    def test_not_checked(self):
+        """``Prober`` - ``status`` isn't ready before the first check"""
+        ready, results = self.prober.status()
+
+        self.assertFalse(ready)
+        self.assertEqual(results['thing']['error'], 'Not checked yet')
+
+    def test_cached(self):
+        """``Prober`` - ``status`` doesn't run the checks"""
+        self.prober.probe()
+        for _ in range(5):
+            self.prober.status()
+
+        self.assertEqual(self.fake_check.call_count, 1)
+
+    def test_stale(self):
+        """``Prober`` - a result older than three intervals isn't trusted"""
+        with patch.object(readiness.time, 'time', return_value=100):
+            self.prober.probe()
+        with patch.object(readiness.time, 'time', return_value=131):
+            ready, results = self.prober.status()
+
+        self.assertFalse(ready)
+        self.assertEqual(results['thing']['error'], 'Result is stale')
+
+    @patch.object(readiness.os, 'getpid')
+    def test_forked(self, fake_getpid):
+        """``Prober`` - a forked process doesn't trust the results of its parent"""
+        fake_getpid.return_value = 1
+        self.prober._init_state()
+        self.prober.probe()
+        fake_getpid.return_value = 2
+        self.prober._check_pid()
+
+        ready, _ = self.prober.status()
+
+        self.assertFalse(ready)
+
+
+class TestChecks(unittest.TestCase):
+    """A set of test cases for the checks of the readiness.py module"""
+
+    @patch.object(readiness, 'Connection')
+    def test_check_broker(self, fake_Connection):
+        """``check_broker`` connects to the message broker"""
+        readiness.check_broker()
+
+        fake_conn = fake_Connection.return_value.__enter__.return_value
+        self.assertTrue(fake_conn.connect.called)
+
+    @patch.object(readiness.urllib.request, 'urlopen')
+    def test_check_vcenter(self, fake_urlopen):
+        """``check_vcenter`` logs into vCenter, then logs out"""
+        fake_resp = fake_urlopen.return_value.__enter__.return_value
+        fake_resp.headers = {'vmware-api-session-id': 'abc'}
+
+        readiness.check_vcenter()
+
+        logout = fake_urlopen.call_args_list[1][0][0]
+        self.assertEqual(logout.get_method(), 'DELETE')
+        self.assertEqual(logout.get_header('Vmware-api-session-id'), 'abc')
+
+    @patch.object(readiness.urllib.request, 'urlopen')
+    def test_check_vcenter_body(self, fake_urlopen):
+        """``check_vcenter`` supports vCenters that return the session in the body"""
+        fake_resp = fake_urlopen.return_value.__enter__.return_value
+        fake_resp.headers = {}
+        fake_resp.read.return_value = b'{"value": "abc"}'
+
+        readiness.check_vcenter()
+
+        logout = fake_urlopen.call_args_list[1][0][0]
+        self.assertEqual(logout.get_header('Vmware-api-session-id'), 'abc')
+
+    @patch.object(readiness.urllib.request, 'urlopen')
+    def test_check_vcenter_logout_error(self, fake_urlopen):
+        """``check_vcenter`` doesn't fail if only the logout fails"""
+        fake_resp = MagicMock()
+        fake_resp.__enter__.return_value.headers = {'vmware-api-session-id': 'abc'}
+        fake_urlopen.side_effect = [fake_resp, OSError('testing')]
+
+        readiness.check_vcenter()
+
+    @patch.object(readiness.os, 'listdir')
+    def test_check_images(self, fake_listdir):
+        """``check_images`` raises if the images directory cannot be read"""
+        fake_listdir.side_effect = PermissionError('testing')
+
+        with self.assertRaises(PermissionError):
+            readiness.check_images()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in routes.py
+"""
+import unittest
+
+from vlab_icap_api.lib import routes
+from vlab_icap_api.lib.worker import tasks
+
+
+class TestRoutes(unittest.TestCase):
+    """A set of test cases for routes.py"""
+
+    def test_reads(self):
+        """``queue_for`` sends reads to the read queue"""
+        for task_name in ('icap.show', 'icap.image'):
+            self.assertEqual(routes.queue_for(task_name), routes.const.VLAB_ICAP_READ_QUEUE)
+
+    def test_lifecycle(self):
+        """``queue_for`` sends lifecycle operations to the lifecycle queue"""
+        for task_name in ('icap.create', 'icap.bulk_create', 'icap.delete', 'icap.bulk_delete'):
+            self.assertEqual(routes.queue_for(task_name), routes.const.VLAB_ICAP_LIFECYCLE_QUEUE)
+
+    def test_separate_queues(self):
+        """Reads and lifecycle operations never share a queue"""
+        self.assertNotEqual(routes.const.VLAB_ICAP_READ_QUEUE, routes.const.VLAB_ICAP_LIFECYCLE_QUEUE)
+
+    def test_unknown(self):
+        """``queue_for`` raises KeyError for tasks it doesn't know about"""
+        with self.assertRaises(KeyError):
+            routes.queue_for('icap.doh')
+
+    def test_every_task_routed(self):
+        """Every ICAP task the worker registers has a route"""
+        registered = {x for x in tasks.app.tasks.keys() if x.startswith('icap.')}
+
+        self.assertEqual(registered, set(routes.TASK_ROUTES.keys()))
+
+    def test_api_routes(self):
+        """The API's Celery app routes tasks the same way the worker does"""
+        from vlab_icap_api.app import app
+
+        self.assertEqual(app.celery_app.conf.task_routes, routes.TASK_ROUTES)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,120 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the FairScheduler object in scheduler.py
+"""
+import time
+import unittest
+import threading
+from unittest.mock import MagicMock
+
+from vlab_icap_api.lib.worker import scheduler
+
+
+class TestFairScheduler(unittest.TestCase):
+    """A set of test cases for the FairScheduler object"""
+
+    def _wait_for(self, check):
+        """Poll until ``check`` returns True, or give up after a few seconds"""
+        for _ in range(500):
+            if check():
+                return
+            time.sleep(0.01)
+        self.fail('Timed out')
+
+    def _hold(self, the_scheduler, username, order, release, on_wait=None):
+        """Start a thread that takes a slot, records it, and holds it until ``release`` is set"""
+        def deploy():
+            with the_scheduler.slot(username, on_wait=on_wait):
+                order.append(username)
+                release.wait(5)
+        thread = threading.Thread(target=deploy)
+        thread.start()
+        self.addCleanup(thread.join, 5)
+        self.addCleanup(release.set)
+        return thread
+
+    def test_slot(self):
+        """``slot`` tracks the running deploys of each user"""
+        the_scheduler = scheduler.FairScheduler(slots=2)
+
+        with the_scheduler.slot('bob'):
+            running = the_scheduler.running()
+
+        self.assertEqual(running, {'bob': 1})
+        self.assertEqual(the_scheduler.running(), {})
+
+    def test_no_limit(self):
+        """Zero slots means deploys never wait"""
+        the_scheduler = scheduler.FairScheduler(slots=0)
+        on_wait = MagicMock()
+
+        with the_scheduler.slot('bob', on_wait=on_wait):
+            with the_scheduler.slot('bob', on_wait=on_wait):
+                pass
+
+        self.assertFalse(on_wait.called)
+
+    def test_released_on_error(self):
+        """``slot`` is released when the deploy fails"""
+        the_scheduler = scheduler.FairScheduler(slots=1)
+
+        with self.assertRaises(RuntimeError):
+            with the_scheduler.slot('bob'):
+                raise RuntimeError('doh')
+
+        self.assertEqual(the_scheduler.running(), {})
+
+    def test_cap(self):
+        """Deploys beyond the number of slots wait, and report their place in line"""
+        the_scheduler = scheduler.FairScheduler(slots=1)
+        order = []
+        release = threading.Event()
+        on_wait = MagicMock()
+        self._hold(the_scheduler, 'bob', order, release)
+        self._wait_for(lambda: order == ['bob'])
+
+        self._hold(the_scheduler, 'alice', order, threading.Event(), on_wait=on_wait)
+        self._wait_for(lambda: the_scheduler.waiting() == 1)
+        release.set()
+        self._wait_for(lambda: order == ['bob', 'alice'])
+
+        on_wait.assert_called_with(1)
+
+    def test_fair(self):
+        """A free slot goes to the waiting user with the fewest running deploys"""
+        the_scheduler = scheduler.FairScheduler(slots=2)
+        order = []
+        bob_release = threading.Event()
+        self._hold(the_scheduler, 'bob', order, bob_release)
+        self._wait_for(lambda: order == ['bob'])
+        self._hold(the_scheduler, 'bob', order, threading.Event())
+        self._wait_for(lambda: order == ['bob', 'bob'])
+        # bob queues another deploy before alice asks for one
+        self._hold(the_scheduler, 'bob', order, threading.Event())
+        self._wait_for(lambda: the_scheduler.waiting() == 1)
+        self._hold(the_scheduler, 'alice', order, threading.Event())
+        self._wait_for(lambda: the_scheduler.waiting() == 2)
+
+        bob_release.set()
+        self._wait_for(lambda: len(order) == 3)
+
+        self.assertEqual(order[2], 'alice')
+
+    def test_deadline(self):
+        """A deploy that runs out of time waiting for a slot leaves the line"""
+        the_scheduler = scheduler.FairScheduler(slots=1)
+        order = []
+        self._hold(the_scheduler, 'bob', order, threading.Event())
+        self._wait_for(lambda: order == ['bob'])
+        scheduler.deadlines.start(0.1)
+        self.addCleanup(scheduler.deadlines.clear)
+
+        with self.assertRaises(scheduler.deadlines.DeadlineExceeded):
+            with the_scheduler.slot('alice'):
+                pass
+
+        self.assertEqual(the_scheduler.waiting(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,206 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in sessions.py
+"""
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_icap_api.lib.worker import sessions
+
+
+@patch.object(sessions, '_KeepAlive')
+@patch.object(sessions, 'PooledvCenter')
+class TestSessionPool(unittest.TestCase):
+    """A set of test cases for the SessionPool object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.pool = sessions.SessionPool(max_idle=2, keepalive=300, max_age=3600)
+
+    def test_reuse(self, fake_PooledvCenter, fake_KeepAlive):
+        """``SessionPool`` reuses an idle session instead of logging in again"""
+        with self.pool.session() as first:
+            pass
+        with self.pool.session() as second:
+            pass
+
+        self.assertTrue(first is second)
+        self.assertEqual(fake_PooledvCenter.call_count, 1)
+
+    def test_stats(self, fake_PooledvCenter, fake_KeepAlive):
+        """``SessionPool`` counts logins and reused sessions"""
+        for _ in range(3):
+            with self.pool.session():
+                pass
+
+        stats = self.pool.stats()
+        expected = {'logins': 1, 'reused': 2, 'expired': 0, 'discarded': 0, 'idle': 1}
+
+        self.assertEqual(stats, expected)
+
+    def test_concurrent(self, fake_PooledvCenter, fake_KeepAlive):
+        """``SessionPool`` never hands the same session to two borrowers"""
+        fake_PooledvCenter.side_effect = lambda **kwargs: MagicMock()
+        with self.pool.session() as first:
+            with self.pool.session() as second:
+                pass
+
+        self.assertFalse(first is second)
+
+    def test_max_idle(self, fake_PooledvCenter, fake_KeepAlive):
+        """``SessionPool`` logs out of sessions beyond ``max_idle``"""
+        fake_PooledvCenter.side_effect = lambda **kwargs: MagicMock()
+        with self.pool.session():
+            with self.pool.session():
+                with self.pool.session():
+                    pass
+
+        self.assertEqual(self.pool.stats()['idle'], 2)
+
+    def test_max_age(self, fake_PooledvCenter, fake_KeepAlive):
+        """``SessionPool`` logs in again once a session is too old"""
+        with self.pool.session():
+            pass
+        self.pool._idle[0].created -= 7200
+        with self.pool.session():
+            pass
+
+        self.assertEqual(self.pool.stats()['expired'], 1)
+        self.assertEqual(fake_PooledvCenter.call_count, 2)
+
+    def test_expired_relogin(self, fake_PooledvCenter, fake_KeepAlive):
+        """``SessionPool`` transparently logs in again when vCenter expired an idle session"""
+        with self.pool.session() as vcenter:
+            pass
+        vcenter.content.sessionManager.currentSession = None
+        self.pool._idle[0].last_used -= 600
+        with self.pool.session():
+            pass
+
+        self.assertEqual(self.pool.stats()['expired'], 1)
+        self.assertEqual(fake_PooledvCenter.call_count, 2)
+
+    def test_session_error(self, fake_PooledvCenter, fake_KeepAlive):
+        """``SessionPool`` throws away a session that had a connection error"""
+        with self.assertRaises(OSError):
+            with self.pool.session():
+                raise OSError('testing')
+
+        self.assertEqual(self.pool.stats()['discarded'], 1)
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    def test_task_error(self, fake_PooledvCenter, fake_KeepAlive):
+        """``SessionPool`` keeps a session when the task itself failed"""
+        with self.assertRaises(ValueError):
+            with self.pool.session():
+                raise ValueError('testing')
+
+        self.assertEqual(self.pool.stats()['idle'], 1)
+
+    @patch.object(sessions.os, 'getpid')
+    def test_forked(self, fake_getpid, fake_PooledvCenter, fake_KeepAlive):
+        """``SessionPool`` does not share sessions with a parent process"""
+        fake_getpid.return_value = 1
+        pool = sessions.SessionPool(max_idle=2, keepalive=300, max_age=3600)
+        with pool.session():
+            pass
+        fake_getpid.return_value = 2
+
+        self.assertEqual(pool.stats()['idle'], 0)
+
+    def test_keepalive(self, fake_PooledvCenter, fake_KeepAlive):
+        """``SessionPool`` - ``keepalive`` drops sessions vCenter has expired"""
+        with self.pool.session() as vcenter:
+            pass
+        vcenter.content.sessionManager.currentSession = None
+        self.pool.keepalive()
+
+        self.assertEqual(self.pool.stats()['idle'], 0)
+
+    def test_close(self, fake_PooledvCenter, fake_KeepAlive):
+        """``SessionPool`` - ``close`` logs out of every idle session"""
+        with self.pool.session() as vcenter:
+            pass
+        self.pool.close()
+
+        self.assertTrue(vcenter.close.called)
+
+
+class TestPooledvCenter(unittest.TestCase):
+    """A set of test cases for the PooledvCenter object"""
+
+    @patch.object(sessions, '_ReloginStub')
+    @patch.object(sessions.vCenter, '__init__')
+    def test_content_cached(self, fake_init, fake_ReloginStub):
+        """``PooledvCenter`` only fetches the ServiceContent once"""
+        fake_init.return_value = None
+        with patch.object(sessions.PooledvCenter, '_conn', MagicMock(), create=True):
+            vcenter = sessions.PooledvCenter(host='localhost', user='bob', password='a')
+        vcenter._conn = MagicMock()
+        vcenter.content
+        vcenter.content
+
+        self.assertEqual(vcenter._conn.RetrieveContent.call_count, 1)
+
+    @patch.object(sessions, '_ReloginStub')
+    @patch.object(sessions.vCenter, '__init__')
+    def test_relogin_stub(self, fake_init, fake_ReloginStub):
+        """``PooledvCenter`` makes every call through a ``_ReloginStub``"""
+        fake_init.return_value = None
+        with patch.object(sessions.PooledvCenter, '_conn', MagicMock(), create=True):
+            vcenter = sessions.PooledvCenter(host='localhost', user='bob', password='a')
+
+        self.assertTrue(vcenter._conn._stub is fake_ReloginStub.return_value)
+        self.assertEqual(fake_ReloginStub.call_args[0][1:], ('bob', 'a'))
+
+
+class TestReloginStub(unittest.TestCase):
+    """A set of test cases for the _ReloginStub object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.soap_stub = MagicMock()
+        self.soap_stub.version = 'vim.version.version9'
+        self.stub = sessions._ReloginStub(self.soap_stub, 'bob', 'a')
+        self.service_instance = sessions.vim.ServiceInstance('ServiceInstance', self.stub)
+        self.login = self.soap_stub.InvokeAccessor.return_value.sessionManager.Login
+
+    def test_call(self):
+        """``_ReloginStub`` returns what vCenter returned"""
+        self.soap_stub.InvokeMethod.return_value = (200, 'someTime')
+
+        output = self.service_instance.CurrentTime()
+
+        self.assertEqual(output, 'someTime')
+        self.assertFalse(self.login.called)
+
+    def test_relogin(self):
+        """``_ReloginStub`` logs in again, and retries the call once, when the session expired"""
+        self.soap_stub.InvokeMethod.side_effect = [(500, sessions.vim.fault.NotAuthenticated()), (200, 'someTime')]
+
+        output = self.service_instance.CurrentTime()
+
+        self.assertEqual(output, 'someTime')
+        self.login.assert_called_with('bob', 'a')
+
+    def test_relogin_once(self):
+        """``_ReloginStub`` only retries a call once"""
+        self.soap_stub.InvokeMethod.return_value = (500, sessions.vim.fault.NotAuthenticated())
+
+        with self.assertRaises(sessions.vim.fault.NotAuthenticated):
+            self.service_instance.CurrentTime()
+
+        self.assertEqual(self.soap_stub.InvokeMethod.call_count, 2)
+
+    def test_other_fault(self):
+        """``_ReloginStub`` raises any other fault without logging in again"""
+        self.soap_stub.InvokeMethod.return_value = (500, sessions.vim.fault.InvalidName())
+
+        with self.assertRaises(sessions.vim.fault.InvalidName):
+            self.service_instance.CurrentTime()
+
+        self.assertFalse(self.login.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
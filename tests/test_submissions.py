@@ -0,0 +1,130 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the SubmissionLog object in submissions.py
+"""
+import unittest
+import threading
+from unittest.mock import patch, MagicMock
+
+from vlab_icap_api.lib import submissions
+
+
+class TestSubmissionLog(unittest.TestCase):
+    """A set of test cases for the SubmissionLog object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.log = submissions.SubmissionLog(window=60)
+
+    def test_submit(self):
+        """``submit`` returns the id from ``send``"""
+        output = self.log.submit(('bob', 'create', 'req1'), lambda: 'task-1')
+
+        self.assertEqual(output, 'task-1')
+
+    def test_submit_repeat(self):
+        """``submit`` returns the original task id, without sending, for a repeated key"""
+        send = MagicMock(side_effect=['task-1', 'task-2'])
+        self.log.submit(('bob', 'create', 'req1'), send)
+
+        output = self.log.submit(('bob', 'create', 'req1'), send)
+
+        self.assertEqual(output, 'task-1')
+        self.assertEqual(send.call_count, 1)
+
+    def test_submit_different_keys(self):
+        """``submit`` sends a task for every distinct key"""
+        self.log.submit(('bob', 'create', 'req1'), lambda: 'task-1')
+
+        output = self.log.submit(('alice', 'create', 'req1'), lambda: 'task-2')
+
+        self.assertEqual(output, 'task-2')
+
+    @patch.object(submissions.time, 'time')
+    def test_submit_expires(self, fake_time):
+        """``submit`` forgets a submission after the window"""
+        fake_time.return_value = 100
+        self.log.submit(('bob', 'create', 'req1'), lambda: 'task-1')
+        fake_time.return_value = 161
+
+        output = self.log.submit(('bob', 'create', 'req1'), lambda: 'task-2')
+
+        self.assertEqual(output, 'task-2')
+        self.assertEqual(len(self.log), 1)
+
+    @patch.object(submissions.time, 'time')
+    def test_submit_window(self, fake_time):
+        """``submit`` supports a per-submission window"""
+        fake_time.return_value = 100
+        self.log.submit(('bob', 'show', False), lambda: 'task-1', window=2)
+        fake_time.return_value = 103
+
+        output = self.log.submit(('bob', 'show', False), lambda: 'task-2', window=2)
+
+        self.assertEqual(output, 'task-2')
+
+    def test_submit_failure(self):
+        """``submit`` doesn't remember a submission that failed to send"""
+        with self.assertRaises(RuntimeError):
+            self.log.submit(('bob', 'create', 'req1'), MagicMock(side_effect=RuntimeError('broker down')))
+
+        output = self.log.submit(('bob', 'create', 'req1'), lambda: 'task-1')
+
+        self.assertEqual(output, 'task-1')
+
+    def test_submit_concurrent(self):
+        """``submit`` only sends once, when the same key is submitted concurrently"""
+        started = threading.Event()
+        release = threading.Event()
+        sent = []
+
+        def slow_send():
+            sent.append(1)
+            started.set()
+            release.wait(5)
+            return 'task-1'
+
+        results = []
+        first = threading.Thread(target=lambda: results.append(self.log.submit(('bob', 'show', False), slow_send)))
+        first.start()
+        started.wait(5)
+        second = threading.Thread(target=lambda: results.append(self.log.submit(('bob', 'show', False), slow_send)))
+        second.start()
+        release.set()
+        first.join(5)
+        second.join(5)
+
+        self.assertEqual(results, ['task-1', 'task-1'])
+        self.assertEqual(len(sent), 1)
+
+    def test_submit_waiting_unblocked(self):
+        """``submit`` of another key isn't held up by a repeat waiting on a slow publish"""
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_send():
+            started.set()
+            release.wait(5)
+            return 'task-1'
+
+        first = threading.Thread(target=lambda: self.log.submit(('bob', 'show', False), slow_send))
+        first.start()
+        started.wait(5)
+        repeat = threading.Thread(target=lambda: self.log.submit(('bob', 'show', False), slow_send))
+        repeat.start()
+        repeat.join(0.1)
+        other = []
+        another = threading.Thread(target=lambda: other.append(self.log.submit(('alice', 'show', False), lambda: 'task-2')))
+        another.start()
+        another.join(1)
+        before_release = list(other)
+        release.set()
+        first.join(5)
+        repeat.join(5)
+        another.join(5)
+
+        self.assertEqual(before_release, ['task-2'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,14 +2,24 @@
 """
 A suite of tests for the functions in tasks.py
 """
+import shutil
+import tempfile
 import unittest
+import threading
 from unittest.mock import patch, MagicMock
 
-from vlab_icap_api.lib.worker import tasks
+from vlab_icap_api.lib.worker import cache, tasks
 
 
 class TestTasks(unittest.TestCase):
     """A set of test cases for tasks.py"""
+    def setUp(self):
+        """Runs before every test case"""
+        patcher = patch.object(tasks, 'INVENTORY')
+        self.fake_inventory = patcher.start()
+        self.fake_inventory.get.return_value = None
+        self.addCleanup(patcher.stop)
+
     @patch.object(tasks, 'vmware')
     def test_show_ok(self, fake_vmware):
         """``show`` returns a dictionary when everything works as expected"""
@@ -30,6 +40,72 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_show_cached(self, fake_vmware):
+        """``show`` returns the cached inventory without querying vCenter"""
+        self.fake_inventory.get.return_value = {'cached': True}
+        fake_vmware.add_consoles.side_effect = lambda vms: vms
+
+        output = tasks.show(username='bob', txn_id='myId')
+        expected = {'content' : {'cached': True}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(fake_vmware.show_icap.called)
+
+    @patch.object(tasks, 'vmware')
+    def test_show_cached_console(self, fake_vmware):
+        """``show`` never replays the single-use console ticket of a cached inventory"""
+        cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_dir)
+        tickets = iter(['ticket-1', 'ticket-2'])
+
+        def make_consoles(vms):
+            for info in vms.values():
+                info['console'] = 'https://vcenter/console?sessionTicket={}'.format(next(tickets))
+            return vms
+
+        fake_vmware.show_icap.side_effect = lambda username: make_consoles({'myICAP': {'moid': 'vm-1'}})
+        fake_vmware.add_consoles.side_effect = make_consoles
+        with patch.object(tasks, 'INVENTORY', cache.InventoryCache(cache_dir, ttl=300)):
+            first = tasks.show(username='bob', txn_id='myId')
+            second = tasks.show(username='bob', txn_id='myId')
+
+        self.assertEqual(fake_vmware.show_icap.call_count, 1)
+        self.assertTrue(first['content']['myICAP']['console'].endswith('ticket-1'))
+        self.assertTrue(second['content']['myICAP']['console'].endswith('ticket-2'))
+
+    @patch.object(tasks, 'vmware')
+    def test_show_cached_gone(self, fake_vmware):
+        """``show`` queries vCenter when a VM in the cached inventory no longer exists"""
+        self.fake_inventory.get.return_value = {'cached': True}
+        fake_vmware.add_consoles.return_value = None
+        fake_vmware.show_icap.return_value = {'worked': True}
+
+        output = tasks.show(username='bob', txn_id='myId')
+
+        self.assertEqual(output['content'], {'worked': True})
+        self.fake_inventory.set.assert_called_with('bob', {'worked': True}, generation=self.fake_inventory.generation.return_value)
+
+    @patch.object(tasks, 'vmware')
+    def test_show_caches(self, fake_vmware):
+        """``show`` caches the inventory it obtained from vCenter"""
+        fake_vmware.show_icap.return_value = {'worked': True}
+
+        tasks.show(username='bob', txn_id='myId')
+
+        self.fake_inventory.set.assert_called_with('bob', {'worked': True}, generation=self.fake_inventory.generation.return_value)
+
+    @patch.object(tasks, 'vmware')
+    def test_show_refresh(self, fake_vmware):
+        """``show`` ignores the cached inventory when ``refresh`` is True"""
+        self.fake_inventory.get.return_value = {'cached': True}
+        fake_vmware.show_icap.return_value = {'worked': True}
+
+        output = tasks.show(username='bob', txn_id='myId', refresh=True)
+        expected = {'content' : {'worked': True}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
     @patch.object(tasks, 'vmware')
     def test_create_ok(self, fake_vmware):
         """``create`` returns a dictionary when everything works as expected"""
@@ -58,6 +134,75 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_create_updates_cache(self, fake_vmware):
+        """``create`` adds the new instance to the cached inventory"""
+        fake_vmware.create_icap.return_value = {'icapBox': {'worked': True}}
+
+        tasks.create(username='bob',
+                     machine_name='icapBox',
+                     image='0.0.1',
+                     network='someLAN',
+                     txn_id='myId')
+
+        self.fake_inventory.update.assert_called_with('bob', {'icapBox': {'worked': True}})
+
+    @patch.object(tasks, 'vmware')
+    def test_create_failure_invalidates_cache(self, fake_vmware):
+        """``create`` invalidates the cached inventory if the deploy blew up"""
+        fake_vmware.create_icap.side_effect = [RuntimeError('testing')]
+
+        with self.assertRaises(RuntimeError):
+            tasks.create(username='bob',
+                         machine_name='icapBox',
+                         image='0.0.1',
+                         network='someLAN',
+                         txn_id='myId')
+
+        self.fake_inventory.invalidate.assert_called_with('bob')
+
+    @patch.object(tasks, 'vmware')
+    def test_bulk_create_ok(self, fake_vmware):
+        """``bulk_create`` returns a dictionary when everything works as expected"""
+        fake_vmware.create_icaps.return_value = {'created': {'icap1': {}}, 'failed': {}}
+
+        output = tasks.bulk_create(username='bob',
+                                   machine_names=['icap1'],
+                                   image='0.0.1',
+                                   network='someLAN',
+                                   txn_id='myId')
+        expected = {'content' : {'created': {'icap1': {}}, 'failed': {}}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+        self.fake_inventory.update.assert_called_with('bob', {'icap1': {}})
+
+    @patch.object(tasks, 'vmware')
+    def test_bulk_create_partial(self, fake_vmware):
+        """``bulk_create`` invalidates the cached inventory when some instances failed"""
+        fake_vmware.create_icaps.return_value = {'created': {'icap1': {}}, 'failed': {'icap2': 'doh'}}
+
+        tasks.bulk_create(username='bob',
+                          machine_names=['icap1', 'icap2'],
+                          image='0.0.1',
+                          network='someLAN',
+                          txn_id='myId')
+
+        self.fake_inventory.invalidate.assert_called_with('bob')
+
+    @patch.object(tasks, 'vmware')
+    def test_bulk_create_value_error(self, fake_vmware):
+        """``bulk_create`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.create_icaps.side_effect = [ValueError("testing")]
+
+        output = tasks.bulk_create(username='bob',
+                                   machine_names=['icap1'],
+                                   image='0.0.1',
+                                   network='someLAN',
+                                   txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
     @patch.object(tasks, 'vmware')
     def test_delete_ok(self, fake_vmware):
         """``delete`` returns a dictionary when everything works as expected"""
@@ -79,6 +224,34 @@ class TestTasks(unittest.TestCase):
         self.assertEqual(output, expected)
 
 
+    @patch.object(tasks, 'vmware')
+    def test_delete_updates_cache(self, fake_vmware):
+        """``delete`` removes the instance from the cached inventory"""
+        tasks.delete(username='bob', machine_name='icapBox', txn_id='myId')
+
+        self.fake_inventory.remove.assert_called_with('bob', 'icapBox')
+
+    @patch.object(tasks, 'vmware')
+    def test_bulk_delete_ok(self, fake_vmware):
+        """``bulk_delete`` returns a dictionary when everything works as expected"""
+        fake_vmware.delete_icaps.return_value = {'deleted': ['icap1'], 'failed': {}}
+
+        output = tasks.bulk_delete(username='bob', machine_names=['icap1'], txn_id='myId')
+        expected = {'content' : {'deleted': ['icap1'], 'failed': {}}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+        self.fake_inventory.invalidate.assert_called_with('bob')
+
+    @patch.object(tasks, 'vmware')
+    def test_bulk_delete_value_error(self, fake_vmware):
+        """``bulk_delete`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.delete_icaps.side_effect = [ValueError("testing")]
+
+        output = tasks.bulk_delete(username='bob', machine_names=None, txn_id='myId')
+        expected = {'content' : {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
     @patch.object(tasks, 'vmware')
     def test_image(self, fake_vmware):
         """``image`` returns a dictionary when everything works as expected"""
@@ -100,6 +273,16 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'vmware')
+    def test_modify_network_invalidates_cache(self, fake_vmware):
+        """``modify_network`` invalidates the cached inventory"""
+        tasks.modify_network(username='pat',
+                             machine_name='myICAP',
+                             new_network='wootTown',
+                             txn_id='someTransactionID')
+
+        self.fake_inventory.invalidate.assert_called_with('pat')
+
     @patch.object(tasks, 'vmware')
     def test_modify_network_error(self, fake_vmware):
         """``modify_network`` Catches ValueError, and sets the response accordingly"""
@@ -114,5 +297,258 @@ class TestTasks(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
+    @patch.object(tasks, 'refill_pool')
+    @patch.object(tasks, 'warm_pool')
+    @patch.object(tasks, 'vmware')
+    def test_create_refills_pool(self, fake_vmware, fake_warm_pool, fake_refill_pool):
+        """``create`` queues a refill of the warm pool when it's turned on"""
+        fake_warm_pool.enabled.return_value = True
+        fake_vmware.create_icap.return_value = {'icapBox': {'worked': True}}
+
+        tasks.create(username='bob',
+                     machine_name='icapBox',
+                     image='0.0.1',
+                     network='someLAN',
+                     txn_id='myId')
+
+        self.assertTrue(fake_refill_pool.apply_async.called)
+
+    @patch.object(tasks, 'vmware')
+    def test_refill_pool(self, fake_vmware):
+        """``refill_pool`` returns how many VMs were deployed for each version"""
+        fake_vmware.refill_warm_pool.return_value = {'1.0.0': 2}
+
+        output = tasks.refill_pool(txn_id='myId')
+        expected = {'content': {'deployed': {'1.0.0': 2}}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_refill_pool_value_error(self, fake_vmware):
+        """``refill_pool`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.refill_warm_pool.side_effect = [ValueError('testing')]
+
+        output = tasks.refill_pool(txn_id='myId')
+        expected = {'content': {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_sync_templates(self, fake_vmware):
+        """``sync_templates`` returns which templates were imported and removed"""
+        fake_vmware.sync_templates.return_value = {'imported': ['1.0.0'], 'removed': []}
+
+        output = tasks.sync_templates(txn_id='myId')
+        expected = {'content': {'imported': ['1.0.0'], 'removed': []}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_sync_templates_value_error(self, fake_vmware):
+        """``sync_templates`` sets the error in the dictionary to the ValueError message"""
+        fake_vmware.sync_templates.side_effect = [ValueError('testing')]
+
+        output = tasks.sync_templates(txn_id='myId')
+        expected = {'content': {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_sync_library(self, fake_vmware):
+        """``sync_library`` returns which versions were staged and removed"""
+        fake_vmware.sync_library.return_value = {'staged': ['1.0.0'], 'removed': [], 'failed': {}}
+
+        output = tasks.sync_library(txn_id='myId')
+        expected = {'content': {'staged': ['1.0.0'], 'removed': [], 'failed': {}}, 'error': None, 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(tasks, 'vmware')
+    def test_sync_library_runtime_error(self, fake_vmware):
+        """``sync_library`` sets the error in the dictionary when the content library cannot be used"""
+        fake_vmware.sync_library.side_effect = [RuntimeError('testing')]
+
+        output = tasks.sync_library(txn_id='myId')
+        expected = {'content': {}, 'error': 'testing', 'params': {}}
+
+        self.assertEqual(output, expected)
+
+    def test_progress_reporter(self):
+        """``_progress_reporter`` publishes the phase and details as the PROGRESS state"""
+        fake_task = MagicMock()
+        fake_task.request.id = 'task-1'
+        progress = tasks._progress_reporter(fake_task, MagicMock())
+
+        progress('uploading', uploaded=1, total=2)
+
+        fake_task.update_state.assert_called_with(task_id='task-1', state='PROGRESS',
+                                                  meta={'phase': 'uploading', 'uploaded': 1, 'total': 2})
+
+    def test_progress_reporter_other_thread(self):
+        """``_progress_reporter`` reports for the right task from the upload's threads, where ``task.request`` is empty"""
+        tasks.create.push_request(id='task-1')
+        self.addCleanup(tasks.create.pop_request)
+        progress = tasks._progress_reporter(tasks.create, MagicMock())
+        with patch.object(tasks.create, 'update_state') as fake_update_state:
+            thread = threading.Thread(target=progress, args=('uploading',), kwargs={'uploaded': 1, 'total': 2})
+            thread.start()
+            thread.join()
+
+        self.assertEqual(fake_update_state.call_args[1]['task_id'], 'task-1')
+
+    def test_task_routes(self):
+        """The worker routes the tasks it queues itself, like ``icap.refill_pool``"""
+        queue = tasks.app.conf.task_routes['icap.refill_pool']['queue']
+
+        self.assertEqual(queue, tasks.const.VLAB_ICAP_LIFECYCLE_QUEUE)
+
+    def test_time_limits(self):
+        """Reads are given a shorter time limit than lifecycle operations"""
+        self.assertEqual(tasks.show.time_limit, tasks.const.VLAB_ICAP_READ_TIME_LIMIT)
+        self.assertEqual(tasks.create.time_limit, tasks.const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT)
+
+    @patch.object(tasks, 'retire_process')
+    @patch.object(tasks, 'is_loaded', return_value=True)
+    @patch.object(tasks, 'sessions')
+    @patch.object(tasks, 'waiter')
+    def test_close_sessions(self, fake_waiter, fake_sessions, fake_is_loaded, fake_retire_process):
+        """``close_sessions`` logs out of the pooled vCenter sessions"""
+        tasks.close_sessions()
+
+        self.assertTrue(fake_waiter.WAITER.close.called)
+        self.assertTrue(fake_sessions.POOL.close.called)
+
+    @patch.object(tasks, 'retire_process')
+    @patch.object(tasks, 'is_loaded', return_value=False)
+    @patch.object(tasks, 'sessions')
+    def test_close_sessions_not_loaded(self, fake_sessions, fake_is_loaded, fake_retire_process):
+        """``close_sessions`` doesn't import pyVmomi just to close nothing"""
+        tasks.close_sessions()
+
+        self.assertFalse(fake_sessions.POOL.close.called)
+
+    @patch.object(tasks, 'retire_process')
+    @patch.object(tasks, 'is_loaded', return_value=True)
+    @patch.object(tasks, 'sessions')
+    @patch.object(tasks, 'waiter')
+    def test_close_sessions_worker_shutdown(self, fake_waiter, fake_sessions, fake_is_loaded, fake_retire_process):
+        """The sessions are closed when the "threads" pool shuts down, which only sends ``worker_shutdown``"""
+        tasks.worker_shutdown.send(sender=None)
+
+        self.assertTrue(fake_waiter.WAITER.close.called)
+        self.assertTrue(fake_sessions.POOL.close.called)
+        self.assertTrue(fake_retire_process.called)
+
+    @patch.object(tasks, 'refill_pool')
+    @patch.object(tasks, 'sync_templates')
+    def test_stage_images(self, fake_sync_templates, fake_refill_pool):
+        """``stage_images`` queues the template and warm pool tasks that are enabled"""
+        with patch.object(tasks, 'const', tasks.const._replace(VLAB_ICAP_DEPLOY_MODE='linked',
+                                                               VLAB_ICAP_WARM_POOL_SIZE=0)):
+            tasks.stage_images()
+
+        self.assertTrue(fake_sync_templates.apply_async.called)
+        self.assertFalse(fake_refill_pool.apply_async.called)
+
+    @patch.object(tasks, 'refill_pool')
+    @patch.object(tasks, 'sync_library')
+    @patch.object(tasks, 'sync_templates')
+    def test_stage_images_library(self, fake_sync_templates, fake_sync_library, fake_refill_pool):
+        """``stage_images`` queues a content library sync in the library deploy mode"""
+        with patch.object(tasks, 'const', tasks.const._replace(VLAB_ICAP_DEPLOY_MODE='library',
+                                                               VLAB_ICAP_WARM_POOL_SIZE=0)):
+            tasks.stage_images()
+
+        self.assertTrue(fake_sync_library.apply_async.called)
+        self.assertFalse(fake_sync_templates.apply_async.called)
+
+    @patch.object(tasks, 'sync_templates')
+    def test_images_verified(self, fake_sync_templates):
+        """``images_verified`` queues a template sync once new OVAs pass verification"""
+        with patch.object(tasks, 'const', tasks.const._replace(VLAB_ICAP_DEPLOY_MODE='template')):
+            tasks.images_verified(['ICAP-1.0.0.ova'])
+
+        fake_sync_templates.apply_async.assert_called_with(args=['imagesVerified'])
+
+    @patch.object(tasks, 'sync_library')
+    def test_images_verified_library(self, fake_sync_library):
+        """``images_verified`` queues a content library sync once new OVAs pass verification"""
+        with patch.object(tasks, 'const', tasks.const._replace(VLAB_ICAP_DEPLOY_MODE='library')):
+            tasks.images_verified(['ICAP-1.0.0.ova'])
+
+        fake_sync_library.apply_async.assert_called_with(args=['imagesVerified'])
+
+    @patch.object(tasks, 'sync_library')
+    @patch.object(tasks, 'sync_templates')
+    def test_images_verified_ova(self, fake_sync_templates, fake_sync_library):
+        """``images_verified`` queues nothing when every create uploads the OVA"""
+        with patch.object(tasks, 'const', tasks.const._replace(VLAB_ICAP_DEPLOY_MODE='ova')):
+            tasks.images_verified(['ICAP-1.0.0.ova'])
+
+        self.assertFalse(fake_sync_templates.apply_async.called)
+        self.assertFalse(fake_sync_library.apply_async.called)
+
+    def test_images_verified_subscribed(self):
+        """The worker is told when OVAs pass verification"""
+        self.assertIn(tasks.images_verified, tasks.INDEX._subscribers)
+
+    @patch.object(tasks, 'QUEUE_WAIT_SECONDS')
+    @patch.object(tasks.time, 'time', return_value=105.0)
+    def test_start_task_timer(self, fake_time, fake_queue_wait):
+        """``start_task_timer`` records how long the task waited in the queue"""
+        fake_task = MagicMock()
+        fake_task.name = 'icap.show'
+        fake_task.time_limit = None
+        fake_task.request.published_at = 100.0
+
+        tasks.start_task_timer(task_id='asdf', task=fake_task)
+        tasks._STARTED.pop('asdf')
+
+        fake_queue_wait.labels.assert_called_with(task='icap.show')
+        fake_queue_wait.labels.return_value.observe.assert_called_with(5.0)
+
+    @patch.object(tasks, 'QUEUE_WAIT_SECONDS')
+    def test_start_task_timer_deadline(self, fake_queue_wait):
+        """``start_task_timer`` sets a deadline from the task's time limit, which the "threads" pool can't enforce"""
+        fake_task = MagicMock()
+        fake_task.time_limit = 60
+        fake_task.request.published_at = None
+        self.addCleanup(tasks.deadlines.clear)
+
+        tasks.start_task_timer(task_id='asdf', task=fake_task)
+        tasks._STARTED.pop('asdf')
+
+        self.assertTrue(0 < tasks.deadlines.remaining() <= 60)
+
+    @patch.object(tasks, 'TASK_SECONDS')
+    def test_stop_task_timer_deadline(self, fake_task_seconds):
+        """``stop_task_timer`` clears the deadline, so it doesn't carry over to the next task in the thread"""
+        tasks.deadlines.start(60)
+
+        tasks.stop_task_timer(task_id='nope', task=MagicMock(), retval=None, state='SUCCESS')
+
+        self.assertTrue(tasks.deadlines.current() is None)
+
+    @patch.object(tasks, 'TASK_SECONDS')
+    def test_stop_task_timer(self, fake_task_seconds):
+        """``stop_task_timer`` records how long the task ran, and its outcome"""
+        fake_task = MagicMock()
+        fake_task.name = 'icap.show'
+        outcomes = []
+        for retval, state in (({'error': None}, 'SUCCESS'), ({'error': 'doh'}, 'SUCCESS'), (None, 'FAILURE')):
+            tasks._STARTED['asdf'] = 100.0
+            tasks.stop_task_timer(task_id='asdf', task=fake_task, retval=retval, state=state)
+            outcomes.append(fake_task_seconds.labels.call_args[1]['outcome'])
+
+        self.assertEqual(outcomes, ['success', 'error', 'failure'])
+        self.assertTrue(fake_task_seconds.labels.return_value.observe.called)
+
+    @patch.object(tasks, 'TASK_SECONDS')
+    def test_stop_task_timer_unknown(self, fake_task_seconds):
+        """``stop_task_timer`` ignores tasks it never saw start"""
+        tasks.stop_task_timer(task_id='nope', task=MagicMock(), retval=None, state='SUCCESS')
+
+        self.assertFalse(fake_task_seconds.labels.called)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,217 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in templates.py
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_icap_api.lib.worker import templates
+
+
+class TestTemplates(unittest.TestCase):
+    """A set of test cases for the templates.py module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_vcenter = MagicMock()
+        self.fake_vcenter.networks = {'someLAN': MagicMock()}
+        self.fake_vcenter.resource_pools = {'Resources': templates.vim.ResourcePool('resgroup-1')}
+        self.fake_logger = MagicMock()
+
+    def _set_mode(self, mode, **kwargs):
+        """Patch the deploy mode for a single test"""
+        patcher = patch.object(templates, 'const', templates.const._replace(VLAB_ICAP_DEPLOY_MODE=mode, **kwargs))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_enabled(self):
+        """``enabled`` is True for the template and linked deploy modes"""
+        for mode in ('template', 'linked'):
+            self._set_mode(mode)
+            self.assertTrue(templates.enabled())
+
+    def test_disabled(self):
+        """``enabled`` is False for the ova deploy mode"""
+        self._set_mode('ova')
+
+        self.assertFalse(templates.enabled())
+
+    def test_template_name(self):
+        """``template_name`` includes the version"""
+        self.assertEqual(templates.template_name('1.0.0'), 'icap-template-1.0.0')
+
+    @patch.object(templates, 'is_stale', return_value=False)
+    @patch.object(templates, 'read_props')
+    @patch.object(templates, 'get_folder')
+    def test_find_template(self, fake_get_folder, fake_read_props, fake_is_stale):
+        """``find_template`` returns the template of the version"""
+        the_template = templates.vim.VirtualMachine('vm-1')
+        self.fake_vcenter.content.searchIndex.FindChild.return_value = the_template
+        fake_read_props.return_value = {'config.annotation': '{"component": "ICAP"}', 'config.template': True}
+
+        output = templates.find_template(self.fake_vcenter, '1.0.0')
+
+        self.assertTrue(output is the_template)
+
+    @patch.object(templates, 'is_stale', return_value=False)
+    @patch.object(templates, 'read_props')
+    @patch.object(templates, 'get_folder')
+    def test_find_template_not_template(self, fake_get_folder, fake_read_props, fake_is_stale):
+        """``find_template`` returns None for a VM that was never marked as a template"""
+        self.fake_vcenter.content.searchIndex.FindChild.return_value = templates.vim.VirtualMachine('vm-1')
+        fake_read_props.return_value = {'config.annotation': '{"component": "ICAP"}', 'config.template': False}
+
+        output = templates.find_template(self.fake_vcenter, '1.0.0')
+
+        self.assertTrue(output is None)
+
+    @patch.object(templates, 'is_stale', return_value=True)
+    @patch.object(templates, 'read_props')
+    @patch.object(templates, 'get_folder')
+    def test_find_template_stale(self, fake_get_folder, fake_read_props, fake_is_stale):
+        """``find_template`` returns None when the OVA was replaced after the template was made"""
+        self.fake_vcenter.content.searchIndex.FindChild.return_value = templates.vim.VirtualMachine('vm-1')
+        fake_read_props.return_value = {'config.annotation': '{"component": "ICAP", "created": 1234}', 'config.template': True}
+
+        output = templates.find_template(self.fake_vcenter, '1.0.0')
+
+        self.assertTrue(output is None)
+        fake_is_stale.assert_called_with('1.0.0', {'component': 'ICAP', 'created': 1234})
+
+    @patch.object(templates, 'get_folder')
+    def test_find_template_no_folder(self, fake_get_folder):
+        """``find_template`` returns None when the template folder doesn't exist"""
+        fake_get_folder.return_value = None
+
+        output = templates.find_template(self.fake_vcenter, '1.0.0')
+
+        self.assertTrue(output is None)
+
+    @patch.object(templates, 'current_app')
+    def test_request_sync(self, fake_current_app):
+        """``request_sync`` only queues one sync per scan interval"""
+        patcher = patch.object(templates, '_last_sync_request', 0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        first = templates.request_sync()
+        second = templates.request_sync()
+
+        self.assertTrue(first)
+        self.assertFalse(second)
+        fake_current_app.send_task.assert_called_once_with('icap.sync_templates', args=['templateMiss'])
+
+    @patch.object(templates, 'retrieve_vms')
+    def test_list_templates(self, fake_retrieve_vms):
+        """``list_templates`` only returns ICAP templates"""
+        vm1, vm2 = MagicMock(), MagicMock()
+        fake_retrieve_vms.return_value = {
+            vm1: {'config.template': True, 'config.annotation': '{"component": "ICAP", "version": "1.0.0"}'},
+            vm2: {'config.template': False, 'config.annotation': '{"component": "ICAP", "version": "2.0.0"}'},
+        }
+
+        output = templates.list_templates(self.fake_vcenter, MagicMock())
+
+        self.assertEqual(list(output.keys()), ['1.0.0'])
+        self.assertTrue(output['1.0.0'][0] is vm1)
+
+    def test_is_stale(self):
+        """``is_stale`` is True when the OVA is newer than the template"""
+        images_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, images_dir)
+        self._set_mode('template', VLAB_ICAP_IMAGES_DIR=images_dir)
+        with open(os.path.join(images_dir, 'ICAP-1.0.0.ova'), 'w') as the_file:
+            the_file.write('testing')
+
+        self.assertTrue(templates.is_stale('1.0.0', {'created': 0}))
+        self.assertFalse(templates.is_stale('1.0.0', {'created': 2 ** 40}))
+
+    def test_is_stale_deleted(self):
+        """``is_stale`` is True when the OVA no longer exists"""
+        self._set_mode('template', VLAB_ICAP_IMAGES_DIR='/no/such/dir')
+
+        self.assertTrue(templates.is_stale('1.0.0', {'created': 2 ** 40}))
+
+    @patch.object(templates, 'wait_for_task')
+    @patch.object(templates, 'virtual_machine')
+    def test_import_template(self, fake_virtual_machine, fake_wait_for_task):
+        """``import_template`` snapshots the new VM, then marks it as a template"""
+        the_vm = fake_virtual_machine.deploy_from_ova.return_value
+
+        templates.import_template(self.fake_vcenter, MagicMock(), MagicMock(), '1.0.0', self.fake_logger)
+
+        self.assertTrue(the_vm.CreateSnapshot_Task.called)
+        self.assertTrue(the_vm.MarkAsTemplate.called)
+        self.assertFalse(fake_virtual_machine.deploy_from_ova.call_args[1]['power_on'])
+
+    @patch.object(templates, 'wait_for_task')
+    @patch.object(templates, 'virtual_machine')
+    def test_import_template_fails(self, fake_virtual_machine, fake_wait_for_task):
+        """``import_template`` destroys the new VM if it cannot be made into a template"""
+        the_vm = fake_virtual_machine.deploy_from_ova.return_value
+        the_vm.MarkAsTemplate.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            templates.import_template(self.fake_vcenter, MagicMock(), MagicMock(), '1.0.0', self.fake_logger)
+
+        self.assertTrue(the_vm.Destroy_Task.called)
+
+    @patch.object(templates, 'wait_for_task')
+    @patch.object(templates, 'virtual_machine')
+    def test_import_template_destroy_fails(self, fake_virtual_machine, fake_wait_for_task):
+        """``import_template`` raises the original error when the new VM cannot be destroyed"""
+        fake_virtual_machine.set_meta.side_effect = ValueError('testing')
+        fake_wait_for_task.side_effect = RuntimeError('destroy failed')
+
+        with self.assertRaises(ValueError):
+            templates.import_template(self.fake_vcenter, MagicMock(), MagicMock(), '1.0.0', self.fake_logger)
+
+    @patch.object(templates, 'wait_for_task')
+    @patch.object(templates, 'virtual_machine')
+    def test_clone_linked(self, fake_virtual_machine, fake_wait_for_task):
+        """``clone`` makes a linked clone off the template's snapshot in linked mode"""
+        self._set_mode('linked')
+        the_template = MagicMock()
+        the_template.snapshot.currentSnapshot = templates.vim.vm.Snapshot('snapshot-1')
+
+        templates.clone(self.fake_vcenter, the_template, 'alice', 'myICAP', 'someLAN', self.fake_logger)
+        spec = the_template.CloneVM_Task.call_args[1]['spec']
+
+        self.assertEqual(spec.location.diskMoveType, 'createNewChildDiskBacking')
+        self.assertTrue(spec.snapshot is the_template.snapshot.currentSnapshot)
+        self.assertTrue(fake_wait_for_task.return_value.PowerOnVM_Task.called)
+
+    @patch.object(templates, 'wait_for_task')
+    @patch.object(templates, 'virtual_machine')
+    def test_clone_full(self, fake_virtual_machine, fake_wait_for_task):
+        """``clone`` makes a full clone in template mode"""
+        self._set_mode('template')
+        the_template = MagicMock()
+
+        templates.clone(self.fake_vcenter, the_template, 'alice', 'myICAP', 'someLAN', self.fake_logger)
+        spec = the_template.CloneVM_Task.call_args[1]['spec']
+
+        self.assertTrue(spec.snapshot is None)
+        self.assertTrue(spec.location.diskMoveType is None)
+
+    @patch.object(templates, 'wait_for_task')
+    @patch.object(templates, 'virtual_machine')
+    def test_clone_powered_off(self, fake_virtual_machine, fake_wait_for_task):
+        """``clone`` can leave the new VM powered off"""
+        self._set_mode('template')
+
+        templates.clone(self.fake_vcenter, MagicMock(), 'alice', 'myICAP', 'someLAN', self.fake_logger, power_on=False)
+
+        self.assertFalse(fake_wait_for_task.return_value.PowerOnVM_Task.called)
+
+    def test_clone_bad_network(self):
+        """``clone`` raises ValueError when the network doesn't exist"""
+        with self.assertRaises(ValueError):
+            templates.clone(self.fake_vcenter, MagicMock(), 'alice', 'myICAP', 'noSuchLAN', self.fake_logger)
+
+
+if __name__ == '__main__':
+    unittest.main()
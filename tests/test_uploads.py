@@ -0,0 +1,210 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in uploads.py
+"""
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import unittest
+import time
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from unittest.mock import patch, MagicMock
+
+from vlab_icap_api.lib.worker import uploads
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class TestDiskUploader(unittest.TestCase):
+    """A set of test cases for the DiskUploader object"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.received = {}
+        self.status = 200
+        test = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                test.received[self.path] = (body, self.headers['Content-Type'])
+                self.send_response(test.status)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server(('127.0.0.1', 0), Handler)
+        thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.01}, daemon=True)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.url = 'http://127.0.0.1:{}/nfc/'.format(self.server.server_address[1])
+
+        self.images_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.images_dir)
+        self.disks = {'disk1.vmdk': os.urandom(5000), 'disk2.vmdk': os.urandom(3000)}
+        self.path = os.path.join(self.images_dir, 'ICAP-1.0.0.ova')
+        with tarfile.open(self.path, 'w') as the_tar:
+            for name, data in [('icap.ovf', b'<Envelope/>')] + sorted(self.disks.items()):
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                the_tar.addfile(info, io.BytesIO(data))
+        with tarfile.open(self.path) as the_tar:
+            self.members = [x for x in the_tar.getmembers() if x.name.endswith('.vmdk')]
+
+    def _uploader(self, **kwargs):
+        """Make a DiskUploader with small chunks, so every disk takes a few"""
+        self.fake_lease = MagicMock()
+        kwargs.setdefault('chunk_size', 1024)
+        return uploads.DiskUploader(self.path, self.fake_lease, 'somehost', limiter=uploads.RateLimiter(0),
+                                    **kwargs)
+
+    def test_upload(self):
+        """``DiskUploader`` - ``upload`` sends the bytes of every disk to its URL"""
+        uploader = self._uploader()
+
+        output = uploader.upload([(x, self.url + x.name) for x in self.members])
+
+        self.assertEqual(output, 8000)
+        for name, data in self.disks.items():
+            body, content_type = self.received['/nfc/{}'.format(name)]
+            self.assertEqual(body, data)
+            self.assertEqual(content_type, 'application/x-vnd.vmware-streamVmdk')
+
+    def test_upload_progress(self):
+        """``DiskUploader`` - ``upload`` reports the progress to the lease, and ``on_upload``"""
+        fake_on_upload = MagicMock()
+        uploader = self._uploader(on_upload=fake_on_upload)
+
+        uploader.upload([(x, self.url + x.name) for x in self.members])
+
+        fake_on_upload.assert_called_with(8000, 8000)
+        self.fake_lease.Progress.assert_called_with(99)
+
+    def test_keepalive(self):
+        """``DiskUploader`` - the lease progress is updated while the disks are uploading"""
+        uploader = self._uploader(progress_interval=0.01)
+
+        def fake_consume(amount):
+            time.sleep(0.05)
+
+        uploader._limiter = MagicMock()
+        uploader._limiter.consume.side_effect = fake_consume
+        uploader.upload([(self.members[0], self.url + 'disk1.vmdk')])
+
+        self.assertTrue(self.fake_lease.Progress.call_count > 1)
+
+    def test_upload_error(self):
+        """``DiskUploader`` - ``upload`` raises RuntimeError if vCenter rejects a disk"""
+        self.status = 500
+        uploader = self._uploader()
+
+        with self.assertRaises(RuntimeError):
+            uploader.upload([(x, self.url + x.name) for x in self.members])
+
+    def test_upload_nothing(self):
+        """``DiskUploader`` - ``upload`` supports an OVA without disks to send"""
+        uploader = self._uploader()
+
+        output = uploader.upload([])
+
+        self.assertEqual(output, 0)
+
+    def test_host_placeholder(self):
+        """``DiskUploader`` - a "*" in the device URL is replaced with the ESXi host"""
+        uploader = uploads.DiskUploader(self.path, MagicMock(), '127.0.0.1', limiter=uploads.RateLimiter(0))
+        url = 'http://*:{}/nfc/disk1.vmdk'.format(self.server.server_address[1])
+
+        uploader.upload([(self.members[0], url)])
+
+        self.assertIn('/nfc/disk1.vmdk', self.received)
+
+    def test_upload_put(self):
+        """``DiskUploader`` - ``upload`` can PUT the disks with other headers, without a lease"""
+        test = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_PUT(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                test.received[self.path] = (body, self.headers['X-Some-Header'])
+                self.send_response(200)
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+        self.server.RequestHandlerClass = Handler
+        uploader = uploads.DiskUploader(self.path, None, 'somehost', limiter=uploads.RateLimiter(0),
+                                        method='PUT', headers={'X-Some-Header': 'someValue'})
+
+        output = uploader.upload([(x, self.url + x.name) for x in self.members])
+
+        self.assertEqual(output, 8000)
+        self.assertEqual(self.received['/nfc/disk1.vmdk'], (self.disks['disk1.vmdk'], 'someValue'))
+
+    def test_sparse(self):
+        """``DiskUploader`` - sparse tar members cannot be sent from the memory map"""
+        self.members[0].sparse = [(0, 10)]
+        uploader = self._uploader()
+
+        with self.assertRaises(RuntimeError):
+            uploader.upload([(self.members[0], self.url + 'disk1.vmdk')])
+
+    def test_deadline(self):
+        """``DiskUploader`` - ``upload`` stops once the task that started it runs out of time"""
+        with patch.object(uploads.deadlines, 'current', return_value=time.time() - 1):
+            uploader = self._uploader()
+
+        with self.assertRaises(uploads.deadlines.DeadlineExceeded):
+            uploader.upload([(x, self.url + x.name) for x in self.members])
+
+
+class TestRateLimiter(unittest.TestCase):
+    """A set of test cases for the RateLimiter object"""
+
+    @patch.object(uploads.time, 'sleep')
+    @patch.object(uploads.time, 'monotonic', return_value=100.0)
+    def test_consume(self, fake_monotonic, fake_sleep):
+        """``RateLimiter`` - every chunk waits for the ones that asked before it"""
+        limiter = uploads.RateLimiter(rate=1000)
+
+        limiter.consume(1000)
+        limiter.consume(1000)
+        limiter.consume(500)
+
+        waits = [x[0][0] for x in fake_sleep.call_args_list]
+
+        self.assertEqual(waits, [1.0, 2.0])
+
+    @patch.object(uploads.time, 'sleep')
+    @patch.object(uploads.time, 'monotonic')
+    def test_no_saving_up(self, fake_monotonic, fake_sleep):
+        """``RateLimiter`` - bandwidth that went unused isn't saved up for a burst"""
+        limiter = uploads.RateLimiter(rate=1000)
+        fake_monotonic.return_value = 100.0
+        limiter.consume(1000)
+        fake_monotonic.return_value = 200.0
+        limiter.consume(1000)
+        limiter.consume(1000)
+
+        waits = [x[0][0] for x in fake_sleep.call_args_list]
+
+        self.assertEqual(waits, [1.0])
+
+    @patch.object(uploads.time, 'sleep')
+    def test_unlimited(self, fake_sleep):
+        """``RateLimiter`` - a rate of zero never waits"""
+        limiter = uploads.RateLimiter(rate=0)
+
+        limiter.consume(10 ** 12)
+
+        self.assertFalse(fake_sleep.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,33 +2,57 @@
 """
 A suite of tests for the functions in vmware.py
 """
+import os
+import time
+import tempfile
 import unittest
 from unittest.mock import patch, MagicMock
 
-from vlab_icap_api.lib.worker import vmware
+from vlab_icap_api.lib.worker import cache, vmware
 
 
 class TestVMware(unittest.TestCase):
     """A set of test cases for the vmware.py module"""
 
-    @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_show_icap(self, fake_vCenter, fake_consume_task, fake_get_info):
+    def setUp(self):
+        """Runs before every test case"""
+        for name in ('wait_for_ip', 'wait_for_task'):
+            patcher = patch.object(vmware, name)
+            setattr(self, 'fake_{}'.format(name), patcher.start())
+            self.addCleanup(patcher.stop)
+        # Every image has already been verified, unless a test says otherwise
+        patcher = patch.object(vmware, 'INDEX')
+        self.fake_INDEX = patcher.start()
+        self.fake_INDEX.verified.side_effect = lambda names: ([vmware.convert_name(x, to_version=True) for x in names], False)
+        self.addCleanup(patcher.stop)
+
+    @patch.object(vmware.virtual_machine, '_get_vm_console_url')
+    @patch.object(vmware, 'retrieve_vms')
+    @patch.object(vmware, 'vcenter_session')
+    def test_show_icap(self, fake_vcenter_session, fake_retrieve_vms, fake_get_vm_console_url):
         """``icap`` returns a dictionary when everything works as expected"""
         fake_vm = MagicMock()
-        fake_vm.name = 'ICAP'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'meta' : {'component': 'ICAP',
-                                                'created': 1234,
-                                                'version': '3.28',
-                                                'configured': False,
-                                                'generation': 1}}
+        fake_vm._moId = 'vm-1'
+        fake_nic = MagicMock()
+        fake_nic.ipAddress = ['10.1.1.2', 'fe80::1']
+        fake_net = MagicMock()
+        fake_net._moId = 'net-1'
+        fake_vcenter = fake_vcenter_session.return_value.__enter__.return_value
+        fake_vcenter.networks = {'alice_frontend': fake_net}
+        fake_get_vm_console_url.return_value = 'https://some-console'
+        fake_retrieve_vms.return_value = {fake_vm: {'name': 'ICAP',
+                                                    'runtime.powerState': 'poweredOn',
+                                                    'config.annotation': '{"component": "ICAP", "created": 1234, "version": "3.28", "configured": false, "generation": 1}',
+                                                    'guest.net': [fake_nic],
+                                                    'network': [fake_net]}}
 
         output = vmware.show_icap(username='alice')
-        expected = {'ICAP': {'meta' : {'component': 'ICAP',
+        expected = {'ICAP': {'state': 'poweredOn',
+                             'console': 'https://some-console',
+                             'ips': ['10.1.1.2'],
+                             'networks': ['frontend'],
+                             'moid': 'vm-1',
+                             'meta' : {'component': 'ICAP',
                                        'created': 1234,
                                        'version': '3.28',
                                        'configured': False,
@@ -36,62 +60,192 @@ class TestVMware(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
-    @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware.virtual_machine, 'power')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_delete_icap(self, fake_vCenter, fake_consume_task, fake_power, fake_get_info):
+    @patch.object(vmware.virtual_machine, '_get_vm_console_url')
+    @patch.object(vmware, 'retrieve_vms')
+    @patch.object(vmware, 'vcenter_session')
+    def test_show_icap_other_vms(self, fake_vcenter_session, fake_retrieve_vms, fake_get_vm_console_url):
+        """``icap`` ignores VMs that are not ICAP servers"""
+        fake_retrieve_vms.return_value = {MagicMock(): {'name': 'win10',
+                                                        'runtime.powerState': 'poweredOn',
+                                                        'config.annotation': '{"component": "Windows"}'},
+                                          MagicMock(): {'name': 'deploying',
+                                                        'runtime.powerState': 'poweredOff'}}
+
+        output = vmware.show_icap(username='alice')
+
+        self.assertEqual(output, {})
+        self.assertFalse(fake_get_vm_console_url.called)
+
+    @patch.object(vmware.virtual_machine, '_get_vm_console_url')
+    @patch.object(vmware, 'vcenter_session')
+    def test_add_consoles(self, fake_vcenter_session, fake_get_vm_console_url):
+        """``add_consoles`` gives every cached VM a new console URL"""
+        fake_get_vm_console_url.return_value = 'https://new-console'
+
+        output = vmware.add_consoles({'ICAP': {'moid': 'vm-1', 'state': 'poweredOn'}})
+        expected = {'ICAP': {'moid': 'vm-1', 'state': 'poweredOn', 'console': 'https://new-console'}}
+
+        self.assertEqual(output, expected)
+        the_vm = fake_get_vm_console_url.call_args[0][1]
+        self.assertEqual(the_vm._moId, 'vm-1')
+
+    @patch.object(vmware.virtual_machine, '_get_vm_console_url')
+    @patch.object(vmware, 'vcenter_session')
+    def test_add_consoles_gone(self, fake_vcenter_session, fake_get_vm_console_url):
+        """``add_consoles`` returns None when a cached VM was deleted"""
+        fake_get_vm_console_url.side_effect = vmware.vmodl.fault.ManagedObjectNotFound()
+
+        output = vmware.add_consoles({'ICAP': {'moid': 'vm-1'}})
+
+        self.assertTrue(output is None)
+
+    @patch.object(vmware, 'vcenter_session')
+    def test_add_consoles_empty(self, fake_vcenter_session):
+        """``add_consoles`` doesn't log into vCenter for an empty inventory"""
+        output = vmware.add_consoles({})
+
+        self.assertEqual(output, {})
+        self.assertFalse(fake_vcenter_session.called)
+
+    @patch.object(vmware, 'find_icap')
+    @patch.object(vmware, 'vcenter_session')
+    def test_delete_icap(self, fake_vCenter, fake_find_icap):
         """``delete_icap`` returns None when everything works as expected"""
         fake_logger = MagicMock()
         fake_vm = MagicMock()
         fake_vm.name = 'IcapBox'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'meta' : {'component': 'ICAP',
-                                                'created': 1234,
-                                                'version': '3.28',
-                                                'configured': False,
-                                                'generation': 1}}
+        fake_find_icap.return_value = fake_vm
 
         output = vmware.delete_icap(username='bob', machine_name='IcapBox', logger=fake_logger)
         expected = None
 
         self.assertEqual(output, expected)
+        self.assertTrue(fake_vm.Destroy_Task.called)
+        self.assertTrue(fake_vm.PowerOffVM_Task.called)
+        self.assertEqual(self.fake_wait_for_task.call_count, 2)
+
+    @patch.object(vmware, 'find_icap')
+    @patch.object(vmware, 'vcenter_session')
+    def test_delete_icap_powered_off(self, fake_vCenter, fake_find_icap):
+        """``delete_icap`` doesn't power off a VM that's already off"""
+        fake_vm = MagicMock()
+        fake_vm.runtime.powerState = vmware.vim.VirtualMachinePowerState.poweredOff
+        fake_find_icap.return_value = fake_vm
 
-    @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware.virtual_machine, 'power')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_delete_icap_value_error(self, fake_vCenter, fake_consume_task, fake_power, fake_get_info):
+        vmware.delete_icap(username='bob', machine_name='IcapBox', logger=MagicMock())
+
+        self.assertFalse(fake_vm.PowerOffVM_Task.called)
+        self.assertTrue(fake_vm.Destroy_Task.called)
+
+    @patch.object(vmware, 'find_icap')
+    @patch.object(vmware, 'vcenter_session')
+    def test_delete_icap_value_error(self, fake_vCenter, fake_find_icap):
         """``delete_icap`` raises ValueError when unable to find requested vm for deletion"""
         fake_logger = MagicMock()
-        fake_vm = MagicMock()
-        fake_vm.name = 'win10'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
-        fake_get_info.return_value = {'component': 'otherThing',
-                                      'created': 1234,
-                                      'version': '3.28',
-                                      'configured': False,
-                                      'generation': 1}
+        fake_find_icap.return_value = None
 
         with self.assertRaises(ValueError):
             vmware.delete_icap(username='bob', machine_name='myOtherIcapBox', logger=fake_logger)
 
+    @patch.object(vmware, 'wait_for_tasks')
+    @patch.object(vmware, 'retrieve_vms')
+    @patch.object(vmware, 'vcenter_session')
+    def test_delete_icaps(self, fake_vcenter_session, fake_retrieve_vms, fake_wait_for_tasks):
+        """``delete_icaps`` powers off and destroys every requested ICAP instance"""
+        fake_logger = MagicMock()
+        vm1, vm2 = MagicMock(), MagicMock()
+        fake_retrieve_vms.return_value = {vm1: {'name': 'icap1', 'runtime.powerState': 'poweredOn', 'config.annotation': '{"component": "ICAP"}'},
+                                          vm2: {'name': 'icap2', 'runtime.powerState': 'poweredOff', 'config.annotation': '{"component": "ICAP"}'}}
+        fake_wait_for_tasks.side_effect = lambda tasks: {x: None for x in tasks}
+
+        output = vmware.delete_icaps(username='bob', machine_names=['icap1', 'icap2'], logger=fake_logger)
+        expected = {'deleted': ['icap1', 'icap2'], 'failed': {}}
+
+        self.assertEqual(output, expected)
+        self.assertTrue(vm1.PowerOffVM_Task.called)
+        self.assertFalse(vm2.PowerOffVM_Task.called)
+        self.assertTrue(vm1.Destroy_Task.called)
+        self.assertTrue(vm2.Destroy_Task.called)
+
+    @patch.object(vmware, 'wait_for_tasks')
+    @patch.object(vmware, 'retrieve_vms')
+    @patch.object(vmware, 'vcenter_session')
+    def test_delete_icaps_all(self, fake_vcenter_session, fake_retrieve_vms, fake_wait_for_tasks):
+        """``delete_icaps`` deletes every ICAP instance, and nothing else, when no names are supplied"""
+        fake_logger = MagicMock()
+        vm1, vm2 = MagicMock(), MagicMock()
+        fake_retrieve_vms.return_value = {vm1: {'name': 'icap1', 'runtime.powerState': 'poweredOff', 'config.annotation': '{"component": "ICAP"}'},
+                                          vm2: {'name': 'win10', 'runtime.powerState': 'poweredOff', 'config.annotation': '{"component": "Windows"}'}}
+        fake_wait_for_tasks.side_effect = lambda tasks: {x: None for x in tasks}
+
+        output = vmware.delete_icaps(username='bob', machine_names=None, logger=fake_logger)
+        expected = {'deleted': ['icap1'], 'failed': {}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(vm2.Destroy_Task.called)
+
+    @patch.object(vmware, 'wait_for_tasks')
+    @patch.object(vmware, 'retrieve_vms')
+    @patch.object(vmware, 'vcenter_session')
+    def test_delete_icaps_failures(self, fake_vcenter_session, fake_retrieve_vms, fake_wait_for_tasks):
+        """``delete_icaps`` reports missing VMs and failed tasks per VM"""
+        fake_logger = MagicMock()
+        vm1 = MagicMock()
+        fake_retrieve_vms.return_value = {vm1: {'name': 'icap1', 'runtime.powerState': 'poweredOn', 'config.annotation': '{"component": "ICAP"}'}}
+        fake_wait_for_tasks.side_effect = [{'icap1': 'some error'}, {}]
+
+        output = vmware.delete_icaps(username='bob', machine_names=['icap1', 'icap2'], logger=fake_logger)
+        expected = {'deleted': [], 'failed': {'icap1': 'some error', 'icap2': 'No icap named icap2 found'}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(vm1.Destroy_Task.called)
+
+    @patch.object(vmware, 'wait_for_tasks')
+    @patch.object(vmware, 'retrieve_vms')
+    @patch.object(vmware, 'vcenter_session')
+    def test_delete_icaps_power_off_refused(self, fake_vcenter_session, fake_retrieve_vms, fake_wait_for_tasks):
+        """``delete_icaps`` keeps deleting the other VMs when vCenter refuses to power one off"""
+        vm1, vm2 = MagicMock(), MagicMock()
+        vm1.PowerOffVM_Task.side_effect = RuntimeError('InvalidState')
+        fake_retrieve_vms.return_value = {vm1: {'name': 'icap1', 'runtime.powerState': 'poweredOn', 'config.annotation': '{"component": "ICAP"}'},
+                                          vm2: {'name': 'icap2', 'runtime.powerState': 'poweredOn', 'config.annotation': '{"component": "ICAP"}'}}
+        fake_wait_for_tasks.side_effect = lambda tasks: {x: None for x in tasks}
+
+        output = vmware.delete_icaps(username='bob', machine_names=['icap1', 'icap2'], logger=MagicMock())
+        expected = {'deleted': ['icap2'], 'failed': {'icap1': 'InvalidState'}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(vm1.Destroy_Task.called)
+        self.assertTrue(vm2.Destroy_Task.called)
+
+    @patch.object(vmware, 'wait_for_tasks')
+    @patch.object(vmware, 'retrieve_vms')
+    @patch.object(vmware, 'vcenter_session')
+    def test_delete_icaps_destroy_refused(self, fake_vcenter_session, fake_retrieve_vms, fake_wait_for_tasks):
+        """``delete_icaps`` keeps deleting the other VMs when vCenter refuses to destroy one"""
+        vm1, vm2 = MagicMock(), MagicMock()
+        vm1.Destroy_Task.side_effect = RuntimeError('ManagedObjectNotFound')
+        fake_retrieve_vms.return_value = {vm1: {'name': 'icap1', 'runtime.powerState': 'poweredOff', 'config.annotation': '{"component": "ICAP"}'},
+                                          vm2: {'name': 'icap2', 'runtime.powerState': 'poweredOff', 'config.annotation': '{"component": "ICAP"}'}}
+        fake_wait_for_tasks.side_effect = lambda tasks: {x: None for x in tasks}
+
+        output = vmware.delete_icaps(username='bob', machine_names=['icap1', 'icap2'], logger=MagicMock())
+        expected = {'deleted': ['icap2'], 'failed': {'icap1': 'ManagedObjectNotFound'}}
+
+        self.assertEqual(output, expected)
+
     @patch.object(vmware.virtual_machine, 'set_meta')
-    @patch.object(vmware, 'Ova')
+    @patch.object(vmware, 'OVAS')
     @patch.object(vmware.virtual_machine, 'get_info')
     @patch.object(vmware.virtual_machine, 'deploy_from_ova')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_create_icap(self, fake_vCenter, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_Ova, fake_set_meta):
+    @patch.object(vmware, 'wait_for_task')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap(self, fake_vCenter, fake_wait_for_task, fake_deploy_from_ova, fake_get_info, fake_OVAS, fake_set_meta):
         """``create_icap`` returns a dictionary upon success"""
         fake_logger = MagicMock()
         fake_deploy_from_ova.return_value.name = "IcapBox"
         fake_get_info.return_value = {'worked': True}
-        fake_Ova.return_value.networks = ['someLAN']
+        fake_OVAS.get.return_value.networks = ['someLAN']
         fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
 
         output = vmware.create_icap(username='alice',
@@ -103,16 +257,434 @@ class TestVMware(unittest.TestCase):
 
         self.assertEqual(output, expected)
 
-    @patch.object(vmware, 'Ova')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'wait_for_task')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap_progress(self, fake_vCenter, fake_wait_for_task, fake_deploy_from_ova, fake_get_info, fake_OVAS, fake_set_meta):
+        """``create_icap`` reports each phase of the create"""
+        fake_progress = MagicMock()
+        fake_deploy_from_ova.return_value.name = "IcapBox"
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        vmware.create_icap(username='alice',
+                           machine_name='IcapBox',
+                           image='1.0.0',
+                           network='someLAN',
+                           logger=MagicMock(),
+                           progress=fake_progress)
+        phases = [x[0][0] for x in fake_progress.call_args_list]
+        expected = ['ova_parsed', 'powered_on', 'waiting_for_ip']
+
+        self.assertEqual(phases, expected)
+        self.assertTrue(self.fake_wait_for_ip.called)
+        self.assertFalse(fake_get_info.call_args[1].get('ensure_ip', False))
+
+    @patch.object(vmware, 'DEPLOYS')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap_deploy_slot(self, fake_vCenter, fake_deploy_from_ova, fake_get_info, fake_OVAS, fake_set_meta, fake_DEPLOYS):
+        """``create_icap`` waits for one of the user's fair share of deploy slots"""
+        fake_progress = MagicMock()
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        vmware.create_icap(username='alice',
+                           machine_name='IcapBox',
+                           image='1.0.0',
+                           network='someLAN',
+                           logger=MagicMock(),
+                           progress=fake_progress)
+        fake_DEPLOYS.slot.call_args[1]['on_wait'](3)
+
+        self.assertEqual(fake_DEPLOYS.slot.call_args[0][0], 'alice')
+        fake_progress.assert_called_with('queued', position=3)
+
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware.warm_pool, 'claim')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap_warm(self, fake_vCenter, fake_claim, fake_deploy_from_ova, fake_get_info, fake_OVAS, fake_set_meta):
+        """``create_icap`` skips the OVA deploy when a warm VM is claimed"""
+        fake_logger = MagicMock()
+        fake_claim.return_value.name = "IcapBox"
+        fake_get_info.return_value = {'worked': True}
+
+        output = vmware.create_icap(username='alice',
+                                    machine_name='IcapBox',
+                                    image='1.0.0',
+                                    network='someLAN',
+                                    logger=fake_logger)
+        expected = {'IcapBox': {'worked': True}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(fake_deploy_from_ova.called)
+        self.assertFalse(fake_OVAS.open.called)
+
+    @patch.object(vmware, 'list_images')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware.warm_pool, 'staged_vms')
+    @patch.object(vmware.warm_pool, 'get_pool_folder')
+    @patch.object(vmware, 'vcenter_session')
+    def test_refill_warm_pool(self, fake_vCenter, fake_get_pool_folder, fake_staged_vms, fake_deploy_from_ova,
+                              fake_OVAS, fake_set_meta, fake_list_images):
+        """``refill_warm_pool`` only deploys the VMs missing from the pool"""
+        fake_logger = MagicMock()
+        fake_list_images.return_value = ['1.0.0', '2.0.0']
+        fake_staged_vms.return_value = {'1.0.0': [MagicMock()]}
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vCenter.return_value.__enter__.return_value.networks = {'icap-warm-pool' : vmware.vim.Network(moId='1')}
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            test_const = vmware.const._replace(VLAB_ICAP_CACHE_DIR=cache_dir, VLAB_ICAP_WARM_POOL_SIZE=2)
+            with patch.object(vmware, 'const', test_const), patch.object(vmware.warm_pool, 'const', test_const), \
+                 patch.object(cache, 'const', test_const):
+                output = vmware.refill_warm_pool(fake_logger)
+        expected = {'1.0.0': 1, '2.0.0': 2}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(fake_deploy_from_ova.call_args[1]['power_on'])
+
+    @patch.object(vmware, 'vcenter_session')
+    def test_refill_warm_pool_disabled(self, fake_vCenter):
+        """``refill_warm_pool`` does nothing when the warm pool is turned off"""
+        output = vmware.refill_warm_pool(MagicMock())
+
+        self.assertEqual(output, {})
+        self.assertFalse(fake_vCenter.called)
+
+    @patch.object(vmware, 'wait_for_task')
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.templates, 'import_template')
+    @patch.object(vmware.templates, 'list_templates')
+    @patch.object(vmware, 'get_folder')
+    @patch.object(vmware, 'vcenter_session')
+    def test_sync_templates_cold_index(self, fake_vCenter, fake_get_folder, fake_list_templates, fake_import_template,
+                                       fake_OVAS, fake_wait_for_task):
+        """``sync_templates`` keeps the templates of OVAs that are still waiting to be verified"""
+        self.fake_INDEX.verified.side_effect = None
+        self.fake_INDEX.verified.return_value = ([], True)
+        self.fake_INDEX.result.return_value = None
+        fake_list_templates.return_value = {'1.0.0': (MagicMock(), {'created': time.time() + 60}),
+                                            '2.0.0': (MagicMock(), {'created': time.time() + 60})}
+        with tempfile.TemporaryDirectory() as images_dir:
+            for version in ('1.0.0', '2.0.0'):
+                open(os.path.join(images_dir, vmware.convert_name(version)), 'w').close()
+            with tempfile.TemporaryDirectory() as cache_dir:
+                with patch.object(cache, 'const', cache.const._replace(VLAB_ICAP_CACHE_DIR=cache_dir)), \
+                     patch.object(vmware, 'const', vmware.const._replace(VLAB_ICAP_IMAGES_DIR=images_dir)), \
+                     patch.object(vmware.templates, 'const', vmware.const._replace(VLAB_ICAP_IMAGES_DIR=images_dir)):
+                    output = vmware.sync_templates(MagicMock())
+        expected = {'imported': [], 'removed': []}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(fake_wait_for_task.called)
+
+    def test_image_removed(self):
+        """``image_removed`` is True for a deleted OVA, or one that failed verification, but not a pending one"""
+        with tempfile.TemporaryDirectory() as images_dir:
+            open(os.path.join(images_dir, vmware.convert_name('1.0.0')), 'w').close()
+            with patch.object(vmware, 'const', vmware.const._replace(VLAB_ICAP_IMAGES_DIR=images_dir)):
+                self.fake_INDEX.result.return_value = None
+                pending = vmware.image_removed('1.0.0')
+                self.fake_INDEX.result.return_value = {'ok': False}
+                failed = vmware.image_removed('1.0.0')
+                self.fake_INDEX.result.return_value = {'ok': True}
+                verified = vmware.image_removed('1.0.0')
+                deleted = vmware.image_removed('9.9.9')
+
+        self.assertEqual((pending, failed, verified, deleted), (False, True, False, True))
+
+    @patch.object(vmware, 'OVAS')
     @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'set_meta')
     @patch.object(vmware.virtual_machine, 'deploy_from_ova')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_create_icap_invalid_network(self, fake_vCenter, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_Ova):
+    @patch.object(vmware.templates, 'request_sync')
+    @patch.object(vmware.templates, 'clone')
+    @patch.object(vmware.templates, 'find_template')
+    @patch.object(vmware.templates, 'enabled')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap_template(self, fake_vCenter, fake_enabled, fake_find_template, fake_clone,
+                                  fake_request_sync, fake_deploy_from_ova, fake_set_meta, fake_get_info, fake_OVAS):
+        """``create_icap`` clones the template instead of uploading the OVA when there is one"""
+        fake_enabled.return_value = True
+        fake_clone.return_value.name = 'IcapBox'
+        fake_get_info.return_value = {'worked': True}
+
+        output = vmware.create_icap(username='alice',
+                                    machine_name='IcapBox',
+                                    image='1.0.0',
+                                    network='someLAN',
+                                    logger=MagicMock())
+
+        self.assertEqual(output, {'IcapBox': {'worked': True}})
+        self.assertFalse(fake_deploy_from_ova.called)
+        self.assertFalse(fake_OVAS.open.called)
+        self.assertFalse(fake_request_sync.called)
+
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware.templates, 'request_sync')
+    @patch.object(vmware.templates, 'clone')
+    @patch.object(vmware.templates, 'find_template')
+    @patch.object(vmware.templates, 'enabled')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap_no_template(self, fake_vCenter, fake_enabled, fake_find_template, fake_clone,
+                                     fake_request_sync, fake_deploy_from_ova, fake_set_meta, fake_get_info, fake_OVAS):
+        """``create_icap`` uploads the OVA, and asks for a template sync, when the version has no current template"""
+        fake_enabled.return_value = True
+        fake_find_template.return_value = None
+        fake_deploy_from_ova.return_value.name = 'IcapBox'
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        vmware.create_icap(username='alice',
+                           machine_name='IcapBox',
+                           image='1.0.0',
+                           network='someLAN',
+                           logger=MagicMock())
+
+        self.assertTrue(fake_deploy_from_ova.called)
+        self.assertFalse(fake_clone.called)
+        self.assertTrue(fake_request_sync.called)
+
+    @patch.object(vmware, 'image_removed', side_effect=lambda version: version == '0.9.0')
+    @patch.object(vmware, 'wait_for_task')
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware, 'list_images')
+    @patch.object(vmware.templates, 'is_stale')
+    @patch.object(vmware.templates, 'import_template')
+    @patch.object(vmware.templates, 'list_templates')
+    @patch.object(vmware, 'get_folder')
+    @patch.object(vmware, 'vcenter_session')
+    def test_sync_templates(self, fake_vCenter, fake_get_folder, fake_list_templates, fake_import_template,
+                            fake_is_stale, fake_list_images, fake_OVAS, fake_wait_for_task, fake_image_removed):
+        """``sync_templates`` imports new versions, and removes templates of deleted OVAs"""
+        fake_list_images.return_value = ['1.0.0', '2.0.0']
+        fake_is_stale.return_value = False
+        fake_list_templates.return_value = {'1.0.0': (MagicMock(), {}), '0.9.0': (MagicMock(), {})}
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vCenter.return_value.__enter__.return_value.networks = {'icap-templates' : vmware.vim.Network(moId='1')}
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with patch.object(cache, 'const', cache.const._replace(VLAB_ICAP_CACHE_DIR=cache_dir)):
+                output = vmware.sync_templates(MagicMock())
+        expected = {'imported': ['2.0.0'], 'removed': ['0.9.0']}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(vmware, 'wait_for_task')
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware, 'list_images')
+    @patch.object(vmware.templates, 'is_stale')
+    @patch.object(vmware.templates, 'import_template')
+    @patch.object(vmware.templates, 'list_templates')
+    @patch.object(vmware, 'get_folder')
+    @patch.object(vmware, 'vcenter_session')
+    def test_sync_templates_stale(self, fake_vCenter, fake_get_folder, fake_list_templates, fake_import_template,
+                                  fake_is_stale, fake_list_images, fake_OVAS, fake_wait_for_task):
+        """``sync_templates`` re-imports a version when its OVA was replaced"""
+        fake_list_images.return_value = ['1.0.0']
+        fake_is_stale.return_value = True
+        fake_list_templates.return_value = {'1.0.0': (MagicMock(), {})}
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vCenter.return_value.__enter__.return_value.networks = {'icap-templates' : vmware.vim.Network(moId='1')}
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with patch.object(cache, 'const', cache.const._replace(VLAB_ICAP_CACHE_DIR=cache_dir)):
+                output = vmware.sync_templates(MagicMock())
+        expected = {'imported': ['1.0.0'], 'removed': ['1.0.0']}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware.library, 'deploy')
+    @patch.object(vmware.library, 'find_item')
+    @patch.object(vmware.library, 'enabled')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap_library(self, fake_vCenter, fake_enabled, fake_find_item, fake_deploy,
+                                 fake_deploy_from_ova, fake_set_meta, fake_get_info, fake_OVAS):
+        """``create_icap`` deploys the content library item instead of uploading the OVA when the version is staged"""
+        fake_enabled.return_value = True
+        fake_find_item.return_value = 'item-1'
+        fake_deploy.return_value = 'vm-42'
+        fake_get_info.return_value = {'worked': True}
+        fake_OVAS.get.return_value.networks = ['frontend']
+        fake_vcenter = fake_vCenter.return_value.__enter__.return_value
+        fake_vcenter.networks = {'someLAN' : vmware.vim.Network(moId='network-1')}
+
+        with patch.object(vmware.vim, 'VirtualMachine') as fake_VirtualMachine:
+            fake_VirtualMachine.return_value.name = 'IcapBox'
+            output = vmware.create_icap(username='alice',
+                                        machine_name='IcapBox',
+                                        image='1.0.0',
+                                        network='someLAN',
+                                        logger=MagicMock())
+        args = fake_deploy.call_args[0]
+
+        self.assertEqual(output, {'IcapBox': {'worked': True}})
+        self.assertEqual(args[1:5], ('item-1', 'IcapBox', 'frontend', 'network-1'))
+        self.assertEqual(fake_VirtualMachine.call_args[0], ('vm-42',))
+        self.assertFalse(fake_vcenter.content.searchIndex.FindChild.called)
+        self.assertFalse(fake_deploy_from_ova.called)
+        self.assertFalse(fake_OVAS.open.called)
+
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware.library, 'request_sync')
+    @patch.object(vmware.library, 'deploy')
+    @patch.object(vmware.library, 'find_item')
+    @patch.object(vmware.library, 'enabled')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap_library_not_staged(self, fake_vCenter, fake_enabled, fake_find_item, fake_deploy,
+                                            fake_request_sync, fake_deploy_from_ova, fake_set_meta,
+                                            fake_get_info, fake_OVAS):
+        """``create_icap`` uploads the OVA, and asks for a library sync, when the version isn't staged"""
+        fake_enabled.return_value = True
+        fake_find_item.return_value = None
+        fake_deploy_from_ova.return_value.name = 'IcapBox'
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        vmware.create_icap(username='alice',
+                           machine_name='IcapBox',
+                           image='1.0.0',
+                           network='someLAN',
+                           logger=MagicMock())
+
+        self.assertTrue(fake_deploy_from_ova.called)
+        self.assertTrue(fake_request_sync.called)
+        self.assertFalse(fake_deploy.called)
+
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware.library, 'request_sync')
+    @patch.object(vmware.library, 'find_item')
+    @patch.object(vmware.library, 'enabled')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap_library_unreachable(self, fake_vCenter, fake_enabled, fake_find_item, fake_request_sync,
+                                             fake_deploy_from_ova, fake_set_meta, fake_get_info, fake_OVAS):
+        """``create_icap`` uploads the OVA if the content library cannot be reached"""
+        fake_enabled.return_value = True
+        fake_find_item.side_effect = RuntimeError('testing')
+        fake_deploy_from_ova.return_value.name = 'IcapBox'
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        vmware.create_icap(username='alice',
+                           machine_name='IcapBox',
+                           image='1.0.0',
+                           network='someLAN',
+                           logger=MagicMock())
+
+        self.assertTrue(fake_deploy_from_ova.called)
+
+    @patch.object(vmware, 'image_removed', side_effect=lambda version: version == '0.9.0')
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware, 'list_images')
+    @patch.object(vmware.library, 'CLIENT')
+    @patch.object(vmware.library, 'is_stale')
+    @patch.object(vmware.library, 'delete_item')
+    @patch.object(vmware.library, 'publish')
+    @patch.object(vmware.library, 'list_items')
+    @patch.object(vmware, 'vcenter_session')
+    def test_sync_library(self, fake_vCenter, fake_list_items, fake_publish, fake_delete_item, fake_is_stale,
+                          fake_CLIENT, fake_list_images, fake_OVAS, fake_image_removed):
+        """``sync_library`` stages new and replaced versions, and removes the items of deleted OVAs"""
+        fake_list_images.return_value = ['1.0.0', '2.0.0', '3.0.0']
+        fake_is_stale.side_effect = lambda version, meta: version == '2.0.0'
+        fake_list_items.return_value = {'1.0.0': ('item-1', {}), '2.0.0': ('item-2', {}), '0.9.0': ('item-0', {})}
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with patch.object(cache, 'const', cache.const._replace(VLAB_ICAP_CACHE_DIR=cache_dir)):
+                output = vmware.sync_library(MagicMock())
+        expected = {'staged': ['2.0.0', '3.0.0'], 'removed': ['2.0.0', '0.9.0'], 'failed': {}}
+        deleted = [x[0][1] for x in fake_delete_item.call_args_list]
+
+        self.assertEqual(output, expected)
+        self.assertEqual(deleted, ['item-2', 'item-0'])
+        # The library already exists
+        self.assertFalse(fake_vCenter.called)
+
+    @patch.object(vmware.library, 'CLIENT')
+    @patch.object(vmware.library, 'delete_item')
+    @patch.object(vmware.library, 'publish')
+    @patch.object(vmware.library, 'list_items')
+    @patch.object(vmware, 'vcenter_session')
+    def test_sync_library_cold_index(self, fake_vCenter, fake_list_items, fake_publish, fake_delete_item, fake_CLIENT):
+        """``sync_library`` keeps the items of OVAs that are still waiting to be verified"""
+        self.fake_INDEX.verified.side_effect = None
+        self.fake_INDEX.verified.return_value = ([], True)
+        self.fake_INDEX.result.return_value = None
+        self.fake_INDEX.key.side_effect = lambda name: [name]
+        fake_list_items.return_value = {x: ('item-{}'.format(x), {'key': [vmware.convert_name(x)]})
+                                        for x in ('1.0', '2.0')}
+        with tempfile.TemporaryDirectory() as images_dir:
+            for version in ('1.0', '2.0'):
+                open(os.path.join(images_dir, vmware.convert_name(version)), 'w').close()
+            with tempfile.TemporaryDirectory() as cache_dir:
+                with patch.object(cache, 'const', cache.const._replace(VLAB_ICAP_CACHE_DIR=cache_dir)), \
+                     patch.object(vmware, 'const', vmware.const._replace(VLAB_ICAP_IMAGES_DIR=images_dir)), \
+                     patch.object(vmware.library, 'INDEX', self.fake_INDEX):
+                    output = vmware.sync_library(MagicMock())
+        expected = {'staged': [], 'removed': [], 'failed': {}}
+
+        self.assertEqual(output, expected)
+        self.assertFalse(fake_delete_item.called)
+        self.assertFalse(fake_publish.called)
+
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware, 'list_images')
+    @patch.object(vmware.library, 'CLIENT')
+    @patch.object(vmware.library, 'publish')
+    @patch.object(vmware.library, 'list_items')
+    @patch.object(vmware, 'vcenter_session')
+    def test_sync_library_new(self, fake_vCenter, fake_list_items, fake_publish, fake_CLIENT,
+                              fake_list_images, fake_OVAS):
+        """``sync_library`` makes the library on the datastore, and reports versions it failed to stage"""
+        fake_list_images.return_value = ['1.0.0']
+        fake_list_items.return_value = {}
+        fake_publish.side_effect = RuntimeError('testing')
+        fake_CLIENT.library_id = None
+        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = vmware.vim.Datastore('datastore-1')
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            with patch.object(cache, 'const', cache.const._replace(VLAB_ICAP_CACHE_DIR=cache_dir)):
+                output = vmware.sync_library(MagicMock())
+        expected = {'staged': [], 'removed': [], 'failed': {'1.0.0': 'testing'}}
+
+        self.assertEqual(output, expected)
+        fake_CLIENT.create_library.assert_called_with('datastore-1')
+
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'wait_for_task')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap_invalid_network(self, fake_vCenter, fake_wait_for_task, fake_deploy_from_ova, fake_get_info, fake_OVAS):
         """``create_icap`` raises ValueError if supplied with a non-existing network"""
         fake_logger = MagicMock()
         fake_get_info.return_value = {'worked': True}
-        fake_Ova.return_value.networks = ['someLAN']
+        fake_OVAS.get.return_value.networks = ['someLAN']
         fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
 
         with self.assertRaises(ValueError):
@@ -122,16 +694,35 @@ class TestVMware(unittest.TestCase):
                                   network='someOtherLAN',
                                   logger=fake_logger)
 
-    @patch.object(vmware, 'Ova')
+    @patch.object(vmware, 'OVAS')
     @patch.object(vmware.virtual_machine, 'get_info')
     @patch.object(vmware.virtual_machine, 'deploy_from_ova')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_create_icap_bad_image(self, fake_vCenter, fake_consume_task, fake_deploy_from_ova, fake_get_info, fake_Ova):
+    @patch.object(vmware, 'wait_for_task')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap_invalid_network_closed(self, fake_vCenter, fake_wait_for_task, fake_deploy_from_ova, fake_get_info, fake_OVAS):
+        """``create_icap`` doesn't open the OVA when the network is invalid"""
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        with self.assertRaises(ValueError):
+            vmware.create_icap(username='alice',
+                               machine_name='IcapBox',
+                               image='1.0.0',
+                               network='someOtherLAN',
+                               logger=MagicMock())
+
+        self.assertFalse(fake_OVAS.open.called)
+
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'wait_for_task')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap_bad_image(self, fake_vCenter, fake_wait_for_task, fake_deploy_from_ova, fake_get_info, fake_OVAS):
         """``create_icap`` raises ValueError if supplied with a non-existing image/version for deployment"""
         fake_logger = MagicMock()
         fake_get_info.return_value = {'worked': True}
-        fake_Ova.side_effect = FileNotFoundError('testing')
+        fake_OVAS.get.side_effect = ValueError('testing')
         fake_vCenter.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
 
         with self.assertRaises(ValueError):
@@ -141,6 +732,162 @@ class TestVMware(unittest.TestCase):
                                   network='someOtherLAN',
                                   logger=fake_logger)
 
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icaps(self, fake_vcenter_session, fake_deploy_from_ova, fake_get_info, fake_OVAS, fake_set_meta):
+        """``create_icaps`` returns the info of every new instance"""
+        fake_logger = MagicMock()
+        def fake_deploy(vcenter, ova, network_map, username, machine_name, logger, power_on=True):
+            the_vm = MagicMock()
+            the_vm.name = machine_name
+            return the_vm
+        fake_deploy_from_ova.side_effect = fake_deploy
+        fake_get_info.return_value = {'worked': True}
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        output = vmware.create_icaps(username='alice',
+                                     machine_names=['icap1', 'icap2'],
+                                     image='1.0.0',
+                                     network='someLAN',
+                                     logger=fake_logger)
+        expected = {'created': {'icap1': {'worked': True}, 'icap2': {'worked': True}}, 'failed': {}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(vmware, '_finish_create')
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.warm_pool, 'claim')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icaps_deadline(self, fake_vcenter_session, fake_claim, fake_OVAS, fake_finish_create):
+        """``create_icaps`` gives every create the deadline of the task"""
+        fake_logger = MagicMock()
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+        seen = []
+        def fake_finish(vcenter, the_vm, username, image):
+            seen.append(vmware.deadlines.current())
+            return {}
+        fake_finish_create.side_effect = fake_finish
+        vmware.deadlines.start(600)
+        deadline = vmware.deadlines.current()
+        try:
+            vmware.create_icaps(username='alice',
+                                machine_names=['icap1', 'icap2'],
+                                image='1.0.0',
+                                network='someLAN',
+                                logger=fake_logger)
+        finally:
+            vmware.deadlines.clear()
+
+        self.assertEqual(seen, [deadline, deadline])
+
+    @patch.object(vmware.virtual_machine, 'set_meta')
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'get_info')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icaps_partial(self, fake_vcenter_session, fake_deploy_from_ova, fake_get_info, fake_OVAS, fake_set_meta):
+        """``create_icaps`` reports the instances that failed, without stopping the others"""
+        fake_logger = MagicMock()
+        def fake_deploy(vcenter, ova, network_map, username, machine_name, logger, power_on=True):
+            if machine_name == 'icap2':
+                raise RuntimeError('testing')
+            the_vm = MagicMock()
+            the_vm.name = machine_name
+            return the_vm
+        fake_deploy_from_ova.side_effect = fake_deploy
+        fake_get_info.return_value = {'worked': True}
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        output = vmware.create_icaps(username='alice',
+                                     machine_names=['icap1', 'icap2'],
+                                     image='1.0.0',
+                                     network='someLAN',
+                                     logger=fake_logger)
+        expected = {'created': {'icap1': {'worked': True}}, 'failed': {'icap2': 'testing'}}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware.virtual_machine, 'deploy_from_ova')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icaps_invalid_network(self, fake_vcenter_session, fake_deploy_from_ova, fake_OVAS):
+        """``create_icaps`` raises ValueError before deploying anything if the network doesn't exist"""
+        fake_logger = MagicMock()
+        fake_OVAS.get.return_value.networks = ['someLAN']
+        fake_vcenter_session.return_value.__enter__.return_value.networks = {'someLAN' : vmware.vim.Network(moId='1')}
+
+        with self.assertRaises(ValueError):
+            vmware.create_icaps(username='alice',
+                                machine_names=['icap1', 'icap2'],
+                                image='1.0.0',
+                                network='someOtherLAN',
+                                logger=fake_logger)
+
+        self.assertFalse(fake_deploy_from_ova.called)
+
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icaps_bad_image(self, fake_vcenter_session, fake_OVAS):
+        """``create_icaps`` raises ValueError if supplied with a non-existing image/version"""
+        fake_logger = MagicMock()
+        fake_OVAS.get.side_effect = ValueError('testing')
+
+        with self.assertRaises(ValueError):
+            vmware.create_icaps(username='alice',
+                                machine_names=['icap1', 'icap2'],
+                                image='1.0.0',
+                                network='someLAN',
+                                logger=fake_logger)
+
+    @patch.object(vmware, 'OVAS')
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icap_unverified(self, fake_vCenter, fake_OVAS):
+        """``create_icap`` raises ValueError, without touching vCenter, if the image hasn't passed verification"""
+        self.fake_INDEX.check.side_effect = ValueError('ICAP 1.0.0 failed verification: testing')
+
+        with self.assertRaises(ValueError):
+            vmware.create_icap(username='alice',
+                               machine_name='IcapBox',
+                               image='1.0.0',
+                               network='someLAN',
+                               logger=MagicMock())
+
+        self.assertFalse(fake_vCenter.called)
+        self.assertFalse(fake_OVAS.get.called)
+
+    @patch.object(vmware, 'vcenter_session')
+    def test_create_icaps_unverified(self, fake_vcenter_session):
+        """``create_icaps`` raises ValueError, without touching vCenter, if the image hasn't passed verification"""
+        self.fake_INDEX.check.side_effect = ValueError('ICAP 1.0.0 is still being verified')
+
+        with self.assertRaises(ValueError):
+            vmware.create_icaps(username='alice',
+                                machine_names=['icap1', 'icap2'],
+                                image='1.0.0',
+                                network='someLAN',
+                                logger=MagicMock())
+
+        self.assertFalse(fake_vcenter_session.called)
+
+    @patch.object(vmware.os, 'listdir')
+    def test_list_images_verified(self, fake_listdir):
+        """``list_images`` - Only returns the versions that passed verification"""
+        fake_listdir.return_value = ['ICAP-1.0.0.ova', 'ICAP-2.0.0.ova']
+        self.fake_INDEX.verified.side_effect = None
+        self.fake_INDEX.verified.return_value = (['1.0.0'], True)
+
+        output = vmware.list_images()
+        expected = ['1.0.0']
+
+        self.assertEqual(output, expected)
+        self.fake_INDEX.verified.assert_called_with(['ICAP-1.0.0.ova', 'ICAP-2.0.0.ova'])
+
     @patch.object(vmware.os, 'listdir')
     def test_list_images(self, fake_listdir):
         """``list_images`` - Returns a list of available ICAP versions that can be deployed"""
@@ -168,19 +915,16 @@ class TestVMware(unittest.TestCase):
 
 
     @patch.object(vmware.virtual_machine, 'change_network')
-    @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_update_network(self, fake_vCenter, fake_consume_task, fake_get_info, fake_change_network):
+    @patch.object(vmware, 'find_icap')
+    @patch.object(vmware, 'wait_for_task')
+    @patch.object(vmware, 'vcenter_session')
+    def test_update_network(self, fake_vCenter, fake_wait_for_task, fake_find_icap, fake_change_network):
         """``update_network`` Returns None upon success"""
         fake_logger = MagicMock()
         fake_vm = MagicMock()
         fake_vm.name = 'myICAP'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
         fake_vCenter.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
-        fake_get_info.return_value = {'meta': {'component' : 'ICAP'}}
+        fake_find_icap.return_value = fake_vm
 
         result = vmware.update_network(username='pat',
                                        machine_name='myICAP',
@@ -189,19 +933,16 @@ class TestVMware(unittest.TestCase):
         self.assertTrue(result is None)
 
     @patch.object(vmware.virtual_machine, 'change_network')
-    @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_update_network_no_vm(self, fake_vCenter, fake_consume_task, fake_get_info, fake_change_network):
+    @patch.object(vmware, 'find_icap')
+    @patch.object(vmware, 'wait_for_task')
+    @patch.object(vmware, 'vcenter_session')
+    def test_update_network_no_vm(self, fake_vCenter, fake_wait_for_task, fake_find_icap, fake_change_network):
         """``update_network`` Raises ValueError if the supplied VM doesn't exist"""
         fake_logger = MagicMock()
         fake_vm = MagicMock()
         fake_vm.name = 'myICAP'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
         fake_vCenter.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
-        fake_get_info.return_value = {'meta': {'component' : 'ICAP'}}
+        fake_find_icap.return_value = None
 
         with self.assertRaises(ValueError):
             vmware.update_network(username='pat',
@@ -209,19 +950,16 @@ class TestVMware(unittest.TestCase):
                                   new_network='wootTown')
 
     @patch.object(vmware.virtual_machine, 'change_network')
-    @patch.object(vmware.virtual_machine, 'get_info')
-    @patch.object(vmware, 'consume_task')
-    @patch.object(vmware, 'vCenter')
-    def test_update_network_no_network(self, fake_vCenter, fake_consume_task, fake_get_info, fake_change_network):
+    @patch.object(vmware, 'find_icap')
+    @patch.object(vmware, 'wait_for_task')
+    @patch.object(vmware, 'vcenter_session')
+    def test_update_network_no_network(self, fake_vCenter, fake_wait_for_task, fake_find_icap, fake_change_network):
         """``update_network`` Raises ValueError if the supplied new network doesn't exist"""
         fake_logger = MagicMock()
         fake_vm = MagicMock()
         fake_vm.name = 'myICAP'
-        fake_folder = MagicMock()
-        fake_folder.childEntity = [fake_vm]
-        fake_vCenter.return_value.__enter__.return_value.get_by_name.return_value = fake_folder
         fake_vCenter.return_value.__enter__.return_value.networks = {'wootTown' : 'someNetworkObject'}
-        fake_get_info.return_value = {'meta': {'component' : 'ICAP'}}
+        fake_find_icap.return_value = fake_vm
 
         with self.assertRaises(ValueError):
             vmware.update_network(username='pat',
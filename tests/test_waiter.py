@@ -0,0 +1,296 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in waiter.py
+"""
+import time
+import unittest
+from contextlib import contextmanager
+from unittest.mock import patch, MagicMock
+
+from vlab_icap_api.lib.worker import waiter
+
+
+def make_update(changes, version='1'):
+    """Build a fake UpdateSet object from a mapping of moId -> {property: value}"""
+    update = MagicMock()
+    update.version = version
+    filter_update = MagicMock()
+    filter_update.objectSet = []
+    for moid, props in changes.items():
+        obj_update = MagicMock()
+        obj_update.obj = waiter.vim.Task(moid)
+        obj_update.changeSet = []
+        for name, value in props.items():
+            change = MagicMock()
+            change.name = name
+            change.op = 'assign'
+            change.val = value
+            obj_update.changeSet.append(change)
+        filter_update.objectSet.append(obj_update)
+    update.filterSet = [filter_update]
+    return update
+
+
+def make_error(msg):
+    """Build a fake ``info.error`` value"""
+    error = MagicMock()
+    error.msg = msg
+    return error
+
+
+class FakeCollector(object):
+    """Acts like a PropertyCollector that pushes scripted states of vCenter tasks
+
+    :param script: The states each task goes through, by moId; a state is a
+                   dictionary of property -> value
+    :type script: Dictionary
+    """
+    def __init__(self, script):
+        self.script = {k: list(v) for k, v in script.items()}
+        self.watched = []
+        self.calls = 0
+        self.destroyed = False
+
+    def CreateFilter(self, filter_spec, partialUpdates):
+        moid = filter_spec.objectSet[0].obj._moId
+        self.watched.append(moid)
+        the_filter = MagicMock()
+        the_filter.DestroyPropertyFilter.side_effect = lambda: self.watched.remove(moid)
+        return the_filter
+
+    def WaitForUpdatesEx(self, version, options):
+        self.calls += 1
+        changes = {}
+        for moid in self.watched:
+            if self.script.get(moid):
+                changes[moid] = self.script[moid].pop(0)
+        if not changes:
+            time.sleep(0.01)
+            return None
+        return make_update(changes, version=str(self.calls))
+
+    def DestroyPropertyCollector(self):
+        self.destroyed = True
+
+
+class TestTaskWaiter(unittest.TestCase):
+    """A set of test cases for waiting on vCenter tasks via TaskWaiter"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_vcenter = MagicMock()
+        self.sessions = 0
+        self.waiter = waiter.TaskWaiter(interval=1)
+        self.addCleanup(self.waiter.close)
+        patcher = patch.object(waiter, 'WAITER', self.waiter)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(waiter, 'vcenter_session', self._fake_session)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @contextmanager
+    def _fake_session(self):
+        self.sessions += 1
+        yield self.waiter_vcenter
+
+    def _script(self, script):
+        """Set what the waiter's PropertyCollector will report"""
+        self.collector = FakeCollector(script)
+        self.waiter_vcenter = MagicMock()
+        self.waiter_vcenter.content.propertyCollector.CreatePropertyCollector.return_value = self.collector
+
+    def test_wait_for_tasks(self):
+        """``wait_for_tasks`` maps every key to None when the tasks succeed"""
+        self._script({'task-1': [{'info.state': 'running'}, {'info.state': 'success'}],
+                      'task-2': [{'info.state': 'success'}]})
+
+        output = waiter.wait_for_tasks({'a': waiter.vim.Task('task-1'), 'b': waiter.vim.Task('task-2')})
+        expected = {'a': None, 'b': None}
+
+        self.assertEqual(output, expected)
+
+    def test_wait_for_tasks_error(self):
+        """``wait_for_tasks`` returns the error message of failed tasks"""
+        self._script({'task-1': [{'info.state': 'success'}],
+                      'task-2': [{'info.state': 'error', 'info.error': make_error('doh')}]})
+
+        output = waiter.wait_for_tasks({'a': waiter.vim.Task('task-1'), 'b': waiter.vim.Task('task-2')})
+        expected = {'a': None, 'b': 'doh'}
+
+        self.assertEqual(output, expected)
+
+    def test_wait_for_tasks_timeout(self):
+        """``wait_for_tasks`` reports the tasks that did not finish in time"""
+        self._script({'task-1': [{'info.state': 'running'}]})
+
+        output = waiter.wait_for_tasks({'a': waiter.vim.Task('task-1')}, timeout=0.2)
+
+        self.assertTrue(output['a'].startswith('Timeout of 0.2 seconds'))
+
+    def test_wait_for_tasks_timeout_unwatched(self):
+        """Tasks nobody waits on anymore are no longer watched"""
+        self._script({'task-1': [{'info.state': 'running'}]})
+
+        waiter.wait_for_tasks({'a': waiter.vim.Task('task-1')}, timeout=0.2)
+        for _ in range(100):
+            if not self.waiter.pending():
+                break
+            time.sleep(0.02)
+
+        self.assertEqual(self.waiter.pending(), 0)
+
+    def test_wait_for_tasks_empty(self):
+        """``wait_for_tasks`` doesn't start the waiter when there's nothing to wait on"""
+        output = waiter.wait_for_tasks({})
+
+        self.assertEqual(output, {})
+        self.assertEqual(self.sessions, 0)
+
+    def test_one_collector(self):
+        """Every task is watched with the same session and PropertyCollector"""
+        self._script({'task-1': [{'info.state': 'success'}],
+                      'task-2': [{'info.state': 'success'}]})
+
+        waiter.wait_for_task(waiter.vim.Task('task-1'))
+        waiter.wait_for_task(waiter.vim.Task('task-2'))
+        collectors = self.waiter_vcenter.content.propertyCollector.CreatePropertyCollector.call_count
+
+        self.assertEqual(self.sessions, 1)
+        self.assertEqual(collectors, 1)
+        self.assertFalse(self.fake_vcenter.content.propertyCollector.CreatePropertyCollector.called)
+
+    def test_restart(self):
+        """The waiter starts over, and keeps watching its tasks, if the session fails"""
+        self._script({'task-1': [{'info.state': 'running'}, {'info.state': 'success'}]})
+        real_wait = self.collector.WaitForUpdatesEx
+        failures = [RuntimeError('session expired')]
+
+        def flaky_wait(version, options):
+            if failures and self.collector.calls:
+                raise failures.pop()
+            return real_wait(version, options)
+        self.collector.WaitForUpdatesEx = flaky_wait
+
+        output = waiter.wait_for_task(waiter.vim.Task('task-1'), timeout=5)
+
+        self.assertTrue(output is None)
+        self.assertEqual(self.sessions, 2)
+        self.assertTrue(self.collector.destroyed)
+
+    def test_close(self):
+        """``close`` fails every task still being waited on"""
+        self._script({'task-1': [{'info.state': 'running'}]})
+        future = self.waiter.submit(waiter.vim.Task('task-1'))
+
+        self.waiter.close()
+
+        self.assertEqual(future.result(timeout=1), ('Task waiter shut down', None))
+
+    @patch.object(waiter.os, 'getpid')
+    def test_forked(self, fake_getpid):
+        """A forked process doesn't inherit the tasks of its parent"""
+        fake_getpid.return_value = 1
+        self.waiter._init_state()
+        self.waiter._new = {'task-1': [MagicMock()]}
+        fake_getpid.return_value = 2
+
+        self.waiter._check_pid()
+
+        self.assertEqual(self.waiter.pending(), 0)
+
+    def test_wait_for_task(self):
+        """``wait_for_task`` returns the result of the task"""
+        self._script({'task-1': [{'info.state': 'success', 'info.result': 'woot'}]})
+
+        output = waiter.wait_for_task(waiter.vim.Task('task-1'))
+
+        self.assertEqual(output, 'woot')
+
+    def test_wait_for_task_rebinds(self):
+        """``wait_for_task`` returns managed objects bound to the caller's session"""
+        self._script({'task-1': [{'info.state': 'success', 'info.result': waiter.vim.VirtualMachine('vm-1')}]})
+        stub = MagicMock()
+
+        output = waiter.wait_for_task(waiter.vim.Task('task-1', stub=stub))
+
+        self.assertEqual(output._moId, 'vm-1')
+        self.assertTrue(output._stub is stub)
+
+    def test_wait_for_task_error(self):
+        """``wait_for_task`` raises RuntimeError when the task fails, just like ``consume_task``"""
+        self._script({'task-1': [{'info.state': 'error', 'info.error': make_error('doh')}]})
+
+        with self.assertRaises(RuntimeError):
+            waiter.wait_for_task(waiter.vim.Task('task-1'))
+
+    def test_wait_for_task_timeout(self):
+        """``wait_for_task`` raises RuntimeError when the task takes too long"""
+        self._script({'task-1': []})
+
+        with self.assertRaises(RuntimeError):
+            waiter.wait_for_task(waiter.vim.Task('task-1'), timeout=0.2)
+
+    def test_wait_for_task_deadline(self):
+        """``wait_for_task`` gives up when the running task hits its time limit"""
+        self._script({'task-1': []})
+        waiter.deadlines.start(0.2)
+        self.addCleanup(waiter.deadlines.clear)
+        start = time.time()
+
+        with self.assertRaises(RuntimeError):
+            waiter.wait_for_task(waiter.vim.Task('task-1'), timeout=600)
+
+        self.assertTrue(time.time() - start < 5)
+
+    def test_wait_for_tasks_deadline(self):
+        """``wait_for_tasks`` gives up when the running task hits its time limit"""
+        self._script({'task-1': []})
+        waiter.deadlines.start(0.2)
+        self.addCleanup(waiter.deadlines.clear)
+
+        output = waiter.wait_for_tasks({'a': waiter.vim.Task('task-1')}, timeout=600)
+
+        self.assertTrue(output['a'].startswith('Timeout'))
+
+
+class TestWaiter(unittest.TestCase):
+    """A set of test cases for waiting on properties in the waiter.py module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.fake_vcenter = MagicMock()
+        self.collector = self.fake_vcenter.content.propertyCollector.CreatePropertyCollector.return_value
+
+    def test_wait_for_ip(self):
+        """``wait_for_ip`` returns once the VM reports an IP"""
+        self.collector.WaitForUpdatesEx.side_effect = [make_update({'vm-1': {'guest.ipAddress': None}}, version='1'),
+                                                       make_update({'vm-1': {'guest.ipAddress': 'fe80::1'}}, version='2'),
+                                                       make_update({'vm-1': {'guest.ipAddress': '10.1.1.2'}}, version='3')]
+
+        waiter.wait_for_ip(self.fake_vcenter, waiter.vim.VirtualMachine('vm-1'))
+
+        self.assertEqual(self.collector.WaitForUpdatesEx.call_count, 3)
+
+    def test_wait_for_ip_timeout(self):
+        """``wait_for_ip`` raises RuntimeError when the VM never gets an IP"""
+        self.collector.WaitForUpdatesEx.side_effect = [make_update({'vm-1': {'guest.ipAddress': None}}), None]
+
+        with self.assertRaises(RuntimeError):
+            waiter.wait_for_ip(self.fake_vcenter, waiter.vim.VirtualMachine('vm-1'), timeout=5)
+
+    @patch.object(waiter.time, 'time')
+    def test_max_wait_shrinks(self, fake_time):
+        """``wait_for_updates`` never waits on vCenter longer than the time left"""
+        fake_time.side_effect = [100, 100, 104]
+        self.collector.WaitForUpdatesEx.side_effect = [make_update({'vm-1': {'guest.ipAddress': None}}), None]
+
+        with self.assertRaises(RuntimeError):
+            waiter.wait_for_ip(self.fake_vcenter, waiter.vim.VirtualMachine('vm-1'), timeout=10)
+        waits = [x[0][1].maxWaitSeconds for x in self.collector.WaitForUpdatesEx.call_args_list]
+
+        self.assertEqual(waits, [10, 6])
+
+
+if __name__ == '__main__':
+    unittest.main()
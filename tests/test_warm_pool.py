@@ -0,0 +1,175 @@
+# -*- coding: UTF-8 -*-
+"""
+A suite of tests for the functions in warm_pool.py
+"""
+import shutil
+import tempfile
+import unittest
+from unittest.mock import patch, MagicMock
+
+from vlab_icap_api.lib.worker import cache, warm_pool
+
+
+class TestWarmPool(unittest.TestCase):
+    """A set of test cases for the warm_pool.py module"""
+
+    def setUp(self):
+        """Runs before every test case"""
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        test_const = warm_pool.const._replace(VLAB_ICAP_CACHE_DIR=self.cache_dir, VLAB_ICAP_WARM_POOL_SIZE=2)
+        for module in (warm_pool, cache):
+            patcher = patch.object(module, 'const', test_const)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.fake_vcenter = MagicMock()
+        self.fake_vcenter.networks = {'someLAN': MagicMock()}
+        self.fake_logger = MagicMock()
+
+    def test_enabled(self):
+        """``enabled`` is True when the pool size is greater than zero"""
+        self.assertTrue(warm_pool.enabled())
+
+    def test_disabled(self):
+        """``enabled`` is False when the pool size is zero"""
+        with patch.object(warm_pool, 'const', warm_pool.const._replace(VLAB_ICAP_WARM_POOL_SIZE=0)):
+            self.assertFalse(warm_pool.enabled())
+
+    def test_get_pool_folder_missing(self):
+        """``get_pool_folder`` returns None when the folder doesn't exist"""
+        self.fake_vcenter.get_by_name.side_effect = [ValueError('testing')]
+
+        output = warm_pool.get_pool_folder(self.fake_vcenter)
+
+        self.assertTrue(output is None)
+        self.assertFalse(self.fake_vcenter.create_vm_folder.called)
+
+    def test_get_pool_folder_create(self):
+        """``get_pool_folder`` makes the folder when told to"""
+        the_folder = MagicMock()
+        self.fake_vcenter.get_by_name.side_effect = [ValueError('testing'), the_folder]
+
+        output = warm_pool.get_pool_folder(self.fake_vcenter, create=True)
+
+        self.assertTrue(output is the_folder)
+        self.fake_vcenter.create_vm_folder.assert_called_with('vlab/icap-warm-pool')
+
+    @patch.object(warm_pool, 'retrieve_vms')
+    def test_staged_vms(self, fake_retrieve_vms):
+        """``staged_vms`` only returns powered off ICAP VMs, grouped by version"""
+        vm1, vm2, vm3 = MagicMock(), MagicMock(), MagicMock()
+        off = warm_pool.vim.VirtualMachinePowerState.poweredOff
+        on = warm_pool.vim.VirtualMachinePowerState.poweredOn
+        fake_retrieve_vms.return_value = {
+            vm1 : {'runtime.powerState': off, 'config.annotation': '{"component": "ICAP", "version": "1.0.0"}'},
+            vm2 : {'runtime.powerState': on, 'config.annotation': '{"component": "ICAP", "version": "1.0.0"}'},
+            vm3 : {'runtime.powerState': off, 'config.annotation': None},
+        }
+
+        output = warm_pool.staged_vms(self.fake_vcenter, MagicMock())
+        expected = {'1.0.0': [vm1]}
+
+        self.assertEqual(output, expected)
+
+    @patch.object(warm_pool, 'virtual_machine')
+    @patch.object(warm_pool, 'wait_for_task')
+    @patch.object(warm_pool, 'staged_vms')
+    def test_claim(self, fake_staged_vms, fake_wait_for_task, fake_virtual_machine):
+        """``claim`` moves, renames, and powers on a warm VM"""
+        the_vm = MagicMock()
+        fake_staged_vms.return_value = {'1.0.0': [the_vm]}
+
+        output = warm_pool.claim(self.fake_vcenter, 'alice', 'myICAP', '1.0.0', 'someLAN', self.fake_logger)
+
+        self.assertTrue(output is the_vm)
+        the_vm.Rename_Task.assert_called_with('myICAP')
+        self.assertTrue(the_vm.PowerOnVM_Task.called)
+
+    @patch.object(warm_pool, 'virtual_machine')
+    @patch.object(warm_pool, 'wait_for_task')
+    @patch.object(warm_pool, 'staged_vms')
+    def test_claim_empty(self, fake_staged_vms, fake_wait_for_task, fake_virtual_machine):
+        """``claim`` returns None when there's no warm VM for the version"""
+        fake_staged_vms.return_value = {'2.0.0': [MagicMock()]}
+
+        output = warm_pool.claim(self.fake_vcenter, 'alice', 'myICAP', '1.0.0', 'someLAN', self.fake_logger)
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_wait_for_task.called)
+
+    @patch.object(warm_pool, 'staged_vms')
+    def test_claim_disabled(self, fake_staged_vms):
+        """``claim`` returns None without talking to vCenter when the pool is turned off"""
+        with patch.object(warm_pool, 'const', warm_pool.const._replace(VLAB_ICAP_WARM_POOL_SIZE=0)):
+            output = warm_pool.claim(self.fake_vcenter, 'alice', 'myICAP', '1.0.0', 'someLAN', self.fake_logger)
+
+        self.assertTrue(output is None)
+        self.assertFalse(fake_staged_vms.called)
+
+    def test_claim_bad_network(self):
+        """``claim`` raises ValueError when the network doesn't exist"""
+        with self.assertRaises(ValueError):
+            warm_pool.claim(self.fake_vcenter, 'alice', 'myICAP', '1.0.0', 'noSuchLAN', self.fake_logger)
+
+    @patch.object(warm_pool, 'virtual_machine')
+    @patch.object(warm_pool, 'wait_for_task')
+    @patch.object(warm_pool, 'staged_vms')
+    def test_claim_rename_fails(self, fake_staged_vms, fake_wait_for_task, fake_virtual_machine):
+        """``claim`` returns the VM to the pool if it cannot be renamed"""
+        the_vm = MagicMock()
+        fake_staged_vms.return_value = {'1.0.0': [the_vm]}
+        fake_wait_for_task.side_effect = [None, RuntimeError('name taken'), None]
+
+        with self.assertRaises(ValueError):
+            warm_pool.claim(self.fake_vcenter, 'alice', 'myICAP', '1.0.0', 'someLAN', self.fake_logger)
+
+        self.assertEqual(fake_wait_for_task.call_count, 3)
+        self.assertFalse(the_vm.PowerOnVM_Task.called)
+
+    @patch.object(warm_pool, 'virtual_machine')
+    @patch.object(warm_pool, 'wait_for_task')
+    @patch.object(warm_pool, 'staged_vms')
+    def test_claim_network_fails(self, fake_staged_vms, fake_wait_for_task, fake_virtual_machine):
+        """``claim`` destroys the VM if it cannot be connected to the network"""
+        the_vm = MagicMock()
+        the_vm.runtime.powerState = warm_pool.vim.VirtualMachinePowerState.poweredOff
+        fake_staged_vms.return_value = {'1.0.0': [the_vm]}
+        fake_virtual_machine.change_network.side_effect = RuntimeError('testing')
+
+        with self.assertRaises(RuntimeError):
+            warm_pool.claim(self.fake_vcenter, 'alice', 'myICAP', '1.0.0', 'someLAN', self.fake_logger)
+
+        self.assertFalse(the_vm.PowerOnVM_Task.called)
+        self.assertFalse(the_vm.PowerOffVM_Task.called)
+        self.assertTrue(the_vm.Destroy_Task.called)
+
+    @patch.object(warm_pool, 'virtual_machine')
+    @patch.object(warm_pool, 'wait_for_task')
+    @patch.object(warm_pool, 'staged_vms')
+    def test_claim_power_on_fails(self, fake_staged_vms, fake_wait_for_task, fake_virtual_machine):
+        """``claim`` powers off and destroys the VM if powering it on fails"""
+        the_vm = MagicMock()
+        the_vm.runtime.powerState = warm_pool.vim.VirtualMachinePowerState.poweredOn
+        fake_staged_vms.return_value = {'1.0.0': [the_vm]}
+        fake_wait_for_task.side_effect = [None, None, RuntimeError('testing'), None, None]
+
+        with self.assertRaises(RuntimeError):
+            warm_pool.claim(self.fake_vcenter, 'alice', 'myICAP', '1.0.0', 'someLAN', self.fake_logger)
+
+        self.assertTrue(the_vm.PowerOffVM_Task.called)
+        self.assertTrue(the_vm.Destroy_Task.called)
+
+    @patch.object(warm_pool, 'wait_for_task')
+    def test_discard_fails(self, fake_wait_for_task):
+        """``_discard`` only logs when the VM cannot be destroyed"""
+        the_vm = MagicMock()
+        the_vm.runtime.powerState = warm_pool.vim.VirtualMachinePowerState.poweredOff
+        fake_wait_for_task.side_effect = RuntimeError('testing')
+
+        warm_pool._discard(the_vm, self.fake_logger)
+
+        self.assertTrue(self.fake_logger.error.called)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,14 +3,22 @@ from flask import Flask
 from celery import Celery
 
 from vlab_icap_api.lib import const
-from vlab_icap_api.lib.views import HealthView, IcapView
+from vlab_icap_api.lib.publisher import configure
+from vlab_icap_api.lib.routes import TASK_ROUTES
+from vlab_icap_api.lib.views import HealthView, IcapView, MetricsView, record_requests, report_broker_busy
 
 app = Flask(__name__)
 app.celery_app = Celery('icap', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER)
 app.celery_app.conf.broker_heartbeat = 0 #https://github.com/celery/celery/issues/4895
+# Anything not sent through IcapView._send_task still lands on a queue a worker consumes
+app.celery_app.conf.task_routes = TASK_ROUTES
+configure(app.celery_app)
 
 HealthView.register(app)
 IcapView.register(app)
+MetricsView.register(app)
+record_requests(app)
+report_broker_busy(app)
 
 
 if __name__ == '__main__':
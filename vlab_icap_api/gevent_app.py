@@ -0,0 +1,24 @@
+# -*- coding: UTF-8 -*-
+"""
+Serves the API with gevent, as an alternative to uwsgi (see ``app.ini``).
+
+Every connection gets a greenlet, so a request waiting on RabbitMQ only ties up
+a few KB of memory instead of a uwsgi worker::
+
+    python3 gevent_app.py
+"""
+from gevent import monkey
+monkey.patch_all()
+
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.evented import serve
+from vlab_icap_api.app import app
+
+
+def main():
+    """Run the API until the process is stopped"""
+    serve(app, '0.0.0.0', 5000, const.VLAB_ICAP_EVENTED_CONNECTIONS)
+
+
+if __name__ == '__main__':
+    main()
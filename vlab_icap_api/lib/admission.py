@@ -0,0 +1,182 @@
+# -*- coding: UTF-8 -*-
+"""
+Decides if a new create can be queued, or if the client has to back off.
+
+A single user may only have ``VLAB_ICAP_USER_MAX_CREATES`` ICAP instances
+being created at once, and nobody can queue a create while the lifecycle queue
+holds ``VLAB_ICAP_MAX_QUEUED_CREATES`` or more tasks. A bulk create counts once
+for every instance it makes; one bigger than the per-user limit is only let in
+when the user has nothing else in flight. A rejected create is answered
+with an HTTP 429, and an estimate (in the Retry-After header) of when to try
+again. Setting a limit to zero turns it off.
+
+The in-flight creates of a user are the ones this API process submitted, and
+that haven't finished yet. The queue depth comes from the broker, so it covers
+every API process.
+"""
+import math
+import time
+import threading
+
+from vlab_api_common import get_logger
+
+from vlab_icap_api.lib import const
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_ICAP_LOG_LEVEL)
+# Seconds to reuse the depth of the lifecycle queue for, so a burst of creates
+# doesn't open a broker connection per create
+QUEUE_DEPTH_TTL = 1
+
+
+class Throttled(Exception):
+    """Raised when a create is not admitted
+
+    :param retry_after: How many seconds the client should wait before trying again
+    :type retry_after: Integer
+    """
+    def __init__(self, message, retry_after):
+        super(Throttled, self).__init__(message)
+        self.retry_after = retry_after
+
+
+def queue_depth(celery_app, queue):
+    """Ask the broker how many tasks are waiting in a queue
+
+    :Returns: Integer, or None if the broker cannot tell
+
+    :param celery_app: The Celery application the API sends tasks with
+    :type celery_app: celery.Celery
+
+    :param queue: The name of the queue
+    :type queue: String
+    """
+    try:
+        with celery_app.connection_for_read() as conn:
+            return conn.default_channel.queue_declare(queue=queue, passive=True).message_count
+    except Exception as doh:
+        # A queue that doesn't exist yet, or a broker that can't be queried
+        logger.debug('Unable to obtain depth of queue {}: {}'.format(queue, doh))
+        return None
+
+
+class AdmissionControl(object):
+    """Tracks the in-flight creates of every user, and enforces the create limits.
+
+    Only the creates of the same user wait on each other, so a slow broker
+    doesn't hold up every create the process is handling.
+
+    :param user_limit: The most creates a user can have in flight
+    :type user_limit: Integer
+
+    :param queue_limit: The most tasks the lifecycle queue can hold before creates are refused
+    :type queue_limit: Integer
+
+    :param estimate: About how many seconds a create takes
+    :type estimate: Integer
+    """
+    def __init__(self, user_limit, queue_limit, estimate):
+        self._user_limit = user_limit
+        self._queue_limit = queue_limit
+        self._estimate = estimate
+        self._lock = threading.Lock()
+        # username -> lock held while one of their creates is admitted and sent
+        self._user_locks = {}
+        # username -> {task id: (submitted at, how many instances it creates)}
+        self._inflight = {}
+        # (depth of the lifecycle queue, when it was checked)
+        self._depth = (None, None)
+
+    def admit(self, celery_app, username, send, weight=1):
+        """Send a create task, if the limits allow it
+
+        :Returns: String - the id of the task
+
+        :Raises: Throttled if the create isn't allowed right now
+
+        :param celery_app: The Celery application the API sends tasks with
+        :type celery_app: celery.Celery
+
+        :param username: The user who wants to create ICAP instances
+        :type username: String
+
+        :param send: Publishes the task, and returns its id
+        :type send: Function
+
+        :param weight: How many ICAP instances the task creates
+        :type weight: Integer
+        """
+        with self._user_lock(username):
+            # Without a limit, checking on every create the user ever sent is just broker I/O
+            inflight = self._refresh(celery_app, username) if self._user_limit else {}
+            used = sum(x[1] for x in inflight.values())
+            # A bulk create bigger than the limit would never fit; it gets to run alone
+            if self._user_limit and used and used + weight > self._user_limit:
+                # The oldest create should be the first one to finish
+                age = time.time() - min(x[0] for x in inflight.values())
+                retry_after = max(1, int(self._estimate - age))
+                raise Throttled('Too many ICAP creates in progress; limit is {}'.format(self._user_limit),
+                                retry_after)
+            if self._queue_limit:
+                depth = self._queue_depth(celery_app)
+                if depth is not None and depth >= self._queue_limit:
+                    # Every deploy slot works through a create per ``estimate`` seconds
+                    batches = math.ceil((depth - self._queue_limit + 1) / max(1, const.VLAB_ICAP_DEPLOY_SLOTS))
+                    raise Throttled('Too many ICAP creates queued, try again later',
+                                    int(batches * self._estimate))
+            task_id = send()
+            if self._user_limit:
+                with self._lock:
+                    self._inflight.setdefault(username, {})[task_id] = (time.time(), weight)
+            return task_id
+
+    def inflight(self, username):
+        """How many ICAP instances a user is creating, as far as this process knows
+
+        :Returns: Integer
+
+        :param username: The user who created ICAP instances
+        :type username: String
+        """
+        with self._lock:
+            return sum(x[1] for x in self._inflight.get(username, {}).values())
+
+    def _user_lock(self, username):
+        """The lock that makes one user's creates take turns
+
+        :Returns: threading.Lock
+        """
+        with self._lock:
+            return self._user_locks.setdefault(username, threading.Lock())
+
+    def _queue_depth(self, celery_app):
+        """The depth of the lifecycle queue, asking the broker at most once per ``QUEUE_DEPTH_TTL``
+
+        :Returns: Integer, or None if the broker cannot tell
+        """
+        depth, checked = self._depth
+        now = time.monotonic()
+        if checked is None or now - checked >= QUEUE_DEPTH_TTL:
+            depth = queue_depth(celery_app, const.VLAB_ICAP_LIFECYCLE_QUEUE)
+            self._depth = (depth, now)
+        return depth
+
+    def _refresh(self, celery_app, username):
+        """Forget the creates of a user that finished; call while holding the lock of the user
+
+        :Returns: Dictionary, of task id -> (when it was submitted, its weight)
+        """
+        with self._lock:
+            inflight = dict(self._inflight.get(username, {}))
+        # A task can't outlive its queue wait and time limit; don't count lost results forever
+        expired = time.time() - (2 * const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT)
+        # Asking the result backend is broker I/O, so it's done without holding the shared lock
+        finished = [x for x, y in inflight.items() if y[0] < expired or celery_app.AsyncResult(x).ready()]
+        with self._lock:
+            tracked = self._inflight.get(username, {})
+            for task_id in finished:
+                tracked.pop(task_id, None)
+                inflight.pop(task_id)
+            if not tracked:
+                self._inflight.pop(username, None)
+        return inflight
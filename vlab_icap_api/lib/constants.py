@@ -24,6 +24,44 @@ DEFINED = OrderedDict([
             ('VLAB_URL', environ.get('VLAB_URL', 'https://localhost')),
             ('VLAB_ICAP_IMAGES_DIR', environ.get('VLAB_ICAP_IMAGES_DIR', '/images')),
             ('VLAB_VERIFY_TOKEN', environ.get('VLAB_VERIFY_TOKEN', False)),
+            ('VLAB_ICAP_SESSION_POOL_SIZE', int(environ.get('VLAB_ICAP_SESSION_POOL_SIZE', 4))),
+            ('VLAB_ICAP_SESSION_KEEPALIVE', int(environ.get('VLAB_ICAP_SESSION_KEEPALIVE', 300))),
+            ('VLAB_ICAP_SESSION_MAX_AGE', int(environ.get('VLAB_ICAP_SESSION_MAX_AGE', 3600))),
+            ('VLAB_ICAP_CACHE_DIR', environ.get('VLAB_ICAP_CACHE_DIR', '/tmp/vlab_icap')),
+            ('VLAB_ICAP_INVENTORY_TTL', int(environ.get('VLAB_ICAP_INVENTORY_TTL', 300))),
+            ('VLAB_ICAP_BULK_PARALLELISM', int(environ.get('VLAB_ICAP_BULK_PARALLELISM', 4))),
+            ('VLAB_ICAP_BULK_MAX', int(environ.get('VLAB_ICAP_BULK_MAX', 20))),
+            ('VLAB_ICAP_WARM_POOL_SIZE', int(environ.get('VLAB_ICAP_WARM_POOL_SIZE', 0))),
+            ('VLAB_ICAP_WARM_POOL_FOLDER', environ.get('VLAB_ICAP_WARM_POOL_FOLDER', 'icap-warm-pool')),
+            ('VLAB_ICAP_WARM_POOL_NETWORK', environ.get('VLAB_ICAP_WARM_POOL_NETWORK', 'icap-warm-pool')),
+            ('VLAB_ICAP_DEPLOY_MODE', environ.get('VLAB_ICAP_DEPLOY_MODE', 'ova')),
+            ('VLAB_ICAP_TEMPLATE_FOLDER', environ.get('VLAB_ICAP_TEMPLATE_FOLDER', 'icap-templates')),
+            ('VLAB_ICAP_TEMPLATE_NETWORK', environ.get('VLAB_ICAP_TEMPLATE_NETWORK', 'icap-templates')),
+            ('VLAB_ICAP_LIBRARY_NAME', environ.get('VLAB_ICAP_LIBRARY_NAME', 'icap-images')),
+            ('VLAB_ICAP_TASK_WAITER_INTERVAL', int(environ.get('VLAB_ICAP_TASK_WAITER_INTERVAL', 1))),
+            ('VLAB_ICAP_WORKER_POOL', environ.get('VLAB_ICAP_WORKER_POOL', 'prefork')),
+            ('VLAB_ICAP_WORKER_CONCURRENCY', int(environ.get('VLAB_ICAP_WORKER_CONCURRENCY', 0))),
+            ('VLAB_ICAP_READ_QUEUE', environ.get('VLAB_ICAP_READ_QUEUE', 'icap-read')),
+            ('VLAB_ICAP_LIFECYCLE_QUEUE', environ.get('VLAB_ICAP_LIFECYCLE_QUEUE', 'icap-lifecycle')),
+            ('VLAB_ICAP_READ_TIME_LIMIT', int(environ.get('VLAB_ICAP_READ_TIME_LIMIT', 120))),
+            ('VLAB_ICAP_LIFECYCLE_TIME_LIMIT', int(environ.get('VLAB_ICAP_LIFECYCLE_TIME_LIMIT', 1800))),
+            ('VLAB_ICAP_DEDUPE_WINDOW', int(environ.get('VLAB_ICAP_DEDUPE_WINDOW', 600))),
+            ('VLAB_ICAP_SHOW_COALESCE_WINDOW', int(environ.get('VLAB_ICAP_SHOW_COALESCE_WINDOW', 2))),
+            ('VLAB_ICAP_USER_MAX_CREATES', int(environ.get('VLAB_ICAP_USER_MAX_CREATES', 5))),
+            ('VLAB_ICAP_MAX_QUEUED_CREATES', int(environ.get('VLAB_ICAP_MAX_QUEUED_CREATES', 50))),
+            ('VLAB_ICAP_CREATE_ESTIMATE', int(environ.get('VLAB_ICAP_CREATE_ESTIMATE', 600))),
+            ('VLAB_ICAP_DEPLOY_SLOTS', int(environ.get('VLAB_ICAP_DEPLOY_SLOTS', 4))),
+            ('VLAB_ICAP_READY_INTERVAL', int(environ.get('VLAB_ICAP_READY_INTERVAL', 10))),
+            ('VLAB_ICAP_READY_TIMEOUT', int(environ.get('VLAB_ICAP_READY_TIMEOUT', 5))),
+            ('VLAB_ICAP_UPLOAD_STREAMS', int(environ.get('VLAB_ICAP_UPLOAD_STREAMS', 4))),
+            ('VLAB_ICAP_UPLOAD_CHUNK_MB', int(environ.get('VLAB_ICAP_UPLOAD_CHUNK_MB', 8))),
+            ('VLAB_ICAP_UPLOAD_MAX_MBPS', int(environ.get('VLAB_ICAP_UPLOAD_MAX_MBPS', 0))),
+            ('VLAB_ICAP_UPLOAD_PROGRESS_INTERVAL', int(environ.get('VLAB_ICAP_UPLOAD_PROGRESS_INTERVAL', 5))),
+            ('VLAB_ICAP_IMAGE_SCAN_INTERVAL', int(environ.get('VLAB_ICAP_IMAGE_SCAN_INTERVAL', 60))),
+            ('VLAB_ICAP_BROKER_POOL_LIMIT', int(environ.get('VLAB_ICAP_BROKER_POOL_LIMIT', 10))),
+            ('VLAB_ICAP_PUBLISH_CONFIRMS', int(environ.get('VLAB_ICAP_PUBLISH_CONFIRMS', 1))),
+            ('VLAB_ICAP_PUBLISH_TIMEOUT', int(environ.get('VLAB_ICAP_PUBLISH_TIMEOUT', 5))),
+            ('VLAB_ICAP_EVENTED_CONNECTIONS', int(environ.get('VLAB_ICAP_EVENTED_CONNECTIONS', 2000))),
           ])
 
 Constants = namedtuple('Constants', list(DEFINED.keys()))
@@ -0,0 +1,63 @@
+# -*- coding: UTF-8 -*-
+"""
+Helpers for serving the API with gevent; see ``vlab_icap_api/gevent_app.py``.
+
+gevent is optional. Nothing here imports it unless the process was monkey patched,
+so the same code runs unchanged under uwsgi.
+"""
+import sys
+import socket
+
+
+def is_evented():
+    """Determine if the process was monkey patched by gevent
+
+    :Returns: Boolean
+    """
+    monkey = sys.modules.get('gevent.monkey')
+    return monkey is not None and monkey.is_module_patched('threading')
+
+
+def offload(func, *args):
+    """Run CPU bound work on a real OS thread, so it doesn't stall every request.
+
+    Once threading is monkey patched, a "thread" is a greenlet; hashing a
+    multi-GB OVA in one would block the event loop until it's done. Without
+    gevent, ``func`` just runs in the calling thread.
+
+    :Returns: Whatever ``func`` returns
+
+    :param func: The blocking function to run
+    :type func: Callable
+    """
+    if not is_evented():
+        return func(*args)
+    import gevent
+    return gevent.get_hub().threadpool.apply(func, args)
+
+
+def serve(app, host, port, connections):
+    """Serve a WSGI app from this process, with one greenlet per connection
+
+    :Returns: None
+
+    :param app: The API
+    :type app: flask.Flask
+
+    :param connections: How many connections to handle at the same time
+    :type connections: Integer
+    """
+    from gevent.pool import Pool
+    from gevent.pywsgi import WSGIHandler, WSGIServer
+
+    class Handler(WSGIHandler):
+        def handle(self):
+            # The headers and body are separate writes; on a kept-alive connection,
+            # Nagle and delayed ACKs would hold the body back ~40ms
+            self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            super(Handler, self).handle()
+
+    # A burst of clients shouldn't overflow the accept queue while they wait for a greenlet
+    server = WSGIServer((host, port), app, backlog=connections, spawn=Pool(connections), handler_class=Handler,
+                        log=None)
+    server.serve_forever()
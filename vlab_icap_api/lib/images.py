@@ -0,0 +1,446 @@
+# -*- coding: UTF-8 -*-
+"""
+Knows which versions of ICAP can be deployed, based on the OVAs in the images
+directory.
+
+Listing a directory is cheap enough to do inside the API process, so the
+catalog is kept in memory and only rebuilt when the directory changes.
+
+Only OVAs that passed verification are deployable. Checking the manifest of a
+multi-GB OVA means reading all of it, so ``ImageIndex`` does that once per
+file, in the background, and saves the result in ``<VLAB_ICAP_CACHE_DIR>/images``
+keyed by the inode, mtime and size of the OVA. Every API and worker process
+shares those results; replacing an OVA gets it verified again.
+"""
+import os
+import re
+import time
+import fcntl
+import hashlib
+import tarfile
+import tempfile
+import threading
+
+import ujson
+from vlab_api_common import get_logger
+
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.evented import offload
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_ICAP_LOG_LEVEL)
+# i.e. SHA256(icap-disk1.vmdk)= 2d7e...
+MANIFEST_LINE = re.compile(r'^(SHA1|SHA256|SHA512)\((.+)\)\s*=\s*([0-9a-fA-F]+)$')
+OVF_FILE_REF = re.compile(r'<(?:\w+:)?File\b[^>]*?\bovf:href="([^"]+)"')
+
+
+def convert_name(name, to_version=False):
+    """This function centralizes converting between the name of the OVA, and the
+    version of software it contains.
+
+    The OVA file naming convention is ICAP-<version>.ova, i.e. ICAP-1.0.0.ova
+
+    :param name: The thing to covert
+    :type name: String
+
+    :param to_version: Set to True to covert the name of an OVA to the version
+    :type to_version: Boolean
+    """
+    if to_version:
+        return name.split('-')[-1].replace('.ova', '')
+    else:
+        return 'ICAP-{}.ova'.format(name)
+
+
+def is_ova(name):
+    """Determine if a file in the images directory is an ICAP OVA
+
+    :Returns: Boolean
+
+    :param name: The name of the file
+    :type name: String
+    """
+    return name.startswith('ICAP-') and name.endswith('.ova')
+
+
+def verify_ova(path):
+    """Check that an OVA is complete, and that its contents match its manifest.
+
+    Every file in the OVA is read, so a truncated archive is caught even if the
+    OVA has no manifest.
+
+    :Returns: Dictionary
+
+    :Raises: ValueError describing what's wrong with the OVA
+
+    :param path: The location of the OVA
+    :type path: String
+    """
+    try:
+        with tarfile.open(path) as the_tar:
+            members = the_tar.getmembers()
+            by_name = {x.name: x for x in members}
+            ovfs = [x for x in by_name if x.endswith('.ovf')]
+            if len(ovfs) != 1:
+                raise ValueError('Expected one OVF descriptor, found {}'.format(len(ovfs)))
+            ovf = the_tar.extractfile(by_name[ovfs[0]]).read().decode()
+            missing = [x for x in OVF_FILE_REF.findall(ovf) if x not in by_name]
+            if missing:
+                raise ValueError('Files referenced by the OVF are missing: {}'.format(', '.join(missing)))
+            manifests = [x for x in by_name if x.endswith('.mf')]
+            expected = {}
+            if manifests:
+                expected = _read_manifest(the_tar.extractfile(by_name[manifests[0]]).read().decode())
+                missing = [x for x in expected if x not in by_name]
+                unlisted = [x.name for x in members if x.isfile() and x.name not in expected
+                            and x.name not in manifests and not x.name.endswith('.cert')]
+                if missing or unlisted:
+                    raise ValueError('Manifest does not match the OVA; missing {}, not listed {}'.format(missing, unlisted))
+            # Archive order, so the OVA is read sequentially
+            for member in members:
+                if not member.isfile() or member.name in manifests:
+                    continue
+                algorithm, digest = expected.get(member.name, ('sha256', None))
+                actual = _digest(the_tar.extractfile(member), algorithm)
+                if digest is not None and actual != digest:
+                    raise ValueError('Checksum mismatch for {}'.format(member.name))
+    except (tarfile.TarError, OSError, UnicodeDecodeError) as doh:
+        raise ValueError('Unreadable OVA: {}'.format(doh))
+    return {'manifest': bool(manifests)}
+
+
+def _read_manifest(text):
+    """Parse the expected digest of every file listed in an OVA manifest
+
+    :Returns: Dictionary of file name -> (algorithm, hex digest)
+    """
+    expected = {}
+    for line in text.splitlines():
+        line = line.strip()
+        if not line:
+            continue
+        match = MANIFEST_LINE.match(line)
+        if match is None:
+            raise ValueError('Malformed manifest line: {}'.format(line))
+        algorithm, name, digest = match.groups()
+        expected[name] = (algorithm.lower(), digest.lower())
+    return expected
+
+
+def _digest(the_file, algorithm):
+    """Hash the contents of a file object
+
+    :Returns: String
+    """
+    the_hash = hashlib.new(algorithm)
+    for chunk in iter(lambda: the_file.read(1024 * 1024), b''):
+        the_hash.update(chunk)
+    return the_hash.hexdigest()
+
+
+class ImageIndex(object):
+    """Verifies every OVA in the images directory once, in a background thread.
+
+    The thread starts the first time a result is asked for, so every uwsgi and
+    Celery process that looks up images helps verify them. A lock file per OVA
+    ensures only one process reads a given OVA at a time; the others pick up the
+    saved result. Functions passed to ``subscribe`` are called once an OVA this
+    process saw waiting for verification passes it, whichever process verified it.
+
+    :param images_dir: The directory that contains the ICAP OVAs
+    :type images_dir: String
+
+    :param index_dir: Where to save the result of verifying each OVA
+    :type index_dir: String
+
+    :param interval: How often, in seconds, to look for OVAs to verify
+    :type interval: Integer
+    """
+    def __init__(self, images_dir, index_dir, interval):
+        self._images_dir = images_dir
+        self._index_dir = index_dir
+        self._interval = interval
+        # Kept across a fork, unlike the state of the thread
+        self._subscribers = []
+        self._init_state()
+
+    def _init_state(self):
+        """Start over in the current process"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wakeup = threading.Event()
+        # OVA file name -> result of verifying it
+        self._results = {}
+        # OVA file names that were waiting to be verified at the last scan
+        self._pending = set()
+
+    def _check_pid(self):
+        """The thread of a parent process doesn't run in a forked child"""
+        if self._pid != os.getpid():
+            self._init_state()
+
+    def start(self):
+        """Begin verifying OVAs in the background, if that hasn't happened yet
+
+        :Returns: None
+        """
+        self._check_pid()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._scan_forever, daemon=True)
+                self._thread.start()
+
+    def subscribe(self, callback):
+        """Call a function whenever OVAs pass verification
+
+        :Returns: None
+
+        :param callback: Called with the list of OVA file names that passed
+        :type callback: Function
+        """
+        self._subscribers.append(callback)
+
+    def wake(self):
+        """Look for OVAs to verify now, instead of at the next interval
+
+        :Returns: None
+        """
+        self.start()
+        self._wakeup.set()
+
+    def _scan_forever(self):
+        while True:
+            try:
+                self.scan()
+            except Exception as doh:
+                logger.exception('Failed to verify ICAP images: {}'.format(doh))
+            self._wakeup.wait(self._interval)
+            self._wakeup.clear()
+
+    def scan(self):
+        """Verify every OVA that doesn't have a result yet
+
+        :Returns: None
+        """
+        passed = []
+        for name in sorted(os.listdir(self._images_dir)):
+            if not is_ova(name):
+                continue
+            result = self.result(name)
+            if result is None:
+                self._pending.add(name)
+                self._verify_unlocked(name)
+                result = self.result(name)
+            if result is not None and name in self._pending:
+                self._pending.discard(name)
+                if result['ok']:
+                    passed.append(name)
+        if passed:
+            self._notify(passed)
+
+    def _verify_unlocked(self, name):
+        """Verify one OVA, unless another process is already verifying it"""
+        os.makedirs(self._index_dir, exist_ok=True)
+        with open(os.path.join(self._index_dir, '{}.lock'.format(name)), 'w') as the_lock:
+            try:
+                fcntl.flock(the_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another process is verifying it
+                return
+            try:
+                # It might've been verified while we waited on the lock
+                if self.result(name) is None:
+                    self._verify(name)
+            finally:
+                fcntl.flock(the_lock, fcntl.LOCK_UN)
+
+    def _notify(self, names):
+        """Tell every subscriber which OVAs passed verification"""
+        for callback in self._subscribers:
+            try:
+                callback(names)
+            except Exception as doh:
+                logger.exception('Failed to notify {} of verified images: {}'.format(callback, doh))
+
+    def _verify(self, name):
+        """Verify one OVA, and save the result"""
+        path = os.path.join(self._images_dir, name)
+        key = self._key(path)
+        if key is None:
+            return
+        logger.info('Verifying {}'.format(name))
+        started = time.time()
+        result = {'key': key, 'ok': True, 'error': None, 'manifest': False}
+        try:
+            result.update(offload(verify_ova, path))
+        except ValueError as doh:
+            result['ok'] = False
+            result['error'] = str(doh)
+            logger.error('{} failed verification: {}'.format(name, doh))
+        result['checked'] = time.time()
+        result['seconds'] = round(result['checked'] - started, 3)
+        if self._key(path) != key:
+            # Changed while it was being read; verify the new version next time
+            return
+        self._results[name] = result
+        self._save(name, result)
+
+    def _save(self, name, result):
+        """Write a result where every process can find it"""
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self._index_dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w') as the_file:
+                    ujson.dump(result, the_file)
+                os.replace(tmp_path, os.path.join(self._index_dir, '{}.json'.format(name)))
+            except OSError:
+                os.unlink(tmp_path)
+                raise
+        except OSError as doh:
+            logger.error('Unable to save the verification of {}: {}'.format(name, doh))
+
+    def key(self, name):
+        """Identifies the current version of an OVA; replacing it changes the key
+
+        :Returns: List, or None if the OVA doesn't exist
+
+        :param name: The file name of the OVA
+        :type name: String
+        """
+        return self._key(os.path.join(self._images_dir, name))
+
+    @staticmethod
+    def _key(path):
+        """Identifies one version of a file; replacing or modifying it changes the key"""
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return [stat.st_ino, stat.st_mtime_ns, stat.st_size]
+
+    def result(self, name):
+        """The result of verifying the current version of an OVA
+
+        :Returns: Dictionary, or None if it hasn't been verified
+
+        :param name: The file name of the OVA
+        :type name: String
+        """
+        self.start()
+        key = self._key(os.path.join(self._images_dir, name))
+        if key is None:
+            return None
+        result = self._results.get(name)
+        if result is not None and result['key'] == key:
+            return result
+        try:
+            with open(os.path.join(self._index_dir, '{}.json'.format(name))) as the_file:
+                result = ujson.load(the_file)
+        except (OSError, ValueError):
+            return None
+        if result.get('key') != key:
+            return None
+        self._results[name] = result
+        return result
+
+    def check(self, image):
+        """Make sure a version of ICAP can be deployed
+
+        :Returns: None
+
+        :Raises: ValueError if the version doesn't exist, or isn't verified.
+                 OSError if the images directory cannot be read.
+
+        :param image: The image/version of Icap
+        :type image: String
+        """
+        os.stat(self._images_dir)
+        name = convert_name(image)
+        if not os.path.exists(os.path.join(self._images_dir, name)):
+            raise ValueError('Invalid version for ICAP supplied: {}'.format(image))
+        result = self.result(name)
+        if result is None:
+            self.wake()
+            raise ValueError('ICAP {} is still being verified; try again in a few minutes'.format(image))
+        if not result['ok']:
+            raise ValueError('ICAP {} failed verification: {}'.format(image, result['error']))
+
+    def verified(self, names):
+        """Filter a listing of the images directory down to the deployable versions
+
+        :Returns: Tuple (List of versions, Boolean - if any OVA hasn't been verified yet)
+
+        :param names: The files in the images directory
+        :type names: List
+        """
+        versions = []
+        pending = False
+        for name in names:
+            if not is_ova(name):
+                continue
+            result = self.result(name)
+            if result is None:
+                pending = True
+            elif result['ok']:
+                versions.append(convert_name(name, to_version=True))
+        if pending:
+            self.wake()
+        return sorted(versions), pending
+
+
+class ImageCatalog(object):
+    """The available versions of ICAP, rebuilt when the directory mtime changes.
+
+    Adding, removing or renaming an OVA updates the mtime of the directory, so a
+    single ``stat`` per lookup is enough to know if the catalog is stale; while
+    an OVA is waiting to be verified, the catalog is rebuilt on every lookup.
+
+    :param images_dir: The directory that contains the ICAP OVAs
+    :type images_dir: String
+
+    :param index: Knows which OVAs are verified
+    :type index: ImageIndex
+    """
+    def __init__(self, images_dir, index):
+        self._images_dir = images_dir
+        self._index = index
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._pending = False
+        self._images = []
+        self._etag = None
+
+    def images(self):
+        """Obtain the deployable versions of ICAP, and an ETag for that list
+
+        :Returns: Tuple (List, String)
+
+        :Raises: OSError if the images directory cannot be read
+        """
+        mtime = os.stat(self._images_dir).st_mtime_ns
+        with self._lock:
+            if mtime != self._mtime or self._pending:
+                images, self._pending = self._index.verified(os.listdir(self._images_dir))
+                self._images = images
+                self._etag = hashlib.sha1(ujson.dumps(images).encode()).hexdigest()
+                self._mtime = mtime
+            return list(self._images), self._etag
+
+    def check(self, image):
+        """Make sure a version of ICAP can be deployed
+
+        :Returns: None
+
+        :Raises: ValueError if the version doesn't exist, or isn't verified.
+                 OSError if the images directory cannot be read.
+
+        :param image: The image/version of Icap
+        :type image: String
+        """
+        self._index.check(image)
+
+
+INDEX = ImageIndex(const.VLAB_ICAP_IMAGES_DIR, os.path.join(const.VLAB_ICAP_CACHE_DIR, 'images'),
+                   const.VLAB_ICAP_IMAGE_SCAN_INTERVAL)
+IMAGES = ImageCatalog(const.VLAB_ICAP_IMAGES_DIR, INDEX)
@@ -0,0 +1,132 @@
+# -*- coding: UTF-8 -*-
+"""
+Counters and latency histograms for the API and the workers, in the Prometheus
+text format.
+
+Every process (each uwsgi worker, each Celery worker process) records into
+prometheus_client's multiprocess mode: its values are kept in memory-mapped
+files in ``PROMETHEUS_MULTIPROC_DIR``, which defaults to
+``<VLAB_ICAP_CACHE_DIR>/metrics``. The scrape end point adds up the files of
+every process, so mount the same directory into the API and worker containers
+to see both in one place. The files of exited processes are kept, so the
+counters never go backwards; deleting the directory, while nothing is running,
+resets every counter.
+
+If the directory cannot be created, each process only reports its own metrics;
+recording a metric must not break the task or request that's being measured.
+"""
+import os
+import time
+import atexit
+from contextlib import contextmanager
+
+from vlab_api_common import get_logger
+
+from vlab_icap_api.lib import const
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_ICAP_LOG_LEVEL)
+
+
+def _multiproc_dir():
+    """Set up the directory every process writes its metrics to
+
+    :Returns: String, or None if the directory cannot be used
+    """
+    path = os.environ.get('PROMETHEUS_MULTIPROC_DIR') or os.path.join(const.VLAB_ICAP_CACHE_DIR, 'metrics')
+    try:
+        os.makedirs(path, exist_ok=True)
+    except OSError as doh:
+        logger.error('Unable to use {} for metrics, only reporting this process: {}'.format(path, doh))
+        os.environ.pop('PROMETHEUS_MULTIPROC_DIR', None)
+        return None
+    os.environ['PROMETHEUS_MULTIPROC_DIR'] = path
+    return path
+
+
+# prometheus_client picks how to store values when it's imported, so this must come first
+MULTIPROC_DIR = _multiproc_dir()
+
+from prometheus_client import CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest
+from prometheus_client import multiprocess
+
+
+CONTENT_TYPE = CONTENT_TYPE_LATEST
+
+
+def render():
+    """The metrics of every process, in the Prometheus text format
+
+    :Returns: Bytes
+    """
+    if MULTIPROC_DIR is None:
+        return generate_latest(REGISTRY)
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry, path=MULTIPROC_DIR)
+    return generate_latest(registry)
+
+
+def retire_process():
+    """Tell prometheus_client that this process is exiting
+
+    :Returns: None
+    """
+    if MULTIPROC_DIR is not None:
+        multiprocess.mark_process_dead(os.getpid(), MULTIPROC_DIR)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """Observe how long the ``with`` statement takes, in seconds.
+
+    The histogram's "outcome" label is set to "ok", or to "error" if the ``with``
+    statement raises.
+
+    :Returns: None
+
+    :param histogram: Where to record the duration; must have an "outcome" label
+    :type histogram: prometheus_client.Histogram
+
+    :param labels: The value of every other label of the histogram
+    :type labels: Dictionary
+    """
+    started = time.time()
+    outcome = 'ok'
+    try:
+        yield
+    except Exception:
+        outcome = 'error'
+        raise
+    finally:
+        histogram.labels(outcome=outcome, **labels).observe(time.time() - started)
+
+
+# Celery's prefork children skip atexit; they retire from worker_process_shutdown instead
+atexit.register(retire_process)
+
+TASK_SECONDS = Histogram('icap_task_duration_seconds',
+                         'How long each Celery task ran, by outcome',
+                         labelnames=('task', 'outcome'),
+                         buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1200, 1800))
+QUEUE_WAIT_SECONDS = Histogram('icap_task_queue_wait_seconds',
+                               'Seconds between the API publishing a task, and a worker starting it',
+                               labelnames=('task',),
+                               buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800))
+VCENTER_SECONDS = Histogram('icap_vcenter_operation_duration_seconds',
+                            'How long each vCenter operation took, by outcome',
+                            labelnames=('op', 'outcome'),
+                            buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300, 900))
+OVA_UPLOAD_BYTES = Counter('icap_ova_upload_bytes_total',
+                           'Bytes of OVA disks uploaded to vCenter')
+OVA_UPLOAD_SECONDS = Counter('icap_ova_upload_seconds_total',
+                             'Seconds spent uploading OVA disks to vCenter')
+OVA_UPLOAD_RATE = Histogram('icap_ova_upload_bytes_per_second',
+                            'The throughput of each OVA upload',
+                            buckets=tuple(x * 1024 * 1024 for x in (1, 5, 10, 25, 50, 100, 250, 500)))
+API_SECONDS = Histogram('icap_api_request_duration_seconds',
+                        'How long the API took to answer a request',
+                        labelnames=('method', 'endpoint', 'status'),
+                        buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5))
+TASKS_PUBLISHED = Counter('icap_api_tasks_published_total',
+                          'Tasks the API sent to the workers',
+                          labelnames=('task',))
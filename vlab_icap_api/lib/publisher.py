@@ -0,0 +1,76 @@
+# -*- coding: UTF-8 -*-
+"""
+Publishes tasks over a pool of broker connections that every request reuses.
+
+Celery already keeps a pool of ``broker_pool_limit`` producers, but a request
+that cannot get one waits forever, and so does a publish to a RabbitMQ that has
+stopped answering. Here both waits are bounded by ``VLAB_ICAP_PUBLISH_TIMEOUT``.
+A request that runs out of time gets an HTTP 503 and a Retry-After, so a slow
+broker can't tie up every uwsgi worker (or greenlet) in the API.
+
+With ``VLAB_ICAP_PUBLISH_CONFIRMS`` set, every pooled channel is in confirm mode.
+A task only counts as submitted once RabbitMQ acknowledges it, instead of once
+it's written to a socket.
+"""
+import socket
+
+from amqp.exceptions import MessageNacked
+from kombu.exceptions import LimitExceeded, OperationalError
+
+from vlab_icap_api.lib import const
+
+
+class BrokerBusy(Exception):
+    """Raised when a task cannot be published in time
+
+    :param retry_after: How many seconds the client should wait before trying again
+    :type retry_after: Integer
+    """
+    def __init__(self, message, retry_after):
+        super(BrokerBusy, self).__init__(message)
+        self.retry_after = retry_after
+
+
+def configure(celery_app):
+    """Set the size of the connection pool, and turn on publisher confirms
+
+    :Returns: None
+
+    :param celery_app: The Celery application the API sends tasks with
+    :type celery_app: celery.Celery
+    """
+    celery_app.conf.broker_pool_limit = const.VLAB_ICAP_BROKER_POOL_LIMIT
+    # By default, opening a channel retries the connection 100 times; a request
+    # should get its 503 instead of waiting minutes for RabbitMQ to come back
+    options = {'max_retries': 1}
+    if const.VLAB_ICAP_PUBLISH_CONFIRMS:
+        options['confirm_publish'] = True
+    celery_app.conf.broker_transport_options = options
+
+
+def send_task(celery_app, task_name, args, **options):
+    """Publish a task with a producer from the pool
+
+    :Returns: celery.result.AsyncResult
+
+    :Raises: BrokerBusy if no producer frees up, or the broker doesn't accept the
+             task, within ``VLAB_ICAP_PUBLISH_TIMEOUT`` seconds
+
+    :param celery_app: The Celery application the API sends tasks with
+    :type celery_app: celery.Celery
+
+    :param task_name: The registered name of the Celery task, i.e. "icap.create"
+    :type task_name: String
+
+    :param args: The positional arguments for the task
+    :type args: List
+    """
+    timeout = const.VLAB_ICAP_PUBLISH_TIMEOUT
+    try:
+        with celery_app.producer_pool.acquire(block=True, timeout=timeout) as producer:
+            # Also bounds the wait for the broker to confirm the task
+            return celery_app.send_task(task_name, args, producer=producer, timeout=timeout, **options)
+    except LimitExceeded:
+        raise BrokerBusy('Every broker connection is busy, try again later', timeout)
+    except (OperationalError, MessageNacked, socket.timeout) as doh:
+        raise BrokerBusy('Unable to queue {}: {}'.format(task_name, doh), timeout)
@@ -0,0 +1,156 @@
+# -*- coding: UTF-8 -*-
+"""
+Checks that the dependencies of the API are usable, in the background.
+
+The load balancer asks if the API is ready every second, so the readiness end
+point must not talk to the broker or vCenter itself; that'd add a vCenter login
+per probe, per API instance. Instead, a thread checks every dependency every
+``VLAB_ICAP_READY_INTERVAL`` seconds, and the end point returns the last results.
+"""
+import os
+import ssl
+import time
+import base64
+import threading
+import urllib.request
+
+import ujson
+from kombu import Connection
+from vlab_api_common import get_logger
+
+from vlab_icap_api.lib import const
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_ICAP_LOG_LEVEL)
+
+
+class Prober(object):
+    """Runs a set of checks in a background thread, and caches the results.
+
+    A result that's older than three intervals counts as failed, so a stuck
+    check (or a dead thread) doesn't leave the API reporting itself ready.
+
+    :param checks: The name of each check, and a function that raises if the dependency is unusable
+    :type checks: Dictionary
+
+    :param interval: How often, in seconds, to run the checks
+    :type interval: Integer
+    """
+    def __init__(self, checks, interval):
+        self._checks = checks
+        self._interval = interval
+        self._init_state()
+
+    def _init_state(self):
+        """Forget any results, and start over in the current process"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._results = {}
+
+    def _check_pid(self):
+        """The thread of a parent process doesn't run in a forked child (i.e. a uwsgi worker)"""
+        if self._pid != os.getpid():
+            self._init_state()
+
+    def start(self):
+        """Begin checking the dependencies, if that hasn't happened yet
+
+        :Returns: None
+        """
+        self._check_pid()
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._probe_forever, daemon=True)
+                self._thread.start()
+
+    def _probe_forever(self):
+        while True:
+            self.probe()
+            time.sleep(self._interval)
+
+    def probe(self):
+        """Run every check once, and save the results
+
+        :Returns: None
+        """
+        results = {}
+        for name, check in self._checks.items():
+            started = time.time()
+            error = None
+            try:
+                check()
+            except Exception as doh:
+                error = '{}: {}'.format(type(doh).__name__, doh)
+                logger.warning('Readiness check {} failed: {}'.format(name, error))
+            results[name] = {'ok': error is None,
+                             'seconds': round(time.time() - started, 3),
+                             'error': error,
+                             'checked': started}
+        # Swapped in whole; requests never see a half updated set of results
+        self._results = results
+
+    def status(self):
+        """The last result of every check; starts the checks if needed
+
+        :Returns: Tuple (ready, results)
+        """
+        self.start()
+        now = time.time()
+        results = {}
+        for name in self._checks.keys():
+            result = dict(self._results.get(name, {'ok': False, 'seconds': None,
+                                                   'error': 'Not checked yet', 'checked': None}))
+            if result['checked'] is not None:
+                result['age'] = round(now - result['checked'], 3)
+                if result['ok'] and result['age'] > self._interval * 3:
+                    result['ok'] = False
+                    result['error'] = 'Result is stale'
+            results[name] = result
+        ready = all(x['ok'] for x in results.values())
+        return ready, results
+
+
+def check_broker():
+    """Raises if the API cannot connect to the message broker"""
+    with Connection(const.VLAB_MESSAGE_BROKER, connect_timeout=const.VLAB_ICAP_READY_TIMEOUT) as conn:
+        conn.connect()
+
+
+def check_vcenter():
+    """Raises if the API cannot log into vCenter.
+
+    Uses the vCenter REST API so the API process doesn't need pyVmomi; the SSO
+    login behind it is the same one the workers use.
+    """
+    base_url = 'https://{}:{}/rest/com/vmware/cis/session'.format(const.INF_VCENTER_SERVER,
+                                                                   const.INF_VCENTER_PORT)
+    if const.INF_VCENTER_VERIFY_CERT:
+        context = ssl.create_default_context()
+    else:
+        context = ssl._create_unverified_context()
+    creds = '{}:{}'.format(const.INF_VCENTER_USER, const.INF_VCENTER_PASSWORD).encode()
+    login = urllib.request.Request(base_url, method='POST',
+                                   headers={'Authorization': 'Basic {}'.format(base64.b64encode(creds).decode())})
+    with urllib.request.urlopen(login, timeout=const.VLAB_ICAP_READY_TIMEOUT, context=context) as resp:
+        session_id = resp.headers.get('vmware-api-session-id') or _session_from_body(resp.read())
+    logout = urllib.request.Request(base_url, method='DELETE', headers={'vmware-api-session-id': session_id})
+    try:
+        urllib.request.urlopen(logout, timeout=const.VLAB_ICAP_READY_TIMEOUT, context=context).close()
+    except OSError as doh:
+        # The login worked; the session just lingers until vCenter expires it
+        logger.debug('Unable to log out of vCenter: {}'.format(doh))
+
+
+def _session_from_body(body):
+    """Older vCenter versions only return the session ID in the body of the login"""
+    return ujson.loads(body)['value']
+
+
+def check_images():
+    """Raises if the directory of ICAP images cannot be read"""
+    os.listdir(const.VLAB_ICAP_IMAGES_DIR)
+
+
+PROBER = Prober(checks={'broker': check_broker, 'vcenter': check_vcenter, 'images': check_images},
+                interval=const.VLAB_ICAP_READY_INTERVAL)
@@ -0,0 +1,34 @@
+# -*- coding: UTF-8 -*-
+"""
+Which Celery queue each task is sent to.
+
+Reads (``icap.show`` and ``icap.image``) return in seconds, while lifecycle
+operations (like ``icap.create``) can take many minutes. Sending them to
+separate queues lets a dedicated set of workers keep answering reads, no matter
+how many creates are in flight. Both the API and the worker use this mapping,
+so they always agree on where a task goes.
+"""
+from vlab_icap_api.lib import const
+
+
+READ_TASKS = ('icap.show', 'icap.image')
+LIFECYCLE_TASKS = ('icap.create', 'icap.bulk_create', 'icap.delete', 'icap.bulk_delete',
+                   'icap.modify_network', 'icap.refill_pool', 'icap.sync_templates',
+                   'icap.sync_library')
+
+TASK_ROUTES = {}
+TASK_ROUTES.update({x: {'queue': const.VLAB_ICAP_READ_QUEUE} for x in READ_TASKS})
+TASK_ROUTES.update({x: {'queue': const.VLAB_ICAP_LIFECYCLE_QUEUE} for x in LIFECYCLE_TASKS})
+
+
+def queue_for(task_name):
+    """Obtain the name of the queue a task is consumed from
+
+    :Returns: String
+
+    :Raises: KeyError if the task is unknown
+
+    :param task_name: The registered name of the Celery task, i.e. "icap.show"
+    :type task_name: String
+    """
+    return TASK_ROUTES[task_name]['queue']
@@ -0,0 +1,78 @@
+# -*- coding: UTF-8 -*-
+"""
+Remembers recently submitted tasks, so a retried request doesn't create a second task.
+
+A client that times out waiting on ``POST /api/2/inf/icap`` and retries with
+the same ``X-REQUEST-ID`` would otherwise deploy a second ICAP VM (or fail
+minutes later on a duplicate name). Submissions are keyed on the user, the verb
+and that ID; a repeat within the window is handed the original task id without
+publishing anything. The same mechanism collapses identical ``show`` requests
+that arrive close together into a single ``icap.show`` task.
+
+The log is kept in memory, so it only spans the requests served by one API
+process.
+"""
+import time
+import threading
+from concurrent import futures
+
+
+class SubmissionLog(object):
+    """Maps a submission key to the id of the task it created, for ``window`` seconds.
+
+    :param window: How many seconds a submission is remembered for
+    :type window: Integer
+    """
+    def __init__(self, window):
+        self._window = window
+        self._lock = threading.Lock()
+        # key -> (expires at, Future of the task id)
+        self._log = {}
+
+    def submit(self, key, send, window=None):
+        """Obtain the id of the task for a submission, only calling ``send`` the first time.
+
+        Concurrent calls with the same key wait for the first one to publish its
+        task. If ``send`` fails, nothing is remembered, so the next call retries.
+
+        :Returns: String - the id of the task
+
+        :param key: Identifies the submission, like (username, verb, request id)
+        :type key: Tuple
+
+        :param send: Publishes the task, and returns its id
+        :type send: Function
+
+        :param window: Override how many seconds this submission is remembered for
+        :type window: Integer
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._log.get(key)
+            if entry is None:
+                future = futures.Future()
+                expires = now + (self._window if window is None else window)
+                self._log[key] = (expires, future)
+        if entry is not None:
+            # Waited on outside the lock, so a slow publish doesn't hold up every other submission
+            return entry[1].result()
+        try:
+            task_id = send()
+        except Exception as doh:
+            with self._lock:
+                self._log.pop(key, None)
+            future.set_exception(doh)
+            raise
+        future.set_result(task_id)
+        return task_id
+
+    def _expire(self, now):
+        """Forget every submission whose window has passed; call while holding the lock"""
+        for key, (expires, _) in list(self._log.items()):
+            if expires <= now:
+                self._log.pop(key)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._log)
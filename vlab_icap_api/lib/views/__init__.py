@@ -1,3 +1,4 @@
 # -*- coding: UTF-8 -*-
 from .healthcheck import HealthView
-from .icap import IcapView
+from .icap import IcapView, report_broker_busy
+from .metrics import MetricsView, record_requests
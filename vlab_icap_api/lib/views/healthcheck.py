@@ -3,13 +3,20 @@
 Enables Health checks for the power API
 """
 from time import time
+from functools import lru_cache
 import pkg_resources
 
 import ujson
 from flask_classy import FlaskView, Response
-from vlab_inf_common.vmware import vCenter
 
 from vlab_icap_api.lib import const
+from vlab_icap_api.lib.readiness import PROBER
+
+
+@lru_cache(maxsize=1)
+def _version():
+    """The installed version never changes while the API is running"""
+    return pkg_resources.get_distribution('vlab-icap-api').version
 
 
 class HealthView(FlaskView):
@@ -23,8 +30,21 @@ class HealthView(FlaskView):
         """End point for health checks"""
         resp = {}
         status = 200
-        resp['version'] = pkg_resources.get_distribution('vlab-icap-api').version
+        resp['version'] = _version()
         response = Response(ujson.dumps(resp))
         response.status_code = status
         response.headers['Content-Type'] = 'application/json'
         return response
+
+    def ready(self):
+        """End point for readiness checks; is the broker, vCenter and images directory usable?
+
+        Returns the results of the last background check, so it's cheap to call often.
+        """
+        resp = {}
+        ready, resp['checks'] = PROBER.status()
+        resp['version'] = _version()
+        response = Response(ujson.dumps(resp))
+        response.status_code = 200 if ready else 503
+        response.headers['Content-Type'] = 'application/json'
+        return response
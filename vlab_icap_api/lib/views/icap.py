@@ -2,18 +2,29 @@
 """
 Defines the RESTful API for interacting with ICAP servers in vLab
 """
+import time
+
 import ujson
 from flask import current_app
 from flask_classy import request, route, Response
 from vlab_inf_common.views import MachineView
-from vlab_inf_common.vmware import vCenter, vim
 from vlab_api_common import describe, get_logger, requires, validate_input
 
 
 from vlab_icap_api.lib import const
+from vlab_icap_api.lib.admission import AdmissionControl, Throttled
+from vlab_icap_api.lib.images import IMAGES
+from vlab_icap_api.lib.metrics import TASKS_PUBLISHED
+from vlab_icap_api.lib.publisher import BrokerBusy, send_task
+from vlab_icap_api.lib.routes import queue_for
+from vlab_icap_api.lib.submissions import SubmissionLog
 
 
 logger = get_logger(__name__, loglevel=const.VLAB_ICAP_LOG_LEVEL)
+SUBMISSIONS = SubmissionLog(window=const.VLAB_ICAP_DEDUPE_WINDOW)
+ADMISSION = AdmissionControl(user_limit=const.VLAB_ICAP_USER_MAX_CREATES,
+                             queue_limit=const.VLAB_ICAP_MAX_QUEUED_CREATES,
+                             estimate=const.VLAB_ICAP_CREATE_ESTIMATE)
 
 
 class IcapView(MachineView):
@@ -50,12 +61,74 @@ class IcapView(MachineView):
                      },
                      "required": ["name"]
                     }
+    BULK_POST_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                        "type": "object",
+                        "description": "Create several Icap instances at once. Supply either a list of names, or a count and a name prefix; names are then <prefix>1 through <prefix><count>",
+                        "properties": {
+                            "names": {
+                                "description": "The names to give your Icap instances",
+                                "type": "array",
+                                "items": {"type": "string"},
+                                "minItems": 1,
+                                "maxItems": const.VLAB_ICAP_BULK_MAX,
+                                "uniqueItems": True
+                            },
+                            "count": {
+                                "description": "How many Icap instances to create",
+                                "type": "integer",
+                                "minimum": 1,
+                                "maximum": const.VLAB_ICAP_BULK_MAX
+                            },
+                            "prefix": {
+                                "description": "The start of the name of every new Icap instance",
+                                "type": "string"
+                            },
+                            "image": {
+                                "description": "The image/version of Icap to create",
+                                "type": "string"
+                            },
+                            "network": {
+                                "description": "The network to hook the Icap instances up to",
+                                "type": "string"
+                            }
+                        },
+                        "required": ["image", "network"],
+                        "oneOf": [{"required": ["names"]},
+                                  {"required": ["count", "prefix"]}]
+                       }
+    BULK_DELETE_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
+                          "description": "Destroy several Icap instances at once. Supply either a list of names, or all=true",
+                          "type": "object",
+                          "properties": {
+                              "names": {
+                                  "description": "The names of the Icap instances to destroy",
+                                  "type": "array",
+                                  "items": {"type": "string"},
+                                  "minItems": 1,
+                                  "uniqueItems": True
+                              },
+                              "all": {
+                                  "description": "Destroy every Icap instance you own",
+                                  "type": "boolean",
+                                  "enum": [True]
+                              }
+                          },
+                          "oneOf": [{"required": ["names"]},
+                                    {"required": ["all"]}]
+                         }
     GET_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
-                  "description": "Display the Icap instances you own"
+                  "description": "Display the Icap instances you own. Supply the param refresh=true to bypass the cached inventory"
                  }
     IMAGES_SCHEMA = {"$schema": "http://json-schema.org/draft-04/schema#",
                      "description": "View available versions of Icap that can be created"
                     }
+    # Seconds a client should wait before checking on a task again, by phase
+    POLL_INTERVALS = {'queued': 30,
+                      'uploading': 15,
+                      'cloning': 5,
+                      'waiting_for_ip': 5,
+                     }
+    DEFAULT_POLL_INTERVAL = 2
 
 
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
@@ -64,12 +137,16 @@ class IcapView(MachineView):
         """Display the Icap instances you own"""
         username = kwargs['token']['username']
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        refresh = request.args.get('refresh', '').lower() in ('true', '1', 'yes')
         resp_data = {'user' : username}
-        task = current_app.celery_app.send_task('icap.show', [username, txn_id])
-        resp_data['content'] = {'task-id': task.id}
+        # Identical show requests that arrive together share one task
+        task_id = SUBMISSIONS.submit((username, 'show', refresh),
+                                     lambda: self._send_task('icap.show', [username, txn_id], kwargs={'refresh': refresh}),
+                                     window=const.VLAB_ICAP_SHOW_COALESCE_WINDOW)
+        resp_data['content'] = {'task-id': task_id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
         return resp
 
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
@@ -83,11 +160,19 @@ class IcapView(MachineView):
         machine_name = body['name']
         image = body['image']
         network = '{}_{}'.format(username, body['network'])
-        task = current_app.celery_app.send_task('icap.create', [username, machine_name, image, network, txn_id])
-        resp_data['content'] = {'task-id': task.id}
+        error = self._check_image(image)
+        if error:
+            resp_data['content'] = {}
+            resp_data['error'] = error
+            return ujson.dumps(resp_data), 400
+        try:
+            task_id = self._submit('create', username, txn_id, 'icap.create', [username, machine_name, image, network, txn_id], admit=True)
+        except Throttled as doh:
+            return self._throttled(resp_data, doh)
+        resp_data['content'] = {'task-id': task_id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
         return resp
 
     @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
@@ -98,11 +183,116 @@ class IcapView(MachineView):
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
         resp_data = {'user' : username}
         machine_name = kwargs['body']['name']
-        task = current_app.celery_app.send_task('icap.delete', [username, machine_name, txn_id])
-        resp_data['content'] = {'task-id': task.id}
+        task_id = self._submit('delete', username, txn_id, 'icap.delete', [username, machine_name, txn_id])
+        resp_data['content'] = {'task-id': task_id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
+        return resp
+
+    @route('/bulk', methods=["POST"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @validate_input(schema=BULK_POST_SCHEMA)
+    def bulk_create(self, *args, **kwargs):
+        """Create several Icap instances at once"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        body = kwargs['body']
+        if 'names' in body:
+            machine_names = body['names']
+        else:
+            machine_names = ['{}{}'.format(body['prefix'], x) for x in range(1, body['count'] + 1)]
+        image = body['image']
+        network = '{}_{}'.format(username, body['network'])
+        error = self._check_image(image)
+        if error:
+            resp_data['content'] = {}
+            resp_data['error'] = error
+            return ujson.dumps(resp_data), 400
+        try:
+            task_id = self._submit('bulk_create', username, txn_id, 'icap.bulk_create', [username, machine_names, image, network, txn_id],
+                                   admit=len(machine_names))
+        except Throttled as doh:
+            return self._throttled(resp_data, doh)
+        resp_data['content'] = {'task-id': task_id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
+        return resp
+
+    @route('/bulk', methods=["DELETE"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @validate_input(schema=BULK_DELETE_SCHEMA)
+    def bulk_delete(self, *args, **kwargs):
+        """Destroy several Icap instances at once"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        machine_names = kwargs['body'].get('names', None)
+        task_id = self._submit('bulk_delete', username, txn_id, 'icap.bulk_delete', [username, machine_names, txn_id])
+        resp_data['content'] = {'task-id': task_id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
+        return resp
+
+    @route('/network', methods=["PUT"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @validate_input(schema=MachineView.NETWORK_SCHEMA)
+    @describe(put=MachineView.NETWORK_SCHEMA)
+    def modify_network(self, *args, **kwargs):
+        """Change the network an Icap instance is connected to"""
+        username = kwargs['token']['username']
+        txn_id = request.headers.get('X-REQUEST-ID', 'noId')
+        resp_data = {'user' : username}
+        machine_name = kwargs['body']['name']
+        new_network = '{}_{}'.format(username, kwargs['body']['new_network'])
+        task_id = self._submit('modify_network', username, txn_id, 'icap.modify_network',
+                               [username, machine_name, new_network, txn_id])
+        resp_data['content'] = {'task-id': task_id}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 202
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
+        return resp
+
+    @route('/task', methods=["GET"])
+    @route('/task/<tid>', methods=["GET"])
+    @requires(verify=const.VLAB_VERIFY_TOKEN, version=2)
+    @describe(get_args=MachineView.TASK_ARGS)
+    def handle_task(self, *args, **kwargs):
+        """Check the status of a task
+
+        Unlike the generic task end point, a task in the "PROGRESS" state (like
+        ``icap.create``) reports which phase it's in, and every unfinished task
+        sets the Retry-After header so clients know how long to back off.
+        """
+        resp_data = {'user': kwargs['token']['username'], 'content' : {}}
+        if request.args.get('task-id', None) and kwargs.get('tid', None):
+            resp_data['error'] = 'task-id supplied in URL and as param'
+            return ujson.dumps(resp_data), 400
+
+        task_id = request.args.get('task-id', kwargs.get('tid', None))
+        if task_id is None:
+            resp_data['error'] = "no task id provided"
+            return ujson.dumps(resp_data), 400
+
+        result = current_app.celery_app.AsyncResult(task_id)
+        resp_data['content']['status'] = result.status
+        if result.status == 'SUCCESS':
+            if result.result['error']:
+                resp_data.update(result.result)
+                return ujson.dumps(resp_data), 400
+            return ujson.dumps(result.result), 200
+        elif result.status == 'FAILURE':
+            return ujson.dumps(resp_data), 500
+        retry_after = self.DEFAULT_POLL_INTERVAL
+        if result.status == 'PROGRESS' and isinstance(result.info, dict):
+            resp_data['content']['progress'] = result.info
+            retry_after = self.POLL_INTERVALS.get(result.info.get('phase'), retry_after)
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        resp.headers['Retry-After'] = str(retry_after)
         return resp
 
     @route('/image', methods=["GET"])
@@ -113,9 +303,140 @@ class IcapView(MachineView):
         username = kwargs['token']['username']
         txn_id = request.headers.get('X-REQUEST-ID', 'noId')
         resp_data = {'user' : username}
-        task = current_app.celery_app.send_task('icap.image', [txn_id])
-        resp_data['content'] = {'task-id': task.id}
+        try:
+            images, etag = IMAGES.images()
+        except OSError as doh:
+            # Images dir not mounted into the API container; ask a worker
+            logger.debug('Unable to read images directory, falling back to a task: {}'.format(doh))
+        else:
+            if etag in request.if_none_match:
+                resp = Response(status=304)
+            else:
+                resp_data['content'] = {'image': images}
+                resp_data['error'] = None
+                resp_data['params'] = {}
+                resp = Response(ujson.dumps(resp_data))
+                resp.status_code = 200
+                resp.headers['Content-Type'] = 'application/json'
+            resp.set_etag(etag)
+            return resp
+        task_id = self._send_task('icap.image', [txn_id])
+        resp_data['content'] = {'task-id': task_id}
         resp = Response(ujson.dumps(resp_data))
         resp.status_code = 202
-        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task.id))
+        resp.headers.add('Link', '<{0}{1}/task/{2}>; rel=status'.format(const.VLAB_URL, self.route_base, task_id))
+        return resp
+
+    def _send_task(self, task_name, args, kwargs=None):
+        """Publish a task to the queue it belongs on
+
+        :Returns: String - the id of the new task
+
+        :param task_name: The registered name of the Celery task, i.e. "icap.create"
+        :type task_name: String
+
+        :param args: The positional arguments for the task
+        :type args: List
+
+        :param kwargs: The keyword arguments for the task
+        :type kwargs: Dictionary
+        """
+        # The worker measures how long the task waited in the queue from this
+        options = {'queue': queue_for(task_name), 'headers': {'published_at': time.time()}}
+        if kwargs is not None:
+            options['kwargs'] = kwargs
+        task_id = send_task(current_app.celery_app, task_name, args, **options).id
+        TASKS_PUBLISHED.labels(task=task_name).inc()
+        return task_id
+
+    def _submit(self, verb, username, txn_id, task_name, args, admit=False):
+        """Publish a task, unless the client already submitted this request.
+
+        A retry with the same X-REQUEST-ID gets the id of the original task.
+        Requests without an X-REQUEST-ID are never deduplicated.
+
+        :Returns: String - the id of the task
+
+        :Raises: Throttled if ``admit`` is set, and the create limits are reached
+
+        :param verb: What the request does, i.e. "create"
+        :type verb: String
+
+        :param username: The user who sent the request
+        :type username: String
+
+        :param txn_id: The X-REQUEST-ID of the request
+        :type txn_id: String
+
+        :param task_name: The registered name of the Celery task, i.e. "icap.create"
+        :type task_name: String
+
+        :param args: The positional arguments for the task
+        :type args: List
+
+        :param admit: Set to how many ICAP instances the task creates (or True for one)
+                      to enforce the create limits
+        :type admit: Integer
+        """
+        if admit:
+            send = lambda: ADMISSION.admit(current_app.celery_app, username, lambda: self._send_task(task_name, args),
+                                           weight=int(admit))
+        else:
+            send = lambda: self._send_task(task_name, args)
+        if txn_id == 'noId':
+            return send()
+        return SUBMISSIONS.submit((username, verb, txn_id), send)
+
+    @staticmethod
+    def _check_image(image):
+        """Reject a create for an image that doesn't exist or isn't verified,
+        before it's queued behind other creates
+
+        :Returns: String - why the image cannot be deployed, or None
+
+        :param image: The image/version of Icap to create
+        :type image: String
+        """
+        try:
+            IMAGES.check(image)
+        except ValueError as doh:
+            return '{}'.format(doh)
+        except OSError as doh:
+            # Images dir not mounted into the API container; the worker checks it
+            logger.debug('Unable to read images directory, skipping image check: {}'.format(doh))
+        return None
+
+    def _throttled(self, resp_data, error):
+        """Build the HTTP 429 response for a create that wasn't admitted
+
+        :Returns: flask.Response
+
+        :param resp_data: The body of the response
+        :type resp_data: Dictionary
+
+        :param error: Why the create wasn't admitted
+        :type error: Throttled
+        """
+        resp_data['content'] = {}
+        resp_data['error'] = '{}'.format(error)
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 429
+        resp.headers['Retry-After'] = str(error.retry_after)
+        return resp
+
+
+def report_broker_busy(app):
+    """Answer with an HTTP 503, instead of a 500, when a task cannot be published in time
+
+    :Returns: None
+
+    :param app: The API
+    :type app: flask.Flask
+    """
+    @app.errorhandler(BrokerBusy)
+    def broker_busy(error):
+        resp_data = {'content': {}, 'error': '{}'.format(error), 'params': {}}
+        resp = Response(ujson.dumps(resp_data))
+        resp.status_code = 503
+        resp.headers['Retry-After'] = str(error.retry_after)
         return resp
@@ -0,0 +1,47 @@
+# -*- coding: UTF-8 -*-
+"""
+Exposes the metrics of the API and the workers for Prometheus to scrape
+"""
+import time
+
+from flask import g, request
+from flask_classy import FlaskView, Response
+
+from vlab_icap_api.lib.metrics import API_SECONDS, CONTENT_TYPE, render
+
+
+class MetricsView(FlaskView):
+    """
+    End point that reports task, vCenter and request metrics
+    """
+    route_base = '/api/1/inf/icap/metrics'
+    trailing_slash = False
+
+    def get(self):
+        """End point for scraping metrics"""
+        response = Response(render())
+        response.status_code = 200
+        response.headers['Content-Type'] = CONTENT_TYPE
+        return response
+
+
+def record_requests(app):
+    """Time every request the app answers
+
+    :Returns: None
+
+    :param app: The API
+    :type app: flask.Flask
+    """
+    @app.before_request
+    def start_timer():
+        g.metrics_started = time.time()
+
+    @app.after_request
+    def stop_timer(response):
+        started = getattr(g, 'metrics_started', None)
+        if started is not None:
+            endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+            API_SECONDS.labels(method=request.method, endpoint=endpoint,
+                               status=response.status_code).observe(time.time() - started)
+        return response
@@ -0,0 +1,256 @@
+# -*- coding: UTF-8 -*-
+"""
+A cache of each user's ICAP inventory, so ``icap.show`` doesn't have to walk
+vCenter every time a client polls.
+
+The cache is a directory of JSON files (one per user) so that every worker
+process on a host shares it; mount the same directory into every worker
+container to share it between hosts. Only ``icap.create``, ``icap.delete`` and
+``icap.modify_network`` change an inventory, and they update the cache when they
+finish, so the TTL only has to cover changes made outside of this service.
+
+Every change also bumps a per-user generation number. ``icap.show`` reads it
+before walking vCenter, and the inventory it found is only stored if no change
+landed during the walk; otherwise the slower walk would overwrite a newer
+update with what vCenter looked like before it.
+
+The ``console`` URL of each VM is never cached. It contains a single-use session
+ticket, so ``icap.show`` makes new ones every time (see ``vmware.add_consoles``).
+"""
+import os
+import time
+import fcntl
+import tempfile
+from urllib.parse import quote
+from contextlib import contextmanager
+
+import ujson
+from vlab_api_common import get_logger
+
+from vlab_icap_api.lib import const
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_ICAP_LOG_LEVEL)
+# VM info that's only good once, so it's never stored
+UNCACHED = ('console',)
+
+
+class InventoryCache(object):
+    """Stores the output of ``show_icap`` per user, for ``ttl`` seconds.
+
+    Failing to read or write the cache is never fatal; it just means the next
+    ``icap.show`` will query vCenter.
+
+    :param cache_dir: The directory to store the cached inventories in
+    :type cache_dir: String
+
+    :param ttl: How many seconds a cached inventory is valid for
+    :type ttl: Integer
+    """
+    def __init__(self, cache_dir, ttl):
+        self._cache_dir = os.path.join(cache_dir, 'inventory')
+        self._ttl = ttl
+
+    def _path(self, username):
+        """The location of a user's cached inventory"""
+        return os.path.join(self._cache_dir, '{}.json'.format(quote(username, safe='')))
+
+    @contextmanager
+    def _locked(self, username):
+        """Serialize read-modify-write updates to a user's inventory between processes"""
+        os.makedirs(self._cache_dir, exist_ok=True)
+        with open('{}.lock'.format(self._path(username)), 'w') as the_lock:
+            fcntl.flock(the_lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(the_lock, fcntl.LOCK_UN)
+
+    def _generation_path(self, username):
+        """The location of the counter of changes to a user's inventory"""
+        return '{}.gen'.format(self._path(username))
+
+    def generation(self, username):
+        """The number of changes made to a user's inventory; read it before
+        querying vCenter, and pass it to ``set``.
+
+        :Returns: Integer
+
+        :param username: The user who owns the ICAP instances
+        :type username: String
+        """
+        try:
+            with open(self._generation_path(username)) as the_file:
+                return int(the_file.read())
+        except (OSError, ValueError):
+            return 0
+
+    def _bump(self, username):
+        """Record a change to a user's inventory; the caller must hold ``_locked``"""
+        os.makedirs(self._cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as the_file:
+                the_file.write('{}'.format(self.generation(username) + 1))
+            os.replace(tmp_path, self._generation_path(username))
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+
+    def _read(self, username):
+        """Load a user's inventory, if it's still valid
+
+        :Returns: Dictionary or None
+        """
+        try:
+            with open(self._path(username)) as the_file:
+                entry = ujson.load(the_file)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry['stored'] > self._ttl:
+            return None
+        return entry['vms']
+
+    def _write(self, username, vms, stored=None):
+        """Atomically replace a user's cached inventory"""
+        vms = {name: {k: v for k, v in info.items() if k not in UNCACHED} for name, info in vms.items()}
+        entry = {'stored': stored if stored else time.time(), 'vms': vms}
+        os.makedirs(self._cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self._cache_dir)
+        try:
+            with os.fdopen(fd, 'w') as the_file:
+                ujson.dump(entry, the_file)
+            os.replace(tmp_path, self._path(username))
+        except OSError:
+            os.unlink(tmp_path)
+            raise
+
+    def get(self, username):
+        """Obtain a user's cached ICAP inventory
+
+        :Returns: Dictionary or None if there's no valid cached inventory
+
+        :param username: The user who owns the ICAP instances
+        :type username: String
+        """
+        return self._read(username)
+
+    def set(self, username, vms, generation=None):
+        """Replace a user's cached ICAP inventory
+
+        :Returns: None
+
+        :param username: The user who owns the ICAP instances
+        :type username: String
+
+        :param vms: The output of ``show_icap``
+        :type vms: Dictionary
+
+        :param generation: The output of ``generation`` from before ``show_icap``
+                           was called; if the inventory changed since, nothing is stored
+        :type generation: Integer
+        """
+        try:
+            with self._locked(username):
+                if generation is not None and generation != self.generation(username):
+                    logger.debug('Not caching inventory for {}; it changed while being queried'.format(username))
+                    return
+                self._write(username, vms)
+        except OSError as doh:
+            logger.error('Unable to cache inventory for {}: {}'.format(username, doh))
+
+    def update(self, username, vms):
+        """Add/replace instances in a user's cached inventory.
+
+        Does nothing if the user has no valid cached inventory; the next
+        ``icap.show`` will query vCenter anyway.
+
+        :Returns: None
+
+        :param username: The user who owns the ICAP instances
+        :type username: String
+
+        :param vms: A mapping of VM name to the VM info
+        :type vms: Dictionary
+        """
+        self._modify(username, lambda cached: cached.update(vms))
+
+    def remove(self, username, machine_name):
+        """Delete an instance from a user's cached inventory
+
+        :Returns: None
+
+        :param username: The user who owns the ICAP instance
+        :type username: String
+
+        :param machine_name: The name of the deleted ICAP instance
+        :type machine_name: String
+        """
+        self._modify(username, lambda cached: cached.pop(machine_name, None))
+
+    def _modify(self, username, change):
+        """Apply a change to a valid cached inventory, without extending its TTL"""
+        try:
+            with self._locked(username):
+                # Even with nothing cached, a query running now is already out of date
+                self._bump(username)
+                try:
+                    with open(self._path(username)) as the_file:
+                        entry = ujson.load(the_file)
+                except (OSError, ValueError):
+                    return
+                if time.time() - entry['stored'] > self._ttl:
+                    return
+                change(entry['vms'])
+                self._write(username, entry['vms'], stored=entry['stored'])
+        except OSError as doh:
+            logger.error('Unable to update cached inventory for {}: {}'.format(username, doh))
+            self.invalidate(username)
+
+    def invalidate(self, username):
+        """Forget a user's cached inventory
+
+        :Returns: None
+
+        :param username: The user who owns the ICAP instances
+        :type username: String
+        """
+        try:
+            with self._locked(username):
+                self._bump(username)
+                try:
+                    os.unlink(self._path(username))
+                except FileNotFoundError:
+                    pass
+        except OSError as doh:
+            logger.error('Unable to invalidate cached inventory for {}: {}'.format(username, doh))
+
+
+@contextmanager
+def host_lock(name, blocking=True):
+    """Serialize some work between every worker process on a host
+
+    :Returns: Boolean - True if the lock was acquired
+
+    :param name: The name of the lock
+    :type name: String
+
+    :param blocking: Set to False to give up right away if the lock is held
+    :type blocking: Boolean
+    """
+    os.makedirs(const.VLAB_ICAP_CACHE_DIR, exist_ok=True)
+    lock_file = os.path.join(const.VLAB_ICAP_CACHE_DIR, '{}.lock'.format(name))
+    with open(lock_file, 'w') as the_lock:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(the_lock, flags)
+        except BlockingIOError:
+            yield False
+        else:
+            try:
+                yield True
+            finally:
+                fcntl.flock(the_lock, fcntl.LOCK_UN)
+
+
+INVENTORY = InventoryCache(const.VLAB_ICAP_CACHE_DIR, const.VLAB_ICAP_INVENTORY_TTL)
@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+"""
+Enforces the ``time_limit`` of a task from inside the worker.
+
+Celery only enforces time limits with the "prefork" pool, by killing the child
+process that runs the task; a thread can't be killed, so the "threads" pool
+ignores them. Instead, every blocking wait in the worker (on a vCenter task, an
+IP, a deploy slot, or an OVA upload) is cut short at the deadline of the task
+running in that thread.
+"""
+import time
+import threading
+
+
+_LOCAL = threading.local()
+
+
+class DeadlineExceeded(RuntimeError):
+    """Raised when a task has run longer than its time limit"""
+    pass
+
+
+def start(seconds):
+    """Set the deadline of the task running in this thread
+
+    :Returns: None
+
+    :param seconds: The time limit of the task; None or zero means no limit
+    :type seconds: Integer
+    """
+    _LOCAL.deadline = time.time() + seconds if seconds else None
+
+
+def adopt(deadline):
+    """Give a helper thread the deadline of the task that started it
+
+    :Returns: None
+
+    :param deadline: The output of ``current`` in the task's thread; None means no limit
+    :type deadline: Float
+    """
+    _LOCAL.deadline = deadline
+
+
+def clear():
+    """Remove the deadline of this thread, once its task is done
+
+    :Returns: None
+    """
+    _LOCAL.deadline = None
+
+
+def current():
+    """The deadline of the task running in this thread; hand it to any helper
+    threads the task starts, which don't share it.
+
+    :Returns: Float (a Unix timestamp) or None
+    """
+    return getattr(_LOCAL, 'deadline', None)
+
+
+def check(deadline):
+    """Raise if a deadline from ``current`` has passed
+
+    :Returns: None
+
+    :Raises: DeadlineExceeded
+
+    :param deadline: The deadline to check; None means no limit
+    :type deadline: Float
+    """
+    if deadline is not None and time.time() >= deadline:
+        raise DeadlineExceeded('Task time limit exceeded')
+
+
+def remaining(timeout=None):
+    """Cap a timeout at the time left before the deadline of the running task
+
+    :Returns: Float, or None if there's no timeout and no deadline
+
+    :Raises: DeadlineExceeded if the deadline has already passed
+
+    :param timeout: How many seconds the caller would wait; None means forever
+    :type timeout: Integer
+    """
+    deadline = current()
+    if deadline is None:
+        return timeout
+    check(deadline)
+    left = max(0.0, deadline - time.time())
+    if timeout is None:
+        return left
+    return min(timeout, left)
@@ -0,0 +1,201 @@
+# -*- coding: UTF-8 -*-
+"""
+Bulk lookups of virtual machine properties via the vCenter PropertyCollector.
+
+Reading a property off a pyVmomi object is a round-trip to vCenter, so looping
+over a folder and inspecting every VM gets slow in a hurry. These functions
+obtain the same information in one (or a few paginated) API calls.
+"""
+import ujson
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim
+
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.metrics import VCENTER_SECONDS, timed
+
+
+# The properties needed to build the same output as ``virtual_machine.get_info``
+VM_INFO_PROPERTIES = ['name', 'runtime.powerState', 'config.annotation', 'guest.net', 'network']
+
+UNKNOWN_META = {'component': 'Unknown',
+                'created': 0,
+                'version': "Unknown",
+                'generation': 0,
+                'configured': False,
+               }
+
+
+def retrieve_vms(vcenter, folder, properties):
+    """Obtain properties for every virtual machine directly within a folder
+
+    :Returns: Dictionary, of vim.VirtualMachine -> {property path: value}
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The folder that contains the virtual machines
+    :type folder: vim.Folder
+
+    :param properties: The property paths to retrieve, i.e. "runtime.powerState"
+    :type properties: List
+    """
+    traversal = vmodl.query.PropertyCollector.TraversalSpec(name='folderToChildren',
+                                                            type=vim.Folder,
+                                                            path='childEntity',
+                                                            skip=False)
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=folder, skip=True, selectSet=[traversal])
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=properties)
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+    collector = vcenter.content.propertyCollector
+    vms = {}
+    with timed(VCENTER_SECONDS, op='retrieve'):
+        result = collector.RetrievePropertiesEx(specSet=[filter_spec],
+                                                options=vmodl.query.PropertyCollector.RetrieveOptions())
+        while result:
+            for obj in result.objects:
+                vms[obj.obj] = {x.name: x.val for x in obj.propSet}
+            if result.token:
+                result = collector.ContinueRetrievePropertiesEx(token=result.token)
+            else:
+                break
+    return vms
+
+
+def parse_meta(annotation):
+    """Convert the notes of a VM into the vLab meta data
+
+    :Returns: Dictionary
+
+    :param annotation: The notes/annotation of a VM; None if the VM has no config
+    :type annotation: String
+    """
+    try:
+        return ujson.loads(annotation)
+    except (ValueError, TypeError):
+        # ValueError -> VM created, but notes not updated
+        # TypeError  -> VM failed to be created; notes are None
+        return dict(UNKNOWN_META)
+
+
+def get_ips(guest_net):
+    """Obtain the IPs of a VM from its ``guest.net`` property
+
+    :Returns: List
+
+    :param guest_net: The guest NIC info for a VM
+    :type guest_net: List of vim.vm.GuestInfo.NicInfo
+    """
+    ips = []
+    for nic in guest_net or []:
+        ips += nic.ipAddress
+    # No point is showing the IPv6 link local addrs if a firewall wont forward them
+    return [x for x in ips if not x.startswith('fe80::')]
+
+
+def get_networks(vcenter, username, vm_networks):
+    """Obtain the names of the user's networks a VM is connected to
+
+    :Returns: List
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param username: The name of the user who owns the VM
+    :type username: String
+
+    :param vm_networks: The ``network`` property of the VM
+    :type vm_networks: List of vim.Network
+    """
+    connected = {x._moId for x in vm_networks or []}
+    networks = []
+    for net_name, net_object in vcenter.networks.items():
+        if net_name.startswith(username) and net_object._moId in connected:
+            networks.append(net_name.replace('{}_'.format(username), ''))
+    return networks
+
+
+def get_folder(vcenter, name, create=False):
+    """Obtain one of the folders this service keeps under ``INF_VCENTER_TOP_LVL_DIR``
+
+    :Returns: vim.Folder, or None if it doesn't exist
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param name: The name of the folder
+    :type name: String
+
+    :param create: Set to True to make the folder if it doesn't exist
+    :type create: Boolean
+    """
+    try:
+        return vcenter.get_by_name(name=name, vimtype=vim.Folder)
+    except ValueError:
+        if not create:
+            return None
+    vcenter.create_vm_folder('{}/{}'.format(const.INF_VCENTER_TOP_LVL_DIR, name))
+    return vcenter.get_by_name(name=name, vimtype=vim.Folder)
+
+
+def find_icap(vcenter, folder, machine_name):
+    """Look up an ICAP instance by name, without inspecting every VM in the folder
+
+    :Returns: vim.VirtualMachine, or None if there's no ICAP instance with that name
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The folder that contains the virtual machine
+    :type folder: vim.Folder
+
+    :param machine_name: The name of the virtual machine
+    :type machine_name: String
+    """
+    the_vm = vcenter.content.searchIndex.FindChild(entity=folder, name=machine_name)
+    if not isinstance(the_vm, vim.VirtualMachine):
+        return None
+    if read_meta(vcenter, the_vm)['component'] != 'ICAP':
+        return None
+    return the_vm
+
+
+def read_meta(vcenter, the_vm):
+    """Obtain the vLab meta data of a single VM, without fetching its whole config
+
+    :Returns: Dictionary
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_vm: The virtual machine
+    :type the_vm: vim.VirtualMachine
+    """
+    return parse_meta(read_props(vcenter, the_vm, ['config.annotation']).get('config.annotation'))
+
+
+def read_props(vcenter, the_vm, properties):
+    """Obtain only the named properties of a single VM
+
+    :Returns: Dictionary, of property path -> value
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_vm: The virtual machine
+    :type the_vm: vim.VirtualMachine
+
+    :param properties: The property paths to retrieve, i.e. ``config.annotation``
+    :type properties: List
+    """
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=the_vm, skip=False)
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=properties)
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+    with timed(VCENTER_SECONDS, op='retrieve'):
+        result = vcenter.content.propertyCollector.RetrievePropertiesEx(specSet=[filter_spec],
+                                                                        options=vmodl.query.PropertyCollector.RetrieveOptions())
+    props = {}
+    if result:
+        for obj in result.objects:
+            for prop in obj.propSet:
+                props[prop.name] = prop.val
+    return props
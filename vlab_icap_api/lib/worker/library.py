@@ -0,0 +1,442 @@
+# -*- coding: UTF-8 -*-
+"""
+A vCenter content library of every ICAP image, on ``INF_VCENTER_DATASTORE``.
+
+When ``VLAB_ICAP_DEPLOY_MODE`` is "library", each verified OVA in
+``VLAB_ICAP_IMAGES_DIR`` is published once as an OVF item of the
+``VLAB_ICAP_LIBRARY_NAME`` library. A create then asks vCenter to deploy that
+item, so the disks are copied within vSphere instead of being streamed from the
+worker for every new instance.
+
+Each item records the inode, mtime and size of the OVA it was made from (the
+same key as ``ImageIndex``), so an item is stale once the OVA is replaced.
+``icap.sync_library`` publishes the versions that are missing or stale, and
+removes the items of OVAs that were deleted; it runs when a worker starts, and
+again whenever a create finds its version isn't staged yet.
+
+pyVmomi has no content library API, so this talks to the vCenter REST API.
+"""
+import os
+import time
+import uuid
+import base64
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlencode
+
+import ujson
+from celery import current_app
+from vlab_inf_common.ssl_context import get_context
+
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.images import INDEX, convert_name
+from vlab_icap_api.lib.worker import deadlines
+from vlab_icap_api.lib.worker.uploads import DiskUploader
+
+
+# Seconds to wait on a REST call; a deploy waits up to the time limit of a create
+REQUEST_TIMEOUT = 60
+# Seconds between checks on an update session that's importing an OVA
+SESSION_POLL_INTERVAL = 1
+
+
+def enabled():
+    """Determine if new instances should be deployed from the content library
+
+    :Returns: Boolean
+    """
+    return const.VLAB_ICAP_DEPLOY_MODE == 'library'
+
+
+def item_name(image):
+    """The name of the library item for a version of ICAP
+
+    :Returns: String
+
+    :param image: The image/version of Icap
+    :type image: String
+    """
+    return 'icap-{}'.format(image)
+
+
+class LibraryClient(object):
+    """Calls the vCenter REST API, with one session shared by every thread in a process.
+
+    :param server: The vCenter server
+    :type server: String
+
+    :param port: The port of the vCenter server
+    :type port: Integer
+
+    :param user: The user to log in as
+    :type user: String
+
+    :param password: The password of the user
+    :type password: String
+    """
+    def __init__(self, server, port, user, password):
+        self._base_url = 'https://{}:{}'.format(server, port)
+        self._user = user
+        self._password = password
+        self._init_state()
+
+    def _init_state(self):
+        """Forget the session, and start over in the current process"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._session_id = None
+        self._library_id = None
+
+    def _check_pid(self):
+        """A forked child must not share the session of its parent"""
+        if self._pid != os.getpid():
+            self._init_state()
+
+    @property
+    def session_id(self):
+        """The ID of the REST session, logging in if needed
+
+        :Returns: String
+        """
+        self._check_pid()
+        with self._lock:
+            if self._session_id is None:
+                creds = base64.b64encode('{}:{}'.format(self._user, self._password).encode()).decode()
+                request = urllib.request.Request(self._base_url + '/rest/com/vmware/cis/session', method='POST',
+                                                 headers={'Authorization': 'Basic {}'.format(creds)})
+                with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT, context=get_context()) as resp:
+                    self._session_id = ujson.loads(resp.read())['value']
+            return self._session_id
+
+    def call(self, method, path, body=None, params=None, timeout=REQUEST_TIMEOUT):
+        """Make a REST call, logging in again if the session expired
+
+        :Returns: The "value" of the response, or None
+
+        :Raises: RuntimeError if vCenter rejects the call
+
+        :param method: The HTTP method, i.e. "GET"
+        :type method: String
+
+        :param path: The location of the API, i.e. "/rest/com/vmware/content/library"
+        :type path: String
+
+        :param body: Sent as JSON
+        :type body: Dictionary
+
+        :param params: The query parameters
+        :type params: Dictionary
+        """
+        url = self._base_url + path
+        if params:
+            url = '{}{}{}'.format(url, '&' if '?' in url else '?', urlencode(params))
+        data = None if body is None else ujson.dumps(body).encode()
+        for attempt in range(2):
+            session_id = self.session_id
+            request = urllib.request.Request(url, data=data, method=method,
+                                             headers={'vmware-api-session-id': session_id,
+                                                      'Content-Type': 'application/json'})
+            try:
+                with urllib.request.urlopen(request, timeout=timeout, context=get_context()) as resp:
+                    payload = resp.read()
+            except urllib.error.HTTPError as doh:
+                if doh.code == 401 and attempt == 0:
+                    self._expire(session_id)
+                    continue
+                raise RuntimeError('{} {} failed: HTTP {} {}'.format(method, path, doh.code, _error_message(doh.read())))
+            if not payload:
+                return None
+            return ujson.loads(payload).get('value')
+
+    def _expire(self, session_id):
+        """Log in again on the next call, unless another thread already did"""
+        with self._lock:
+            if self._session_id == session_id:
+                self._session_id = None
+
+    @property
+    def library_id(self):
+        """The ID of the ``VLAB_ICAP_LIBRARY_NAME`` library; None if it doesn't exist
+
+        :Returns: String
+        """
+        if self._library_id is None:
+            found = self.call('POST', '/rest/com/vmware/content/library?~action=find',
+                              body={'spec': {'name': const.VLAB_ICAP_LIBRARY_NAME}})
+            if found:
+                self._library_id = found[0]
+        return self._library_id
+
+    def create_library(self, datastore_id):
+        """Make the ``VLAB_ICAP_LIBRARY_NAME`` library, if it doesn't exist
+
+        :Returns: String - the ID of the library
+
+        :param datastore_id: The managed object ID of the datastore to keep the library on
+        :type datastore_id: String
+        """
+        if self.library_id is None:
+            spec = {'name': const.VLAB_ICAP_LIBRARY_NAME,
+                    'description': 'ICAP images, managed by vlab_icap_api',
+                    'type': 'LOCAL',
+                    'storage_backings': [{'type': 'DATASTORE', 'datastore_id': datastore_id}],
+                   }
+            self._library_id = self.call('POST', '/rest/com/vmware/content/local-library',
+                                         body={'create_spec': spec, 'client_token': str(uuid.uuid4())})
+        return self._library_id
+
+
+def _error_message(body):
+    """Pull the messages out of a vCenter REST error, if there are any"""
+    try:
+        value = ujson.loads(body)['value']
+        return '; '.join(x['default_message'] for x in value.get('messages', []))
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return body.decode(errors='replace')[:200]
+
+
+def list_items(client):
+    """Obtain the ICAP items in the library, along with their meta data
+
+    :Returns: Dictionary, of version -> (item ID, meta data)
+
+    :param client: A session with the vCenter REST API
+    :type client: LibraryClient
+    """
+    found = {}
+    if client.library_id is None:
+        return found
+    for item_id in client.call('GET', '/rest/com/vmware/content/library/item', params={'library_id': client.library_id}):
+        item = client.call('GET', '/rest/com/vmware/content/library/item/id:{}'.format(item_id))
+        meta = _parse_meta(item.get('description'))
+        if meta.get('component') == 'ICAP':
+            found[meta['version']] = (item_id, meta)
+    return found
+
+
+def _parse_meta(description):
+    """The meta data of a library item is JSON in its description"""
+    try:
+        meta = ujson.loads(description or '')
+    except ValueError:
+        return {}
+    return meta if isinstance(meta, dict) else {}
+
+
+def is_stale(image, meta):
+    """Determine if the OVA was deleted, replaced, or failed verification after the item was made from it
+
+    Only verified OVAs are published, so an item made from the current OVA is
+    still good while that OVA waits to be verified again (i.e. a cold index).
+
+    :Returns: Boolean
+
+    :param image: The image/version of Icap
+    :type image: String
+
+    :param meta: The meta data of the library item
+    :type meta: Dictionary
+    """
+    name = convert_name(image)
+    if INDEX.key(name) != meta.get('key'):
+        return True
+    result = INDEX.result(name)
+    return result is not None and not result['ok']
+
+
+def find_item(client, image):
+    """Look up the library item of a version of ICAP
+
+    :Returns: String - the ID of the item, or None if the version isn't staged or is stale
+
+    :param client: A session with the vCenter REST API
+    :type client: LibraryClient
+
+    :param image: The image/version of Icap
+    :type image: String
+    """
+    if client.library_id is None:
+        return None
+    found = client.call('POST', '/rest/com/vmware/content/library/item?~action=find',
+                        body={'spec': {'library_id': client.library_id, 'name': item_name(image)}})
+    if not found:
+        return None
+    item = client.call('GET', '/rest/com/vmware/content/library/item/id:{}'.format(found[0]))
+    if is_stale(image, _parse_meta(item.get('description'))):
+        return None
+    return found[0]
+
+
+def publish(client, info, image, logger):
+    """Upload the OVF and disks of an OVA into a new library item
+
+    :Returns: String - the ID of the item
+
+    :Raises: RuntimeError if vCenter rejects the upload
+
+    :param client: A session with the vCenter REST API
+    :type client: LibraryClient
+
+    :param info: The parsed contents of the OVA
+    :type info: vlab_icap_api.lib.worker.ovas.OvaInfo
+
+    :param image: The image/version of Icap
+    :type image: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    result = INDEX.result(convert_name(image))
+    meta = {'component': 'ICAP',
+            'version': image,
+            'key': result['key'] if result else None,
+            'created': time.time(),
+           }
+    spec = {'library_id': client.library_id,
+            'name': item_name(image),
+            'description': ujson.dumps(meta),
+            'type': 'ovf',
+           }
+    item_id = client.call('POST', '/rest/com/vmware/content/library/item',
+                          body={'create_spec': spec, 'client_token': str(uuid.uuid4())})
+    session_id = client.call('POST', '/rest/com/vmware/content/library/item/update-session',
+                             body={'create_spec': {'library_item_id': item_id}, 'client_token': str(uuid.uuid4())})
+    try:
+        ovf = info.ovf.encode()
+        ovf_name = '{}.ovf'.format(item_name(image))
+        endpoint = _add_file(client, session_id, ovf_name, len(ovf))
+        request = urllib.request.Request(endpoint, data=ovf, method='PUT',
+                                         headers={'vmware-api-session-id': client.session_id,
+                                                  'Content-Type': 'text/ovf'})
+        with urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT, context=get_context()) as resp:
+            resp.read()
+        disks = [(x, _add_file(client, session_id, x.name, x.size)) for x in info.members]
+        uploader = DiskUploader(info.path, None, const.INF_VCENTER_SERVER, method='PUT',
+                                headers={'vmware-api-session-id': client.session_id,
+                                         'Content-Type': 'application/octet-stream'})
+        uploader.upload(disks)
+        path = '/rest/com/vmware/content/library/item/update-session/id:{}'.format(session_id)
+        client.call('POST', path + '?~action=complete')
+        _wait_for_session(client, path)
+    except Exception as doh:
+        logger.error('Failed to publish ICAP {} to the content library: {}'.format(image, doh))
+        try:
+            delete_item(client, item_id)
+        except RuntimeError as err:
+            logger.error('Unable to remove the partial library item of ICAP {}: {}'.format(image, err))
+        raise
+    logger.info('Published ICAP {} to the content library'.format(image))
+    return item_id
+
+
+def _add_file(client, session_id, name, size):
+    """Tell an update session a file is coming
+
+    :Returns: String - the URL to upload the file to
+    """
+    value = client.call('POST', '/rest/com/vmware/content/library/item/updatesession/file/id:{}?~action=add'.format(session_id),
+                        body={'file_spec': {'name': name, 'source_type': 'PUSH', 'size': size}})
+    return value['upload_endpoint']['uri']
+
+
+def _wait_for_session(client, path):
+    """Block until vCenter has imported every file of an update session
+
+    :Raises: RuntimeError if the import failed
+    """
+    deadline = time.time() + deadlines.remaining(const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT)
+    while time.time() < deadline:
+        session = client.call('GET', path)
+        if session['state'] == 'DONE':
+            return
+        elif session['state'] in ('ERROR', 'CANCELED'):
+            message = (session.get('error_message') or {}).get('default_message', session['state'])
+            raise RuntimeError('Content library import failed: {}'.format(message))
+        time.sleep(SESSION_POLL_INTERVAL)
+    raise RuntimeError('Timed out waiting on the content library import')
+
+
+def delete_item(client, item_id):
+    """Remove an item from the library, along with its files on the datastore
+
+    :Returns: None
+
+    :param client: A session with the vCenter REST API
+    :type client: LibraryClient
+
+    :param item_id: The ID of the library item
+    :type item_id: String
+    """
+    client.call('DELETE', '/rest/com/vmware/content/library/item/id:{}'.format(item_id))
+
+
+def deploy(client, item_id, machine_name, ova_network, network_id, folder_id, pool_id, datastore_id):
+    """Have vCenter make a new VM from a library item
+
+    :Returns: String - the managed object ID of the new VM
+
+    :Raises: RuntimeError if the deploy fails
+
+    :param client: A session with the vCenter REST API
+    :type client: LibraryClient
+
+    :param item_id: The ID of the library item
+    :type item_id: String
+
+    :param machine_name: The name of the new VM
+    :type machine_name: String
+
+    :param ova_network: The name of the network within the OVA
+    :type ova_network: String
+
+    :param network_id: The managed object ID of the network to connect the new VM to
+    :type network_id: String
+
+    :param folder_id: The managed object ID of the folder to put the new VM in
+    :type folder_id: String
+
+    :param pool_id: The managed object ID of the resource pool of the new VM
+    :type pool_id: String
+
+    :param datastore_id: The managed object ID of the datastore to put the new VM on
+    :type datastore_id: String
+    """
+    body = {'target': {'resource_pool_id': pool_id, 'folder_id': folder_id},
+            'deployment_spec': {'name': machine_name,
+                                'accept_all_EULA': True,
+                                'default_datastore_id': datastore_id,
+                                # The REST API sends maps as a list of key/value pairs
+                                'network_mappings': [{'key': ova_network, 'value': network_id}],
+                               },
+            'client_token': str(uuid.uuid4()),
+           }
+    result = client.call('POST', '/rest/com/vmware/vcenter/ovf/library-item/id:{}?~action=deploy'.format(item_id),
+                         body=body, timeout=const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT)
+    if not result.get('succeeded'):
+        errors = (result.get('error') or {}).get('errors', [])
+        message = '; '.join(x.get('error', {}).get('default_message', '') for x in errors if isinstance(x, dict))
+        raise RuntimeError('Deploy of {} failed: {}'.format(machine_name, message or 'unknown error'))
+    return result['resource_id']['id']
+
+
+_last_sync_request = 0.0
+
+
+def request_sync():
+    """Queue ``icap.sync_library``, at most once per ``VLAB_ICAP_IMAGE_SCAN_INTERVAL``
+    per process. Called when a create finds its version isn't staged.
+
+    :Returns: Boolean - True if a sync was queued
+    """
+    global _last_sync_request
+    now = time.time()
+    if now - _last_sync_request < const.VLAB_ICAP_IMAGE_SCAN_INTERVAL:
+        return False
+    _last_sync_request = now
+    current_app.send_task('icap.sync_library', args=['libraryMiss'])
+    return True
+
+
+CLIENT = LibraryClient(const.INF_VCENTER_SERVER, const.INF_VCENTER_PORT, const.INF_VCENTER_USER,
+                       const.INF_VCENTER_PASSWORD)
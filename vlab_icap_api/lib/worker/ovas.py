@@ -0,0 +1,193 @@
+# -*- coding: UTF-8 -*-
+"""
+A per-worker cache of what's inside each ICAP OVA.
+
+Constructing an ``Ova`` scans every header in the tarball and parses the OVF
+descriptor. That's the same work for every create of the same version, and
+validating the network only needs the descriptor. The descriptor and the
+location of every file in the archive are cached here, keyed by the path, mtime
+and size of the OVA, so a create only opens the archive to stream the disks.
+"""
+import re
+import os
+import time
+import tarfile
+import threading
+
+from pyVmomi import vmodl
+from vlab_inf_common.vmware.ova import Ova, FileHandle
+
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.images import convert_name
+from vlab_icap_api.lib.metrics import OVA_UPLOAD_BYTES, OVA_UPLOAD_SECONDS, OVA_UPLOAD_RATE
+from vlab_icap_api.lib.worker.uploads import DiskUploader
+
+
+class OvaInfo(object):
+    """The parsed contents of an OVA file
+
+    :param path: The location of the OVA
+    :type path: String
+
+    :param ovf: The XML that describes the OVA
+    :type ovf: String
+
+    :param members: Every VMDK within the OVA
+    :type members: List of tarfile.TarInfo
+    """
+    def __init__(self, path, ovf, members):
+        self.path = path
+        self.ovf = ovf
+        self.members = members
+
+    @property
+    def networks(self):
+        """The names of the networks the VM in the OVA has configured"""
+        # Same parsing as Ova.networks, so both agree on the name
+        ntwks = re.findall(r'Network ovf:name=[\w\ \"]{1,50}', self.ovf)
+        return [x.split('=')[1].replace('"', '') for x in ntwks]
+
+    @property
+    def disks(self):
+        """The size in bytes of every VMDK within the OVA"""
+        return {x.name: x.size for x in self.members}
+
+
+class CachedOva(Ova):
+    """An ``Ova`` that reuses an ``OvaInfo`` instead of re-reading the archive,
+    and uploads its disks with a ``DiskUploader``
+
+    :param info: The parsed contents of the OVA
+    :type info: OvaInfo
+
+    :param on_upload: Called with the bytes uploaded and the total bytes, every
+                      time the deploy lease progress is updated.
+    :type on_upload: Function
+    """
+    def __init__(self, info, on_upload=None):
+        self._on_upload = on_upload
+        self._spec = None
+        self._lease = None
+        self._host = None
+        self._prog = None
+        self._path = info.path
+        self._handle = FileHandle(info.path)
+        # Only reads the first header; the disks are located via the cached members
+        self._tar = tarfile.open(fileobj=self._handle)
+        self._ovf = info.ovf
+        self._members = {x.name: x for x in info.members}
+        self._disks = {x.name: self._tar.extractfile(x) for x in info.members}
+
+    def deploy(self, deploy_spec, lease, host):
+        """Upload the disks of the OVA concurrently, and record how fast that went
+
+        :Returns: None
+
+        :param deploy_spec: The OVA deployment spec
+        :type deploy_spec: vim.OvfManager.CreateImportSpecResult
+
+        :param lease: The vSphere lease that enables VM creation
+        :type lease: vim.HttpNfcLease
+
+        :param host: The FQDN of the ESXi host
+        :type host: String
+        """
+        self._spec = deploy_spec
+        self._lease = lease
+        self._host = host
+        started = time.time()
+        try:
+            disks = [(self._members[x.path], self._get_device_url(x))
+                     for x in deploy_spec.fileItem if x.path in self._members]
+            uploader = DiskUploader(self._path, lease, host, on_upload=self._on_upload)
+            uploaded = uploader.upload(disks)
+            lease.Progress(100)
+            lease.Complete()
+        except vmodl.MethodFault as doh:
+            lease.Abort(doh)
+            raise
+        except Exception as doh:
+            lease.Abort(vmodl.fault.SystemError(reason=str(doh)))
+            raise
+        finally:
+            self._reset()
+        elapsed = time.time() - started
+        OVA_UPLOAD_BYTES.inc(uploaded)
+        OVA_UPLOAD_SECONDS.inc(elapsed)
+        if elapsed > 0:
+            OVA_UPLOAD_RATE.observe(uploaded / elapsed)
+
+
+class OvaCache(object):
+    """Parses each OVA once, and again only if the file changes.
+
+    :param images_dir: The directory that contains the ICAP OVAs
+    :type images_dir: String
+    """
+    def __init__(self, images_dir):
+        self._images_dir = images_dir
+        self._lock = threading.Lock()
+        self._cache = {}
+
+    def get(self, image):
+        """Obtain the parsed contents of the OVA for a version of ICAP
+
+        :Returns: OvaInfo
+
+        :Raises: ValueError if there's no such version
+
+        :param image: The image/version of Icap
+        :type image: String
+        """
+        path = os.path.join(self._images_dir, convert_name(image))
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            error = 'Invalid version for ICAP supplied: {}'.format(image)
+            raise ValueError(error)
+        key = (stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._cache.get(path)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+        info = self._parse(path)
+        with self._lock:
+            self._cache[path] = (key, info)
+        return info
+
+    def open(self, image, on_upload=None):
+        """Open the OVA for a version of ICAP, ready to stream its disks
+
+        :Returns: CachedOva
+
+        :Raises: ValueError if there's no such version
+
+        :param image: The image/version of Icap
+        :type image: String
+
+        :param on_upload: Called with the bytes uploaded and the total bytes while deploying
+        :type on_upload: Function
+        """
+        return CachedOva(self.get(image), on_upload=on_upload)
+
+    @staticmethod
+    def _parse(path):
+        """Read the OVF descriptor, and locate every VMDK in an OVA
+
+        :Returns: OvaInfo
+
+        :param path: The location of the OVA
+        :type path: String
+        """
+        ovf = None
+        members = []
+        with tarfile.open(path) as the_tar:
+            for member in the_tar.getmembers():
+                if member.name.endswith('.vmdk'):
+                    members.append(member)
+                elif member.name.endswith('.ovf'):
+                    ovf = the_tar.extractfile(member).read().decode()
+        return OvaInfo(path, ovf, members)
+
+
+OVAS = OvaCache(const.VLAB_ICAP_IMAGES_DIR)
@@ -0,0 +1,106 @@
+# -*- coding: UTF-8 -*-
+"""
+Caps how many ICAP VMs a worker process deploys at once, and shares those
+deploys fairly between users.
+
+Uploading an OVA (or cloning a template) is what loads the datastore and the
+uplink of the worker, so only ``VLAB_ICAP_DEPLOY_SLOTS`` deploys run at the
+same time. When a slot frees up, it goes to the waiting user with the fewest
+deploys already running, so one user's bulk create can't hold every slot while
+other users wait behind it. The cap is per process; run the lifecycle worker
+with the "threads" pool so every create on a host shares it.
+"""
+import threading
+from contextlib import contextmanager
+
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.worker import deadlines
+
+
+class FairScheduler(object):
+    """Hands out a fixed number of deploy slots, fairly between users.
+
+    :param slots: How many deploys can run at the same time; zero means no limit
+    :type slots: Integer
+    """
+    def __init__(self, slots):
+        self._slots = slots
+        self._cond = threading.Condition()
+        self._running = {}
+        # (username, ticket) in the order they started waiting
+        self._waiting = []
+
+    @contextmanager
+    def slot(self, username, on_wait=None):
+        """Block until it's the user's turn to deploy, and hold the slot until done
+
+        :Returns: None
+
+        :Raises: DeadlineExceeded if the task runs out of time while waiting
+
+        :param username: The user the deploy is for
+        :type username: String
+
+        :param on_wait: Called with the position in line, if the deploy has to wait
+        :type on_wait: Function
+        """
+        if not self._slots:
+            yield
+            return
+        ticket = object()
+        with self._cond:
+            self._waiting.append((username, ticket))
+            if not self._is_turn(ticket) and on_wait is not None:
+                on_wait(self._position(ticket))
+            while not self._is_turn(ticket):
+                try:
+                    self._cond.wait(deadlines.remaining())
+                except deadlines.DeadlineExceeded:
+                    self._waiting.remove((username, ticket))
+                    # Leaving the line can make it someone else's turn
+                    self._cond.notify_all()
+                    raise
+            self._waiting.remove((username, ticket))
+            self._running[username] = self._running.get(username, 0) + 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running[username] -= 1
+                if not self._running[username]:
+                    self._running.pop(username)
+                self._cond.notify_all()
+
+    def running(self):
+        """How many deploys are running, by user
+
+        :Returns: Dictionary
+        """
+        with self._cond:
+            return dict(self._running)
+
+    def waiting(self):
+        """How many deploys are waiting for a slot
+
+        :Returns: Integer
+        """
+        with self._cond:
+            return len(self._waiting)
+
+    def _is_turn(self, ticket):
+        """Whether a slot is free, and the ticket is next in line; call while holding the lock"""
+        if sum(self._running.values()) >= self._slots:
+            return False
+        return self._order()[0][1] is ticket
+
+    def _position(self, ticket):
+        """Where a ticket is in line, starting at 1; call while holding the lock"""
+        return [x[1] for x in self._order()].index(ticket) + 1
+
+    def _order(self):
+        """The waiting tickets, with users who have the fewest running deploys first"""
+        # sorted is stable, so ties go to whoever has waited the longest
+        return sorted(self._waiting, key=lambda x: self._running.get(x[0], 0))
+
+
+DEPLOYS = FairScheduler(slots=const.VLAB_ICAP_DEPLOY_SLOTS)
@@ -0,0 +1,322 @@
+# -*- coding: UTF-8 -*-
+"""
+A per-process pool of vCenter sessions.
+
+Logging into vCenter (and fetching the ServiceContent) is the most expensive
+part of a quick task like ``icap.show``, so instead of every task opening a new
+``vCenter`` connection, tasks borrow an already authenticated session from this
+pool and hand it back when they're done.
+"""
+import os
+import time
+import threading
+import http.client
+from contextlib import contextmanager
+
+from pyVmomi.SoapAdapter import StubAdapterBase
+from vlab_api_common import get_logger
+from vlab_inf_common.vmware import vCenter, vim
+
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.metrics import VCENTER_SECONDS, timed
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_ICAP_LOG_LEVEL)
+
+# Errors that mean the session itself is unusable, not that the task failed
+SESSION_ERRORS = (vim.fault.NotAuthenticated, OSError, http.client.HTTPException)
+
+
+class _ReloginStub(StubAdapterBase):
+    """Wraps the SOAP stub of a pooled session, so a call that vCenter rejects
+    because the session expired logs in again, and is retried once.
+
+    Every object fetched through the session carries this stub, so the retry
+    covers property reads (which go through ``InvokeMethod``) and tasks alike.
+
+    :param soap_stub: The stub that talks to vCenter
+    :type soap_stub: pyVmomi.SoapAdapter.SoapStubAdapter
+
+    :param user: The user to log in as
+    :type user: String
+
+    :param password: The password of the user
+    :type password: String
+    """
+    def __init__(self, soap_stub, user, password):
+        StubAdapterBase.__init__(self, version=soap_stub.version)
+        self.soapStub = soap_stub
+        self._user = user
+        self._password = password
+
+    def InvokeMethod(self, mo, info, args):
+        try:
+            return self._invoke(mo, info, args)
+        except vim.fault.NotAuthenticated:
+            self._relogin()
+        return self._invoke(mo, info, args)
+
+    def _invoke(self, mo, info, args):
+        """Make the call, raising the fault vCenter returned, if any"""
+        status, obj = self.soapStub.InvokeMethod(mo, info, args, self)
+        if status != 200:
+            raise obj
+        return obj
+
+    def _relogin(self):
+        """Replace the expired session, over the same connection"""
+        logger.info('vCenter session expired, logging in again')
+        service_instance = vim.ServiceInstance('ServiceInstance', self.soapStub)
+        with timed(VCENTER_SECONDS, op='login'):
+            service_instance.content.sessionManager.Login(self._user, self._password)
+
+
+class PooledvCenter(vCenter):
+    """A vCenter connection that's reused between tasks.
+
+    The ServiceContent of a session never changes, so it's only fetched once
+    instead of on every access of ``content``. If vCenter expires the session
+    while it's in use, the next call logs in again (see ``_ReloginStub``).
+    """
+    def __init__(self, host, user, password, **kwargs):
+        super().__init__(host, user, password, **kwargs)
+        self._conn = vim.ServiceInstance(self._conn._moId, _ReloginStub(self._conn._stub, user, password))
+        self._content = None
+
+    @property
+    def content(self):
+        """
+        The ServiceContent of the session; fetched once, then cached
+
+        :Returns: pyVmomi.VmomiSupport.vim.ServiceInstanceContent
+        """
+        if self._content is None:
+            self._content = self._conn.RetrieveContent()
+        return self._content
+
+
+class _Session(object):
+    """Tracks when a pooled connection was created, and last used"""
+    def __init__(self, vcenter):
+        self.vcenter = vcenter
+        self.created = time.time()
+        self.last_used = self.created
+
+
+class _KeepAlive(threading.Thread):
+    """Periodically pokes the idle sessions so vCenter doesn't expire them.
+
+    :param pool: The pool of sessions to keep alive
+    :type pool: SessionPool
+
+    :param interval: How often, in seconds, to check the idle sessions
+    :type interval: Integer
+    """
+    def __init__(self, pool, interval):
+        super().__init__(daemon=True)
+        self._pool = pool
+        self._interval = interval
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        """Terminate the keepalive thread"""
+        self._stop_event.set()
+
+    def run(self):
+        while not self._stop_event.wait(self._interval):
+            self._pool.keepalive()
+
+
+class SessionPool(object):
+    """A thread-safe pool of authenticated vCenter sessions for a single process.
+
+    Sessions are checked before being handed out if they've been idle for longer
+    than ``keepalive`` seconds; expired sessions are thrown away, and a new login
+    happens transparently. A session vCenter expires anyway (i.e. it restarted)
+    logs in again on its first rejected call. Because a forked child must never share a socket with
+    its parent, the pool empties itself when it detects it's running in a new
+    process (i.e. a Celery prefork child).
+
+    :param max_idle: The most sessions to keep around between tasks
+    :type max_idle: Integer
+
+    :param keepalive: How many seconds a session can sit idle before it's verified
+    :type keepalive: Integer
+
+    :param max_age: How many seconds to use a session before logging in again
+    :type max_age: Integer
+    """
+    def __init__(self, max_idle, keepalive, max_age):
+        self._max_idle = max_idle
+        self._keepalive_interval = keepalive
+        self._max_age = max_age
+        self._init_state()
+
+    def _init_state(self):
+        """Set the pool to an empty state for the current process"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._idle = []
+        self._keepalive = None
+        self._stats = {'logins': 0, 'reused': 0, 'expired': 0, 'discarded': 0}
+
+    def _check_pid(self):
+        """Forget sessions inherited from a parent process"""
+        if self._pid != os.getpid():
+            self._init_state()
+
+    def stats(self):
+        """Counters of how often sessions were reused, versus new logins
+
+        :Returns: Dictionary
+        """
+        self._check_pid()
+        with self._lock:
+            stats = dict(self._stats)
+            stats['idle'] = len(self._idle)
+        return stats
+
+    @contextmanager
+    def session(self):
+        """Borrow a vCenter session for the duration of a ``with`` statement
+
+        :Returns: PooledvCenter
+        """
+        session = self._checkout()
+        try:
+            yield session.vcenter
+        except SESSION_ERRORS:
+            self._discard(session)
+            raise
+        except Exception:
+            self._checkin(session)
+            raise
+        else:
+            self._checkin(session)
+
+    def _checkout(self):
+        """Obtain a usable session, logging in only if there's no idle one
+
+        :Returns: _Session
+        """
+        self._check_pid()
+        now = time.time()
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                session = self._idle.pop()
+            if now - session.created > self._max_age:
+                self._expire(session)
+            elif now - session.last_used > self._keepalive_interval and not _is_alive(session.vcenter):
+                self._expire(session)
+            else:
+                with self._lock:
+                    self._stats['reused'] += 1
+                # Networks get created/deleted by other services, so don't
+                # trust what a previous task saw.
+                session.vcenter._net_cache = None
+                return session
+        return self._login()
+
+    def _login(self):
+        """Create a new session to vCenter
+
+        :Returns: _Session
+        """
+        with timed(VCENTER_SECONDS, op='login'):
+            vcenter = PooledvCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER,
+                                    password=const.INF_VCENTER_PASSWORD)
+        with self._lock:
+            self._stats['logins'] += 1
+            if self._keepalive is None:
+                self._keepalive = _KeepAlive(self, self._keepalive_interval)
+                self._keepalive.start()
+        logger.debug('New vCenter session created: {}'.format(self._stats))
+        return _Session(vcenter)
+
+    def _checkin(self, session):
+        """Return a session to the pool, or log out if the pool is full"""
+        session.last_used = time.time()
+        with self._lock:
+            if self._pid == os.getpid() and len(self._idle) < self._max_idle:
+                self._idle.append(session)
+                return
+        _close(session.vcenter)
+
+    def _discard(self, session):
+        """Throw away a session that had an error"""
+        with self._lock:
+            self._stats['discarded'] += 1
+        _close(session.vcenter)
+
+    def _expire(self, session):
+        """Throw away a session that's too old, or that vCenter has already expired"""
+        with self._lock:
+            self._stats['expired'] += 1
+        _close(session.vcenter)
+
+    def keepalive(self):
+        """Verify every idle session, which also resets vCenter's idle timer"""
+        self._check_pid()
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for session in idle:
+            if _is_alive(session.vcenter):
+                session.last_used = time.time()
+                with self._lock:
+                    self._idle.append(session)
+            else:
+                self._expire(session)
+
+    def close(self):
+        """Log out of every idle session, and stop the keepalive thread"""
+        self._check_pid()
+        with self._lock:
+            idle, self._idle = self._idle, []
+            keepalive, self._keepalive = self._keepalive, None
+        if keepalive is not None:
+            keepalive.stop()
+        for session in idle:
+            _close(session.vcenter)
+
+
+def _is_alive(vcenter):
+    """Determine if vCenter still considers a session to be valid
+
+    :Returns: Boolean
+
+    :param vcenter: The session to test
+    :type vcenter: PooledvCenter
+    """
+    try:
+        return vcenter.content.sessionManager.currentSession is not None
+    except SESSION_ERRORS:
+        return False
+
+
+def _close(vcenter):
+    """Log out of vCenter, ignoring errors from sessions that are already dead
+
+    :Returns: None
+
+    :param vcenter: The session to terminate
+    :type vcenter: PooledvCenter
+    """
+    try:
+        vcenter.close()
+    except Exception:
+        pass
+
+
+POOL = SessionPool(max_idle=const.VLAB_ICAP_SESSION_POOL_SIZE,
+                   keepalive=const.VLAB_ICAP_SESSION_KEEPALIVE,
+                   max_age=const.VLAB_ICAP_SESSION_MAX_AGE)
+
+
+def vcenter_session():
+    """Borrow a vCenter session from this process' pool
+
+    :Returns: contextlib.GeneratorContextManager
+    """
+    return POOL.session()
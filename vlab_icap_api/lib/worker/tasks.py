@@ -2,17 +2,142 @@
 """
 Entry point logic for available backend worker tasks
 """
+import time
+
 from celery import Celery
+from celery.signals import worker_process_shutdown, worker_shutdown, worker_ready, task_prerun, task_postrun
 from vlab_api_common import get_task_logger
 
 from vlab_icap_api.lib import const
-from vlab_icap_api.lib.worker import vmware
+from vlab_icap_api.lib.images import INDEX
+from vlab_icap_api.lib.lazy import LazyModule, is_loaded
+from vlab_icap_api.lib.metrics import TASK_SECONDS, QUEUE_WAIT_SECONDS, retire_process
+from vlab_icap_api.lib.routes import TASK_ROUTES
+from vlab_icap_api.lib.worker import deadlines
+from vlab_icap_api.lib.worker.cache import INVENTORY
+
+# These import pyVmomi, so they're loaded by the first task that uses them
+vmware = LazyModule('vlab_icap_api.lib.worker.vmware')
+warm_pool = LazyModule('vlab_icap_api.lib.worker.warm_pool')
+sessions = LazyModule('vlab_icap_api.lib.worker.sessions')
+waiter = LazyModule('vlab_icap_api.lib.worker.waiter')
 
 app = Celery('icap', backend='rpc://', broker=const.VLAB_MESSAGE_BROKER)
+# Waiting on vCenter is shared by WAITER, so a "threads" pool can run many
+# creates per process without a vCenter poll loop per task. Celery can't enforce
+# time limits on that pool, so start_task_timer sets a deadline the waits honor.
+app.conf.worker_pool = const.VLAB_ICAP_WORKER_POOL
+if const.VLAB_ICAP_WORKER_CONCURRENCY:
+    app.conf.worker_concurrency = const.VLAB_ICAP_WORKER_CONCURRENCY
+# So the warm pool and template tasks queued by the worker land in the right place
+app.conf.task_routes = TASK_ROUTES
+
+
+# task id -> when it started running
+_STARTED = {}
+
+
+@worker_shutdown.connect
+@worker_process_shutdown.connect
+def close_sessions(**kwargs):
+    """Log out of any pooled vCenter sessions, and retire the metrics, when a worker process exits
+
+    Only prefork children send ``worker_process_shutdown``; with the "threads"
+    pool, the tasks run in the main process, which only sends ``worker_shutdown``.
+    """
+    if is_loaded(waiter):
+        waiter.WAITER.close()
+    if is_loaded(sessions):
+        sessions.POOL.close()
+    retire_process()
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, task=None, **kwargs):
+    """Record how long a task waited in the queue, and when it started running"""
+    now = time.time()
+    _STARTED[task_id] = now
+    deadlines.start(task.time_limit)
+    # Only set on tasks the API published
+    published_at = getattr(task.request, 'published_at', None)
+    if published_at is not None:
+        QUEUE_WAIT_SECONDS.labels(task=task.name).observe(max(0, now - published_at))
+
+
+@task_postrun.connect
+def stop_task_timer(task_id=None, task=None, retval=None, state=None, **kwargs):
+    """Record how long a task ran, and if it worked"""
+    deadlines.clear()
+    started = _STARTED.pop(task_id, None)
+    if started is None:
+        return
+    if state != 'SUCCESS':
+        outcome = 'failure'
+    elif isinstance(retval, dict) and retval.get('error'):
+        outcome = 'error'
+    else:
+        outcome = 'success'
+    TASK_SECONDS.labels(task=task.name, outcome=outcome).observe(time.time() - started)
+
+
+def _progress_reporter(task, logger):
+    """Make a callback that publishes the progress of a task as its Celery state
+
+    The status end point returns the ``meta`` of a task in the "PROGRESS" state,
+    so clients can see which phase a long running task is in.
+
+    :Returns: Function
 
+    :param task: The running task
+    :type task: celery.Task
 
-@app.task(name='icap.show', bind=True)
-def show(self, username, txn_id):
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    # The upload reports from its own threads, where ``task.request`` is empty
+    task_id = task.request.id
+    def progress(phase, **details):
+        details['phase'] = phase
+        logger.debug('Progress: {}'.format(details))
+        task.update_state(task_id=task_id, state='PROGRESS', meta=details)
+    return progress
+
+
+def _sync_images(txn_id):
+    """Queue the task that imports templates, or stages library items, if the deploy mode uses them"""
+    # Same as templates.enabled() and library.enabled(), but this runs in the main
+    # worker process, which never needs to import pyVmomi
+    if const.VLAB_ICAP_DEPLOY_MODE in ('template', 'linked'):
+        sync_templates.apply_async(args=[txn_id])
+    elif const.VLAB_ICAP_DEPLOY_MODE == 'library':
+        sync_library.apply_async(args=[txn_id])
+
+
+@worker_ready.connect
+def stage_images(**kwargs):
+    """Top off the warm pool of ICAP VMs, and import any new templates or library
+    items when a worker starts"""
+    _sync_images('workerReady')
+    if const.VLAB_ICAP_WARM_POOL_SIZE > 0:
+        refill_pool.apply_async(args=['workerReady'])
+
+
+def images_verified(names):
+    """Stage OVAs as soon as they pass verification, instead of when a worker restarts.
+
+    :Returns: None
+
+    :param names: The file names of the OVAs that passed
+    :type names: List
+    """
+    _sync_images('imagesVerified')
+
+
+INDEX.subscribe(images_verified)
+
+
+@app.task(name='icap.show', bind=True, time_limit=const.VLAB_ICAP_READ_TIME_LIMIT)
+def show(self, username, txn_id, refresh=False):
     """Obtain basic information about Icap
 
     :Returns: Dictionary
@@ -22,12 +147,23 @@ def show(self, username, txn_id):
 
     :param txn_id: A unique string supplied by the client to track the call through logs
     :type txn_id: String
+
+    :param refresh: Set to True to ignore the cached inventory, and query vCenter
+    :type refresh: Boolean
     """
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ICAP_LOG_LEVEL.upper())
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
     try:
-        info = vmware.show_icap(username)
+        info = None if refresh else INVENTORY.get(username)
+        if info is not None:
+            logger.debug('Using cached inventory')
+            # The console URLs aren't cached; each one can only be used once
+            info = vmware.add_consoles(info)
+        if info is None:
+            generation = INVENTORY.generation(username)
+            info = vmware.show_icap(username)
+            INVENTORY.set(username, info, generation=generation)
     except ValueError as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
@@ -37,7 +173,7 @@ def show(self, username, txn_id):
     return resp
 
 
-@app.task(name='icap.create', bind=True)
+@app.task(name='icap.create', bind=True, time_limit=const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT)
 def create(self, username, machine_name, image, network, txn_id):
     """Deploy a new instance of Icap
 
@@ -62,15 +198,69 @@ def create(self, username, machine_name, image, network, txn_id):
     resp = {'content' : {}, 'error': None, 'params': {}}
     logger.info('Task starting')
     try:
-        resp['content'] = vmware.create_icap(username, machine_name, image, network, logger)
+        resp['content'] = vmware.create_icap(username, machine_name, image, network, logger,
+                                             progress=_progress_reporter(self, logger))
     except ValueError as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
+    except Exception:
+        # The VM might exist, even though the deploy failed
+        INVENTORY.invalidate(username)
+        raise
+    else:
+        INVENTORY.update(username, resp['content'])
+    if warm_pool.enabled():
+        refill_pool.apply_async(args=[txn_id])
     logger.info('Task complete')
     return resp
 
 
-@app.task(name='icap.delete', bind=True)
+@app.task(name='icap.bulk_create', bind=True, time_limit=const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT)
+def bulk_create(self, username, machine_names, image, network, txn_id):
+    """Deploy several new instances of Icap at the same time
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who wants to create new instances of Icap
+    :type username: String
+
+    :param machine_names: The names of the new instances of Icap
+    :type machine_names: List
+
+    :param image: The image/version of Icap to create
+    :type image: String
+
+    :param network: The name of the network to connect the new Icap instances up to
+    :type network: String
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ICAP_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.create_icaps(username, machine_names, image, network, logger,
+                                              progress=_progress_reporter(self, logger))
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    except Exception:
+        INVENTORY.invalidate(username)
+        raise
+    else:
+        if resp['content']['failed']:
+            # A failed deploy can still leave a VM behind
+            INVENTORY.invalidate(username)
+        else:
+            INVENTORY.update(username, resp['content']['created'])
+    if warm_pool.enabled():
+        refill_pool.apply_async(args=[txn_id])
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='icap.delete', bind=True, time_limit=const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT)
 def delete(self, username, machine_name, txn_id):
     """Destroy an instance of Icap
 
@@ -93,12 +283,45 @@ def delete(self, username, machine_name, txn_id):
     except ValueError as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
+    except Exception:
+        INVENTORY.invalidate(username)
+        raise
     else:
+        INVENTORY.remove(username, machine_name)
         logger.info('Task complete')
     return resp
 
 
-@app.task(name='icap.image', bind=True)
+@app.task(name='icap.bulk_delete', bind=True, time_limit=const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT)
+def bulk_delete(self, username, machine_names, txn_id):
+    """Destroy several instances of Icap at the same time
+
+    :Returns: Dictionary
+
+    :param username: The name of the user who wants to delete instances of Icap
+    :type username: String
+
+    :param machine_names: The names of the instances of Icap; None means all of them
+    :type machine_names: List
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ICAP_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.delete_icaps(username, machine_names, logger)
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    finally:
+        INVENTORY.invalidate(username)
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='icap.image', bind=True, time_limit=const.VLAB_ICAP_READ_TIME_LIMIT)
 def image(self, txn_id):
     """Obtain a list of available images/versions of Icap that can be created
 
@@ -115,7 +338,7 @@ def image(self, txn_id):
     return resp
 
 
-@app.task(name='icap.modify_network', bind=True)
+@app.task(name='icap.modify_network', bind=True, time_limit=const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT)
 def modify_network(self, username, machine_name, new_network, txn_id):
     """Change the network an InsightIQ instance is connected to"""
     logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ICAP_LOG_LEVEL.upper())
@@ -126,5 +349,70 @@ def modify_network(self, username, machine_name, new_network, txn_id):
     except ValueError as doh:
         logger.error('Task failed: {}'.format(doh))
         resp['error'] = '{}'.format(doh)
+    finally:
+        INVENTORY.invalidate(username)
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='icap.refill_pool', bind=True, time_limit=const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT)
+def refill_pool(self, txn_id):
+    """Deploy ICAP VMs into the warm pool until every version has enough
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ICAP_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = {'deployed': vmware.refill_warm_pool(logger)}
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='icap.sync_templates', bind=True, time_limit=const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT)
+def sync_templates(self, txn_id):
+    """Import a vCenter template for every ICAP OVA, and remove templates of old OVAs
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ICAP_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.sync_templates(logger)
+    except ValueError as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
+    logger.info('Task complete')
+    return resp
+
+
+@app.task(name='icap.sync_library', bind=True, time_limit=const.VLAB_ICAP_LIFECYCLE_TIME_LIMIT)
+def sync_library(self, txn_id):
+    """Publish every ICAP OVA to the content library, and remove the items of old OVAs
+
+    :Returns: Dictionary
+
+    :param txn_id: A unique string supplied by the client to track the call through logs
+    :type txn_id: String
+    """
+    logger = get_task_logger(txn_id=txn_id, task_id=self.request.id, loglevel=const.VLAB_ICAP_LOG_LEVEL.upper())
+    resp = {'content' : {}, 'error': None, 'params': {}}
+    logger.info('Task starting')
+    try:
+        resp['content'] = vmware.sync_library(logger)
+    except (ValueError, RuntimeError) as doh:
+        logger.error('Task failed: {}'.format(doh))
+        resp['error'] = '{}'.format(doh)
     logger.info('Task complete')
     return resp
@@ -0,0 +1,242 @@
+# -*- coding: UTF-8 -*-
+"""
+vCenter templates of every ICAP image, so new instances can be cloned instead
+of uploading the whole OVA every time.
+
+``VLAB_ICAP_DEPLOY_MODE`` picks how a new instance is made:
+
+- ``ova`` uploads the OVA (the default, and the fallback for the other modes)
+- ``template`` makes a full clone of the version's template
+- ``linked`` makes a linked clone off the template's snapshot, so the new VM
+  only stores the blocks that differ from the template
+- ``library`` deploys the version's item in the content library; see ``library.py``
+
+``icap.sync_templates`` imports each OVA in ``VLAB_ICAP_IMAGES_DIR`` once into
+the ``VLAB_ICAP_TEMPLATE_FOLDER`` folder, and removes templates for OVAs that
+were deleted or replaced. A create that finds no template (or a stale one)
+uploads the OVA, and asks for a sync so the next create can clone.
+"""
+import os
+import time
+
+from celery import current_app
+from vlab_inf_common.vmware import vim, virtual_machine
+
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.images import convert_name
+from vlab_icap_api.lib.metrics import VCENTER_SECONDS, timed
+from vlab_icap_api.lib.worker.waiter import wait_for_task
+from vlab_icap_api.lib.worker.inventory import retrieve_vms, parse_meta, get_folder, read_props
+
+
+DEPLOY_MODES = ('ova', 'template', 'linked', 'library')
+SNAPSHOT_NAME = 'base'
+
+
+def enabled():
+    """Determine if new instances should be cloned from a template
+
+    :Returns: Boolean
+    """
+    return const.VLAB_ICAP_DEPLOY_MODE in ('template', 'linked')
+
+
+def template_name(image):
+    """The name of the template for a version of ICAP
+
+    :Returns: String
+
+    :param image: The image/version of Icap
+    :type image: String
+    """
+    return 'icap-template-{}'.format(image)
+
+
+def find_template(vcenter, image):
+    """Look up the template for a version of ICAP
+
+    :Returns: vim.VirtualMachine, or None if the version has no template, or it's stale or unfinished
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param image: The image/version of Icap
+    :type image: String
+    """
+    folder = get_folder(vcenter, const.VLAB_ICAP_TEMPLATE_FOLDER)
+    if folder is None:
+        return None
+    the_template = vcenter.content.searchIndex.FindChild(entity=folder, name=template_name(image))
+    if not isinstance(the_template, vim.VirtualMachine):
+        return None
+    props = read_props(vcenter, the_template, ['config.annotation', 'config.template'])
+    if not props.get('config.template'):
+        # Still being imported, or left over from an import that failed
+        return None
+    if is_stale(image, parse_meta(props.get('config.annotation'))):
+        # The OVA was replaced since; a clone would be the old build
+        return None
+    return the_template
+
+
+def list_templates(vcenter, folder):
+    """Obtain the ICAP templates, along with their meta data
+
+    :Returns: Dictionary, of version -> (vim.VirtualMachine, meta data)
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The template folder
+    :type folder: vim.Folder
+    """
+    found = {}
+    for the_vm, props in retrieve_vms(vcenter, folder, ['config.annotation', 'config.template']).items():
+        meta = parse_meta(props.get('config.annotation'))
+        if meta['component'] == 'ICAP' and props.get('config.template'):
+            found[meta['version']] = (the_vm, meta)
+    return found
+
+
+def is_stale(image, meta):
+    """Determine if the OVA was replaced after the template was made from it
+
+    :Returns: Boolean
+
+    :param image: The image/version of Icap
+    :type image: String
+
+    :param meta: The meta data of the template
+    :type meta: Dictionary
+    """
+    try:
+        mtime = os.stat(os.path.join(const.VLAB_ICAP_IMAGES_DIR, convert_name(image))).st_mtime
+    except FileNotFoundError:
+        return True
+    return mtime > meta['created']
+
+
+def import_template(vcenter, ova, network_map, image, logger):
+    """Upload an OVA, and turn the new VM into a template
+
+    The template gets a snapshot before it's marked as a template, which is
+    what linked clones are made from. If any step after the upload fails, the
+    new VM is destroyed.
+
+    :Returns: vim.VirtualMachine
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param ova: The OVA of the version
+    :type ova: vlab_inf_common.vmware.ova.Ova
+
+    :param network_map: Maps the network in the OVA to ``VLAB_ICAP_TEMPLATE_NETWORK``
+    :type network_map: vim.OvfManager.NetworkMapping
+
+    :param image: The image/version of Icap
+    :type image: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    created = time.time()
+    with timed(VCENTER_SECONDS, op='deploy'):
+        the_vm = virtual_machine.deploy_from_ova(vcenter, ova, [network_map],
+                                                 const.VLAB_ICAP_TEMPLATE_FOLDER,
+                                                 template_name(image), logger, power_on=False)
+    meta_data = {'component' : "ICAP",
+                 'created': created,
+                 'version': image,
+                 'configured': False,
+                 'generation': 1,
+                }
+    try:
+        with timed(VCENTER_SECONDS, op='reconfigure'):
+            virtual_machine.set_meta(the_vm, meta_data)
+        wait_for_task(the_vm.CreateSnapshot_Task(name=SNAPSHOT_NAME,
+                                                 description='Linked clones of ICAP {} are made from this'.format(image),
+                                                 memory=False,
+                                                 quiesce=False))
+        the_vm.MarkAsTemplate()
+    except Exception:
+        # Otherwise the half made VM keeps the template's name, and every later
+        # import fails with DuplicateName
+        logger.error('Unable to finish the template for ICAP {}, destroying it'.format(image))
+        try:
+            with timed(VCENTER_SECONDS, op='destroy'):
+                wait_for_task(the_vm.Destroy_Task())
+        except Exception as doh:
+            logger.error('Unable to destroy the template for ICAP {}: {}'.format(image, doh))
+        raise
+    logger.info('Imported template for ICAP {}'.format(image))
+    return the_vm
+
+
+def clone(vcenter, the_template, folder_name, machine_name, network, logger, power_on=True):
+    """Make a new VM from an ICAP template
+
+    :Returns: vim.VirtualMachine
+
+    :Raises: ValueError if the network doesn't exist
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_template: The template to clone
+    :type the_template: vim.VirtualMachine
+
+    :param folder_name: The name of the folder to put the new VM in (i.e. the username)
+    :type folder_name: String
+
+    :param machine_name: The name of the new VM
+    :type machine_name: String
+
+    :param network: The name of the network to connect the new VM to
+    :type network: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param power_on: Set to False to leave the new VM powered off
+    :type power_on: Boolean
+    """
+    try:
+        the_network = vcenter.networks[network]
+    except KeyError:
+        raise ValueError('No such network named {}'.format(network))
+    folder = vcenter.get_by_name(name=folder_name, vimtype=vim.Folder)
+    relocate_spec = vim.vm.RelocateSpec(pool=vcenter.resource_pools[const.INF_VCENTER_RESORUCE_POOL])
+    clone_spec = vim.vm.CloneSpec(location=relocate_spec, powerOn=False, template=False)
+    snapshot = the_template.snapshot.currentSnapshot if the_template.snapshot else None
+    if const.VLAB_ICAP_DEPLOY_MODE == 'linked' and snapshot is not None:
+        relocate_spec.diskMoveType = 'createNewChildDiskBacking'
+        clone_spec.snapshot = snapshot
+    elif const.VLAB_ICAP_DEPLOY_MODE == 'linked':
+        logger.error('Template {} has no snapshot, making a full clone'.format(the_template.name))
+    logger.debug('Cloning {} to {}'.format(the_template.name, machine_name))
+    the_vm = wait_for_task(the_template.CloneVM_Task(folder=folder, name=machine_name, spec=clone_spec))
+    with timed(VCENTER_SECONDS, op='reconfigure'):
+        virtual_machine.change_network(the_vm, the_network)
+    if power_on:
+        with timed(VCENTER_SECONDS, op='power'):
+            wait_for_task(the_vm.PowerOnVM_Task())
+    return the_vm
+
+
+_last_sync_request = 0.0
+
+
+def request_sync():
+    """Queue ``icap.sync_templates``, at most once per ``VLAB_ICAP_IMAGE_SCAN_INTERVAL``
+    per process. Called when a create finds its version has no template, or a stale one.
+
+    :Returns: Boolean - True if a sync was queued
+    """
+    global _last_sync_request
+    now = time.time()
+    if now - _last_sync_request < const.VLAB_ICAP_IMAGE_SCAN_INTERVAL:
+        return False
+    _last_sync_request = now
+    current_app.send_task('icap.sync_templates', args=['templateMiss'])
+    return True
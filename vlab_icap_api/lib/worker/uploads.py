@@ -0,0 +1,218 @@
+# -*- coding: UTF-8 -*-
+"""
+Streams the disks of an OVA to vCenter, concurrently.
+
+``Ova.deploy`` uploads one disk at a time, and ``urlopen`` reads the tarball in
+8KB pieces to do it. Here the OVA is memory mapped, and every disk is sent from
+that map in ``VLAB_ICAP_UPLOAD_CHUNK_MB`` slices over its own connection, so
+nothing is copied into Python before the socket encrypts it. One thread keeps
+the HttpNfcLease alive and reports the progress of every disk at once.
+
+Uploads share a per-process bandwidth cap (``VLAB_ICAP_UPLOAD_MAX_MBPS``). Every
+chunk waits for its turn in the order it asked, so concurrent deploys split the
+bandwidth instead of the first one starving the rest.
+"""
+import os
+import mmap
+import time
+import threading
+import http.client
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor
+
+from pyVmomi import vmodl
+from vlab_api_common import get_logger
+from vlab_inf_common.ssl_context import get_context
+
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.worker import deadlines
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_ICAP_LOG_LEVEL)
+MEGABYTE = 1024 * 1024
+
+
+class RateLimiter(object):
+    """Limits how many bytes per second all the uploads in a process can send.
+
+    :param rate: The bytes per second to allow; zero for no limit
+    :type rate: Integer
+    """
+    def __init__(self, rate):
+        self._rate = rate
+        self._init_state()
+
+    def _init_state(self):
+        """Start over in the current process"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        # When the bandwidth that's been handed out is used up
+        self._next_free = 0.0
+
+    def _check_pid(self):
+        """A forked child has its own bandwidth to hand out"""
+        if self._pid != os.getpid():
+            self._init_state()
+
+    def consume(self, amount):
+        """Block until ``amount`` bytes can be sent without going over the limit
+
+        :Returns: None
+
+        :param amount: How many bytes are about to be sent
+        :type amount: Integer
+        """
+        if not self._rate:
+            return
+        self._check_pid()
+        with self._lock:
+            now = time.monotonic()
+            # Unused bandwidth isn't saved up, so an idle worker can't burst over the cap
+            start = max(now, self._next_free)
+            self._next_free = start + amount / self._rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class DiskUploader(object):
+    """Uploads the disks of an OVA to the device URLs of a HttpNfcLease, or to
+    the upload endpoints of a content library update session
+
+    :param path: The location of the OVA
+    :type path: String
+
+    :param lease: The lease vCenter created for the deploy; None if there's no lease to keep alive
+    :type lease: vim.HttpNfcLease
+
+    :param host: The name of the ESXi host, for device URLs that use "*" as the host
+    :type host: String
+
+    :param on_upload: Called with the bytes uploaded and the total bytes, every
+                      time the lease progress is updated.
+    :type on_upload: Function
+
+    :param method: The HTTP method to send each disk with
+    :type method: String
+
+    :param headers: Sent with every disk; defaults to the Content-Type of a HttpNfcLease upload
+    :type headers: Dictionary
+    """
+    def __init__(self, path, lease, host, on_upload=None, streams=None, chunk_size=None,
+                 progress_interval=None, limiter=None, method='POST', headers=None):
+        self._path = path
+        self._method = method
+        self._headers = headers or {'Content-Type': 'application/x-vnd.vmware-streamVmdk'}
+        self._lease = lease
+        self._host = host
+        self._on_upload = on_upload
+        self._streams = streams or const.VLAB_ICAP_UPLOAD_STREAMS
+        self._chunk_size = chunk_size or const.VLAB_ICAP_UPLOAD_CHUNK_MB * MEGABYTE
+        self._progress_interval = progress_interval or const.VLAB_ICAP_UPLOAD_PROGRESS_INTERVAL
+        self._limiter = limiter or LIMITER
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+        self._sent = 0
+        self._total = 0
+        # The disks are sent by other threads, which don't see the task's deadline
+        self._deadline = deadlines.current()
+
+    def upload(self, disks):
+        """Send every disk, concurrently
+
+        :Returns: Integer - the bytes uploaded
+
+        :Raises: RuntimeError if vCenter rejects a disk, or the task runs out of time
+
+        :param disks: The tar member of each disk, and the URL to upload it to
+        :type disks: List of (tarfile.TarInfo, String)
+        """
+        self._total = sum(x.size for x, _ in disks)
+        if not disks:
+            return 0
+        keepalive = threading.Thread(target=self._keepalive, daemon=True)
+        with open(self._path, 'rb') as the_file:
+            with mmap.mmap(the_file.fileno(), 0, access=mmap.ACCESS_READ) as the_map:
+                keepalive.start()
+                try:
+                    with ThreadPoolExecutor(max_workers=min(self._streams, len(disks))) as executor:
+                        futures = [executor.submit(self._send, the_map, member, url) for member, url in disks]
+                        try:
+                            for future in futures:
+                                future.result()
+                        except Exception:
+                            # Stop the other disks; the deploy is going to be aborted
+                            self._done.set()
+                            raise
+                finally:
+                    self._done.set()
+                    keepalive.join()
+        self._report()
+        return self._sent
+
+    def _send(self, the_map, member, url):
+        """Stream one disk from the memory mapped OVA"""
+        if member.sparse:
+            raise RuntimeError('Cannot upload sparse tar member {}'.format(member.name))
+        parsed = urlparse(url.replace('*', self._host))
+        if parsed.scheme == 'https':
+            conn = http.client.HTTPSConnection(parsed.hostname, parsed.port, context=get_context())
+        else:
+            conn = http.client.HTTPConnection(parsed.hostname, parsed.port)
+        try:
+            path = '{}?{}'.format(parsed.path, parsed.query) if parsed.query else parsed.path
+            conn.putrequest(self._method, path, skip_accept_encoding=True)
+            conn.putheader('Content-Length', str(member.size))
+            for name, value in self._headers.items():
+                conn.putheader(name, value)
+            conn.endheaders()
+            end = member.offset_data + member.size
+            with memoryview(the_map) as view:
+                for start in range(member.offset_data, end, self._chunk_size):
+                    if self._done.is_set():
+                        raise RuntimeError('Upload of {} cancelled'.format(member.name))
+                    deadlines.check(self._deadline)
+                    chunk = view[start:min(start + self._chunk_size, end)]
+                    size = len(chunk)
+                    try:
+                        self._limiter.consume(size)
+                        conn.send(chunk)
+                    finally:
+                        chunk.release()
+                    with self._lock:
+                        self._sent += size
+            resp = conn.getresponse()
+            resp.read()
+            if resp.status not in (200, 201):
+                error = 'Upload of {} failed: HTTP {} {}'.format(member.name, resp.status, resp.reason)
+                raise RuntimeError(error)
+        finally:
+            conn.close()
+
+    def _keepalive(self):
+        """Update the lease progress until every disk is sent, so vCenter doesn't expire it"""
+        while not self._done.wait(self._progress_interval):
+            self._report()
+
+    def _report(self):
+        """Tell vCenter and ``on_upload`` how much has been sent"""
+        with self._lock:
+            sent = self._sent
+        percent = int(100 * sent / self._total) if self._total else 100
+        if self._lease is not None:
+            self._update_lease(percent)
+        if self._on_upload is not None:
+            self._on_upload(sent, self._total)
+
+    def _update_lease(self, percent):
+        """Set the progress of the lease, which also keeps it from expiring"""
+        try:
+            # 100% is set once the lease is completed
+            self._lease.Progress(min(percent, 99))
+        except vmodl.fault.ManagedObjectNotFound:
+            # The lease completed between the last chunk, and this update
+            pass
+        except Exception as doh:
+            logger.warning('Unable to update lease progress: {}'.format(doh))
+
+
+LIMITER = RateLimiter(const.VLAB_ICAP_UPLOAD_MAX_MBPS * MEGABYTE)
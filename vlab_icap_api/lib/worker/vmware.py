@@ -1,12 +1,25 @@
 # -*- coding: UTF-8 -*-
 """Business logic for backend worker tasks"""
 import time
+import uuid
 import random
 import os.path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
 from celery.utils.log import get_task_logger
-from vlab_inf_common.vmware import vCenter, Ova, vim, virtual_machine, consume_task
+from pyVmomi import vmodl
+from vlab_inf_common.vmware import vim, virtual_machine
 
 from vlab_icap_api.lib import const
+from vlab_icap_api.lib.images import INDEX, convert_name
+from vlab_icap_api.lib.metrics import VCENTER_SECONDS, timed
+from vlab_icap_api.lib.worker import deadlines, library, templates, warm_pool
+from vlab_icap_api.lib.worker.cache import host_lock
+from vlab_icap_api.lib.worker.ovas import OVAS
+from vlab_icap_api.lib.worker.scheduler import DEPLOYS
+from vlab_icap_api.lib.worker.sessions import vcenter_session
+from vlab_icap_api.lib.worker.inventory import VM_INFO_PROPERTIES, retrieve_vms, parse_meta, get_ips, get_networks, find_icap, get_folder
+from vlab_icap_api.lib.worker.waiter import wait_for_tasks, wait_for_task, wait_for_ip
 
 
 def show_icap(username):
@@ -18,13 +31,48 @@ def show_icap(username):
     :type username: String
     """
     icap_vms = {}
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
+    with vcenter_session() as vcenter:
         folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for vm in folder.childEntity:
-            info = virtual_machine.get_info(vcenter, vm, username)
-            if info['meta']['component'] == 'ICAP':
-                icap_vms[vm.name] = info
+        vms = retrieve_vms(vcenter, folder, VM_INFO_PROPERTIES)
+        for vm, props in vms.items():
+            meta = parse_meta(props.get('config.annotation'))
+            if meta['component'] != 'ICAP':
+                continue
+            # Same output as virtual_machine.get_info, but only the console URL
+            # needs its own calls to vCenter (a single-use session ticket).
+            info = {}
+            info['state'] = props['runtime.powerState']
+            info['console'] = virtual_machine._get_vm_console_url(vcenter, vm)
+            info['ips'] = get_ips(props.get('guest.net'))
+            info['networks'] = get_networks(vcenter, username, props.get('network'))
+            info['moid'] = vm._moId
+            info['meta'] = meta
+            icap_vms[props['name']] = info
+    return icap_vms
+
+
+def add_consoles(icap_vms):
+    """Give every VM of a cached inventory a new console URL.
+
+    A console URL includes a single-use session ticket, so the inventory cache
+    never stores them; every ``icap.show`` needs its own.
+
+    :Returns: Dictionary, or None if a cached VM no longer exists
+
+    :param icap_vms: A cached output of ``show_icap``
+    :type icap_vms: Dictionary
+    """
+    if not icap_vms:
+        return icap_vms
+    with vcenter_session() as vcenter:
+        stub = vcenter.content.rootFolder._stub
+        for info in icap_vms.values():
+            the_vm = vim.VirtualMachine(info['moid'], stub=stub)
+            try:
+                info['console'] = virtual_machine._get_vm_console_url(vcenter, the_vm)
+            except vmodl.fault.ManagedObjectNotFound:
+                # Deleted outside of this service; the cached inventory is wrong
+                return None
     return icap_vms
 
 
@@ -42,28 +90,115 @@ def delete_icap(username, machine_name, logger):
     :param logger: An object for logging messages
     :type logger: logging.LoggerAdapter
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
+    with vcenter_session() as vcenter:
         folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for entity in folder.childEntity:
-            if entity.name == machine_name:
-                info = virtual_machine.get_info(vcenter, entity, username)
-                if info['meta']['component'] == 'ICAP':
-                    logger.debug('powering off VM')
-                    virtual_machine.power(entity, state='off')
-                    delete_task = entity.Destroy_Task()
-                    logger.debug('blocking while VM is being destroyed')
-                    consume_task(delete_task)
-                    break
-        else:
+        the_vm = find_icap(vcenter, folder, machine_name)
+        if the_vm is None:
             raise ValueError('No {} named {} found'.format('icap', machine_name))
+        if the_vm.runtime.powerState != vim.VirtualMachinePowerState.poweredOff:
+            logger.debug('powering off VM')
+            with timed(VCENTER_SECONDS, op='power'):
+                wait_for_task(the_vm.PowerOffVM_Task())
+        logger.debug('blocking while VM is being destroyed')
+        with timed(VCENTER_SECONDS, op='destroy'):
+            wait_for_task(the_vm.Destroy_Task())
+
+
+def delete_icaps(username, machine_names, logger):
+    """Power off and destroy several ICAP instances at the same time
+
+    Every power off is issued before waiting on any of them, then every destroy
+    is issued before waiting on any of them.
+
+    :Returns: Dictionary, with the keys "deleted" and "failed"
+
+    :param username: The user who wants to delete their ICAP instances
+    :type username: String
+
+    :param machine_names: The names of the VMs to delete; None means every ICAP instance the user owns
+    :type machine_names: List
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    results = {'deleted': [], 'failed': {}}
+    with vcenter_session() as vcenter:
+        folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
+        vms = retrieve_vms(vcenter, folder, ['name', 'runtime.powerState', 'config.annotation'])
+        icaps = {}
+        for vm, props in vms.items():
+            if parse_meta(props.get('config.annotation'))['component'] == 'ICAP':
+                icaps[props['name']] = (vm, props['runtime.powerState'])
+        if machine_names is None:
+            machine_names = sorted(icaps.keys())
+        targets = {}
+        for machine_name in machine_names:
+            if machine_name in icaps:
+                targets[machine_name] = icaps[machine_name]
+            else:
+                results['failed'][machine_name] = 'No {} named {} found'.format('icap', machine_name)
+
+        logger.debug('powering off {} VMs'.format(len(targets)))
+        with timed(VCENTER_SECONDS, op='power'):
+            power_tasks = _start_tasks({x: y[0].PowerOffVM_Task for x, y in targets.items() if y[1] != vim.VirtualMachinePowerState.poweredOff},
+                                       results, logger)
+            power_errors = wait_for_tasks(power_tasks)
+        for machine_name, error in power_errors.items():
+            if error:
+                results['failed'][machine_name] = error
+        for machine_name in results['failed']:
+            targets.pop(machine_name, None)
+
+        logger.debug('blocking while {} VMs are being destroyed'.format(len(targets)))
+        with timed(VCENTER_SECONDS, op='destroy'):
+            delete_tasks = _start_tasks({x: y[0].Destroy_Task for x, y in targets.items()}, results, logger)
+            delete_errors = wait_for_tasks(delete_tasks)
+        for machine_name, error in delete_errors.items():
+            if error:
+                results['failed'][machine_name] = error
+            else:
+                results['deleted'].append(machine_name)
+    results['deleted'].sort()
+    return results
+
+
+def _start_tasks(starters, results, logger):
+    """Start a vCenter task for each VM, so one that vCenter refuses doesn't stop the rest
+
+    :Returns: Dictionary, of VM name -> vim.Task
+
+    :param starters: The method that starts the task of each VM, i.e. ``the_vm.Destroy_Task``
+    :type starters: Dictionary
+
+    :param results: The output of ``delete_icaps``; VMs whose task didn't start are added to "failed"
+    :type results: Dictionary
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    tasks = {}
+    for machine_name, start in starters.items():
+        try:
+            tasks[machine_name] = start()
+        except Exception as doh:
+            logger.error('Unable to start task for {}: {}'.format(machine_name, doh))
+            results['failed'][machine_name] = '{}'.format(doh)
+    return tasks
 
 
-def create_icap(username, machine_name, image, network, logger):
+def create_icap(username, machine_name, image, network, logger, progress=None):
     """Deploy a new instance of ICAP
 
+    The ``progress`` callback is called with the name of each phase of the
+    create, plus any details as keyword arguments. The phases are
+    "queued" (position), "ova_parsed", "uploading" (uploaded, total), "cloning"
+    (from a template or the content library), "claimed", "powered_on" and
+    "waiting_for_ip".
+
     :Returns: Dictionary
 
+    :Raises: ValueError if the image doesn't exist, or hasn't passed verification
+
     :param username: The name of the user who wants to create a new Icap
     :type username: String
 
@@ -78,63 +213,387 @@ def create_icap(username, machine_name, image, network, logger):
 
     :param logger: An object for logging messages
     :type logger: logging.LoggerAdapter
+
+    :param progress: Called as each phase of the create starts
+    :type progress: Function
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER,
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
+    progress = progress or _no_progress
+    INDEX.check(image)
+    with vcenter_session() as vcenter:
         image_name = convert_name(image)
         logger.info(image_name)
-        try:
-            ova = Ova(os.path.join(const.VLAB_ICAP_IMAGES_DIR, image_name))
-        except FileNotFoundError:
-            error = 'Invalid version for ICAP supplied: {}'.format(image)
-            raise ValueError(error)
-        try:
-            network_map = vim.OvfManager.NetworkMapping()
-            network_map.name = ova.networks[0]
+        the_vm = warm_pool.claim(vcenter, username, machine_name, image, network, logger)
+        if the_vm is None:
+            with DEPLOYS.slot(username, on_wait=lambda position: progress('queued', position=position)):
+                the_vm = _deploy(vcenter, username, machine_name, image, network, logger, progress=progress)
+        else:
+            progress('claimed')
+        progress('powered_on')
+        return _finish_create(vcenter, the_vm, username, image, progress=progress)
+
+
+def create_icaps(username, machine_names, image, network, logger, progress=None):
+    """Deploy several new instances of ICAP at the same time
+
+    The image and network are validated once, then the instances are deployed
+    concurrently (up to ``VLAB_ICAP_BULK_PARALLELISM`` at a time), each with its
+    own vCenter session. A failed instance doesn't stop the others.
+
+    :Returns: Dictionary, with the keys "created" and "failed"
+
+    :Raises: ValueError if the image or network is invalid
+
+    :param username: The name of the user who wants to create new instances of Icap
+    :type username: String
+
+    :param machine_names: The names of the new instances of Icap
+    :type machine_names: List
+
+    :param image: The image/version of Icap to create
+    :type image: String
+
+    :param network: The name of the network to connect the new Icap instances up to
+    :type network: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+
+    :param progress: Called with the number of instances done, each time one finishes
+    :type progress: Function
+    """
+    progress = progress or _no_progress
+    INDEX.check(image)
+    ova_network = OVAS.get(image).networks[0]
+    with vcenter_session() as vcenter:
+        # fail fast, instead of once per instance
+        _make_network_map(vcenter, ova_network, network)
+
+    results = {'created': {}, 'failed': {}}
+    parallelism = max(1, min(const.VLAB_ICAP_BULK_PARALLELISM, len(machine_names)))
+    # The executor's threads don't see the task's deadline, so each create gets it handed over
+    deadline = deadlines.current()
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        futures = {}
+        for machine_name in machine_names:
+            future = executor.submit(_bulk_create, username, machine_name, image, network, logger, deadline)
+            futures[future] = machine_name
+        for future in as_completed(futures):
+            machine_name = futures[future]
             try:
-                network_map.network = vcenter.networks[network]
-            except KeyError:
-                raise ValueError('No such network named {}'.format(network))
-            the_vm = virtual_machine.deploy_from_ova(vcenter, ova, [network_map],
-                                                     username, machine_name, logger)
-        finally:
-            ova.close()
-        meta_data = {'component' : "ICAP",
-                     'created': time.time(),
-                     'version': image,
-                     'configured': False,
-                     'generation': 1,
-                    }
+                results['created'].update(future.result())
+            except Exception as doh:
+                logger.error('Failed to create {}: {}'.format(machine_name, doh))
+                results['failed'][machine_name] = '{}'.format(doh)
+            progress('creating',
+                     done=len(results['created']) + len(results['failed']),
+                     total=len(machine_names))
+    return results
+
+
+def _bulk_create(username, machine_name, image, network, logger, deadline=None):
+    """Deploy one instance of ICAP as part of ``create_icaps``
+
+    :Returns: Dictionary
+
+    :param deadline: When the ``icap.bulk_create`` task runs out of time; see ``deadlines.current``
+    :type deadline: Float
+    """
+    deadlines.adopt(deadline)
+    try:
+        with vcenter_session() as vcenter:
+            the_vm = warm_pool.claim(vcenter, username, machine_name, image, network, logger)
+            if the_vm is None:
+                with DEPLOYS.slot(username):
+                    the_vm = _deploy(vcenter, username, machine_name, image, network, logger)
+            return _finish_create(vcenter, the_vm, username, image)
+    finally:
+        # The executor's thread runs other creates next
+        deadlines.clear()
+
+
+def _deploy(vcenter, folder_name, machine_name, image, network, logger, power_on=True, progress=None):
+    """Make a new ICAP VM, by cloning the version's template, deploying its
+    content library item, or uploading the OVA
+
+    Cloning only happens when ``VLAB_ICAP_DEPLOY_MODE`` is "template" or "linked"
+    and the template has been imported. Deploying from the library only happens
+    when it's "library" and the version is staged there. Otherwise the OVA is
+    uploaded.
+
+    :Returns: vim.VirtualMachine
+
+    :Raises: ValueError if the image or network is invalid
+
+    :param folder_name: The folder to put the new VM in (i.e. the username)
+    :type folder_name: String
+
+    :param progress: Called as each phase of the deploy starts; see ``create_icap``
+    :type progress: Function
+    """
+    progress = progress or _no_progress
+    if templates.enabled():
+        the_template = templates.find_template(vcenter, image)
+        if the_template is not None:
+            progress('cloning')
+            with timed(VCENTER_SECONDS, op='deploy'):
+                return templates.clone(vcenter, the_template, folder_name, machine_name, network, logger, power_on=power_on)
+        logger.info('No current template for ICAP {}, uploading the OVA'.format(image))
+        templates.request_sync()
+    elif library.enabled():
+        the_vm = _deploy_from_library(vcenter, folder_name, machine_name, image, network, logger,
+                                      power_on=power_on, progress=progress)
+        if the_vm is not None:
+            return the_vm
+    ova_info = OVAS.get(image)
+    progress('ova_parsed')
+    network_map = _make_network_map(vcenter, ova_info.networks[0], network)
+    # Every upload needs its own file handle
+    ova = OVAS.open(image, on_upload=lambda uploaded, total: progress('uploading', uploaded=uploaded, total=total))
+    try:
+        with timed(VCENTER_SECONDS, op='deploy'):
+            return virtual_machine.deploy_from_ova(vcenter, ova, [network_map], folder_name,
+                                                   machine_name, logger, power_on=power_on)
+    finally:
+        ova.close()
+
+
+def _deploy_from_library(vcenter, folder_name, machine_name, image, network, logger, power_on=True, progress=None):
+    """Have vCenter deploy the version's content library item
+
+    :Returns: vim.VirtualMachine, or None if the version isn't staged in the library
+
+    :Raises: ValueError if the network is invalid
+    """
+    progress = progress or _no_progress
+    try:
+        the_network = vcenter.networks[network]
+    except KeyError:
+        raise ValueError('No such network named {}'.format(network))
+    try:
+        item_id = library.find_item(library.CLIENT, image)
+    except (RuntimeError, OSError) as doh:
+        logger.error('Unable to look up ICAP {} in the content library: {}'.format(image, doh))
+        item_id = None
+    if item_id is None:
+        logger.info('ICAP {} is not staged in the content library, uploading the OVA'.format(image))
+        library.request_sync()
+        return None
+    progress('cloning')
+    folder = vcenter.get_by_name(name=folder_name, vimtype=vim.Folder)
+    the_datastore = vcenter.get_by_name(name=const.INF_VCENTER_DATASTORE, vimtype=vim.Datastore)
+    with timed(VCENTER_SECONDS, op='deploy'):
+        vm_id = library.deploy(library.CLIENT, item_id, machine_name, OVAS.get(image).networks[0],
+                               the_network._moId, folder._moId,
+                               vcenter.resource_pools[const.INF_VCENTER_RESORUCE_POOL]._moId,
+                               the_datastore._moId)
+    the_vm = vim.VirtualMachine(vm_id, stub=vcenter.content.rootFolder._stub)
+    if power_on:
+        with timed(VCENTER_SECONDS, op='power'):
+            wait_for_task(the_vm.PowerOnVM_Task())
+    return the_vm
+
+
+def _make_network_map(vcenter, ova_network, network):
+    """Map the network defined in the OVA to a network in vCenter
+
+    :Returns: vim.OvfManager.NetworkMapping
+
+    :Raises: ValueError if there's no such network
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param ova_network: The name of the network within the OVA
+    :type ova_network: String
+
+    :param network: The name of the network in vCenter
+    :type network: String
+    """
+    network_map = vim.OvfManager.NetworkMapping()
+    network_map.name = ova_network
+    try:
+        network_map.network = vcenter.networks[network]
+    except KeyError:
+        raise ValueError('No such network named {}'.format(network))
+    return network_map
+
+
+def _finish_create(vcenter, the_vm, username, image, progress=None):
+    """Set the meta data of a new ICAP instance, and wait for it to get an IP
+
+    :Returns: Dictionary
+    """
+    progress = progress or _no_progress
+    meta_data = {'component' : "ICAP",
+                 'created': time.time(),
+                 'version': image,
+                 'configured': False,
+                 'generation': 1,
+                }
+    with timed(VCENTER_SECONDS, op='reconfigure'):
         virtual_machine.set_meta(the_vm, meta_data)
-        info = virtual_machine.get_info(vcenter, the_vm, username, ensure_ip=True)
-        return {the_vm.name: info}
+    progress('waiting_for_ip')
+    wait_for_ip(vcenter, the_vm)
+    info = virtual_machine.get_info(vcenter, the_vm, username)
+    return {the_vm.name: info}
+
+
+def _no_progress(phase, **details):
+    """The default ``progress`` callback; doesn't report anything"""
+    pass
+
+
+def refill_warm_pool(logger):
+    """Deploy powered off ICAP VMs until every version has ``VLAB_ICAP_WARM_POOL_SIZE``
+    of them in the warm pool.
+
+    Only one refill runs at a time per host; if another is already running,
+    this function returns right away.
+
+    :Returns: Dictionary, of version -> number of VMs deployed
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    deployed = {}
+    if not warm_pool.enabled():
+        return deployed
+    with host_lock('warm_pool_refill', blocking=False) as acquired:
+        if not acquired:
+            logger.info('Warm pool refill already running')
+            return deployed
+        with vcenter_session() as vcenter:
+            folder = warm_pool.get_pool_folder(vcenter, create=True)
+            staged = warm_pool.staged_vms(vcenter, folder)
+            for image in list_images():
+                missing = const.VLAB_ICAP_WARM_POOL_SIZE - len(staged.get(image, []))
+                for _ in range(missing):
+                    machine_name = 'icap-warm-{}-{}'.format(image, uuid.uuid4().hex[:8])
+                    with DEPLOYS.slot(const.VLAB_ICAP_WARM_POOL_FOLDER):
+                        the_vm = _deploy(vcenter, const.VLAB_ICAP_WARM_POOL_FOLDER, machine_name, image,
+                                         const.VLAB_ICAP_WARM_POOL_NETWORK, logger, power_on=False)
+                    meta_data = {'component' : "ICAP",
+                                 'created': time.time(),
+                                 'version': image,
+                                 'configured': False,
+                                 'generation': 1,
+                                }
+                    with timed(VCENTER_SECONDS, op='reconfigure'):
+                        virtual_machine.set_meta(the_vm, meta_data)
+                    deployed[image] = deployed.get(image, 0) + 1
+    return deployed
+
+
+def sync_templates(logger):
+    """Import a template for every ICAP OVA, and remove the templates of OVAs that
+    were deleted or replaced.
+
+    Only one sync runs at a time per host; if another is already running, this
+    function returns right away.
+
+    :Returns: Dictionary, with the keys "imported" and "removed"
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    synced = {'imported': [], 'removed': []}
+    with host_lock('sync_templates', blocking=False) as acquired:
+        if not acquired:
+            logger.info('Template sync already running')
+            return synced
+        images = list_images()
+        with vcenter_session() as vcenter:
+            folder = get_folder(vcenter, const.VLAB_ICAP_TEMPLATE_FOLDER, create=True)
+            existing = templates.list_templates(vcenter, folder)
+            for version, (the_template, meta) in existing.items():
+                if image_removed(version) or templates.is_stale(version, meta):
+                    logger.info('Removing template for ICAP {}'.format(version))
+                    with timed(VCENTER_SECONDS, op='destroy'):
+                        wait_for_task(the_template.Destroy_Task())
+                    synced['removed'].append(version)
+            for image in images:
+                if image in existing and image not in synced['removed']:
+                    continue
+                network_map = _make_network_map(vcenter, OVAS.get(image).networks[0],
+                                                const.VLAB_ICAP_TEMPLATE_NETWORK)
+                ova = OVAS.open(image)
+                try:
+                    templates.import_template(vcenter, ova, network_map, image, logger)
+                finally:
+                    ova.close()
+                synced['imported'].append(image)
+    return synced
+
+
+def sync_library(logger):
+    """Publish every verified ICAP OVA to the content library, and remove the
+    items of OVAs that were deleted or replaced.
+
+    Only one sync runs at a time per host; if another is already running, this
+    function returns right away.
+
+    :Returns: Dictionary, with the keys "staged", "removed" and "failed"
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    synced = {'staged': [], 'removed': [], 'failed': {}}
+    with host_lock('sync_library', blocking=False) as acquired:
+        if not acquired:
+            logger.info('Content library sync already running')
+            return synced
+        images = list_images()
+        client = library.CLIENT
+        if client.library_id is None:
+            with vcenter_session() as vcenter:
+                the_datastore = vcenter.get_by_name(name=const.INF_VCENTER_DATASTORE, vimtype=vim.Datastore)
+            client.create_library(the_datastore._moId)
+        existing = library.list_items(client)
+        for version, (item_id, meta) in existing.items():
+            # Not ``version not in images``; that includes OVAs still waiting to be verified
+            if image_removed(version) or library.is_stale(version, meta):
+                logger.info('Removing ICAP {} from the content library'.format(version))
+                library.delete_item(client, item_id)
+                synced['removed'].append(version)
+        for image in images:
+            if image in existing and image not in synced['removed']:
+                continue
+            try:
+                library.publish(client, OVAS.get(image), image, logger)
+            except (RuntimeError, OSError) as doh:
+                # Creates of this version keep uploading the OVA until the next sync
+                synced['failed'][image] = '{}'.format(doh)
+            else:
+                synced['staged'].append(image)
+    return synced
+
 
 def list_images():
-    """Obtain a list of available versions of Icap that can be created
+    """Obtain a list of available versions of Icap that can be created; only
+    OVAs that passed verification are included.
 
     :Returns: List
     """
-    images = os.listdir(const.VLAB_ICAP_IMAGES_DIR)
-    images = [convert_name(x, to_version=True) for x in images]
+    images, _ = INDEX.verified(os.listdir(const.VLAB_ICAP_IMAGES_DIR))
     return images
 
 
-def convert_name(name, to_version=False):
-    """This function centralizes converting between the name of the OVA, and the
-    version of software it contains.
+def image_removed(image):
+    """Determine if the OVA of a version was deleted, or failed verification.
 
-    The OVA file naming convention is ICAP-<version>.ova, i.e. ICAP-1.0.0.ova
+    An OVA that's still waiting to be verified (i.e. the worker started with a
+    cold index) is neither, so whatever was staged from it is kept.
 
-    :param name: The thing to covert
-    :type name: String
+    :Returns: Boolean
 
-    :param to_version: Set to True to covert the name of an OVA to the version
-    :type to_version: Boolean
+    :param image: The image/version of Icap
+    :type image: String
     """
-    if to_version:
-        return name.split('-')[-1].replace('.ova', '')
-    else:
-        return 'ICAP-{}.ova'.format(name)
+    name = convert_name(image)
+    if not os.path.exists(os.path.join(const.VLAB_ICAP_IMAGES_DIR, name)):
+        return True
+    result = INDEX.result(name)
+    return result is not None and not result['ok']
 
 
 def update_network(username, machine_name, new_network):
@@ -149,16 +608,10 @@ def update_network(username, machine_name, new_network):
     :param new_network: The name of the new network to connect the VM to
     :type new_network: String
     """
-    with vCenter(host=const.INF_VCENTER_SERVER, user=const.INF_VCENTER_USER, \
-                 password=const.INF_VCENTER_PASSWORD) as vcenter:
+    with vcenter_session() as vcenter:
         folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
-        for entity in folder.childEntity:
-            if entity.name == machine_name:
-                info = virtual_machine.get_info(vcenter, entity, username)
-                if info['meta']['component'] == 'ICAP':
-                    the_vm = entity
-                    break
-        else:
+        the_vm = find_icap(vcenter, folder, machine_name)
+        if the_vm is None:
             error = 'No VM named {} found'.format(machine_name)
             raise ValueError(error)
 
@@ -168,4 +621,5 @@ def update_network(username, machine_name, new_network):
             error = 'No VM named {} found'.format(machine_name)
             raise ValueError(error)
         else:
-            virtual_machine.change_network(the_vm, network)
+            with timed(VCENTER_SECONDS, op='reconfigure'):
+                virtual_machine.change_network(the_vm, network)
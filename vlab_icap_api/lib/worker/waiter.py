@@ -0,0 +1,344 @@
+# -*- coding: UTF-8 -*-
+"""
+Functions for waiting on vCenter, without polling it.
+
+Waiting on a property (like the IP of a VM) creates a short lived
+PropertyCollector with a filter on just that property, then blocks in
+``WaitForUpdatesEx`` until vCenter pushes a change (or the timeout expires).
+
+Waiting on a vCenter task goes through ``WAITER``, a single thread per worker
+process that watches every outstanding task with one PropertyCollector on its
+own session. The thread (or process) that started a task blocks on a Future
+until the waiter sees the task finish, so any number of Celery tasks can be
+waiting on vCenter at once for the cost of one ``WaitForUpdatesEx`` loop.
+"""
+import os
+import time
+import threading
+from concurrent import futures
+
+from pyVmomi import vmodl, VmomiSupport
+from vlab_api_common import get_logger
+from vlab_inf_common.vmware import vim
+
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.worker import deadlines
+from vlab_icap_api.lib.worker.sessions import vcenter_session
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_ICAP_LOG_LEVEL)
+
+
+TASK_PROPERTIES = ['info.state', 'info.error', 'info.result']
+TASK_DONE = (vim.TaskInfo.State.success, vim.TaskInfo.State.error)
+
+
+def wait_for_tasks(tasks, timeout=600):
+    """Block until every supplied vCenter task completes.
+
+    The tasks are watched by ``WAITER`` on its own session, so they can come from
+    any session with the same vCenter.
+
+    :Returns: Dictionary, mapping each key to None on success, or the error message
+
+    :param tasks: A mapping of some key (like a VM name) to the task to wait on
+    :type tasks: Dictionary
+
+    :param timeout: How many seconds to wait for all the tasks to complete
+    :type timeout: Integer
+    """
+    timeout = deadlines.remaining(timeout)
+    pending = {key: WAITER.submit(task) for key, task in tasks.items()}
+    futures.wait(pending.values(), timeout=timeout)
+    results = {}
+    for key, future in pending.items():
+        if future.done():
+            results[key] = future.result()[0]
+        else:
+            future.cancel()
+            results[key] = 'Timeout of {} seconds exceeded for task {}'.format(timeout, tasks[key])
+    return results
+
+
+def wait_for_task(task, timeout=600):
+    """Block until a vCenter task completes; a drop-in for ``consume_task``
+
+    :Returns: vim.TaskInfo.result
+
+    :Raises: RuntimeError if the task fails, or takes longer than the timeout
+
+    :param task: The task to wait on
+    :type task: vim.Task
+
+    :param timeout: How many seconds to wait for the task to complete
+    :type timeout: Integer
+    """
+    timeout = deadlines.remaining(timeout)
+    future = WAITER.submit(task)
+    try:
+        error, result = future.result(timeout=timeout)
+    except futures.TimeoutError:
+        future.cancel()
+        raise RuntimeError('Timeout of {} seconds exceeded for task {}'.format(timeout, task))
+    if error:
+        raise RuntimeError(error)
+    if isinstance(result, VmomiSupport.ManagedObject):
+        # It came from the waiter's session; hand back one bound to the caller's
+        result = result.__class__(result._moId, stub=task._stub)
+    return result
+
+
+def wait_for_ip(vcenter, the_vm, timeout=600):
+    """Block until VMware Tools reports an IP for a virtual machine
+
+    :Returns: None
+
+    :Raises: RuntimeError if the VM doesn't get an IP within the timeout
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param the_vm: The virtual machine
+    :type the_vm: vim.VirtualMachine
+
+    :param timeout: How many seconds to wait for an IP
+    :type timeout: Integer
+    """
+    obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=the_vm, skip=False)
+    prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.VirtualMachine, pathSet=['guest.ipAddress'])
+    filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+
+    def has_ip(state):
+        ip = state.get(the_vm._moId, {}).get('guest.ipAddress')
+        # A link local IPv6 addr shows up before DHCP is done
+        return bool(ip) and not ip.startswith('fe80::')
+
+    if not has_ip(wait_for_updates(vcenter, filter_spec, has_ip, timeout)):
+        error = "Unable to obtain an IP within {} seconds".format(timeout)
+        raise RuntimeError(error)
+
+
+def wait_for_updates(vcenter, filter_spec, is_done, timeout):
+    """Block until the watched properties satisfy ``is_done``, or the timeout expires
+
+    :Returns: Dictionary, of moId -> {property path: latest value}
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param filter_spec: Defines the objects and properties to watch
+    :type filter_spec: vmodl.query.PropertyCollector.FilterSpec
+
+    :param is_done: Called with the latest state after every update; return True to stop waiting
+    :type is_done: Function
+
+    :param timeout: How many seconds to wait
+    :type timeout: Integer
+    """
+    timeout = deadlines.remaining(timeout)
+    # A dedicated collector, so the filter doesn't leak into other waits on the same session
+    collector = vcenter.content.propertyCollector.CreatePropertyCollector()
+    try:
+        collector.CreateFilter(filter_spec, partialUpdates=False)
+        state = {}
+        version = ''
+        deadline = time.time() + timeout
+        while not is_done(state):
+            remaining = int(deadline - time.time())
+            if remaining <= 0:
+                break
+            options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=remaining)
+            update = collector.WaitForUpdatesEx(version, options)
+            if update is None:
+                # maxWaitSeconds elapsed without any change
+                break
+            version = update.version
+            _apply_update(state, update)
+        return state
+    finally:
+        collector.DestroyPropertyCollector()
+
+
+def _apply_update(state, update):
+    """Merge the changes from ``WaitForUpdatesEx`` into the known state
+
+    :Returns: None
+
+    :param state: The latest value of every watched property, by moId
+    :type state: Dictionary
+
+    :param update: The changes vCenter pushed
+    :type update: vmodl.query.PropertyCollector.UpdateSet
+    """
+    for filter_update in update.filterSet:
+        for obj_update in filter_update.objectSet:
+            props = state.setdefault(obj_update.obj._moId, {})
+            for change in obj_update.changeSet:
+                if change.op == 'remove':
+                    props[change.name] = None
+                else:
+                    props[change.name] = change.val
+
+
+class TaskWaiter(object):
+    """Watches every outstanding vCenter task of a process from a single thread.
+
+    The thread starts with the first task submitted, borrows a session from the
+    pool for as long as it runs, and logs back in (re-watching every task) if
+    that session dies. Like ``SessionPool`` it starts over in a forked child.
+
+    :param interval: The most seconds to block in ``WaitForUpdatesEx`` before
+                     picking up newly submitted tasks
+    :type interval: Integer
+    """
+    def __init__(self, interval):
+        self._interval = interval
+        self._init_state()
+
+    def _init_state(self):
+        """Set the waiter to an empty state for the current process"""
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._new = {}
+        self._watching = {}
+        self._thread = None
+        self._stopped = False
+
+    def _check_pid(self):
+        """Forget the thread and tasks inherited from a parent process"""
+        if self._pid != os.getpid():
+            self._init_state()
+
+    def submit(self, task):
+        """Start watching a vCenter task
+
+        :Returns: concurrent.futures.Future - its result is a tuple of (error message, task result)
+
+        :param task: The task to watch
+        :type task: vim.Task
+        """
+        self._check_pid()
+        future = futures.Future()
+        with self._lock:
+            self._new.setdefault(task._moId, []).append(future)
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        self._wakeup.set()
+        return future
+
+    def pending(self):
+        """How many tasks are being watched
+
+        :Returns: Integer
+        """
+        with self._lock:
+            return len(self._new) + len(self._watching)
+
+    def close(self):
+        """Stop the waiter thread, failing any task still being watched"""
+        self._check_pid()
+        with self._lock:
+            self._stopped = True
+            thread, self._thread = self._thread, None
+            waiting = list(self._new.values()) + list(self._watching.values())
+            self._new, self._watching = {}, {}
+        self._wakeup.set()
+        for future in [x for futures_list in waiting for x in futures_list]:
+            if future.set_running_or_notify_cancel():
+                future.set_result(('Task waiter shut down', None))
+        if thread is not None:
+            thread.join(timeout=self._interval + 1)
+
+    def _run(self):
+        """The body of the waiter thread"""
+        while not self._stopped:
+            try:
+                with vcenter_session() as vcenter:
+                    self._watch(vcenter)
+            except Exception as doh:
+                logger.error('Task waiter failed, starting over: {}'.format(doh))
+                time.sleep(1)
+
+    def _watch(self, vcenter):
+        """Wait for updates to every watched task, until the waiter is stopped
+
+        :Returns: None
+
+        :param vcenter: The session dedicated to the waiter
+        :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+        """
+        collector = vcenter.content.propertyCollector.CreatePropertyCollector()
+        with self._lock:
+            # After a restart, the old filters are gone with the old collector
+            for moid, waiting in self._watching.items():
+                self._new.setdefault(moid, []).extend(waiting)
+            self._watching = {}
+        filters = {}
+        state = {}
+        version = ''
+        try:
+            while not self._stopped:
+                self._wakeup.clear()
+                self._add_filters(collector, filters)
+                self._drop_cancelled(filters, state)
+                if not filters:
+                    self._wakeup.wait()
+                    continue
+                options = vmodl.query.PropertyCollector.WaitOptions(maxWaitSeconds=self._interval)
+                update = collector.WaitForUpdatesEx(version, options)
+                if update is None:
+                    continue
+                version = update.version
+                _apply_update(state, update)
+                for moid in [x for x in filters if state.get(x, {}).get('info.state') in TASK_DONE]:
+                    self._finish(moid, state.pop(moid), filters.pop(moid))
+        finally:
+            try:
+                collector.DestroyPropertyCollector()
+            except Exception:
+                pass
+
+    def _add_filters(self, collector, filters):
+        """Create a filter for every newly submitted task"""
+        with self._lock:
+            new, self._new = self._new, {}
+            for moid, waiting in new.items():
+                self._watching.setdefault(moid, []).extend(waiting)
+        for moid in new.keys():
+            if moid in filters:
+                continue
+            obj_spec = vmodl.query.PropertyCollector.ObjectSpec(obj=vim.Task(moid), skip=False)
+            prop_spec = vmodl.query.PropertyCollector.PropertySpec(type=vim.Task, pathSet=TASK_PROPERTIES)
+            filter_spec = vmodl.query.PropertyCollector.FilterSpec(objectSet=[obj_spec], propSet=[prop_spec])
+            filters[moid] = collector.CreateFilter(filter_spec, partialUpdates=False)
+
+    def _drop_cancelled(self, filters, state):
+        """Stop watching tasks that nobody is waiting on anymore"""
+        with self._lock:
+            for moid in list(filters.keys()):
+                waiting = [x for x in self._watching.get(moid, []) if not x.cancelled()]
+                if waiting:
+                    self._watching[moid] = waiting
+                    continue
+                self._watching.pop(moid, None)
+                state.pop(moid, None)
+                filters.pop(moid).DestroyPropertyFilter()
+
+    def _finish(self, moid, props, the_filter):
+        """Hand the outcome of a task to everything waiting on it"""
+        the_filter.DestroyPropertyFilter()
+        if props['info.state'] == vim.TaskInfo.State.error:
+            outcome = (props['info.error'].msg, None)
+        else:
+            outcome = (None, props.get('info.result'))
+        with self._lock:
+            waiting = self._watching.pop(moid, [])
+        for future in waiting:
+            if future.set_running_or_notify_cancel():
+                future.set_result(outcome)
+
+
+WAITER = TaskWaiter(interval=const.VLAB_ICAP_TASK_WAITER_INTERVAL)
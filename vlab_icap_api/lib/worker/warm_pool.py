@@ -0,0 +1,157 @@
+# -*- coding: UTF-8 -*-
+"""
+A pool of already deployed, powered off, ICAP VMs for every image version.
+
+Uploading an OVA takes minutes, but moving, renaming and reconfiguring an
+existing VM takes seconds. When ``VLAB_ICAP_WARM_POOL_SIZE`` is greater than
+zero, ``icap.refill_pool`` keeps that many VMs per version in the
+``VLAB_ICAP_WARM_POOL_FOLDER`` folder, and ``create_icap`` claims one of them
+instead of deploying the OVA.
+"""
+from vlab_api_common import get_logger
+from vlab_inf_common.vmware import vim, virtual_machine
+
+from vlab_icap_api.lib import const
+from vlab_icap_api.lib.metrics import VCENTER_SECONDS, timed
+from vlab_icap_api.lib.worker.cache import host_lock
+from vlab_icap_api.lib.worker.waiter import wait_for_task
+from vlab_icap_api.lib.worker.inventory import retrieve_vms, parse_meta, get_folder
+
+
+logger = get_logger(__name__, loglevel=const.VLAB_ICAP_LOG_LEVEL)
+
+
+def enabled():
+    """Determine if the warm pool is turned on
+
+    :Returns: Boolean
+    """
+    return const.VLAB_ICAP_WARM_POOL_SIZE > 0
+
+
+def get_pool_folder(vcenter, create=False):
+    """Obtain the folder that holds the warm pool
+
+    :Returns: vim.Folder, or None if it doesn't exist
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param create: Set to True to make the folder if it doesn't exist
+    :type create: Boolean
+    """
+    return get_folder(vcenter, const.VLAB_ICAP_WARM_POOL_FOLDER, create=create)
+
+
+def staged_vms(vcenter, folder):
+    """Obtain the powered off ICAP VMs in the warm pool, grouped by version
+
+    :Returns: Dictionary, of version -> List of vim.VirtualMachine
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param folder: The warm pool folder
+    :type folder: vim.Folder
+    """
+    staged = {}
+    vms = retrieve_vms(vcenter, folder, ['runtime.powerState', 'config.annotation'])
+    for vm, props in vms.items():
+        meta = parse_meta(props.get('config.annotation'))
+        if meta['component'] != 'ICAP':
+            continue
+        if props['runtime.powerState'] != vim.VirtualMachinePowerState.poweredOff:
+            continue
+        staged.setdefault(meta['version'], []).append(vm)
+    return staged
+
+
+def claim(vcenter, username, machine_name, image, network, logger):
+    """Take a VM out of the warm pool, and make it the user's new ICAP instance.
+
+    The VM is moved to the user's folder, renamed, connected to the requested
+    network and powered on. The caller still has to set the meta data. If it
+    cannot be renamed, the VM goes back into the pool; if any later step fails,
+    the VM is destroyed.
+
+    :Returns: vim.VirtualMachine, or None if there's no warm VM for the version
+
+    :Raises: ValueError if the network doesn't exist, or the name is taken
+
+    :param vcenter: The vCenter object
+    :type vcenter: vlab_inf_common.vmware.vcenter.vCenter
+
+    :param username: The name of the user who wants to create a new Icap
+    :type username: String
+
+    :param machine_name: The name of the new instance of Icap
+    :type machine_name: String
+
+    :param image: The image/version of Icap to create
+    :type image: String
+
+    :param network: The name of the network to connect the new Icap instance up to
+    :type network: String
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    if not enabled():
+        return None
+    try:
+        the_network = vcenter.networks[network]
+    except KeyError:
+        raise ValueError('No such network named {}'.format(network))
+    pool_folder = get_pool_folder(vcenter)
+    if pool_folder is None:
+        return None
+    user_folder = vcenter.get_by_name(name=username, vimtype=vim.Folder)
+    with host_lock('warm_pool_claim'):
+        candidates = staged_vms(vcenter, pool_folder).get(image, [])
+        if not candidates:
+            logger.info('No warm ICAP VMs for version {}'.format(image))
+            return None
+        the_vm = candidates[0]
+        # Once it's out of the pool folder, no one else can claim it
+        wait_for_task(user_folder.MoveIntoFolder_Task([the_vm]))
+    logger.info('Claimed warm ICAP VM {}'.format(the_vm._moId))
+    try:
+        wait_for_task(the_vm.Rename_Task(machine_name))
+    except (RuntimeError, vim.fault.DuplicateName, vim.fault.InvalidName) as doh:
+        wait_for_task(pool_folder.MoveIntoFolder_Task([the_vm]))
+        raise ValueError('Unable to name new ICAP {}: {}'.format(machine_name, doh))
+    try:
+        with timed(VCENTER_SECONDS, op='reconfigure'):
+            virtual_machine.change_network(the_vm, the_network)
+        with timed(VCENTER_SECONDS, op='power'):
+            wait_for_task(the_vm.PowerOnVM_Task())
+    except Exception:
+        # It's renamed, and maybe powered on, so it can't just go back into the pool
+        _discard(the_vm, logger)
+        raise
+    return the_vm
+
+
+def _discard(the_vm, logger):
+    """Destroy a claimed VM that couldn't be made into an ICAP instance.
+
+    Failures are only logged, so the caller can raise the error that caused the
+    claim to fail.
+
+    :Returns: None
+
+    :param the_vm: The VM claimed from the warm pool
+    :type the_vm: vim.VirtualMachine
+
+    :param logger: An object for logging messages
+    :type logger: logging.LoggerAdapter
+    """
+    logger.info('Destroying claimed ICAP VM {}'.format(the_vm._moId))
+    try:
+        if the_vm.runtime.powerState != vim.VirtualMachinePowerState.poweredOff:
+            with timed(VCENTER_SECONDS, op='power'):
+                wait_for_task(the_vm.PowerOffVM_Task())
+        with timed(VCENTER_SECONDS, op='destroy'):
+            wait_for_task(the_vm.Destroy_Task())
+    except Exception as doh:
+        logger.error('Unable to destroy claimed ICAP VM {}: {}'.format(the_vm._moId, doh))